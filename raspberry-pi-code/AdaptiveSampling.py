@@ -0,0 +1,246 @@
+import argparse
+import bisect
+import random
+from time import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from Profiling import Timings
+
+"""
+Adaptive sampling for the sensors
+- sample at the fastest rate while the signal is changing or close to a threshold
+- back off exponentially, up to the slowest rate, while it is flat and far from every threshold
+
+The tradeoff is between samples/hour (work, and wear on the DHT11) and decision latency,
+i.e. how late a threshold crossing is acted on. Both are reported by `stats()`, and the latency
+of every decision is kept in the `<name>.decisionLatency` histogram (see `Profiling.Timings`).
+
+Run `python AdaptiveSampling.py --hours 12` to replay a synthetic day of light readings,
+comparing the fixed one second polling with adaptive sampling.
+"""
+
+
+def isUrgent(
+        _reading: float,
+        _previousReading: Optional[float],
+        _thresholds: Sequence[float],
+        _nearThresholdMargin: float,
+        _changeMargin: float
+) -> bool:
+    """
+    Signal is close to a threshold, or moving
+    """
+    if any(abs(_reading - _threshold) <= _nearThresholdMargin for _threshold in _thresholds):
+        return True
+    return _previousReading is not None and abs(_reading - _previousReading) >= _changeMargin
+
+
+class AdaptiveSampler:
+    """
+    Caller calls `sampled()` for every reading, `decided()` when a reading led to an instruction,
+    and sleeps for `nextInterval()` before the next reading
+    """
+    __name: str = None
+    __minimumIntervalInSeconds: float = None
+    __maximumIntervalInSeconds: float = None
+    __backoffFactor: float = None
+    __intervalInSeconds: float = None
+
+    __startedAt: float = None
+    __lastSampleAt: Optional[float] = None
+    __previousSampleAt: Optional[float] = None
+
+    # counters for tuning
+    samples: int = 0
+    decisions: int = 0
+    totalDecisionLatencyInSeconds: float = 0.0
+    maxDecisionLatencyInSeconds: float = 0.0
+
+    def __init__(
+            self,
+            _name: str,
+            _minimumIntervalInSeconds: float,
+            _maximumIntervalInSeconds: float,
+            _backoffFactor: float = 2,
+            _now: Optional[float] = None
+    ):
+        self.__name = _name
+        self.__minimumIntervalInSeconds = _minimumIntervalInSeconds
+        self.__maximumIntervalInSeconds = _maximumIntervalInSeconds
+        self.__backoffFactor = _backoffFactor
+        self.__intervalInSeconds = _minimumIntervalInSeconds
+        self.__startedAt = time() if _now is None else _now
+
+    def reconfigure(self, _minimumIntervalInSeconds: float, _maximumIntervalInSeconds: float):
+        self.__minimumIntervalInSeconds = _minimumIntervalInSeconds
+        self.__maximumIntervalInSeconds = _maximumIntervalInSeconds
+        self.__intervalInSeconds = min(
+            max(self.__intervalInSeconds, _minimumIntervalInSeconds), _maximumIntervalInSeconds
+        )
+
+    def interval(self) -> float:
+        return self.__intervalInSeconds
+
+    def sampled(self, _now: Optional[float] = None):
+        self.samples += 1
+        self.__previousSampleAt = self.__lastSampleAt
+        self.__lastSampleAt = time() if _now is None else _now
+
+    def nextInterval(self, _isUrgent: bool) -> float:
+        if _isUrgent:
+            self.__intervalInSeconds = self.__minimumIntervalInSeconds
+        else:
+            self.__intervalInSeconds = min(
+                self.__intervalInSeconds * self.__backoffFactor, self.__maximumIntervalInSeconds
+            )
+        return self.__intervalInSeconds
+
+    def decided(self) -> float:
+        """
+        The signal crossed the threshold at some point since the previous reading,
+        so the time since then bounds how late the decision is
+        """
+        previousSampleAt = self.__previousSampleAt if self.__previousSampleAt is not None else self.__startedAt
+        latency = self.__lastSampleAt - previousSampleAt
+
+        self.decisions += 1
+        self.totalDecisionLatencyInSeconds += latency
+        self.maxDecisionLatencyInSeconds = max(self.maxDecisionLatencyInSeconds, latency)
+        Timings.histogram(f"{self.__name}.decisionLatency").record(latency)
+        return latency
+
+    def stats(self, _now: Optional[float] = None) -> Dict[str, float]:
+        elapsed = (time() if _now is None else _now) - self.__startedAt
+        return {
+            "samples": self.samples,
+            "samplesPerHour": round(self.samples / elapsed * 3600, 1) if elapsed > 0 else 0.0,
+            "intervalSeconds": self.__intervalInSeconds,
+            "decisions": self.decisions,
+            "meanDecisionLatencySeconds": (
+                round(self.totalDecisionLatencyInSeconds / self.decisions, 3) if self.decisions else 0.0
+            ),
+            "maxDecisionLatencySeconds": round(self.maxDecisionLatencyInSeconds, 3),
+        }
+
+
+def syntheticLightTrace(_hours: float, _stepInSeconds: float, _seed: int) -> List[float]:
+    """
+    A day of light readings: a slow rise and fall, with clouds and the sun hitting the window
+    """
+    generator = random.Random(_seed)
+    steps = int(_hours * 3600 / _stepInSeconds)
+    trace = []
+    level = 50.0
+    event = 0.0
+    for _step in range(steps):
+        progress = _step / steps
+        baseline = 10 + 500 * max(0.0, 1 - abs(progress - 0.5) * 2.2)
+
+        # a cloud or a burst of sun every so often, decaying over a few minutes
+        if generator.random() < _stepInSeconds / 900:
+            event = generator.choice([-350.0, 300.0])
+        event *= 1 - _stepInSeconds / 120
+
+        level += (baseline + event - level) * min(1.0, _stepInSeconds / 5)
+        trace.append(level + generator.gauss(0, 1))
+    return trace
+
+
+def _crossings(_trace: List[float], _stepInSeconds: float, _thresholds: Tuple[float, float]) -> List[float]:
+    # times the exact trace enters the too dark or too bright range
+    tooDark, tooBright = _thresholds
+    crossings = []
+    previous = None
+    for _index, _reading in enumerate(_trace):
+        region = -1 if _reading < tooDark else (1 if _reading > tooBright else 0)
+        if previous is not None and region != previous and region != 0:
+            crossings.append(_index * _stepInSeconds)
+        previous = region
+    return crossings
+
+
+def replay(
+        _trace: List[float],
+        _stepInSeconds: float,
+        _thresholds: Tuple[float, float],
+        _adaptive: bool,
+        _minimumIntervalInSeconds: float,
+        _maximumIntervalInSeconds: float,
+        _nearThresholdMargin: float,
+        _changeMargin: float
+) -> Dict[str, float]:
+    """
+    Sample the trace like the light sensor would, and measure the true latency of every decision
+    """
+    tooDark, tooBright = _thresholds
+    interval = _minimumIntervalInSeconds if _adaptive else 1.0
+    sampler = AdaptiveSampler("replay", interval, _maximumIntervalInSeconds if _adaptive else 1.0, _now=0.0)
+
+    crossings = _crossings(_trace, _stepInSeconds, _thresholds)
+    latencies = []
+    previousReading = None
+    previousRegion = None
+    previousSampleAt = 0.0
+    now = 0.0
+    duration = len(_trace) * _stepInSeconds
+    while now < duration:
+        reading = _trace[int(now / _stepInSeconds)]
+        sampler.sampled(now)
+
+        region = -1 if reading < tooDark else (1 if reading > tooBright else 0)
+        if previousRegion is not None and region != previousRegion and region != 0:
+            # latency from when the exact trace first crossed, since the previous reading
+            firstCrossing = bisect.bisect_right(crossings, previousSampleAt)
+            crossedAt = crossings[firstCrossing] if firstCrossing < len(crossings) else now
+            latencies.append(max(0.0, now - crossedAt))
+        previousRegion = region
+        previousSampleAt = now
+
+        if _adaptive:
+            urgent = isUrgent(reading, previousReading, _thresholds, _nearThresholdMargin, _changeMargin)
+            interval = sampler.nextInterval(urgent)
+        previousReading = reading
+        now += interval
+
+    latencies.sort()
+    return {
+        "samplesPerHour": round(sampler.samples / duration * 3600, 1),
+        "decisions": len(latencies),
+        "crossings": len(crossings),
+        "meanDecisionLatencySeconds": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p95DecisionLatencySeconds": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0.0,
+        "maxDecisionLatencySeconds": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay light readings, fixed vs adaptive sampling")
+    parser.add_argument("--hours", type=float, default=12)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--too-dark", type=float, default=100)
+    parser.add_argument("--too-bright", type=float, default=700)
+    parser.add_argument("--min-interval", type=float, default=0.25)
+    parser.add_argument("--max-interval", type=float, default=4)
+    parser.add_argument("--near-margin", type=float, default=30)
+    parser.add_argument("--change-margin", type=float, default=15)
+    arguments = parser.parse_args(_arguments)
+
+    stepInSeconds = 0.05
+    trace = syntheticLightTrace(arguments.hours, stepInSeconds, arguments.seed)
+    thresholds = (arguments.too_dark, arguments.too_bright)
+
+    results = {}
+    for _name, _adaptive in (("fixed", False), ("adaptive", True)):
+        results[_name] = replay(
+            trace, stepInSeconds, thresholds, _adaptive,
+            arguments.min_interval, arguments.max_interval, arguments.near_margin, arguments.change_margin
+        )
+
+    print("### SAMPLING REPLAY ###")
+    for _name, _result in results.items():
+        print(f"{_name}: {_result}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
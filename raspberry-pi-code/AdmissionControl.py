@@ -0,0 +1,336 @@
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+from typing import Callable, Optional
+
+from Data import Command
+
+
+class TokenBucket:
+    """
+    Simple token bucket, refilled lazily whenever it is checked
+    """
+    tokens: float = None
+    updatedAt: float = None
+
+    def __init__(self, _burst: float, _now: float):
+        self.tokens: float = _burst
+        self.updatedAt: float = _now
+
+    def take(self, _ratePerSecond: float, _burst: float, _now: float) -> bool:
+        self.tokens = min(_burst, self.tokens + (_now - self.updatedAt) * _ratePerSecond)
+        self.updatedAt = _now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class ClientRateLimiter:
+    """
+    Token bucket per client, e.g. its address, or the process of a producer on the same Pi
+    - "stop" is never turned away, so the caller peeks at the request before asking
+    - only the most recently seen clients are tracked, so memory stays bounded
+    """
+
+    __ratePerSecond: float = None
+    __burst: float = None
+    __maxTrackedClients: int = None
+    __buckets: OrderedDict = None
+    __lock: threading.Lock = None
+
+    # counters for tuning
+    admitted: int = 0
+    rejected: int = 0
+
+    def __init__(self, _ratePerSecond: float = 2, _burst: float = 5, _maxTrackedClients: int = 1024):
+        self.__ratePerSecond = _ratePerSecond
+        self.__burst = _burst
+        self.__maxTrackedClients = _maxTrackedClients
+        self.__buckets = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def admit(self, _client: str) -> bool:
+        now = timer()
+
+        with self.__lock:
+            bucket = self.__buckets.get(_client)
+            if bucket is None:
+                bucket = TokenBucket(self.__burst, now)
+                self.__buckets[_client] = bucket
+
+                # forget the least recently seen client
+                if len(self.__buckets) > self.__maxTrackedClients:
+                    self.__buckets.popitem(last=False)
+            else:
+                self.__buckets.move_to_end(_client)
+
+            isAdmitted = bucket.take(self.__ratePerSecond, self.__burst, now)
+
+            if isAdmitted:
+                self.admitted += 1
+            else:
+                self.rejected += 1
+
+        return isAdmitted
+
+
+class InstructionDebouncer(threading.Thread):
+    """
+    Sits between the network handlers and `ThreadMotorController.instruct()`
+    - the first instruction after a quiet period is passed on straight away
+    - a burst of instructions inside the coalescing window is reduced to the most recent one
+    - reversing the motor's direction is held back until the minimum dwell time has passed
+    - "stop" is never delayed
+    """
+
+    __instruct: Callable[[str], bool] = None
+    __currentBlindExtensionLength: Callable[[], float] = None
+    __coalesceWindowInSeconds: float = None
+    __minimumReversalDwellInSeconds: float = None
+
+    # latest instruction waiting to be passed on
+    __pending: Optional[str] = None
+    __pendingWasDelayed: bool = False
+    __lastForwardedAt: float = None
+
+    # direction the motor was last sent in, and when that direction started
+    __lastDirectionIsUpward: Optional[bool] = None
+    __lastDirectionChangedAt: float = None
+
+    __state: threading.Condition = None
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    submitted: int = 0
+    forwarded: int = 0
+    coalesced: int = 0
+    reversalsDelayed: int = 0
+
+    def __init__(
+            self,
+            _instruct: Callable[[str], bool],
+            _currentBlindExtensionLength: Callable[[], float],
+            _coalesceWindowInSeconds: float = 0.2,
+            _minimumReversalDwellInSeconds: float = 1.5
+    ):
+        super().__init__(daemon=True)
+        self.__instruct = _instruct
+        self.__currentBlindExtensionLength = _currentBlindExtensionLength
+        self.__coalesceWindowInSeconds = _coalesceWindowInSeconds
+        self.__minimumReversalDwellInSeconds = _minimumReversalDwellInSeconds
+
+        self.__lastForwardedAt = -_coalesceWindowInSeconds
+        self.__lastDirectionChangedAt = -_minimumReversalDwellInSeconds
+
+        self.__state = threading.Condition()
+        self.__stop_event = threading.Event()
+
+    def __direction(self, _instruction: str) -> Optional[bool]:
+        """
+        True for upward, False for downward, None when the motor won't move
+        """
+        if _instruction == Command.Up.value:
+            return True
+        if _instruction == Command.Down.value:
+            return False
+
+        try:
+            _newExtensionLength = float(_instruction)
+        except ValueError:
+            return None
+
+        # numeric instructions are positions, i.e. a shorter blind means moving upward
+        return _newExtensionLength < self.__currentBlindExtensionLength()
+
+    def submit(self, _instruction: str) -> bool:
+        """
+        Caller uses this instead of `instruct()`
+        """
+        with self.__state:
+            self.submitted += 1
+            if self.__pending is not None:
+                self.coalesced += 1
+
+            self.__pending = _instruction
+            self.__pendingWasDelayed = False
+            self.__state.notify()
+
+        return True
+
+    def discardPending(self) -> bool:
+        """
+        Drop an instruction still being held back, e.g. when something newer goes to the motor another way
+        """
+        with self.__state:
+            if self.__pending is None:
+                return False
+            self.__pending = None
+            self.coalesced += 1
+            return True
+
+    def takePending(self) -> Optional[str]:
+        """
+        Remove and return an instruction still being held back, e.g. to pass it on to a new process
+        """
+        with self.__state:
+            pending = self.__pending
+            self.__pending = None
+            return pending
+
+    def __readyAt(self, _instruction: str, _direction: Optional[bool]) -> float:
+        # never hold back stopping the motor
+        if _instruction == Command.Stop.value:
+            return 0
+
+        readyAt = self.__lastForwardedAt + self.__coalesceWindowInSeconds
+
+        # give the motor time to settle before reversing it
+        isReversal = (
+                _direction is not None and
+                self.__lastDirectionIsUpward is not None and
+                _direction != self.__lastDirectionIsUpward
+        )
+        if isReversal:
+            readyAt = max(readyAt, self.__lastDirectionChangedAt + self.__minimumReversalDwellInSeconds)
+
+        return readyAt
+
+    def run(self):
+        while not self.__stop_event.is_set():
+            with self.__state:
+                if self.__pending is None:
+                    self.__state.wait()
+                    continue
+
+                _instruction = self.__pending
+                _direction = self.__direction(_instruction)
+                now = timer()
+                waitFor = self.__readyAt(_instruction, _direction) - now
+
+                # hold on to the instruction, newer ones may still replace it
+                if waitFor > 0:
+                    if not self.__pendingWasDelayed and _direction != self.__lastDirectionIsUpward:
+                        self.reversalsDelayed += 1
+                        self.__pendingWasDelayed = True
+                    self.__state.wait(timeout=waitFor)
+                    continue
+
+                self.__pending = None
+                self.__lastForwardedAt = now
+                self.forwarded += 1
+
+                if _direction is not None and _direction != self.__lastDirectionIsUpward:
+                    self.__lastDirectionIsUpward = _direction
+                    self.__lastDirectionChangedAt = now
+
+            # send outside the lock so handlers can keep submitting
+            self.__instruct(_instruction)
+
+    def cleanup(self):
+        self.__stop_event.set()
+        with self.__state:
+            self.__state.notify()
+
+
+class _DeduplicatedRequest:
+    __slots__ = ("createdAt", "done", "reply")
+
+    def __init__(self, _createdAt: float):
+        self.createdAt = _createdAt
+        self.done = threading.Event()
+        self.reply: Optional[str] = None
+
+
+class RequestDeduplicator:
+    """
+    Bounded LRU/TTL cache of replies, keyed by the client and the request ID it supplied
+    - the first request with an ID is handled, repeats within the TTL get the original reply
+    - a repeat that arrives while the original is still being handled waits for its reply
+    - two clients that happen to pick the same ID don't get each other's replies
+    - a request whose handling fails is forgotten, so its retry is handled again
+    """
+
+    __ttlInSeconds: float = None
+    __maxEntries: int = None
+    __waitForOriginalInSeconds: float = None
+    __isMotorAction: Callable[[str], bool] = None
+    __entries: OrderedDict = None
+    __lock: threading.Lock = None
+
+    # counters for tuning
+    originals: int = 0
+    duplicates: int = 0
+    motorActionsSuppressed: int = 0
+
+    def __init__(
+            self,
+            _isMotorAction: Callable[[str], bool],
+            _ttlInSeconds: float = 60,
+            _maxEntries: int = 4096,
+            _waitForOriginalInSeconds: float = 5
+    ):
+        self.__isMotorAction = _isMotorAction
+        self.__ttlInSeconds = _ttlInSeconds
+        self.__maxEntries = _maxEntries
+        self.__waitForOriginalInSeconds = _waitForOriginalInSeconds
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def handleOnce(self, _client: str, _requestId: str, _handle: Callable[[], str]) -> Optional[str]:
+        """
+        Returns the reply for the request, or None when the original didn't finish in time
+        """
+        now = timer()
+        key = (_client, _requestId)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            # forget a request that has expired
+            if entry is not None and now - entry.createdAt > self.__ttlInSeconds:
+                del self.__entries[key]
+                entry = None
+
+            isOriginal = entry is None
+            if isOriginal:
+                entry = _DeduplicatedRequest(now)
+                self.__entries[key] = entry
+                self.originals += 1
+
+                # drop the least recently used request
+                if len(self.__entries) > self.__maxEntries:
+                    self.__entries.popitem(last=False)
+            else:
+                self.__entries.move_to_end(key)
+                self.duplicates += 1
+
+        if isOriginal:
+            try:
+                entry.reply = _handle()
+            except Exception:
+                with self.__lock:
+                    if self.__entries.get(key) is entry:
+                        del self.__entries[key]
+                raise
+            finally:
+                entry.done.set()
+            return entry.reply
+
+        if not entry.done.wait(self.__waitForOriginalInSeconds):
+            return None
+
+        if entry.reply is not None and self.__isMotorAction(entry.reply):
+            with self.__lock:
+                self.motorActionsSuppressed += 1
+
+        return entry.reply
+
+    def counters(self) -> dict:
+        return {
+            "originals": self.originals,
+            "duplicates": self.duplicates,
+            "motorActionsSuppressed": self.motorActionsSuppressed,
+        }
@@ -0,0 +1,263 @@
+import argparse
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from time import time
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+"""
+Audit log of everything that moved, or tried to move, the blind
+- every command the MotorListener received, who sent it (e.g. "unix:ir", see MotorConnection), the request
+  as it arrived, and what it decided (204/304/422/...)
+- every motor start and stop, with the blind's position
+- every sensor-driven decision, with the reading behind it
+
+Callers never wait on disk: events go on a queue, and a background thread writes them to SQLite
+in batches, one transaction per batch. The database is in WAL mode, so the listener, the motor process
+and the sensors can all write to the same file while the CLI reads it.
+
+Run e.g.
+  `python AuditLog.py --since "2024-05-01 14:00" --until "2024-05-01 14:05"`
+  `python AuditLog.py --source light --kind sensorDecision --limit 20`
+"""
+
+defaultFileName = "blind-audit.sqlite3"
+
+_schema = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    instruction TEXT,
+    decision TEXT,
+    position REAL,
+    detail TEXT,
+    request TEXT
+);
+CREATE INDEX IF NOT EXISTS eventsByTime ON events (at);
+CREATE INDEX IF NOT EXISTS eventsBySource ON events (source, at);
+CREATE INDEX IF NOT EXISTS eventsByKind ON events (kind, at);
+"""
+
+_columns = ("at", "kind", "source", "instruction", "decision", "position", "detail", "request")
+
+
+def connect(_fileName: str = defaultFileName) -> sqlite3.Connection:
+    connection = sqlite3.connect(_fileName, timeout=5, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    # WAL keeps the database consistent on power loss, only the last batches could be lost
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_schema)
+
+    # a database from before requests were kept
+    existingColumns = {_row[1] for _row in connection.execute("PRAGMA table_info(events)")}
+    if "request" not in existingColumns:
+        try:
+            with connection:
+                connection.execute("ALTER TABLE events ADD COLUMN request TEXT")
+        except sqlite3.OperationalError:
+            # another process added it meanwhile
+            pass
+    return connection
+
+
+class AuditLog(threading.Thread):
+    """
+    Caller uses `record()`, which never blocks
+    """
+    __fileName: str = None
+    __source: str = None
+    __batchSize: int = None
+    __flushIntervalInSeconds: float = None
+    __events: queue.Queue = None
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    recorded: int = 0
+    dropped: int = 0
+    written: int = 0
+    batches: int = 0
+    writeSeconds: float = 0.0
+
+    def __init__(
+            self,
+            _source: str,
+            _fileName: str = defaultFileName,
+            _batchSize: int = 256,
+            _flushIntervalInSeconds: float = 0.5,
+            _maxQueuedEvents: int = 10_000
+    ):
+        """
+        `_source` is the default source of events, e.g. "motor" or "light"
+        """
+        super().__init__(daemon=True, name=f"audit-log-{_source}")
+        self.__fileName = _fileName
+        self.__source = _source
+        self.__batchSize = _batchSize
+        self.__flushIntervalInSeconds = _flushIntervalInSeconds
+        self.__events = queue.Queue(maxsize=_maxQueuedEvents)
+        self.__stop_event = threading.Event()
+
+    def record(
+            self,
+            _kind: str,
+            _source: Optional[str] = None,
+            _instruction: Optional[str] = None,
+            _decision: Optional[str] = None,
+            _position: Optional[float] = None,
+            _detail: Optional[str] = None,
+            _request: Optional[str] = None
+    ) -> bool:
+        """
+        Queue an event, returns False when the writer has fallen too far behind and the event was dropped
+        - `_request` is the request as it arrived, headers and all
+        """
+        event = (
+            time(), _kind, self.__source if _source is None else _source,
+            _instruction, _decision, _position, _detail, _request
+        )
+        try:
+            self.__events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.recorded += 1
+        return True
+
+    def __takeBatch(self, _timeout: float) -> List[tuple]:
+        try:
+            batch = [self.__events.get(timeout=_timeout)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.__batchSize:
+            try:
+                batch.append(self.__events.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __write(self, _connection: sqlite3.Connection, _batch: List[tuple]):
+        startedAt = timer()
+        try:
+            with _connection:
+                _connection.executemany(
+                    f"INSERT INTO events ({', '.join(_columns)}) VALUES ({', '.join('?' * len(_columns))})",
+                    _batch
+                )
+        except sqlite3.Error as error:
+            print(f"AUDIT LOG ERROR: could not write {len(_batch)} events {error=}")
+            return
+
+        self.written += len(_batch)
+        self.batches += 1
+        self.writeSeconds += timer() - startedAt
+
+    def run(self):
+        print(f" $$$$$$$$ RUNNING AUDIT LOG ({self.__source}) $$$$$$$$")
+        connection = connect(self.__fileName)
+
+        while not self.__stop_event.is_set():
+            batch = self.__takeBatch(self.__flushIntervalInSeconds)
+            if batch:
+                self.__write(connection, batch)
+
+        # write whatever is still queued
+        batch = self.__takeBatch(0)
+        while batch:
+            self.__write(connection, batch)
+            batch = self.__takeBatch(0)
+
+        connection.close()
+
+    def counters(self) -> Dict[str, float]:
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "writeSeconds": round(self.writeSeconds, 6),
+        }
+
+    def cleanup(self):
+        print(f"AUDIT LOG CLEANUP: {self.counters()}")
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def query(
+        _fileName: str = defaultFileName,
+        _since: Optional[float] = None,
+        _until: Optional[float] = None,
+        _source: Optional[str] = None,
+        _kind: Optional[str] = None,
+        _limit: int = 100
+) -> List[Dict]:
+    """
+    Events in time order, filtered by time range (epoch seconds), source and kind
+    """
+    conditions = []
+    values = []
+    if _since is not None:
+        conditions.append("at >= ?")
+        values.append(_since)
+    if _until is not None:
+        conditions.append("at < ?")
+        values.append(_until)
+    if _source is not None:
+        conditions.append("source = ?")
+        values.append(_source)
+    if _kind is not None:
+        conditions.append("kind = ?")
+        values.append(_kind)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    connection = connect(_fileName)
+    try:
+        rows = connection.execute(
+            f"SELECT {', '.join(_columns)} FROM events {where} ORDER BY at LIMIT ?",
+            (*values, _limit)
+        ).fetchall()
+    finally:
+        connection.close()
+
+    return [dict(zip(_columns, _row)) for _row in rows]
+
+
+def _parseTime(_value: str) -> float:
+    # local time, e.g. "2024-05-01 14:02" or "2024-05-01T14:02:30"
+    return datetime.fromisoformat(_value).timestamp()
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Query the blind's audit log")
+    parser.add_argument("--file", default=defaultFileName)
+    parser.add_argument("--since", type=_parseTime, help="local time, e.g. '2024-05-01 14:00'")
+    parser.add_argument("--until", type=_parseTime, help="local time, e.g. '2024-05-01 14:05'")
+    parser.add_argument("--source", help="e.g. unix:ir, unix:relay, 192.168.1.20, scheduler, motor, light, climate")
+    parser.add_argument("--kind", choices=["command", "motorStart", "motorStop", "sensorDecision"])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--requests", action="store_true", help="print each command's request as it arrived")
+    arguments = parser.parse_args(_arguments)
+
+    events = query(arguments.file, arguments.since, arguments.until, arguments.source, arguments.kind, arguments.limit)
+    for _event in events:
+        at = datetime.fromtimestamp(_event["at"]).isoformat(sep=" ", timespec="milliseconds")
+        position = "" if _event["position"] is None else f" at {_event['position']:.1f} cm"
+        print(
+            f"{at} {_event['kind']:<14} {_event['source']:<12} "
+            f"{_event['instruction'] or '-'} -> {_event['decision'] or '-'}{position} {_event['detail'] or ''}"
+        )
+        if arguments.requests and _event["request"] is not None:
+            print(f"    {_event['request']!r}")
+    return events
+
+
+if __name__ == "__main__":
+    main()
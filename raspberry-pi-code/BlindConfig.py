@@ -0,0 +1,488 @@
+import argparse
+import ctypes
+import ctypes.util
+import json
+import math
+import os
+import select
+import struct
+import tempfile
+import threading
+from copy import deepcopy
+from time import sleep, time
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from Profiling import Timings
+from PwmBackend import backendNames as pwmBackendNames, rpiGpioBackend
+
+"""
+One config file for every entry point, that can be changed while they run
+- the file is json, with one section per part of the system, every value is optional
+- it is validated against `schema`, a file that fails validation is reported and ignored,
+  the last good config stays in effect
+- `ConfigWatcher` watches the file with inotify (polling the file's mtime where inotify isn't available),
+  and hands every new config to the running services
+- each service applies a new config between two iterations of its own loop, all of it at once,
+  so no iteration ever sees half an old config and half a new one
+- pins only change while the motor is stopped
+
+Every reload is timed, from reading the file to handing over the new config (`config.reload`),
+and from the file changing to the config being in effect in the service (`config.changeToEffect`).
+
+Run e.g.
+  `python BlindConfig.py --write-defaults blind-config.json`
+  `python BlindConfig.py --check blind-config.json`
+  `python BlindConfig.py --benchmark 200` (reload cost and latency, with inotify and with polling)
+"""
+
+defaultFileName = "blind-config.json"
+
+# section -> key -> (type, minimum, maximum, default), text has no minimum and maximum but `choices`
+schema: Dict[str, Dict[str, Tuple[type, Optional[float], Optional[float], Any]]] = {
+    "light": {
+        "closeBlindWhenBrighterThan": (float, 0, 1023, 700),
+        "closeBlindWhenDarkerThan": (float, 0, 1023, 100),
+        "medianWindow": (int, 1, 99, 1),
+        "minimumSampleIntervalInSeconds": (float, 0.01, 3600, 0.25),
+        "maximumSampleIntervalInSeconds": (float, 0.01, 3600, 4),
+        # close ahead of a crossing (see LightTrend), off while the lead time is 0
+        "predictLeadInSeconds": (float, 0, 3600, 0),
+        "predictMinimumConfidence": (float, 0, 1000, 16),
+    },
+    "climate": {
+        "closeBlindAtTemperature": (float, -40, 80, 25),
+        "closeBlindAtHumidity": (float, 0, 100, 80),
+        "minimumSampleIntervalInSeconds": (float, 1, 3600, 1),
+        "maximumSampleIntervalInSeconds": (float, 1, 3600, 30),
+    },
+    "blind": {
+        "heightInCm": (float, 1, 1000, 200),
+        "speedInCmPerSecond": (float, 0.1, 100, 8),
+    },
+    "motor": {
+        "lowPowerForLoweringBlind": (float, 0, 100, 90),
+        "highPowerForRaisingBlind": (float, 0, 100, 100),
+        "bridgeInput1Pin": (int, 0, 27, 26),
+        "bridgeInput2Pin": (int, 0, 27, 4),
+        "bridgePwmPin": (int, 0, 27, 22),
+        # only read when the motor starts, see PwmBackend
+        "pwmBackend": (str, None, None, rpiGpioBackend),
+    },
+}
+
+# section -> key -> the values a text setting can have
+choices: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "motor": {
+        "pwmBackend": pwmBackendNames,
+    },
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def defaults() -> Dict[str, Dict[str, Any]]:
+    return {
+        _section: {_key: _spec[3] for _key, _spec in _keys.items()}
+        for _section, _keys in schema.items()
+    }
+
+
+def validate(_raw: Dict) -> Dict[str, Dict[str, Any]]:
+    """
+    The complete config, with defaults for everything the file leaves out
+    - raises ConfigError for unknown sections and keys, wrong types, values out of range,
+      and values that contradict each other
+    """
+    if not isinstance(_raw, dict):
+        raise ConfigError("config must be a json object")
+
+    config = defaults()
+    for _section, _values in _raw.items():
+        if _section not in schema:
+            raise ConfigError(f"unknown section '{_section}'")
+        if not isinstance(_values, dict):
+            raise ConfigError(f"section '{_section}' must be a json object")
+
+        for _key, _value in _values.items():
+            if _key not in schema[_section]:
+                raise ConfigError(f"unknown key '{_section}.{_key}'")
+
+            _type, _minimum, _maximum, _ = schema[_section][_key]
+            if _type is str:
+                if _value not in choices[_section][_key]:
+                    raise ConfigError(
+                        f"'{_section}.{_key}' must be one of {', '.join(choices[_section][_key])}, not {_value!r}"
+                    )
+                config[_section][_key] = _value
+                continue
+
+            # json has no separate int type for floats, but a bool is not a number here
+            if isinstance(_value, bool) or not isinstance(_value, (int, float)):
+                raise ConfigError(f"'{_section}.{_key}' must be a number, not {_value!r}")
+            # python's json reads NaN and Infinity, which no setting can be
+            if not math.isfinite(_value):
+                raise ConfigError(f"'{_section}.{_key}' must be a finite number, not {_value!r}")
+            if _type is int and _value != int(_value):
+                raise ConfigError(f"'{_section}.{_key}' must be a whole number, not {_value!r}")
+            if not _minimum <= _value <= _maximum:
+                raise ConfigError(f"'{_section}.{_key}' must be between {_minimum} and {_maximum}, not {_value!r}")
+
+            config[_section][_key] = _type(_value)
+
+    light, climate, motor = config["light"], config["climate"], config["motor"]
+    if light["closeBlindWhenDarkerThan"] >= light["closeBlindWhenBrighterThan"]:
+        raise ConfigError("'light.closeBlindWhenDarkerThan' must be below 'light.closeBlindWhenBrighterThan'")
+    if light["medianWindow"] % 2 == 0:
+        raise ConfigError("'light.medianWindow' must be odd")
+    for _section in (light, climate):
+        if _section["minimumSampleIntervalInSeconds"] > _section["maximumSampleIntervalInSeconds"]:
+            raise ConfigError("minimum sample interval must not be above the maximum")
+    pins = [motor["bridgeInput1Pin"], motor["bridgeInput2Pin"], motor["bridgePwmPin"]]
+    if len(set(pins)) != len(pins):
+        raise ConfigError(f"motor pins must all be different, not {pins}")
+
+    return config
+
+
+def load(_fileName: str = defaultFileName) -> Dict[str, Dict[str, Any]]:
+    """
+    A missing file means every default, a broken one raises ConfigError
+    - a file that can't be read (e.g. no permission) raises OSError, one that isn't utf-8 UnicodeDecodeError
+    """
+    try:
+        with open(_fileName) as _file:
+            raw = json.load(_file)
+    except FileNotFoundError:
+        return defaults()
+    except json.JSONDecodeError as error:
+        raise ConfigError(f"{_fileName} is not valid json: {error}")
+    return validate(raw)
+
+
+def loadAtStartup(_fileName: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    A service that can't read its config still starts, with the defaults, rather than leave the blind stuck
+    """
+    if _fileName is None:
+        return defaults()
+    try:
+        return load(_fileName)
+    except (ConfigError, OSError, ValueError) as error:
+        print(f"CONFIG ERROR, STARTING WITH THE DEFAULTS: {error}")
+        return defaults()
+
+
+def recordInEffect(_changedAt: float):
+    """
+    Called by a service once a new config is in effect, with the time the file changed
+    """
+    Timings.histogram("config.changeToEffect").record(max(0.0, time() - _changedAt))
+
+
+class PendingConfig:
+    """
+    Hands a new config over from the watcher's thread to the thread of the service that uses it
+    - `isWaiting` is a plain attribute, cheap enough to check on every iteration of a loop
+    - `arrived` is set with it, so a service can wait for its next reading or a new config
+    """
+    isWaiting: bool = False
+    arrived: threading.Event = None
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pending: Optional[Tuple[Dict, float]] = None
+        self.arrived = threading.Event()
+
+    def offer(self, _config: Dict, _changedAt: float):
+        """
+        Takes the place of any config still waiting, only the newest is ever applied
+        """
+        with self.__lock:
+            self.__pending = (_config, _changedAt)
+            self.isWaiting = True
+        self.arrived.set()
+
+    def take(self) -> Optional[Tuple[Dict, float]]:
+        with self.__lock:
+            pending, self.__pending = self.__pending, None
+            self.isWaiting = False
+            self.arrived.clear()
+        return pending
+
+    def putBack(self, _pending: Tuple[Dict, float]):
+        """
+        Not the right moment to apply it, e.g. the motor is running, unless a newer one came in meanwhile
+        """
+        with self.__lock:
+            if self.__pending is None:
+                self.__pending = _pending
+                self.isWaiting = True
+
+
+class _Inotify:
+    """
+    Just enough inotify, through libc, to hear about one directory
+    """
+    __closeWrite = 0x00000008
+    __movedTo = 0x00000080
+    __create = 0x00000100
+    __event = struct.Struct("iIII")
+
+    def __init__(self, _directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fileno = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fileno < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = self.__closeWrite | self.__movedTo | self.__create
+        if libc.inotify_add_watch(self.fileno, _directory.encode(), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fileno)
+            raise OSError(error, f"inotify_add_watch failed for {_directory}")
+
+    def changedNames(self) -> List[str]:
+        names = []
+        try:
+            data = os.read(self.fileno, 64 * 1024)
+        except BlockingIOError:
+            return names
+
+        offset = 0
+        while offset + self.__event.size <= len(data):
+            _watch, _mask, _cookie, length = self.__event.unpack_from(data, offset)
+            offset += self.__event.size
+            names.append(data[offset:offset + length].rstrip(b"\0").decode())
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fileno)
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Hands every new, valid config to `_apply` callbacks, which take the config and the time the file changed
+    - callbacks run in this thread, and should only hand the config over to the service's own thread
+    """
+    __fileName: str = None
+    __apply: List[Callable[[Dict, float], None]] = None
+    __pollIntervalInSeconds: float = None
+    __settleInSeconds: float = None
+
+    # the config in effect
+    config: Dict[str, Dict[str, Any]] = None
+    __lastModified: Optional[int] = None
+
+    # allow this thread to be stopped as part of the cleanup
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    usesInotify: bool = False
+    reloads: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+
+    def __init__(
+            self,
+            _fileName: str,
+            _apply: List[Callable[[Dict, float], None]],
+            _initialConfig: Optional[Dict] = None,
+            _pollIntervalInSeconds: float = 1,
+            _settleInSeconds: float = 0.005,
+            _useInotify: bool = True
+    ):
+        super().__init__(daemon=True, name="config-watcher")
+        self.__fileName = os.path.abspath(_fileName)
+        self.__apply = _apply
+        self.__pollIntervalInSeconds = _pollIntervalInSeconds
+        self.__settleInSeconds = _settleInSeconds
+        self.__stop_event = threading.Event()
+        self.usesInotify = _useInotify
+        self.config = _initialConfig if _initialConfig is not None else load(_fileName)
+        self.__lastModified = self.__modified()
+
+    def __modified(self) -> Optional[int]:
+        try:
+            return os.stat(self.__fileName).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        """
+        Read the file again, and hand the config over when it's valid and different
+        """
+        changedAt = time()
+        startedAt = timer()
+        modified = self.__modified()
+        if modified is not None:
+            changedAt = modified / 1e9
+
+        # anything wrong with the file is reported, an exception here would end the watcher and with it every reload
+        # - e.g. it's gone for a moment while an editor saves it, or can't be read
+        try:
+            config = load(self.__fileName)
+        except (ConfigError, OSError, ValueError) as error:
+            self.rejected += 1
+            print(f"CONFIG REJECTED, KEEPING THE LAST GOOD CONFIG: {error}")
+            return False
+
+        if config == self.config:
+            self.unchanged += 1
+            return False
+
+        self.config = config
+        for _apply in self.__apply:
+            _apply(deepcopy(config), changedAt)
+
+        self.reloads += 1
+        Timings.histogram("config.reload").record(timer() - startedAt)
+        print(f"CONFIG RELOADED from {self.__fileName}")
+        return True
+
+    def run(self):
+        inotify = None
+        if self.usesInotify:
+            try:
+                inotify = _Inotify(os.path.dirname(self.__fileName))
+            except (OSError, AttributeError) as error:
+                print(f"CONFIG: inotify unavailable, polling every {self.__pollIntervalInSeconds}s {error=}")
+                self.usesInotify = False
+
+        try:
+            while not self.__stop_event.is_set():
+                if inotify is not None:
+                    self.__waitForInotify(inotify)
+                else:
+                    self.__waitForPoll()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def __waitForInotify(self, _inotify: _Inotify):
+        # wake up now and then to notice the stop event
+        readable, _, _ = select.select([_inotify.fileno], [], [], self.__pollIntervalInSeconds)
+        if not readable:
+            return
+
+        if os.path.basename(self.__fileName) not in _inotify.changedNames():
+            return
+
+        # editors write in several steps, take the file once they're done
+        sleep(self.__settleInSeconds)
+        _inotify.changedNames()
+        self.reload()
+
+    def __waitForPoll(self):
+        if self.__stop_event.wait(self.__pollIntervalInSeconds):
+            return
+
+        modified = self.__modified()
+        if modified != self.__lastModified:
+            self.__lastModified = modified
+            self.reload()
+
+    def counters(self) -> Dict:
+        return {
+            "usesInotify": self.usesInotify,
+            "reloads": self.reloads,
+            "unchanged": self.unchanged,
+            "rejected": self.rejected,
+        }
+
+    def cleanup(self):
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def writeAtomically(_fileName: str, _config: Dict):
+    """
+    Replace the file in one step, so a watcher never reads half of it
+    """
+    directory = os.path.dirname(os.path.abspath(_fileName))
+    descriptor, temporaryName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(descriptor, "w") as _file:
+        json.dump(_config, _file, indent=2)
+    os.replace(temporaryName, _fileName)
+
+
+def benchmark(_reloads: int, _useInotify: bool, _pollIntervalInSeconds: float) -> Dict[str, Any]:
+    """
+    Change the file over and over, and time how long each change takes to reach a service
+    """
+    directory = tempfile.mkdtemp()
+    fileName = os.path.join(directory, defaultFileName)
+    writeAtomically(fileName, defaults())
+
+    applied = threading.Condition()
+    latest: List[float] = []
+
+    def _apply(_config: Dict, _changedAt: float):
+        with applied:
+            latest.append(_config["light"]["closeBlindWhenBrighterThan"])
+            applied.notify_all()
+
+    Timings.reset()
+    watcher = ConfigWatcher(
+        fileName, [_apply], _pollIntervalInSeconds=_pollIntervalInSeconds, _useInotify=_useInotify
+    )
+    watcher.start()
+    sleep(0.1)
+
+    latencies = []
+    config = defaults()
+    for _reload in range(_reloads):
+        config["light"]["closeBlindWhenBrighterThan"] = 500 + _reload
+        writtenAt = timer()
+        writeAtomically(fileName, config)
+        with applied:
+            applied.wait_for(lambda: latest and latest[-1] == 500 + _reload, timeout=10)
+        latencies.append(timer() - writtenAt)
+
+    watcher.cleanup()
+    os.unlink(fileName)
+    os.rmdir(directory)
+
+    latencies.sort()
+    return {
+        "mode": "inotify" if watcher.usesInotify else "polling",
+        "reloads": watcher.reloads,
+        "reloadCostMeanUs": round(Timings.snapshot()["config.reload"].get("meanUs", 0), 1),
+        "changeToApplyMeanMs": round(sum(latencies) / len(latencies) * 1000, 2),
+        "changeToApplyP99Ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Check, write or benchmark the blind's config file")
+    parser.add_argument("--check", metavar="FILE", help="validate a config file")
+    parser.add_argument("--write-defaults", metavar="FILE", help="write a config file with every default")
+    parser.add_argument("--benchmark", type=int, metavar="RELOADS", help="time this many reloads")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="for the polling benchmark")
+    arguments = parser.parse_args(_arguments)
+
+    if arguments.check:
+        try:
+            print(json.dumps(load(arguments.check), indent=2))
+            print(f"### {arguments.check} IS VALID ###")
+        except ConfigError as error:
+            print(f"### {arguments.check} IS NOT VALID: {error} ###")
+            return False
+
+    if arguments.write_defaults:
+        writeAtomically(arguments.write_defaults, defaults())
+        print(f"### WROTE {arguments.write_defaults} ###")
+
+    if arguments.benchmark:
+        Timings.enabled = True
+        print("### CONFIG RELOAD BENCHMARK ###")
+        for _useInotify in (True, False):
+            print(benchmark(arguments.benchmark, _useInotify, arguments.poll_interval))
+    return True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import heapq
+import json
+import math
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, List, Optional
+
+
+class ScheduleEntry:
+    """
+    Simple data class for one schedule, e.g. "close to 120 at sunset" or "up at 07:00 on weekdays"
+    - `at` is either "HH:MM" local time, "sunrise" or "sunset"
+    - `weekdays` uses python numbering, i.e. monday is 0 and sunday is 6
+    """
+    entryId: str = None
+    room: str = None
+    at: str = None
+    offsetInMinutes: int = 0
+    weekdays: List[int] = None
+    instruction: str = None
+
+    def __init__(
+            self,
+            _entryId: str,
+            _room: str,
+            _at: str,
+            _instruction: str,
+            _weekdays: List[int] = None,
+            _offsetInMinutes: int = 0
+    ):
+        self.entryId: str = _entryId
+        self.room: str = _room
+        self.at: str = _at
+        self.instruction: str = _instruction
+        self.weekdays: List[int] = sorted(set(_weekdays)) if _weekdays else list(range(7))
+        self.offsetInMinutes: int = _offsetInMinutes
+
+    def toDict(self) -> Dict:
+        return {
+            "id": self.entryId,
+            "room": self.room,
+            "at": self.at,
+            "instruction": self.instruction,
+            "weekdays": self.weekdays,
+            "offsetInMinutes": self.offsetInMinutes,
+        }
+
+    @staticmethod
+    def fromDict(_data: Dict) -> 'ScheduleEntry':
+        return ScheduleEntry(
+            _entryId=str(_data["id"]),
+            _room=_data.get("room", BlindScheduler.anyRoom),
+            _at=_data["at"],
+            _instruction=str(_data["instruction"]),
+            _weekdays=_data.get("weekdays"),
+            _offsetInMinutes=int(_data.get("offsetInMinutes", 0)),
+        )
+
+
+class BlindScheduler(threading.Thread):
+    """
+    Run time-of-day schedules for the blind in a background thread
+    - due times are kept in a min-heap, so adding a schedule is O(log n)
+    - cancelling marks the heap item as dead (O(1)), dead items are dropped when they reach the top
+    - the thread sleeps until the next due schedule, or until an earlier schedule is added
+    - due schedules are sent to the same `instruct()` path that network commands use
+    """
+
+    # schedules that should run in every room
+    anyRoom = "*"
+
+    # names of the weekdays accepted by `parseWeekdays()`
+    __weekdayNames = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+    # sun events that can be used instead of a clock time
+    __sunrise = "sunrise"
+    __sunset = "sunset"
+
+    # schedules are saved here so they survive a restart
+    __filePath: Path = None
+
+    # only schedules for this room (or for any room) are run by this blind
+    __room: str = None
+
+    # location of the blind, needed for sunrise/sunset
+    __latitude: float = None
+    __longitude: float = None
+
+    # send due instructions to the motor
+    __instruct: Callable[[str], bool] = None
+
+    # raises ValueError for an instruction the motor can't act on, see `Data.checkInstruction()`
+    __checkInstruction: Callable[[str], None] = None
+
+    # all known schedules, including those for other rooms
+    __entries: Dict[str, ScheduleEntry] = None
+
+    # heap of [dueTimestamp, sequence, entryId, isAlive]
+    __heap: List[list] = None
+    __heapItems: Dict[str, list] = None
+    __deadItemsInHeap: int = 0
+    __sequence = None
+
+    # wake the thread when schedules change or on cleanup
+    __state: threading.Condition = None
+    __stop_event: threading.Event = None
+
+    def __init__(
+            self,
+            _instruct: Callable[[str], bool],
+            _checkInstruction: Callable[[str], None],
+            _room: str = anyRoom,
+            _fileName: str = "blind-schedules.json",
+            _latitude: float = -37.8136,
+            _longitude: float = 144.9631
+    ):
+        super().__init__(daemon=True)
+        self.__instruct = _instruct
+        self.__checkInstruction = _checkInstruction
+        self.__room = _room
+        self.__filePath = Path(f"./{_fileName}")
+        self.__latitude = _latitude
+        self.__longitude = _longitude
+
+        self.__entries = {}
+        self.__heap = []
+        self.__heapItems = {}
+        self.__deadItemsInHeap = 0
+        self.__sequence = count()
+
+        self.__state = threading.Condition()
+        self.__stop_event = threading.Event()
+
+        self.__loadFromDisk()
+
+    def __loadFromDisk(self):
+        """
+        Read saved schedules, e.g. after a restart or power outage
+        """
+        if not self.__filePath.is_file():
+            return
+
+        try:
+            with open(self.__filePath, "r") as _file:
+                _savedEntries = json.load(_file)
+        except (OSError, ValueError) as error:
+            print(f'SCHEDULE ERROR: could not read "{self.__filePath}" {error=}')
+            return
+
+        for _data in _savedEntries:
+            try:
+                self.__addEntry(ScheduleEntry.fromDict(_data))
+            except (KeyError, TypeError, ValueError) as error:
+                print(f'SCHEDULE ERROR: skipping invalid schedule {_data=} {error=}')
+
+        print(f"### LOADED {len(self.__entries)} SCHEDULES ###")
+
+    def __saveToDisk(self):
+        """
+        Overwrite the schedules file, via a temporary file so a power cut can't leave half a file
+        """
+        _temporaryPath = self.__filePath.with_suffix(".tmp")
+        with open(_temporaryPath, "w") as _file:
+            json.dump([_entry.toDict() for _entry in self.__entries.values()], _file)
+            _file.flush()
+            os.fsync(_file.fileno())
+        os.replace(_temporaryPath, self.__filePath)
+
+    @classmethod
+    def parseWeekdays(cls, _weekdays: str) -> List[int]:
+        """
+        Turn "mon-fri", "sat,sun", "daily" or "weekdays" into weekday numbers
+        """
+        _weekdays = _weekdays.lower()
+        if _weekdays in ("daily", "everyday", "*"):
+            return list(range(7))
+        if _weekdays == "weekdays":
+            return list(range(5))
+        if _weekdays == "weekends":
+            return [5, 6]
+
+        days = set()
+        for _part in _weekdays.split(","):
+            if "-" in _part:
+                _first, _last = _part.split("-")
+                _first, _last = cls.__weekdayNames.index(_first), cls.__weekdayNames.index(_last)
+                days.update(range(_first, _last + 1))
+            else:
+                days.add(cls.__weekdayNames.index(_part))
+
+        return sorted(days)
+
+    def __isForThisBlind(self, _entry: ScheduleEntry) -> bool:
+        return self.__room == self.anyRoom or _entry.room in (self.anyRoom, self.__room)
+
+    def __sunEventTime(self, _date: datetime, _isSunrise: bool) -> Optional[datetime]:
+        """
+        NOAA sunrise equation, accurate to roughly a minute
+        - returns None during polar day/night
+        """
+        dayOfYear = _date.timetuple().tm_yday
+        gamma = 2 * math.pi / 365 * (dayOfYear - 1)
+        equationOfTime = 229.18 * (
+                0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma)
+        )
+        declination = (
+                0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+                - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+                - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma)
+        )
+
+        latitude = math.radians(self.__latitude)
+        cosHourAngle = (
+                math.cos(math.radians(90.833)) / (math.cos(latitude) * math.cos(declination))
+                - math.tan(latitude) * math.tan(declination)
+        )
+        if not -1 <= cosHourAngle <= 1:
+            return None
+
+        hourAngle = math.degrees(math.acos(cosHourAngle))
+        hourAngle = hourAngle if _isSunrise else -hourAngle
+        minutesAfterUtcMidnight = 720 - 4 * (self.__longitude + hourAngle) - equationOfTime
+
+        # the equation works in minutes after utc midnight, convert that to local time
+        utcMidnight = datetime(_date.year, _date.month, _date.day, tzinfo=timezone.utc).timestamp()
+        return datetime.fromtimestamp(utcMidnight + minutesAfterUtcMidnight * 60)
+
+    def __timeOnDay(self, _entry: ScheduleEntry, _day: datetime) -> Optional[datetime]:
+        """
+        When the schedule runs on the given day (local time)
+        """
+        if _entry.at in (self.__sunrise, self.__sunset):
+            dueAt = self.__sunEventTime(_day, _isSunrise=_entry.at == self.__sunrise)
+            if dueAt is None:
+                return None
+        else:
+            _hours, _minutes = _entry.at.split(":")
+            dueAt = _day.replace(hour=int(_hours), minute=int(_minutes), second=0, microsecond=0)
+
+        return dueAt + timedelta(minutes=_entry.offsetInMinutes)
+
+    def nextDueTime(self, _entry: ScheduleEntry, _after: float) -> Optional[float]:
+        """
+        Find the first time after `_after` that the schedule should run
+        """
+        startOfDay = datetime.fromtimestamp(_after).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # look one day further than a week so late sunsets and offsets are always found
+        for _daysAhead in range(9):
+            day = startOfDay + timedelta(days=_daysAhead)
+            if day.weekday() not in _entry.weekdays:
+                continue
+
+            dueAt = self.__timeOnDay(_entry, day)
+            if dueAt is not None and dueAt.timestamp() > _after:
+                return dueAt.timestamp()
+
+        return None
+
+    def __push(self, _entry: ScheduleEntry, _after: float):
+        """
+        Put the next run of a schedule onto the heap
+        """
+        dueTime = self.nextDueTime(_entry, _after)
+        if dueTime is None:
+            print(f'SCHEDULE NOTICE: "{_entry.entryId}" has no upcoming run')
+            return
+
+        heapItem = [dueTime, next(self.__sequence), _entry.entryId, True]
+        self.__heapItems[_entry.entryId] = heapItem
+        heapq.heappush(self.__heap, heapItem)
+
+    def __removeFromHeap(self, _entryId: str):
+        heapItem = self.__heapItems.pop(_entryId, None)
+        if heapItem is None:
+            return
+
+        # lazy delete, the item is dropped when it reaches the top of the heap
+        heapItem[3] = False
+        self.__deadItemsInHeap += 1
+
+        # rebuild the heap when it is mostly dead items so memory doesn't grow
+        if self.__deadItemsInHeap > len(self.__heap) // 2:
+            self.__heap = [_item for _item in self.__heap if _item[3]]
+            heapq.heapify(self.__heap)
+            self.__deadItemsInHeap = 0
+
+    def __addEntry(self, _entry: ScheduleEntry):
+        # validate the schedule before accepting it
+        if _entry.at not in (self.__sunrise, self.__sunset):
+            _hours, _minutes = _entry.at.split(":")
+            if not (0 <= int(_hours) < 24 and 0 <= int(_minutes) < 60):
+                raise ValueError(f'invalid time "{_entry.at}"')
+        if not all(0 <= _day < 7 for _day in _entry.weekdays):
+            raise ValueError(f'invalid weekdays "{_entry.weekdays}"')
+        # same rules as an instruction sent live, checked now rather than when it's due
+        self.__checkInstruction(_entry.instruction)
+
+        # replacing an existing schedule cancels its old run
+        self.__removeFromHeap(_entry.entryId)
+        self.__entries[_entry.entryId] = _entry
+
+        if self.__isForThisBlind(_entry):
+            self.__push(_entry, time())
+
+    def add(self, _entry: ScheduleEntry) -> str:
+        """
+        Caller uses this to add (or replace) a schedule
+        """
+        with self.__state:
+            self.__addEntry(_entry)
+            self.__saveToDisk()
+
+            # wake the thread in case this schedule is due before the one it is sleeping for
+            self.__state.notify()
+
+        return _entry.entryId
+
+    def cancel(self, _entryId: str) -> bool:
+        """
+        Caller uses this to remove a schedule
+        """
+        with self.__state:
+            if self.__entries.pop(_entryId, None) is None:
+                return False
+
+            self.__removeFromHeap(_entryId)
+            self.__saveToDisk()
+            self.__state.notify()
+
+        return True
+
+    def entries(self) -> List[ScheduleEntry]:
+        with self.__state:
+            return list(self.__entries.values())
+
+    def newEntryId(self) -> str:
+        return f"{int(time() * 1000):x}{next(self.__sequence):x}"
+
+    def __popDueEntries(self, _now: float) -> List[ScheduleEntry]:
+        """
+        Take every schedule that is due off the heap and queue its next run
+        """
+        dueEntries = []
+
+        while self.__heap and self.__heap[0][0] <= _now:
+            _dueTime, _sequence, _entryId, _isAlive = heapq.heappop(self.__heap)
+
+            if not _isAlive:
+                self.__deadItemsInHeap -= 1
+                continue
+
+            del self.__heapItems[_entryId]
+            _entry = self.__entries[_entryId]
+            dueEntries.append(_entry)
+            self.__push(_entry, max(_now, _dueTime))
+
+        return dueEntries
+
+    def run(self):
+        print(" $$$$$$$$ RUNNING SCHEDULER $$$$$$$$")
+
+        while not self.__stop_event.is_set():
+            with self.__state:
+                dueEntries = self.__popDueEntries(time())
+
+                # sleep until the next schedule is due (or until woken by add/cancel/cleanup)
+                if not dueEntries:
+                    sleepFor = self.__heap[0][0] - time() if self.__heap else None
+                    self.__state.wait(timeout=sleepFor)
+                    continue
+
+            # send outside the lock so add/cancel are never blocked by the motor
+            for _entry in dueEntries:
+                print(f'SCHEDULE DUE: "{_entry.entryId}" sending "{_entry.instruction}"')
+                self.__instruct(_entry.instruction)
+
+    def cleanup(self):
+        print("SCHEDULER CLEANUP: Stop thread")
+        self.__stop_event.set()
+        with self.__state:
+            self.__state.notify()
@@ -1,3 +1,4 @@
+import math
 from enum import Enum
 
 
@@ -23,3 +24,16 @@ class Instruction:
             self.shouldMoveUpward,
             self.newRequestedLength)
         )
+
+
+def checkInstruction(_instruction: str, _blindHeightInCm: float):
+    """
+    Raises ValueError unless the motor can act on the instruction:
+    one of the commands, or a length within the blind's height
+    """
+    if _instruction in (Command.Up.value, Command.Down.value, Command.Stop.value):
+        return
+
+    length = float(_instruction)
+    if not math.isfinite(length) or not 0 <= length <= _blindHeightInCm:
+        raise ValueError(f"a length must be between 0 and {_blindHeightInCm:g} cm, not {_instruction}")
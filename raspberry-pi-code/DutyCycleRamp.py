@@ -0,0 +1,155 @@
+from typing import List, NamedTuple, Optional
+
+"""
+Soft-start and soft-reversal of the motor, without blocking the motor thread
+- a profile is a precomputed list of steps, each with a time offset from the start of the profile
+- the motor loop asks `due()` for the steps whose time has come, and applies them
+- a new instruction replaces (or cancels) the profile at any step, e.g. a stop during the kick
+- every step says how fast the blind moves until the next one, so the time spent in a ramp
+  is counted by the position tracking
+
+Profiles
+- kick: full power for a moment to get a standing motor turning, then the running duty cycle
+- ramp-up: a few steps from a gentle duty cycle up to the running one
+- ramp-down: a few steps down to no power, before the motor is reversed
+"""
+
+
+class RampStep(NamedTuple):
+    atInSeconds: float
+    dutyCycle: float
+    # set the direction of rotation before the duty cycle, None keeps the current direction
+    upward: Optional[bool]
+    # estimated speed of the blind until the next step, as a fraction of its full speed
+    speedFraction: float
+
+
+def kickProfile(
+        _upward: bool,
+        _dutyCycle: float,
+        _kickDutyCycle: float = 100,
+        _kickInSeconds: float = 0.25,
+        _kickSpeedFraction: float = 0.5
+) -> List[RampStep]:
+    """
+    The motor is still turning up to speed during the kick
+    """
+    return [
+        RampStep(0.0, _kickDutyCycle, _upward, _kickSpeedFraction),
+        RampStep(_kickInSeconds, _dutyCycle, None, 1.0),
+    ]
+
+
+def rampUpProfile(
+        _upward: bool,
+        _dutyCycle: float,
+        _startDutyCycle: float = 50,
+        _rampInSeconds: float = 0.2,
+        _steps: int = 4
+) -> List[RampStep]:
+    profile = []
+    for _step in range(_steps + 1):
+        dutyCycle = round(_startDutyCycle + (_dutyCycle - _startDutyCycle) * _step / _steps, 2)
+        profile.append(RampStep(
+            _rampInSeconds * _step / _steps,
+            dutyCycle,
+            _upward if _step == 0 else None,
+            dutyCycle / _dutyCycle if _dutyCycle else 0.0
+        ))
+    return profile
+
+
+def rampDownProfile(_fromDutyCycle: float, _rampInSeconds: float = 0.15, _steps: int = 3) -> List[RampStep]:
+    """
+    The blind keeps moving the way it was going, slower with every step
+    """
+    profile = []
+    for _step in range(1, _steps + 1):
+        dutyCycle = round(_fromDutyCycle * (1 - _step / _steps), 2)
+        profile.append(RampStep(
+            _rampInSeconds * (_step - 1) / _steps,
+            dutyCycle,
+            None,
+            dutyCycle / _fromDutyCycle if _fromDutyCycle else 0.0
+        ))
+    return profile
+
+
+def followedBy(_first: List[RampStep], _second: List[RampStep], _pauseInSeconds: float = 0.05) -> List[RampStep]:
+    """
+    One profile after the other, e.g. ramp down, then kick the other way
+    """
+    offset = _first[-1].atInSeconds + _pauseInSeconds
+    return _first + [_step._replace(atInSeconds=_step.atInSeconds + offset) for _step in _second]
+
+
+def steadyProfile(_dutyCycle: float) -> List[RampStep]:
+    """
+    Already running the right way, only the duty cycle changes
+    """
+    return [RampStep(0.0, _dutyCycle, None, 1.0)]
+
+
+class DutyCycleRamp:
+    """
+    Plays one profile at a time
+    - only used from the motor thread, except for `cancel()`
+    """
+    __profile: List[RampStep] = None
+    __startedAt: float = None
+    __nextStep: int = 0
+
+    # counters for tuning
+    profilesStarted: int = 0
+    profilesPreempted: int = 0
+    stepsApplied: int = 0
+
+    def __init__(self):
+        self.__profile = []
+
+    def begin(self, _profile: List[RampStep], _now: float):
+        if self.isRunning():
+            self.profilesPreempted += 1
+        self.__profile = _profile
+        self.__startedAt = _now
+        self.__nextStep = 0
+        self.profilesStarted += 1
+
+    def cancel(self):
+        if self.isRunning():
+            self.profilesPreempted += 1
+        self.__profile = []
+        self.__nextStep = 0
+
+    def isRunning(self) -> bool:
+        return self.__nextStep < len(self.__profile)
+
+    def due(self, _now: float) -> List[RampStep]:
+        """
+        Steps whose time has come, in order, each is only returned once
+        """
+        profile = self.__profile
+        first = self.__nextStep
+        last = first
+        elapsed = _now - self.__startedAt if first < len(profile) else 0.0
+        while last < len(profile) and profile[last].atInSeconds <= elapsed:
+            last += 1
+
+        self.__nextStep = last
+        self.stepsApplied += last - first
+        return profile[first:last]
+
+    def remaining(self, _now: float) -> List[RampStep]:
+        """
+        Steps still to come, timed from now, e.g. to play the rest of the profile somewhere else
+        """
+        elapsed = _now - self.__startedAt if self.isRunning() else 0.0
+        return [
+            _step._replace(atInSeconds=max(0.0, _step.atInSeconds - elapsed))
+            for _step in self.__profile[self.__nextStep:]
+        ]
+
+    def remainingSeconds(self, _now: float) -> float:
+        if not self.isRunning():
+            return 0.0
+        return max(0.0, self.__profile[-1].atInSeconds - (_now - self.__startedAt))
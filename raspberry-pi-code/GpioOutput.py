@@ -0,0 +1,154 @@
+import threading
+from typing import Dict, Iterable, Set
+
+from RPi import GPIO  # type: ignore
+
+
+class RpiGpioBackend:
+    """
+    Writes pins with RPi.GPIO
+    - a batch goes through one `GPIO.output(channels, values)` call, which writes the pins in order,
+      so the pins going low are listed first, e.g. both h-bridge inputs are never high during a reversal
+    """
+
+    def setup(self, _pin: int, _level: bool):
+        GPIO.setup(_pin, GPIO.OUT, initial=GPIO.HIGH if _level else GPIO.LOW)
+
+    def write(self, _pin: int, _level: bool):
+        GPIO.output(_pin, GPIO.HIGH if _level else GPIO.LOW)
+
+    def writeBatch(self, _levels: Dict[int, bool]) -> int:
+        ordered = sorted(_levels.items(), key=lambda _item: _item[1])
+        GPIO.output([_pin for _pin, _ in ordered], [GPIO.HIGH if _level else GPIO.LOW for _, _level in ordered])
+        return 1
+
+
+class PigpioBankBackend:
+    """
+    Writes pins through the pigpio daemon
+    - a batch is applied with one `clear_bank_1` and then one `set_bank_1`, i.e. every pin
+      that goes low changes in the same instant, and only then every pin that goes high
+    - clearing first means a reversal passes through both h-bridge inputs low, never both high
+    """
+
+    __pi = None
+    __outputMode: int = None
+
+    def __init__(self, _pi):
+        import pigpio
+        self.__pi = _pi
+        self.__outputMode = pigpio.OUTPUT
+
+    def setup(self, _pin: int, _level: bool):
+        self.__pi.set_mode(_pin, self.__outputMode)
+        self.__pi.write(_pin, int(_level))
+
+    def write(self, _pin: int, _level: bool):
+        self.__pi.write(_pin, int(_level))
+
+    def writeBatch(self, _levels: Dict[int, bool]) -> int:
+        highMask = 0
+        lowMask = 0
+        for _pin, _level in _levels.items():
+            if _level:
+                highMask |= 1 << _pin
+            else:
+                lowMask |= 1 << _pin
+
+        calls = 0
+        if lowMask:
+            self.__pi.clear_bank_1(lowMask)
+            calls += 1
+        if highMask:
+            self.__pi.set_bank_1(highMask)
+            calls += 1
+        return calls
+
+
+class CachedGpioOutput:
+    """
+    Write-through cache in front of the GPIO output pins
+    - remembers the level of every pin it has set, and skips writes that wouldn't change anything
+    - `writeMany()` applies every change for one transition as a single batch
+    - pins that something else drives (e.g. the PWM pin) can opt out of the cache
+    - safe to share between threads, e.g. the watchdog's emergency stop writes while the motor thread does
+    """
+
+    __backend = None
+    __levels: Dict[int, bool] = None
+    __uncachedPins: Set[int] = None
+
+    # one write (or batch) at a time, so the cached levels always match what was written last
+    __lock: threading.Lock = None
+
+    # counters showing how much work the cache saved
+    writesRequested: int = 0
+    writesSkipped: int = 0
+    hardwareCalls: int = 0
+
+    def __init__(self, _backend=None):
+        self.__backend = _backend if _backend is not None else RpiGpioBackend()
+        self.__levels = {}
+        self.__uncachedPins = set()
+        self.__lock = threading.Lock()
+
+    def setup(self, _pin: int, _level: bool = False, _cacheWrites: bool = True):
+        with self.__lock:
+            self.__backend.setup(_pin, bool(_level))
+            self.__levels[_pin] = bool(_level)
+
+            if not _cacheWrites:
+                self.__uncachedPins.add(_pin)
+
+    def write(self, _pin: int, _level: bool):
+        _level = bool(_level)
+
+        with self.__lock:
+            self.writesRequested += 1
+
+            # nothing to do, the pin is already at this level
+            if _pin not in self.__uncachedPins and self.__levels.get(_pin) == _level:
+                self.writesSkipped += 1
+                return
+
+            self.__backend.write(_pin, _level)
+            self.__levels[_pin] = _level
+            self.hardwareCalls += 1
+
+    def writeMany(self, _levels: Dict[int, bool]):
+        """
+        Apply all pin changes for one transition together
+        """
+        with self.__lock:
+            self.writesRequested += len(_levels)
+
+            changedLevels = {
+                _pin: bool(_level) for _pin, _level in _levels.items()
+                if _pin in self.__uncachedPins or self.__levels.get(_pin) != bool(_level)
+            }
+            self.writesSkipped += len(_levels) - len(changedLevels)
+
+            if not changedLevels:
+                return
+
+            if len(changedLevels) == 1:
+                (_pin, _level), = changedLevels.items()
+                self.__backend.write(_pin, _level)
+                self.hardwareCalls += 1
+            else:
+                self.hardwareCalls += self.__backend.writeBatch(changedLevels)
+
+            self.__levels.update(changedLevels)
+
+    def forget(self, _pins: Iterable[int]):
+        # e.g. after GPIO.cleanup() the real pin levels are unknown
+        with self.__lock:
+            for _pin in _pins:
+                self.__levels.pop(_pin, None)
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "writesRequested": self.writesRequested,
+            "writesSkipped": self.writesSkipped,
+            "hardwareCalls": self.hardwareCalls,
+        }
@@ -0,0 +1,123 @@
+import threading
+from timeit import default_timer as timer
+from typing import Callable, Optional
+
+from Data import Command
+
+"""
+Press-and-hold control for the IR remote
+- the first frame of a press starts a full move, exactly like a tap
+- NEC remotes send a repeat frame every ~108 ms while a button is held, each one extends a short lease,
+  without contacting the MotorListener
+- once a press has been held for a few repeats, the lease running out (the button was released) stops the motor
+"""
+
+
+class HoldToMove(threading.Thread):
+    """
+    Caller uses `press()` for every full frame and `repeat()` for every repeat frame
+    """
+    __leaseInSeconds: float = None
+    __repeatsBeforeHold: int = None
+    __send: Callable[[str, float], None] = None
+
+    __command: Optional[str] = None
+    __repeats: int = 0
+    __lastFrameAt: float = None
+
+    __state: threading.Condition = None
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    presses: int = 0
+    holds: int = 0
+    leasesExtended: int = 0
+    sendErrors: int = 0
+
+    def __init__(
+            self,
+            _send: Callable[[str, float], None],
+            _leaseInSeconds: float = 0.15,
+            _repeatsBeforeHold: int = 2
+    ):
+        """
+        `_send(instruction, since)` sends to the MotorListener, `since` is when the IR frame that caused it ended
+        - NEC repeat frames are 108 ms apart, the lease allows for one arriving a little late
+        - fewer repeats than `_repeatsBeforeHold` is a tap, and the full move carries on after release
+        """
+        super().__init__(daemon=True)
+        self.__send = _send
+        self.__leaseInSeconds = _leaseInSeconds
+        self.__repeatsBeforeHold = _repeatsBeforeHold
+
+        self.__state = threading.Condition()
+        self.__stop_event = threading.Event()
+
+    def press(self, _instruction: str, _frameEndedAt: Optional[float] = None):
+        """
+        A full frame: send the instruction, and start watching for a hold if it moves the blind
+        """
+        frameEndedAt = timer() if _frameEndedAt is None else _frameEndedAt
+
+        with self.__state:
+            self.presses += 1
+            isMove = _instruction in (Command.Up.value, Command.Down.value)
+            self.__command = _instruction if isMove else None
+            self.__repeats = 0
+            self.__lastFrameAt = frameEndedAt
+            self.__state.notify()
+
+        self.__sendSafely(_instruction, frameEndedAt)
+
+    def repeat(self, _frameEndedAt: Optional[float] = None) -> bool:
+        """
+        A repeat frame: extend the lease of the button being held, returns False when nothing is being held
+        """
+        with self.__state:
+            if self.__command is None:
+                return False
+
+            self.__repeats += 1
+            self.__lastFrameAt = timer() if _frameEndedAt is None else _frameEndedAt
+            if self.__repeats == self.__repeatsBeforeHold:
+                self.holds += 1
+            elif self.__repeats > self.__repeatsBeforeHold:
+                self.leasesExtended += 1
+
+        return True
+
+    def run(self):
+        while not self.__stop_event.is_set():
+            with self.__state:
+                if self.__command is None:
+                    self.__state.wait()
+                    continue
+
+                lastFrameAt = self.__lastFrameAt
+                waitFor = lastFrameAt + self.__leaseInSeconds - timer()
+
+                # button may still be held
+                if waitFor > 0:
+                    self.__state.wait(timeout=waitFor)
+                    continue
+
+                # button released: a tap keeps its full move, a hold stops where it is
+                wasHeld = self.__repeats >= self.__repeatsBeforeHold
+                self.__command = None
+
+            if wasHeld:
+                print("IR HOLD RELEASED: stop motor")
+                self.__sendSafely(Command.Stop.value, lastFrameAt)
+
+    def __sendSafely(self, _instruction: str, _since: float):
+        # a failed send must not end this thread, or no later hold would ever stop the motor
+        try:
+            self.__send(_instruction, _since)
+        except Exception as error:
+            self.sendErrors += 1
+            print(f'IR HOLD ERROR: could not send "{_instruction}" {error=}')
+
+    def cleanup(self):
+        self.__stop_event.set()
+        with self.__state:
+            self.__state.notify()
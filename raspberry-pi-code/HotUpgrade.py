@@ -0,0 +1,181 @@
+import json
+import os
+import socket
+from typing import Dict, List, Optional, Tuple
+
+import MotorConnection
+
+"""
+Hand a running MotorListener over to a new process (e.g. a new version), without refusing clients or stopping the motor
+- the running listener waits for a successor on a unix socket of its own (the handoff socket, only for its own user)
+- the successor connects and asks to take over, the running listener stops accepting (new clients wait in the
+  listening sockets' backlogs), answers the clients it already accepted, and parks its motor loop
+- it sends the listening sockets (tcp, unix, telemetry and the handoff socket itself) with `SCM_RIGHTS`,
+  in the same message as a snapshot of the motor: position, the move in flight, when it started, the rest of
+  a ramp or sequence, and an instruction the debouncer was still holding back
+- the successor starts its motor controller from the snapshot, the pins and pwm are left as they are, then says
+  it adopted everything, and the old listener exits without stopping the motor or cleaning up the pins
+- when the successor goes away without confirming (e.g. it crashed on start), the old listener un-parks its motor
+  and carries on as if nothing happened
+- only a motor on the pigpio PWM backend is handed over: RPi.GPIO's software PWM is timed by a thread of the
+  process that started it, so the old and the new process would both drive the pin (see PwmBackend)
+
+Messages are one JSON object per packet (SOCK_SEQPACKET, so a message never arrives in pieces)
+- successor: takeOver {version, pid}, adopted
+- running listener: handoff {version, sockets, state} with the sockets' descriptors, refused {reason}
+
+Run e.g. `python MotorListener.py --take-over /tmp/blind-motor-listener-handoff.sock` next to the running listener
+(`python UpgradeBenchmark.py` measures how long the listener can't be reached, against a kill and restart)
+"""
+
+defaultHandoffSocketPath = "/tmp/blind-motor-listener-handoff.sock"
+protocolVersion = 1
+maxMessageSize = 1 << 16
+maxSockets = 8
+
+
+class HandoffError(ValueError):
+    pass
+
+
+def listenForSuccessor(_path: str, _mode: int = 0o600) -> socket.socket:
+    """
+    The handoff socket, whoever can connect to it can take the listener's sockets and motor, hence the mode
+    """
+    # remove a socket left behind by a previous run
+    if MotorConnection.isUnixSocket(_path):
+        os.unlink(_path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    listener.bind(_path)
+    os.chmod(_path, _mode)
+    listener.listen(1)
+    return listener
+
+
+def _send(_connection: socket.socket, _message: Dict, _fds: List[int] = ()):
+    body = json.dumps(_message, separators=(",", ":")).encode()
+    if len(body) > maxMessageSize:
+        raise HandoffError(f"a message carries up to {maxMessageSize} bytes, not {len(body)}")
+    socket.send_fds(_connection, [body], list(_fds))
+
+
+def _receive(_connection: socket.socket, _timeoutInSeconds: float) -> Tuple[Dict, List[int]]:
+    _connection.settimeout(_timeoutInSeconds)
+    body, fds, flags, _ = socket.recv_fds(_connection, maxMessageSize, maxSockets)
+    if not body:
+        raise ConnectionResetError("handoff connection closed")
+    if flags & (socket.MSG_TRUNC | socket.MSG_CTRUNC):
+        for _fd in fds:
+            os.close(_fd)
+        raise HandoffError("handoff message was truncated")
+
+    try:
+        message = json.loads(body)
+    except ValueError as error:
+        raise HandoffError(f"handoff message is not valid json: {error}")
+    if not isinstance(message, dict) or "type" not in message:
+        raise HandoffError("a handoff message must be a json object with a type")
+    return message, fds
+
+
+def _expect(_connection: socket.socket, _type: str, _timeoutInSeconds: float) -> Tuple[Dict, List[int]]:
+    message, fds = _receive(_connection, _timeoutInSeconds)
+    if message["type"] == "refused":
+        for _fd in fds:
+            os.close(_fd)
+        raise HandoffError(f"refused: {message.get('reason')}")
+    if message["type"] != _type or message.get("version", protocolVersion) != protocolVersion:
+        for _fd in fds:
+            os.close(_fd)
+        raise HandoffError(f"expected {_type} version {protocolVersion}, not {message}")
+    return message, fds
+
+
+# ---- the running listener ----
+
+def receiveTakeOver(_connection: socket.socket, _timeoutInSeconds: float = 5) -> Dict:
+    return _expect(_connection, "takeOver", _timeoutInSeconds)[0]
+
+
+def refuse(_connection: socket.socket, _reason: str):
+    try:
+        _send(_connection, {"type": "refused", "reason": _reason})
+    except OSError:
+        pass
+
+
+def sendHandoff(_connection: socket.socket, _sockets: Dict[str, socket.socket], _state: Dict):
+    """
+    The sockets stay open here too, the successor gets its own descriptors of them
+    """
+    names = list(_sockets)
+    _send(
+        _connection,
+        {"type": "handoff", "version": protocolVersion, "sockets": names, "state": _state},
+        [_sockets[_name].fileno() for _name in names]
+    )
+
+
+def awaitAdopted(_connection: socket.socket, _timeoutInSeconds: float) -> bool:
+    """
+    Whether the successor confirmed it took over, False when it went away or took too long
+    """
+    try:
+        _expect(_connection, "adopted", _timeoutInSeconds)
+        return True
+    except (OSError, HandoffError) as error:
+        print(f'HANDOFF: successor did not take over {error=}')
+        return False
+
+
+# ---- the successor ----
+
+def takeOver(
+        _path: str = defaultHandoffSocketPath,
+        _timeoutInSeconds: float = 30
+) -> Tuple[socket.socket, Dict[str, socket.socket], Dict]:
+    """
+    Ask the running listener for its sockets and state, returns the connection to confirm on, the sockets by name,
+    and the state, raises HandoffError (or OSError) when it didn't hand over
+    - the running listener first answers the clients it already accepted, which can take a client timeout
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        connection.settimeout(_timeoutInSeconds)
+        connection.connect(_path)
+        _send(connection, {"type": "takeOver", "version": protocolVersion, "pid": os.getpid()})
+        message, fds = _expect(connection, "handoff", _timeoutInSeconds)
+    except (OSError, HandoffError):
+        connection.close()
+        raise
+
+    names = message.get("sockets", [])
+    if len(names) != len(fds):
+        for _fd in fds:
+            os.close(_fd)
+        connection.close()
+        raise HandoffError(f"got {len(fds)} sockets for {names}")
+
+    # the family and type of each socket are read from its descriptor
+    sockets = {_name: socket.socket(fileno=_fd) for _name, _fd in zip(names, fds)}
+    return connection, sockets, message.get("state", {})
+
+
+def confirmAdopted(_connection: socket.socket) -> bool:
+    try:
+        _send(_connection, {"type": "adopted"})
+        return True
+    except OSError as error:
+        print(f'HANDOFF: could not confirm to the previous listener {error=}')
+        return False
+    finally:
+        _connection.close()
+
+
+def socketPath(_socket: Optional[socket.socket]) -> Optional[str]:
+    # e.g. the path of an adopted unix socket, so it's removed by whoever closes it last
+    if _socket is None:
+        return None
+    name = _socket.getsockname()
+    return name if isinstance(name, str) and name else None
@@ -1,7 +1,12 @@
-from typing import Callable
+from typing import Callable, Optional
 import pigpio
-import irreceiver
 import socket
+from time import sleep
+from timeit import default_timer as timer
+from HoldToMove import HoldToMove
+from IrDecoder import DecodedFrame, IrDecoder, RemoteButtons, frameEndInMilliseconds, loadRemotes
+from MotorConnection import commandMessage, openMotorListenerConnection
+from Profiling import Profiler, Timings
 
 """
 !!! PiPulseCollector IS NOT MY CODE, IT IS FROM:
@@ -20,7 +25,7 @@ class PiPulseCollector:
             receive_pin: int,
             done_callback: Callable,
             max_time: int,
-            decoder: irreceiver.NecDecoder,
+            decoder: IrDecoder,
     ):
         self.pi = pi
         self.receive_pin = receive_pin
@@ -33,6 +38,7 @@ class PiPulseCollector:
         self.pulse_times = []
         self.collecting = False
 
+    @Timings.timed("ir.collectPulses")
     def collect_pulses(self, _, level: int, tick: int):
         """
         This function adds a pulse to self.pulse_times
@@ -73,117 +79,139 @@ class InfraRedListener:
     THIS IS MY OWN CODE
     """
 
-    # button codes received via IR (transformed from hex to int)
-    __arduinoRemoteIdentifier = 210
-    __upButtonCode = 50
-    __stopButtonCode = 40
-    __downButtonCode = 30
-    __buttons = {
-        __upButtonCode: "up",
-        __stopButtonCode: "stop",
-        __downButtonCode: "down",
-    }
-
-    # network connection for talking to MotorListener
+    # what every button of every known remote does (see IrDecoder)
+    __buttons: RemoteButtons = None
+
+    # network connection for talking to MotorListener, a new one for every instruction
     __host: str = None
     __port = 5000
-    __connection: socket.socket = None
+    __timeoutInSeconds: float = 5
+
+    # from the end of an IR frame to the MotorListener's reply
+    __responseBudgetInSeconds = 0.05
+
+    # holding a button down moves the blind until it is released
+    __holdToMove: HoldToMove = None
+
+    __pi: pigpio.pi = None
+    __decoder: IrDecoder = None
+    __collector: PiPulseCollector = None
+
+    def __init__(self, _remotesFileName: str = None):
+        self.__buttons = loadRemotes() if _remotesFileName is None else loadRemotes(_remotesFileName)
 
-    def __init__(self):
         # prepare network connection
         self.__host = socket.gethostname()
-        self.__connection = socket.socket()
-        self.__connection.connect((self.__host, self.__port))
+
+        self.__holdToMove = HoldToMove(_send=self.__sendToMotorListener)
+        self.__holdToMove.start()
 
         # setup board
         ir_pin = 17
-        pi = pigpio.pi()
-        pi.set_mode(ir_pin, pigpio.INPUT)
+        self.__pi = pigpio.pi()
+        self.__pi.set_mode(ir_pin, pigpio.INPUT)
 
         # setup decoding of received IR signal
-        decoder = irreceiver.NecDecoder()
-        collector: PiPulseCollector = PiPulseCollector(
-            pi,
+        self.__decoder = IrDecoder()
+        self.__collector = PiPulseCollector(
+            self.__pi,
             ir_pin,
             self.handleNewCommandCallback,  # callback to run when new command received
-            irreceiver.FRAME_TIME_MS + irreceiver.TIMING_TOLERANCE,
-            decoder,
+            frameEndInMilliseconds,
+            self.__decoder,
         )
-        _ = pi.callback(ir_pin, pigpio.EITHER_EDGE, collector.collect_pulses)
+        _ = self.__pi.callback(ir_pin, pigpio.EITHER_EDGE, self.__collector.collect_pulses)
 
-    @staticmethod
-    def __decodeIrHex(integer):
-        return divmod(integer, 0x100)
+    def __frameEndedAt(self) -> float:
+        """
+        When the last edge of the frame just decoded arrived, on the same clock as `timer()`
+        """
+        sinceLastEdgeInSeconds = pigpio.tickDiff(self.__collector.t2, self.__pi.get_current_tick()) / 1_000_000
+        return timer() - sinceLastEdgeInSeconds
 
     # send instruction to motor listener
-    def __sendToMotorListener(self, message: str):
+    def __sendToMotorListener(self, message: str, _frameEndedAt: float = None) -> bool:
         print("Send message")
 
-        # create a new connection when needed because the motor listener
-        # closes connections after instructions are received
+        # a new connection every time, because the motor listener closes connections after instructions are received
+        # - when the listener can't be reached (e.g. it's restarting) the instruction is dropped,
+        #   the next button press tries again
         try:
-            self.__connection = socket.socket()
-            self.__connection.connect((self.__host, self.__port))
-        except Exception as error:
-            print(f'Socket was already open {error=}')
-
-        # send new instruction to motor listener over local network
-        self.__connection.send(message.encode())
-        data = self.__connection.recv(1024).decode()
-        print(f'Response from MotorListenerL: "{data}"')
-        self.__connection.close()
-
-    def handleNewCommandCallback(self, code: int):
-        # nothing to do
-        if code is None:
-            print("IR ERROR: No code")
+            connection = openMotorListenerConnection(self.__host, self.__port, _timeout=self.__timeoutInSeconds)
+        except OSError as error:
+            print(f'IR ERROR: MotorListener unavailable {error=}')
+            return False
+
+        try:
+            # send new instruction to motor listener over local network
+            connection.sendall(commandMessage(message, _producer="ir").encode())
+            data = connection.recv(1024).decode()
+            print(f'Response from MotorListenerL: "{data}"')
+        except OSError as error:
+            print(f'IR ERROR: no reply from MotorListener {error=}')
+            return False
+        finally:
+            connection.close()
+
+        # measure from the IR edge to the motor listener's response
+        if _frameEndedAt is not None:
+            edgeToResponse = timer() - _frameEndedAt
+            Timings.histogram("ir.edgeToResponse").record(edgeToResponse)
+            if edgeToResponse > self.__responseBudgetInSeconds:
+                print(f'IR WARNING: edge to response {edgeToResponse * 1000:.1f} ms is over budget')
+        return True
+
+    def handleNewCommandCallback(self, frame: Optional[DecodedFrame]):
+        # invalid IR data received (or noise) - do nothing
+        if frame is None:
+            print("IR ERROR: Invalid frame")
             return
 
-        # invalid IR data received - do nothing
-        if code == irreceiver.INVALID_FRAME:
-            print(f"IR ERROR: Invalid code '{code}'")
+        frameEndedAt = self.__frameEndedAt()
+
+        # button is still held down: extend the hold, nothing to send
+        if frame.repeat:
+            if self.__buttons.isKnownRemote(frame):
+                self.__holdToMove.repeat(frameEndedAt)
             return
 
-        # decode IR message
-        remoteIdentifier, buttonPressed = self.__decodeIrHex(code)
-        print(f"DECODED IR: id '{remoteIdentifier}' button '{buttonPressed}")
+        print(f"DECODED IR: {frame.protocol} id '{frame.address}' button '{frame.command}'")
 
         # received an errant IR pulse from some other remote control
-        if remoteIdentifier != self.__arduinoRemoteIdentifier:
-            print(f'ERROR: received errant IR signal from sender "{remoteIdentifier}"')
+        if not self.__buttons.isKnownRemote(frame):
+            print(f'ERROR: received errant IR signal from {frame.protocol} sender "{frame.address}"')
             print("=== STOP HERE ===")
             print()
             return
 
-        _commandToSend = ""
-
         # try to turn code into a usable command
-        try:
-            _commandToSend = self.__buttons[buttonPressed]
-            print(f'IR SUCCESS: Identified command to send "{_commandToSend}"')
-            print()
-        except KeyError:
-            print(f'ERROR: Invalid button received from IR "{buttonPressed}"')
+        _commandToSend = self.__buttons.instructionFor(frame)
+        if _commandToSend is None:
+            print(f'ERROR: Invalid button received from IR "{frame.command}"')
             print("=== STOP HERE ===")
             print()
             return
+        print(f'IR SUCCESS: Identified command to send "{_commandToSend}"')
+        print()
 
-        # send message to motor listener over network
+        # send message to motor listener over network, holding the button keeps it moving
         print(">>>> CONTACTING MOTOR LISTENER <<<<")
-        self.__sendToMotorListener(_commandToSend)
+        self.__holdToMove.press(_commandToSend, frameEndedAt)
         print("Command sent. Finishing callback....")
         print()
 
     def cleanup(self):
-        print("IR CLEANUP: Close connection")
-        self.__connection.close()
+        print("IR CLEANUP: Stop hold to move")
+        self.__holdToMove.cleanup()
 
 
 if __name__ == "__main__":
+    Profiler.install("infra-red-listener")
     irListener = InfraRedListener()
     try:
+        # IR is handled in pigpio's callback thread, don't compete with it for the GIL
         while True:
-            pass
+            sleep(1)
     except Exception as error:
         irListener.cleanup()
 
@@ -0,0 +1,149 @@
+import argparse
+import json
+import random
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import IrDecoder
+from IrDecoder import DecodedFrame
+
+"""
+Throughput and accuracy of the IR decoder, on synthetic noisy pulse trains or recorded ones
+- synthetic frames are random buttons of every protocol, with each pulse off by gaussian jitter,
+  marks stretched (and spaces shortened) by the receiver's AGC, and now and then a glitch
+  that splits a pulse in two
+- every frame is decoded as a separate press, and is either correct, rejected (no frame),
+  or misdecoded (a frame, but the wrong one), a misdecode is the one that moves the blind by mistake
+- recorded trains are a JSON list of {"pulses": [...], "protocol": ..., "address": ..., "command": ...},
+  e.g. collected from `PiPulseCollector` on the Pi while pressing known buttons
+
+Run e.g. `python IrBenchmark.py --frames 20000 --jitter 0.05 0.1 0.15` or `python IrBenchmark.py --recorded ir.json`
+"""
+
+
+def randomFrame(_generator: random.Random, _protocol: str) -> Tuple[List[int], DecodedFrame]:
+    if _protocol == IrDecoder.nec:
+        address, command = _generator.randrange(256), _generator.randrange(256)
+        return IrDecoder.necPulses(address, command), DecodedFrame(IrDecoder.nec, address, command)
+    if _protocol == IrDecoder.rc5:
+        address, command, toggle = _generator.randrange(32), _generator.randrange(128), _generator.randrange(2)
+        return (
+            IrDecoder.rc5Pulses(address, command, toggle),
+            DecodedFrame(IrDecoder.rc5, address, command, False, toggle)
+        )
+
+    bits = _generator.choice((12, 15, 20))
+    address = _generator.randrange({12: 32, 15: 256, 20: 8192}[bits])
+    command = _generator.randrange(128)
+    return IrDecoder.sircPulses(address, command, bits), DecodedFrame(IrDecoder.sirc, address, command)
+
+
+def addNoise(
+        _generator: random.Random,
+        _pulses: List[int],
+        _jitter: float,
+        _markBiasInMicroseconds: int,
+        _glitchRate: float
+) -> List[int]:
+    """
+    The pulses as a real receiver might report them, marks are the even ones
+    """
+    noisy = []
+    for _index, _pulse in enumerate(_pulses):
+        bias = _markBiasInMicroseconds if _index % 2 == 0 else -_markBiasInMicroseconds
+        pulse = max(1, int(_pulse * _generator.gauss(1, _jitter)) + bias)
+        if _generator.random() < _glitchRate:
+            # a short spike in the middle of the pulse
+            split = _generator.randrange(1, pulse + 1)
+            noisy += [split, 60, max(1, pulse - split)]
+        else:
+            noisy.append(pulse)
+    return noisy
+
+
+def makeSyntheticTrains(
+        _frames: int,
+        _jitter: float,
+        _markBiasInMicroseconds: int,
+        _glitchRate: float,
+        _seed: int
+) -> List[Tuple[List[int], DecodedFrame]]:
+    generator = random.Random(_seed)
+    trains = []
+    for _index in range(_frames):
+        pulses, expected = randomFrame(generator, IrDecoder.protocols[_index % len(IrDecoder.protocols)])
+        trains.append((addNoise(generator, pulses, _jitter, _markBiasInMicroseconds, _glitchRate), expected))
+    return trains
+
+
+def loadRecordedTrains(_fileName: str) -> List[Tuple[List[int], DecodedFrame]]:
+    with open(_fileName) as recordedFile:
+        recorded = json.load(recordedFile)
+    return [
+        (
+            _train["pulses"],
+            DecodedFrame(_train["protocol"], _train["address"], _train["command"], False, _train.get("toggle", 0))
+        )
+        for _train in recorded
+    ]
+
+
+def benchmarkTrains(_name: str, _trains: List[Tuple[List[int], DecodedFrame]]) -> Dict:
+    decoder = IrDecoder.IrDecoder()
+
+    # frames a second apart, so none of them counts as a repeat of the one before
+    startedAt = timer()
+    decoded = [decoder.decode(_pulses, _now=float(_index)) for _index, (_pulses, _) in enumerate(_trains)]
+    seconds = timer() - startedAt
+
+    counts = {_protocol: {"frames": 0, "correct": 0, "rejected": 0, "misdecoded": 0} for _protocol in IrDecoder.protocols}
+    for (_, _expected), _frame in zip(_trains, decoded):
+        counts[_expected.protocol]["frames"] += 1
+        if _frame is None:
+            counts[_expected.protocol]["rejected"] += 1
+        elif _frame == _expected:
+            counts[_expected.protocol]["correct"] += 1
+        else:
+            counts[_expected.protocol]["misdecoded"] += 1
+
+    frames = len(_trains)
+    result = {
+        "trains": _name,
+        "frames": frames,
+        "framesPerSecond": round(frames / seconds) if seconds else 0,
+        "usPerFrame": round(seconds / frames * 1_000_000, 2) if frames else 0.0,
+        "correctRate": round(sum(_count["correct"] for _count in counts.values()) / frames, 4) if frames else 0.0,
+        "rejectRate": round(sum(_count["rejected"] for _count in counts.values()) / frames, 4) if frames else 0.0,
+        "misdecodeRate": round(sum(_count["misdecoded"] for _count in counts.values()) / frames, 5) if frames else 0.0,
+        "perProtocol": {_protocol: _count for _protocol, _count in counts.items() if _count["frames"]},
+    }
+    print(result)
+    return result
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Frames per second and misdecode rate of the IR decoder")
+    parser.add_argument("--frames", type=int, default=20000, help="synthetic frames per jitter")
+    parser.add_argument("--jitter", type=float, nargs="+", default=[0.05, 0.1, 0.15], help="relative, per pulse")
+    parser.add_argument("--mark-bias", type=int, default=60, help="microseconds marks are stretched by")
+    parser.add_argument("--glitch-rate", type=float, default=0.0005, help="chance a pulse is split by a spike")
+    parser.add_argument("--recorded", help="JSON file of recorded pulse trains, instead of synthetic ones")
+    parser.add_argument("--seed", type=int, default=1)
+    arguments = parser.parse_args(_arguments)
+
+    print("### IR DECODER BENCHMARK ###")
+    print(f"numpy classification: {'on' if IrDecoder.numpy is not None else 'off'}")
+    if arguments.recorded:
+        return [benchmarkTrains(arguments.recorded, loadRecordedTrains(arguments.recorded))]
+
+    return [
+        benchmarkTrains(
+            f"jitter {_jitter}",
+            makeSyntheticTrains(arguments.frames, _jitter, arguments.mark_bias, arguments.glitch_rate, arguments.seed)
+        )
+        for _jitter in arguments.jitter
+    ]
+
+
+if __name__ == "__main__":
+    main()
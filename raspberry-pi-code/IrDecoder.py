@@ -0,0 +1,336 @@
+import json
+import re
+from timeit import default_timer as timer
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from BlindConfig import ConfigError
+from Data import Command
+
+# classifies a whole frame in one go where it's installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Decodes IR frames from the times between edges that `PiPulseCollector` collects, for several protocols
+- NEC (and its repeat frame), RC5 and Sony SIRC (12, 15 and 20 bits)
+- every pulse is classified with one table lookup: tables map a pulse's length, in 32 µs steps,
+  to a symbol of the protocol, and are built once with each protocol's timing tolerance
+- with numpy, all the pulses of a frame are looked up at once, which is faster from about a dozen pulses
+- the first pulse picks the protocol, the symbols of the whole frame are then matched against the protocol's
+  frame pattern, and the bits are cut out of the symbol string with slices, rather than walked pulse by pulse
+- a button held down repeats: NEC sends repeat frames, RC5 and SIRC send the same frame again
+  (RC5 with the same toggle bit), which is reported as a repeat
+
+Which remote and button does what is configured per remote in `ir-remotes.json` (see `RemoteButtons`).
+"""
+
+nec = "nec"
+rc5 = "rc5"
+sirc = "sirc"
+protocols = (nec, rc5, sirc)
+
+quantumShift = 5
+longestPulseInMicroseconds = 16384
+invalidSymbol = "?"
+
+# silence that ends a frame: the longest pulse inside any frame is NEC's 9 ms leader
+# - a long SIRC frame of a held button can follow the one before within 7 ms, the first of the two is decoded
+frameEndInMilliseconds = 12
+
+
+class DecodedFrame(NamedTuple):
+    protocol: str
+    address: int
+    command: int
+    repeat: bool = False
+    # RC5 flips it on every new press
+    toggle: int = 0
+
+
+class ToleranceTable:
+    """
+    Symbol for every 32 µs step of pulse length, the closest symbol whose nominal length is within the tolerance
+    """
+    # below this many pulses a python loop beats numpy's overhead
+    __vectorFromPulses = 12
+
+    symbols: str = None
+    __last: int = None
+    __codes = None
+
+    def __init__(self, _symbols: Dict[str, int], _tolerance: float):
+        table = []
+        for _step in range(longestPulseInMicroseconds >> quantumShift):
+            length = (_step << quantumShift) + (1 << quantumShift) // 2
+            best, bestError = invalidSymbol, _tolerance
+            for _symbol, _nominal in _symbols.items():
+                error = abs(length - _nominal) / _nominal
+                if error <= bestError:
+                    best, bestError = _symbol, error
+            table.append(best)
+        # anything longer is invalid too
+        table.append(invalidSymbol)
+
+        self.symbols = "".join(table)
+        self.__last = len(table) - 1
+        if numpy is not None:
+            self.__codes = numpy.frombuffer(self.symbols.encode("ascii"), dtype=numpy.uint8)
+
+    def lookup(self, _pulse: int) -> str:
+        return self.symbols[min(_pulse >> quantumShift, self.__last)]
+
+    def classify(self, _pulses: List[int]) -> str:
+        if self.__codes is not None and len(_pulses) >= self.__vectorFromPulses:
+            steps = numpy.minimum(numpy.asarray(_pulses) >> quantumShift, self.__last)
+            return self.__codes[steps].tobytes().decode("ascii")
+
+        symbols, last = self.symbols, self.__last
+        return "".join([symbols[min(_pulse >> quantumShift, last)] for _pulse in _pulses])
+
+
+# leader 9 ms mark, 4.5 ms (or 2.25 ms for a repeat) space, 562 µs marks, 562 µs (0) or 1687 µs (1) spaces
+# - a repeat frame has a table of its own, a 1's space stretched towards 2.25 ms is still a 1
+necTable = ToleranceTable({"L": 9000, "S": 4500, "s": 562, "l": 1687}, 0.5)
+necFrame = re.compile(r"LS(?:s[sl]){32}s")
+necRepeatTable = ToleranceTable({"L": 9000, "R": 2250, "s": 562}, 0.3)
+necRepeat = re.compile(r"LRs")
+necBits = str.maketrans("sl", "01")
+
+# half bits of 889 µs, a mark or space of two half bits is 1778 µs
+rc5Table = ToleranceTable({"h": 889, "f": 1778}, 0.3)
+# the half bits of a mark and the space after it (or the frame's last mark)
+rc5Halves = {
+    "hh": "10", "hf": "100", "fh": "110", "ff": "1100", "h": "1", "f": "11",
+}
+rc5Frame = re.compile(r"(?:01|10){14}")
+
+# 2.4 ms start mark, 600 µs spaces, 600 µs (0) or 1200 µs (1) marks
+# - SIRC has no checksum, a wider tolerance lets a stretched 0 mark through as a 1, the wrong button
+sircTable = ToleranceTable({"H": 2400, "z": 600, "o": 1200}, 0.25)
+sircFrame = re.compile(r"H(?:z[zo]){20}|H(?:z[zo]){15}|H(?:z[zo]){12}")
+# a held button's next frame starts 45 ms after the one before, so at least 6.6 ms after its last mark
+# - anything shorter after a frame means a longer frame lost a pulse, and was cut short
+sircGapInMicroseconds = 5000
+sircBits = str.maketrans("zo", "01")
+
+# the first pulse (a mark) picks the protocol, an RC5 frame starts with one or two half bits of mark
+leaderTable = ToleranceTable({"n": 9000, "r": 889, "R": 1778, "s": 2400}, 0.3)
+leaders = {"n": nec, "r": rc5, "R": rc5, "s": sirc}
+
+
+def decodeNec(_pulses: List[int]) -> Optional[Tuple[int, int, bool]]:
+    if len(_pulses) == 3:
+        return (0, 0, True) if necRepeat.fullmatch(necRepeatTable.classify(_pulses)) else None
+
+    symbols = necTable.classify(_pulses)
+    if not necFrame.fullmatch(symbols):
+        return None
+
+    # every other symbol from the fourth is a bit, least significant first
+    bits = int(symbols[65:2:-2].translate(necBits), 2)
+    address, inverseAddress = bits & 0xFF, bits >> 8 & 0xFF
+    command, inverseCommand = bits >> 16 & 0xFF, bits >> 24
+    if command ^ inverseCommand != 0xFF:
+        return None
+
+    # extended NEC uses both address bytes as one 16 bit address
+    if address ^ inverseAddress != 0xFF:
+        address = bits & 0xFFFF
+    return address, command, False
+
+
+def decodeRc5(_pulses: List[int]) -> Optional[Tuple[int, int, int]]:
+    symbols = rc5Table.classify(_pulses)
+    if invalidSymbol in symbols:
+        return None
+
+    # the frame starts halfway through the first bit, after its space half, and ends on the idle space
+    halves = "0" + "".join([rc5Halves[symbols[_index:_index + 2]] for _index in range(0, len(symbols), 2)])
+    halves = halves.ljust(28, "0")
+    if not rc5Frame.fullmatch(halves):
+        return None
+
+    # a 1 is a space then a mark, so the second half of every bit is its value, most significant first
+    bits = int(halves[1::2], 2)
+    toggle = bits >> 11 & 1
+    address = bits >> 6 & 0x1F
+    # the second start bit is the inverted 7th command bit (RC5X)
+    command = bits & 0x3F | (0 if bits >> 12 & 1 else 0x40)
+    return address, command, toggle
+
+
+def decodeSirc(_pulses: List[int]) -> Optional[Tuple[int, int]]:
+    symbols = sircTable.classify(_pulses)
+    frame = sircFrame.match(symbols)
+    if frame is None or frame.end() < len(symbols) and _pulses[frame.end()] < sircGapInMicroseconds:
+        return None
+
+    # every mark after the start mark is a bit, least significant first
+    bitString = symbols[frame.end() - 1:0:-2].translate(sircBits)
+    bits = int(bitString, 2)
+    command = bits & 0x7F
+    if len(bitString) == 20:
+        # 5 bit device and 8 bit extended device
+        return bits >> 7 & 0x1F | (bits >> 12) << 5, command
+    return bits >> 7, command
+
+
+class IrDecoder:
+    """
+    Decodes one frame at a time, the same instance keeps track of repeats
+    """
+    __repeatWindowInSeconds: float = None
+
+    __lastFrame: Optional[DecodedFrame] = None
+    __lastFrameAt: float = 0.0
+
+    # counters for tuning
+    frames: Dict[str, int] = None
+    invalidFrames: int = 0
+
+    def __init__(self, _repeatWindowInSeconds: float = 0.2):
+        """
+        `_repeatWindowInSeconds`: an RC5 or SIRC frame identical to the one before, within this time,
+        is the button still being held
+        """
+        self.__repeatWindowInSeconds = _repeatWindowInSeconds
+        self.frames = {_protocol: 0 for _protocol in protocols}
+
+    def decode(self, _pulses: List[int], _now: Optional[float] = None) -> Optional[DecodedFrame]:
+        """
+        The frame the pulses make, None when they don't make a valid frame of any protocol
+        """
+        frame = self.__decode(_pulses)
+        if frame is None:
+            self.invalidFrames += 1
+            return None
+
+        now = timer() if _now is None else _now
+        isRecent = now - self.__lastFrameAt <= self.__repeatWindowInSeconds
+        lastFrame = self.__lastFrame
+
+        if frame.repeat:
+            # a NEC repeat frame is only a repeat of the NEC frame before it
+            if lastFrame is None or lastFrame.protocol != nec:
+                self.invalidFrames += 1
+                return None
+            frame = lastFrame._replace(repeat=True)
+        elif (
+                frame.protocol != nec and isRecent and lastFrame is not None
+                and frame == lastFrame._replace(repeat=False)
+        ):
+            frame = frame._replace(repeat=True)
+
+        self.__lastFrame = frame
+        self.__lastFrameAt = now
+        self.frames[frame.protocol] += 1
+        return frame
+
+    @staticmethod
+    def __decode(_pulses: List[int]) -> Optional[DecodedFrame]:
+        if not _pulses:
+            return None
+
+        protocol = leaders.get(leaderTable.lookup(_pulses[0]))
+        if protocol == nec:
+            decoded = decodeNec(_pulses)
+            return None if decoded is None else DecodedFrame(nec, decoded[0], decoded[1], decoded[2])
+        if protocol == rc5:
+            decoded = decodeRc5(_pulses)
+            return None if decoded is None else DecodedFrame(rc5, decoded[0], decoded[1], False, decoded[2])
+        if protocol == sirc:
+            decoded = decodeSirc(_pulses)
+            return None if decoded is None else DecodedFrame(sirc, decoded[0], decoded[1])
+        return None
+
+
+def necPulses(_address: int, _command: int, _repeat: bool = False) -> List[int]:
+    if _repeat:
+        return [9000, 2250, 562]
+    if _address > 0xFF:
+        bits = _address | _command << 16 | (~_command & 0xFF) << 24
+    else:
+        bits = _address | (~_address & 0xFF) << 8 | _command << 16 | (~_command & 0xFF) << 24
+    pulses = [9000, 4500]
+    for _bit in range(32):
+        pulses += [562, 1687 if bits >> _bit & 1 else 562]
+    return pulses + [562]
+
+
+def rc5Pulses(_address: int, _command: int, _toggle: int = 0) -> List[int]:
+    bits = 1 << 13 | (0 if _command & 0x40 else 1) << 12 | _toggle << 11 | (_address & 0x1F) << 6 | _command & 0x3F
+    halves = "".join("01" if bits >> _bit & 1 else "10" for _bit in range(13, -1, -1))
+
+    # the receiver only sees edges, from the first mark to the last one
+    halves = halves[halves.index("1"):].rstrip("0")
+    return [len(_run.group()) * 889 for _run in re.finditer(r"1+|0+", halves)]
+
+
+def sircPulses(_address: int, _command: int, _bits: int = 12) -> List[int]:
+    if _bits == 20:
+        bits = _command & 0x7F | (_address & 0x1F) << 7 | (_address >> 5 & 0xFF) << 12
+    else:
+        bits = _command & 0x7F | _address << 7
+    pulses = [2400]
+    for _bit in range(_bits):
+        pulses += [600, 1200 if bits >> _bit & 1 else 600]
+    return pulses
+
+
+defaultRemotesFileName = "ir-remotes.json"
+
+# the arduino's remote (see arduino-infra-red-sender)
+defaultRemotes = [
+    {"name": "arduino", "protocol": nec, "address": 210, "buttons": {"50": "up", "40": "stop", "30": "down"}},
+]
+
+
+class RemoteButtons:
+    """
+    The instruction for every button of every known remote
+    - e.g. `{"name": "tv", "protocol": "rc5", "address": 0, "buttons": {"16": "up", "17": "down", "13": "stop"}}`
+    - an instruction is up, down, stop, or a length in cm
+    """
+    __buttons: Dict[Tuple[str, int], Dict[int, str]] = None
+
+    def __init__(self, _remotes: List[Dict]):
+        self.__buttons = {}
+        for _remote in _remotes:
+            if _remote.get("protocol") not in protocols:
+                raise ConfigError(f"remote {_remote.get('name')!r} has an unknown protocol {_remote.get('protocol')!r}")
+            address = _remote.get("address")
+            if isinstance(address, bool) or not isinstance(address, int) or not 0 <= address <= 0xFFFF:
+                raise ConfigError(f"remote {_remote.get('name')!r} needs an address from 0 to 65535, not {address!r}")
+
+            buttons = {}
+            for _code, _instruction in dict(_remote.get("buttons", {})).items():
+                if _instruction not in (Command.Up.value, Command.Down.value, Command.Stop.value):
+                    try:
+                        if float(_instruction) < 0:
+                            raise ValueError
+                    except (TypeError, ValueError):
+                        raise ConfigError(f"button {_code} of {_remote.get('name')!r} has no valid instruction")
+                buttons[int(_code)] = str(_instruction)
+            self.__buttons[(_remote["protocol"], address)] = buttons
+
+    def isKnownRemote(self, _frame: DecodedFrame) -> bool:
+        return (_frame.protocol, _frame.address) in self.__buttons
+
+    def instructionFor(self, _frame: DecodedFrame) -> Optional[str]:
+        return self.__buttons.get((_frame.protocol, _frame.address), {}).get(_frame.command)
+
+
+def loadRemotes(_fileName: str = defaultRemotesFileName) -> RemoteButtons:
+    """
+    A missing file means only the arduino's remote, a broken one raises ConfigError
+    """
+    try:
+        with open(_fileName) as _file:
+            remotes = json.load(_file)["remotes"]
+    except FileNotFoundError:
+        return RemoteButtons(defaultRemotes)
+    except (json.JSONDecodeError, KeyError, TypeError) as error:
+        raise ConfigError(f"{_fileName} should be {{\"remotes\": [...]}}: {error}")
+    return RemoteButtons(remotes)
@@ -0,0 +1,131 @@
+from collections import deque
+from statistics import median
+from time import time
+from typing import Deque, Optional
+
+from Data import Command
+
+"""
+Decisions of the light sensor, with no hardware or network involved
+- used by `SerialLightSensorListener` online, and mirrored by `ThresholdTuner` offline,
+  the two must make exactly the same decisions for the same readings (`python ThresholdTuner.py --verify`)
+"""
+
+
+class LightHysteresis:
+    """
+    Caller passes every reading to `update()`, and sends the instruction it returns (if any)
+    - a reading below the dark boundary closes the blind, unless it already closed for the dark
+    - a reading above the bright boundary closes the blind, unless it already closed for the brightness
+    - a reading between the boundaries opens the blind again, if it had closed for either
+    - a reading exactly on a boundary changes nothing
+    """
+    normalLight = "normal light"
+    tooDark = "too dark"
+    tooBright = "too bright"
+
+    __tooDark: float = None
+    __tooBright: float = None
+
+    # optional median filter over the most recent readings, to ignore single noisy readings
+    __medianWindow: int = 1
+    __recentReadings: Deque[float] = None
+
+    # track the latest state of the blind
+    tooDark_blindIsClosed: bool = False
+    tooBright_blindIsClosed: bool = False
+
+    # after an early close (see LightTrend) the blind stays closed until then,
+    # unless the light really gets past the boundary first
+    __holdClosedUntil: float = 0.0
+
+    # counters for tuning
+    earlyCloses: int = 0
+    earlyClosesConfirmed: int = 0
+    earlyClosesExpired: int = 0
+
+    def __init__(self, _tooDark: float, _tooBright: float, _medianWindow: int = 1):
+        if _medianWindow < 1 or _medianWindow % 2 == 0:
+            raise ValueError(f"median window must be a positive odd number, not {_medianWindow}")
+
+        self.__tooDark = _tooDark
+        self.__tooBright = _tooBright
+        self.__medianWindow = _medianWindow
+        self.__recentReadings = deque(maxlen=_medianWindow)
+
+    def update(self, _lightReading: float, _now: Optional[float] = None) -> Optional[str]:
+        """
+        Returns the reason for an instruction (`normalLight`, `tooDark` or `tooBright`), or None
+        - nothing is decided until the median filter has a full window of readings
+        - `_now` only matters after an early close, it defaults to the wall clock
+        """
+        self.__recentReadings.append(_lightReading)
+        if len(self.__recentReadings) < self.__medianWindow:
+            return None
+        lightReading = median(self.__recentReadings) if self.__medianWindow > 1 else _lightReading
+
+        # figure out what state the blind should be in now
+        blindShouldBeOpen = self.__tooDark < lightReading < self.__tooBright
+
+        # figure out the current state of the blind
+        blindIsClosed = self.tooDark_blindIsClosed or self.tooBright_blindIsClosed
+
+        # closed early: keep it closed until the light gets there, or the hold runs out
+        if self.__holdClosedUntil:
+            if (
+                    (self.tooDark_blindIsClosed and lightReading < self.__tooDark) or
+                    (self.tooBright_blindIsClosed and lightReading > self.__tooBright)
+            ):
+                self.__holdClosedUntil = 0.0
+                self.earlyClosesConfirmed += 1
+            elif (time() if _now is None else _now) < self.__holdClosedUntil:
+                return None
+            else:
+                self.__holdClosedUntil = 0.0
+                self.earlyClosesExpired += 1
+
+        # standard amount of daylight - open the blinds
+        if blindShouldBeOpen and blindIsClosed:
+            self.tooDark_blindIsClosed = False
+            self.tooBright_blindIsClosed = False
+            return self.normalLight
+
+        # nighttime - close the blinds
+        if lightReading < self.__tooDark and not self.tooDark_blindIsClosed:
+            self.tooDark_blindIsClosed = True
+            return self.tooDark
+
+        # too bright - close the blinds
+        if lightReading > self.__tooBright and not self.tooBright_blindIsClosed:
+            self.tooBright_blindIsClosed = True
+            return self.tooBright
+
+        return None
+
+    def isClosed(self) -> bool:
+        return self.tooDark_blindIsClosed or self.tooBright_blindIsClosed
+
+    def closeEarly(self, _reason: str, _holdUntil: float):
+        """
+        The caller closed the blind ahead of the light reaching the boundary of `_reason`
+        """
+        self.tooDark_blindIsClosed = _reason == self.tooDark
+        self.tooBright_blindIsClosed = _reason == self.tooBright
+        self.__holdClosedUntil = _holdUntil
+        self.earlyCloses += 1
+
+    def reconfigure(self, _tooDark: float, _tooBright: float, _medianWindow: int):
+        """
+        New boundaries take effect from the next reading, the blind's state and recent readings are kept
+        """
+        if _medianWindow < 1 or _medianWindow % 2 == 0:
+            raise ValueError(f"median window must be a positive odd number, not {_medianWindow}")
+
+        self.__tooDark = _tooDark
+        self.__tooBright = _tooBright
+        self.__medianWindow = _medianWindow
+        self.__recentReadings = deque(self.__recentReadings, maxlen=_medianWindow)
+
+    @classmethod
+    def instructionFor(cls, _reason: str) -> str:
+        return Command.Up.value if _reason == cls.normalLight else Command.Down.value
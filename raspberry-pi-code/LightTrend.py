@@ -0,0 +1,331 @@
+import argparse
+import math
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from AdaptiveSampling import syntheticLightTrace
+from LightHysteresis import LightHysteresis
+
+"""
+Close the blind before the light crosses a boundary, rather than once it has
+- the blind takes up to `_blindHeightInCm / speed` (about 25 s) to close, so reacting to the crossing is late
+- a least-squares line through the latest readings predicts when a boundary will be crossed
+- when the crossing is close enough and the slope is clearly not noise, the blind is closed early
+- an early close that the light doesn't follow up on is held for a while, then the blind opens again
+
+Run `python LightTrend.py --hours 24` to replay a synthetic day of light readings, comparing
+how far ahead of the crossing the blind is closed, against how many early closes were false.
+A straight line overshoots a reading that is levelling off, so the lead time is bought with false triggers,
+which is why the default asks for a steep, clean trend and only a short lead.
+"""
+
+
+class SlidingTrend:
+    """
+    Least-squares line through the readings of a time window
+    - running sums are updated as readings come in and go out, so every reading is O(1)
+    - times are kept relative to a base, moved forward now and then, so the sums stay precise
+    """
+    __windowInSeconds: float = None
+    __samples: Deque[Tuple[float, float]] = None
+    __base: float = None
+    __rebaseAfterInSeconds: float = 3600
+
+    # sums of t, y, t*t, t*y, y*y over the window, with t relative to the base
+    __count: int = 0
+    __sumT: float = 0.0
+    __sumY: float = 0.0
+    __sumTT: float = 0.0
+    __sumTY: float = 0.0
+    __sumYY: float = 0.0
+
+    def __init__(self, _windowInSeconds: float):
+        self.__windowInSeconds = _windowInSeconds
+        self.__samples = deque()
+
+    def __addToSums(self, _t: float, _y: float, _sign: int):
+        t = _t - self.__base
+        self.__count += _sign
+        self.__sumT += _sign * t
+        self.__sumY += _sign * _y
+        self.__sumTT += _sign * t * t
+        self.__sumTY += _sign * t * _y
+        self.__sumYY += _sign * _y * _y
+
+    def __rebase(self, _base: float):
+        self.__base = _base
+        self.__count = 0
+        self.__sumT = self.__sumY = self.__sumTT = self.__sumTY = self.__sumYY = 0.0
+        for _t, _y in self.__samples:
+            self.__addToSums(_t, _y, 1)
+
+    def add(self, _now: float, _reading: float):
+        if self.__base is None or _now - self.__base > self.__rebaseAfterInSeconds:
+            self.__samples.append((_now, _reading))
+            while self.__samples[0][0] < _now - self.__windowInSeconds:
+                self.__samples.popleft()
+            self.__rebase(self.__samples[0][0])
+            return
+
+        self.__samples.append((_now, _reading))
+        self.__addToSums(_now, _reading, 1)
+        while self.__samples[0][0] < _now - self.__windowInSeconds:
+            _t, _y = self.__samples.popleft()
+            self.__addToSums(_t, _y, -1)
+
+    def count(self) -> int:
+        return self.__count
+
+    def fit(self) -> Optional[Tuple[float, float, float]]:
+        """
+        Slope (per second), the line's value at the newest reading, and the t-statistic of the slope
+        - None until there are three readings at different times
+        """
+        n = self.__count
+        if n < 3:
+            return None
+
+        spreadT = self.__sumTT - self.__sumT * self.__sumT / n
+        if spreadT <= 1e-12:
+            return None
+
+        slope = (self.__sumTY - self.__sumT * self.__sumY / n) / spreadT
+        intercept = (self.__sumY - slope * self.__sumT) / n
+        squaredErrors = max(0.0, self.__sumYY - intercept * self.__sumY - slope * self.__sumTY)
+        standardError = math.sqrt(squaredErrors / (n - 2) / spreadT)
+        tStatistic = math.inf if standardError == 0 else abs(slope) / standardError
+
+        latest = slope * (self.__samples[-1][0] - self.__base) + intercept
+        return slope, latest, tStatistic
+
+
+class TrendPredictor:
+    """
+    Caller passes every reading to `update()` after `LightHysteresis.update()` decided nothing,
+    and sends the instruction for the reason it returns (if any)
+    """
+    __tooDark: float = None
+    __tooBright: float = None
+    __trend: SlidingTrend = None
+    __leadInSeconds: float = None
+    __minimumConfidence: float = None
+    __minimumSamples: int = None
+    __holdInSeconds: float = None
+
+    # after an early close ran out, don't try again straight away
+    __quietUntil: float = 0.0
+
+    # counters for tuning
+    predictions: int = 0
+
+    def __init__(
+            self,
+            _tooDark: float,
+            _tooBright: float,
+            _windowInSeconds: float = 10,
+            _leadInSeconds: float = 10,
+            _minimumConfidence: float = 16,
+            _minimumSamples: int = 8,
+            _holdInSeconds: float = 60
+    ):
+        self.__tooDark = _tooDark
+        self.__tooBright = _tooBright
+        self.__trend = SlidingTrend(_windowInSeconds)
+        self.__leadInSeconds = _leadInSeconds
+        self.__minimumConfidence = _minimumConfidence
+        self.__minimumSamples = _minimumSamples
+        self.__holdInSeconds = _holdInSeconds
+
+    def reconfigure(self, _tooDark: float, _tooBright: float, _leadInSeconds: float, _minimumConfidence: float):
+        self.__tooDark = _tooDark
+        self.__tooBright = _tooBright
+        self.__leadInSeconds = _leadInSeconds
+        self.__minimumConfidence = _minimumConfidence
+
+    def secondsToCrossing(self) -> Optional[Tuple[str, float]]:
+        """
+        The boundary the light is heading for, and how long until it gets there, when the trend is clear
+        """
+        if self.__trend.count() < self.__minimumSamples:
+            return None
+        fit = self.__trend.fit()
+        if fit is None:
+            return None
+
+        slope, latest, confidence = fit
+        if confidence < self.__minimumConfidence or slope == 0:
+            return None
+
+        if slope < 0 and latest > self.__tooDark:
+            return LightHysteresis.tooDark, (latest - self.__tooDark) / -slope
+        if slope > 0 and latest < self.__tooBright:
+            return LightHysteresis.tooBright, (self.__tooBright - latest) / slope
+        return None
+
+    def update(self, _now: float, _lightReading: float, _hysteresis: LightHysteresis) -> Optional[str]:
+        self.__trend.add(_now, _lightReading)
+
+        if _hysteresis.isClosed() or _now < self.__quietUntil:
+            return None
+
+        crossing = self.secondsToCrossing()
+        if crossing is None or crossing[1] > self.__leadInSeconds:
+            return None
+
+        reason = crossing[0]
+        _hysteresis.closeEarly(reason, _now + self.__holdInSeconds)
+        self.__quietUntil = _now + self.__holdInSeconds * 2
+        self.predictions += 1
+        return reason
+
+
+def replay(
+        _trace: List[float],
+        _stepInSeconds: float,
+        _thresholds: Tuple[float, float],
+        _intervalInSeconds: float,
+        _noise: float,
+        _seed: int,
+        _predictor: Optional[TrendPredictor]
+) -> Tuple[List[Tuple[float, str, bool]], LightHysteresis]:
+    """
+    Every decision (time, reason, was it early) from sampling the trace like the light sensor would
+    """
+    generator = random.Random(_seed)
+    hysteresis = LightHysteresis(*_thresholds)
+    decisions = []
+    now = 0.0
+    duration = len(_trace) * _stepInSeconds
+    while now < duration:
+        reading = _trace[int(now / _stepInSeconds)] + generator.gauss(0, _noise)
+
+        reason = hysteresis.update(reading, now)
+        if reason is not None:
+            decisions.append((now, reason, False))
+        elif _predictor is not None:
+            reason = _predictor.update(now, reading, hysteresis)
+            if reason is not None:
+                decisions.append((now, reason, True))
+
+        now += _intervalInSeconds
+    return decisions, hysteresis
+
+
+def crossings(
+        _trace: List[float],
+        _stepInSeconds: float,
+        _thresholds: Tuple[float, float],
+        _rearmMargin: float = 20
+) -> List[Tuple[float, str]]:
+    """
+    When the trace goes past a boundary, and which one
+    - wobbling around the boundary is one crossing, the trace has to come back by the margin first
+    """
+    tooDark, tooBright = _thresholds
+    found = []
+    armed = {LightHysteresis.tooDark: True, LightHysteresis.tooBright: True}
+    for _index, _reading in enumerate(_trace):
+        if _reading < tooDark and armed[LightHysteresis.tooDark]:
+            found.append((_index * _stepInSeconds, LightHysteresis.tooDark))
+            armed[LightHysteresis.tooDark] = False
+        elif _reading > tooBright and armed[LightHysteresis.tooBright]:
+            found.append((_index * _stepInSeconds, LightHysteresis.tooBright))
+            armed[LightHysteresis.tooBright] = False
+
+        if _reading > tooDark + _rearmMargin:
+            armed[LightHysteresis.tooDark] = True
+        if _reading < tooBright - _rearmMargin:
+            armed[LightHysteresis.tooBright] = True
+    return found
+
+
+def reactionTimes(
+        _crossings: List[Tuple[float, str]],
+        _decisions: List[Tuple[float, str, bool]],
+        _holdInSeconds: float,
+        _lateLimitInSeconds: float = 60
+) -> Tuple[List[float], int]:
+    """
+    For every crossing, when the blind was told to close for it (negative is ahead of the crossing),
+    and how many crossings it wasn't told to close for at all
+    """
+    closes = [(_at, _reason) for _at, _reason, _ in _decisions if _reason != LightHysteresis.normalLight]
+    reactions = []
+    missed = 0
+    for _crossedAt, _reason in _crossings:
+        matching = [
+            _at for _at, _closeReason in closes
+            if _closeReason == _reason and _crossedAt - _holdInSeconds <= _at <= _crossedAt + _lateLimitInSeconds
+        ]
+        if matching:
+            reactions.append(min(matching) - _crossedAt)
+        else:
+            missed += 1
+    return reactions, missed
+
+
+def summarise(_reactions: List[float], _missed: int) -> Dict[str, float]:
+    reactions = sorted(_reactions)
+    return {
+        "crossings": len(reactions) + _missed,
+        "missed": _missed,
+        "closedAhead": sum(1 for _reaction in reactions if _reaction < 0),
+        "meanReactionSeconds": round(sum(reactions) / len(reactions), 1) if reactions else 0.0,
+        "medianReactionSeconds": round(reactions[len(reactions) // 2], 1) if reactions else 0.0,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay light readings, reacting to crossings vs predicting them")
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--too-dark", type=float, default=100)
+    parser.add_argument("--too-bright", type=float, default=700)
+    parser.add_argument("--interval", type=float, default=1, help="seconds between readings")
+    parser.add_argument("--noise", type=float, default=5, help="sensor noise added to the trace")
+    parser.add_argument("--window", type=float, default=10, help="seconds of readings the trend is fitted to")
+    parser.add_argument("--leads", default="5,10,20", help="comma separated lead times to try, in seconds")
+    parser.add_argument("--confidences", default="4,8,16", help="comma separated minimum t-statistics to try")
+    parser.add_argument("--hold", type=float, default=60)
+    arguments = parser.parse_args(_arguments)
+
+    stepInSeconds = 0.05
+    trace = syntheticLightTrace(arguments.hours, stepInSeconds, arguments.seed)
+    thresholds = (arguments.too_dark, arguments.too_bright)
+    trueCrossings = crossings(trace, stepInSeconds, thresholds)
+
+    baseline, _ = replay(
+        trace, stepInSeconds, thresholds, arguments.interval, arguments.noise, arguments.seed, None
+    )
+
+    print("### TREND REPLAY ###")
+    print(f"reacting: {summarise(*reactionTimes(trueCrossings, baseline, arguments.hold))}")
+
+    results = []
+    for _lead in (float(_value) for _value in arguments.leads.split(",")):
+        for _confidence in (float(_value) for _value in arguments.confidences.split(",")):
+            predictor = TrendPredictor(
+                *thresholds, _windowInSeconds=arguments.window, _leadInSeconds=_lead,
+                _minimumConfidence=_confidence, _holdInSeconds=arguments.hold
+            )
+            decisions, hysteresis = replay(
+                trace, stepInSeconds, thresholds, arguments.interval, arguments.noise, arguments.seed, predictor
+            )
+            result = {
+                "leadSeconds": _lead,
+                "minimumConfidence": _confidence,
+                **summarise(*reactionTimes(trueCrossings, decisions, arguments.hold)),
+                "earlyCloses": hysteresis.earlyCloses,
+                "falseTriggers": hysteresis.earlyClosesExpired,
+                "falseTriggerRate": (
+                    round(hysteresis.earlyClosesExpired / hysteresis.earlyCloses, 3) if hysteresis.earlyCloses else 0.0
+                ),
+            }
+            results.append(result)
+            print(result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
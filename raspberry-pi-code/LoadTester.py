@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from queue import Empty, Queue
+from time import sleep
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional, Tuple
+
+import MotorConnection
+
+"""
+Load generator for the MotorListener command path
+- drives any transport (tcp or unix socket) with a configurable command mix
+- closed loop: every worker sends its next command as soon as it has a reply
+- open loop: commands are due at a fixed average rate (poisson arrivals), latency is measured
+  from when a command was due, so a slow server can't hide its queueing delay
+- by default it starts its own MotorListener on simulated hardware and samples that process's
+  RSS and thread count while the test runs
+
+Run e.g.
+  `python LoadTester.py --seconds 30 --concurrency 16 --mix up=1,down=1,stop=2,numeric=2,status=10`
+  `python LoadTester.py --open-loop 200 --transport unix`
+  `python LoadTester.py --no-server --host raspberrypi --port 5000`
+"""
+
+# what each reply code means
+_replyKinds = {
+    "204": "ok",
+    "304": "noChange",
+    "400": "badRequest",
+    "429": "rateLimited",
+    "503": "unavailable",
+}
+
+
+def classifyReply(_command: str, _reply: str) -> str:
+    if not _reply:
+        return "emptyReply"
+    if _command == "status":
+        return "ok"
+    for _code, _kind in _replyKinds.items():
+        if _code in _reply:
+            return _kind
+    return "unknownReply"
+
+
+class CommandMix:
+    """
+    Weighted random choice of commands, e.g. "up=1,down=1,stop=1,numeric=1,status=4"
+    """
+
+    def __init__(self, _mix: str, _seed: Optional[int] = None):
+        self.__random = random.Random(_seed)
+        self.__names: List[str] = []
+        self.__weights: List[float] = []
+        for _part in _mix.split(","):
+            _name, _weight = _part.split("=")
+            self.__names.append(_name)
+            self.__weights.append(float(_weight))
+
+    def next(self) -> str:
+        name = self.__random.choices(self.__names, self.__weights)[0]
+        if name == "numeric":
+            return str(round(self.__random.uniform(0, 200), 1))
+        return name
+
+
+class Worker(threading.Thread):
+    """
+    Sends commands and records (latency, result) for each
+    """
+
+    def __init__(
+            self,
+            _connect: Callable[[], socket.socket],
+            _mix: CommandMix,
+            _stop_event: threading.Event,
+            _reuseConnections: bool,
+            _arrivals: Optional[Queue] = None
+    ):
+        super().__init__(daemon=True)
+        self.__connect = _connect
+        self.__mix = _mix
+        self.__stop_event = _stop_event
+        self.__reuseConnections = _reuseConnections
+        self.__arrivals = _arrivals
+        self.__connection: Optional[socket.socket] = None
+
+        self.results: List[Tuple[float, float, str]] = []
+        self.reconnects = 0
+
+    def __send(self, _command: str) -> str:
+        if self.__connection is None:
+            self.__connection = self.__connect()
+        self.__connection.sendall(_command.encode())
+        reply = self.__connection.recv(1024).decode()
+
+        if not self.__reuseConnections or not reply:
+            self.__connection.close()
+            self.__connection = None
+        return reply
+
+    def __sendWithReuse(self, _command: str) -> str:
+        wasReused = self.__connection is not None
+        try:
+            reply = self.__send(_command)
+            if reply or not wasReused:
+                return reply
+        except OSError:
+            if not wasReused:
+                raise
+
+        # the listener closed the reused connection, try once more on a new one
+        if self.__connection is not None:
+            self.__connection.close()
+        self.__connection = None
+        self.reconnects += 1
+        return self.__send(_command)
+
+    def run(self):
+        while not self.__stop_event.is_set():
+            # open loop: wait for the next due command, closed loop: go straight away
+            if self.__arrivals is not None:
+                try:
+                    dueAt = self.__arrivals.get(timeout=0.1)
+                except Empty:
+                    continue
+            else:
+                dueAt = timer()
+
+            command = self.__mix.next()
+            try:
+                reply = self.__sendWithReuse(command)
+                result = classifyReply(command, reply)
+            except socket.timeout:
+                result = "timeout"
+            except OSError as error:
+                result = f"connectionError:{type(error).__name__}"
+                if self.__connection is not None:
+                    self.__connection.close()
+                    self.__connection = None
+
+            finishedAt = timer()
+            self.results.append((finishedAt, finishedAt - dueAt, result))
+
+        if self.__connection is not None:
+            self.__connection.close()
+
+
+def openLoopArrivals(_ratePerSecond: float, _arrivals: Queue, _stop_event: threading.Event, _seed: Optional[int]):
+    """
+    Put due times on the queue with exponential gaps
+    """
+    generator = random.Random(_seed)
+    dueAt = timer()
+    while not _stop_event.is_set():
+        dueAt += generator.expovariate(_ratePerSecond)
+        sleepFor = dueAt - timer()
+        if sleepFor > 0:
+            sleep(sleepFor)
+        _arrivals.put(dueAt)
+
+
+def processStatus(_pid: int) -> Dict[str, int]:
+    """
+    RSS (kB) and thread count of a process, from /proc
+    """
+    status = {}
+    with open(f"/proc/{_pid}/status") as _file:
+        for _line in _file:
+            if _line.startswith("VmRSS:"):
+                status["rssKb"] = int(_line.split()[1])
+            elif _line.startswith("Threads:"):
+                status["threads"] = int(_line.split()[1])
+    return status
+
+
+def percentile(_sorted: List[float], _fraction: float) -> float:
+    if not _sorted:
+        return 0.0
+    return _sorted[min(len(_sorted) - 1, int(len(_sorted) * _fraction))]
+
+
+def report(_results: List[Tuple[float, float, str]], _startedAt: float, _seconds: float) -> Dict:
+    latencies = sorted(_latency for _finishedAt, _latency, _result in _results if _result == "ok")
+    outcomes = Counter(_result for _finishedAt, _latency, _result in _results)
+    total = len(_results)
+
+    # completed commands per second, second by second
+    perSecond = Counter(int(_finishedAt - _startedAt) for _finishedAt, _latency, _result in _results)
+
+    return {
+        "commands": total,
+        "throughputPerSecond": total / _seconds,
+        "okThroughputPerSecond": len(latencies) / _seconds,
+        "p50Ms": percentile(latencies, 0.50) * 1000,
+        "p95Ms": percentile(latencies, 0.95) * 1000,
+        "p99Ms": percentile(latencies, 0.99) * 1000,
+        "maxMs": latencies[-1] * 1000 if latencies else 0,
+        "errorRate": (total - outcomes.get("ok", 0) - outcomes.get("noChange", 0)) / total if total else 0,
+        "outcomes": dict(outcomes),
+        "throughputTimeline": [perSecond.get(_second, 0) for _second in range(int(_seconds) + 1)],
+    }
+
+
+def serve(_arguments):
+    """
+    Run a MotorListener on simulated hardware until killed
+    """
+    import SimulatedHardware
+
+    directory = _arguments.directory or tempfile.mkdtemp(prefix="blind-load-")
+    listener, thread = SimulatedHardware.startSimulatedMotorListener(
+        directory,
+        _port=_arguments.port,
+        _unixSocketPath=_arguments.unix_socket,
+        _requestsPerSecondPerClient=_arguments.client_rate,
+        _burstPerClient=_arguments.client_rate,
+        _motorInSeparateProcess=_arguments.motor_process
+    )
+    print("READY", flush=True)
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        listener.shutdown()
+        thread.join()
+
+
+def startServer(_arguments) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve",
+        "--port", str(_arguments.port),
+        "--unix-socket", _arguments.unix_socket,
+        "--client-rate", str(_arguments.client_rate),
+    ]
+    if _arguments.motor_process:
+        command.append("--motor-process")
+
+    # the listener prints every request, which would dominate the results
+    server = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    for _line in server.stdout:
+        if _line.strip() == "READY":
+            break
+
+    # keep draining the output so the listener never blocks on a full pipe
+    threading.Thread(target=lambda: [None for _ in server.stdout], daemon=True).start()
+    return server
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test the MotorListener")
+    parser.add_argument("--transport", choices=["tcp", "unix"], default="tcp")
+    parser.add_argument("--host", default=socket.gethostname())
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--unix-socket", default=os.path.join(tempfile.gettempdir(), "blind-load-test.sock"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--mix", default="up=1,down=1,stop=1,numeric=1,status=4")
+    parser.add_argument("--open-loop", type=float, metavar="RATE", help="commands per second, closed loop when unset")
+    parser.add_argument("--reuse", action="store_true", help="keep connections open between commands")
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--no-server", action="store_true", help="test an already running listener")
+    parser.add_argument("--client-rate", type=float, default=1_000_000, help="per-client limit of the test server")
+    parser.add_argument("--motor-process", action="store_true", help="test server runs the motor in its own process")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    arguments = parser.parse_args(_arguments)
+
+    if arguments.serve:
+        serve(arguments)
+        return None
+
+    server = None if arguments.no_server else startServer(arguments)
+
+    if arguments.transport == "unix":
+        connect = lambda: MotorConnection.openUnixConnection(arguments.unix_socket, arguments.timeout)  # noqa: E731
+    else:
+        connect = lambda: MotorConnection.openTcpConnection(arguments.host, arguments.port, arguments.timeout)  # noqa: E731
+
+    _stop_event = threading.Event()
+    arrivals = Queue() if arguments.open_loop else None
+    workers = [
+        Worker(
+            connect,
+            CommandMix(arguments.mix, None if arguments.seed is None else arguments.seed + _index),
+            _stop_event,
+            arguments.reuse,
+            arrivals
+        )
+        for _index in range(arguments.concurrency)
+    ]
+
+    startedAt = timer()
+    for _worker in workers:
+        _worker.start()
+    if arrivals is not None:
+        threading.Thread(
+            target=openLoopArrivals,
+            args=(arguments.open_loop, arrivals, _stop_event, arguments.seed),
+            daemon=True
+        ).start()
+
+    # sample the server while the load runs
+    serverTimeline = []
+    while timer() - startedAt < arguments.seconds:
+        sleep(1)
+        if server is not None:
+            serverTimeline.append({"second": round(timer() - startedAt), **processStatus(server.pid)})
+
+    _stop_event.set()
+    for _worker in workers:
+        _worker.join()
+    elapsed = timer() - startedAt
+
+    results = [_result for _worker in workers for _result in _worker.results]
+    summary = report(results, startedAt, elapsed)
+    summary["reconnects"] = sum(_worker.reconnects for _worker in workers)
+    summary["server"] = serverTimeline
+
+    # interrupt the server so it shuts down its motor cleanly
+    if server is not None:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    if arguments.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print("### LOAD TEST ###")
+        for _key, _value in summary.items():
+            print(f"{_key}: {_value}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import selectors
+import socket
+import threading
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional
+
+from RelayConnector import FrameError, FrameReader, defaultRelayPort, encodeFrame, protocolVersion, receiveMessage
+
+"""
+Stand-in for the cloud relay, to run the RelayConnector against offline
+- connectors dial in and say hello, the newest connection of a node replaces an older one
+- `command()` sends a command to a node and waits for its reply, `state()` is the node's latest pushed state
+- `dropConnections()` cuts every connector off, as a network blip or relay restart would,
+  `mute()` ignores everything the connectors send for a while, as a relay that hangs would
+- with `_clientPort`, it also takes commands the way the MotorListener does (the body's last line,
+  an optional `X-Request-Id:` and `X-Node:` header), so the web back-end can post to it instead of the tunnel
+
+Run e.g. `python LocalRelay.py --port 7000 --client-port 7080`,
+then `python RelayConnector.py --relay localhost:7000` next to a MotorListener
+"""
+
+
+class ConnectorSession:
+    """
+    One connected connector, as the relay sees it
+    """
+    node: str = None
+    connection: socket.socket = None
+    sendLock: threading.Lock = None
+    connectedAt: float = None
+    lastReceivedAt: float = None
+    state: Optional[Dict] = None
+    stateUpdates: int = 0
+
+    # command id -> [reply arrived, reply]
+    pending: Dict[int, list] = None
+
+    def __init__(self, _node: str, _connection: socket.socket):
+        self.node = _node
+        self.connection = _connection
+        self.sendLock = threading.Lock()
+        self.connectedAt = self.lastReceivedAt = timer()
+        self.pending = {}
+
+    def send(self, _message: Dict) -> bool:
+        try:
+            with self.sendLock:
+                self.connection.sendall(encodeFrame(_message))
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class LocalRelay(threading.Thread):
+    """
+    Stop it with `cleanup()`
+    """
+    __host: str = None
+    __port: int = None
+    __clientPort: Optional[int] = None
+    __token: Optional[str] = None
+    __deadAfterInSeconds: float = None
+    __helloTimeoutInSeconds: float = 5
+    __tickInSeconds: float = 0.05
+
+    __listener: socket.socket = None
+    __clientListener: Optional[socket.socket] = None
+    __sessions: Dict[str, ConnectorSession] = None
+    __nextCommandId: int = 0
+    __mutedUntil: float = 0.0
+    # notified whenever a connector comes or goes, or pushes its state
+    __changed: threading.Condition = None
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    connections: int = 0
+    refused: int = 0
+    commands: int = 0
+    commandTimeouts: int = 0
+    dropped: int = 0
+
+    def __init__(
+            self,
+            _host: str = "127.0.0.1",
+            _port: int = defaultRelayPort,
+            _clientPort: Optional[int] = None,
+            _token: Optional[str] = None,
+            _deadAfterInSeconds: float = 30
+    ):
+        super().__init__(daemon=True, name="local-relay")
+        self.__host = _host
+        self.__token = _token
+        self.__deadAfterInSeconds = _deadAfterInSeconds
+        self.__sessions = {}
+        self.__changed = threading.Condition()
+        self.__stop_event = threading.Event()
+
+        # listen straight away, so a connector started right after this can connect
+        self.__listener = socket.create_server((_host, _port))
+        self.__port = self.__listener.getsockname()[1]
+        if _clientPort is not None:
+            self.__clientListener = socket.create_server((_host, _clientPort))
+            self.__clientPort = self.__clientListener.getsockname()[1]
+
+    def port(self) -> int:
+        return self.__port
+
+    def clientPort(self) -> Optional[int]:
+        return self.__clientPort
+
+    def run(self):
+        print(f" $$$$$$$$ RUNNING LOCAL RELAY ({self.__host}:{self.__port}) $$$$$$$$")
+        selector = selectors.DefaultSelector()
+        selector.register(self.__listener, selectors.EVENT_READ, self.__acceptConnector)
+        if self.__clientListener is not None:
+            selector.register(self.__clientListener, selectors.EVENT_READ, self.__acceptClient)
+
+        while not self.__stop_event.is_set():
+            for _key, _events in selector.select(timeout=0.2):
+                try:
+                    connection, _ = _key.fileobj.accept()
+                except OSError:
+                    continue
+                threading.Thread(target=_key.data, args=(connection,), daemon=True).start()
+        selector.close()
+
+    # ---- connectors ----
+
+    def __acceptConnector(self, _connection: socket.socket):
+        _connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = FrameReader()
+        try:
+            hello = receiveMessage(_connection, reader, self.__helloTimeoutInSeconds)
+            refusal = self.__refusalOf(hello)
+            if refusal is not None:
+                self.refused += 1
+                _connection.sendall(encodeFrame({"type": "refused", "reason": refusal}))
+                _connection.close()
+                return
+            _connection.sendall(encodeFrame({"type": "welcome"}))
+        except (OSError, FrameError) as error:
+            print(f'LOCAL RELAY: no hello from connector {error=}')
+            _connection.close()
+            return
+
+        session = ConnectorSession(str(hello["node"]), _connection)
+        with self.__changed:
+            replaced = self.__sessions.get(session.node)
+            self.__sessions[session.node] = session
+            self.connections += 1
+            self.__changed.notify_all()
+        if replaced is not None:
+            replaced.close()
+
+        self.__serve(session, reader)
+
+        with self.__changed:
+            if self.__sessions.get(session.node) is session:
+                del self.__sessions[session.node]
+            self.__changed.notify_all()
+        session.close()
+
+        # nobody will reply to what was still in flight
+        for _waiting in list(session.pending.values()):
+            _waiting[0].set()
+
+    def __refusalOf(self, _hello: Dict) -> Optional[str]:
+        if _hello.get("type") != "hello" or not _hello.get("node"):
+            return "expected a hello with a node"
+        if _hello.get("version") != protocolVersion:
+            return f"protocol version {protocolVersion} only"
+        if self.__token is not None and _hello.get("token") != self.__token:
+            return "wrong token"
+        return None
+
+    def __serve(self, _session: ConnectorSession, _reader: FrameReader):
+        _session.connection.settimeout(self.__tickInSeconds)
+        while not self.__stop_event.is_set():
+            try:
+                data = _session.connection.recv(65536)
+                if not data:
+                    return
+            except socket.timeout:
+                data = None
+            except OSError:
+                return
+
+            now = timer()
+            if data and now < self.__mutedUntil:
+                continue
+            if data:
+                _session.lastReceivedAt = now
+                try:
+                    messages = _reader.feed(data)
+                except FrameError as error:
+                    print(f'LOCAL RELAY: bad frame from {_session.node} {error=}')
+                    return
+                for _message in messages:
+                    self.__handle(_session, _message)
+
+            if now - _session.lastReceivedAt > self.__deadAfterInSeconds:
+                print(f"LOCAL RELAY: {_session.node} went silent")
+                return
+
+    def __handle(self, _session: ConnectorSession, _message: Dict):
+        kind = _message["type"]
+        if kind == "reply":
+            waiting = _session.pending.get(_message.get("id"))
+            if waiting is not None:
+                waiting[1] = _message.get("reply")
+                waiting[0].set()
+        elif kind == "state":
+            with self.__changed:
+                _session.state = _message.get("state")
+                _session.stateUpdates += 1
+                self.__changed.notify_all()
+        elif kind == "ping":
+            _session.send({"type": "pong", "at": _message.get("at")})
+
+    def nodes(self) -> List[str]:
+        with self.__changed:
+            return list(self.__sessions)
+
+    def command(
+            self,
+            _node: str,
+            _instruction: str,
+            _requestId: Optional[str] = None,
+            _timeoutInSeconds: float = 5
+    ) -> Optional[str]:
+        """
+        The node's reply to the command, None when the node isn't connected or didn't reply in time
+        """
+        with self.__changed:
+            session = self.__sessions.get(_node)
+            self.__nextCommandId += 1
+            commandId = self.__nextCommandId
+        if session is None:
+            return None
+
+        waiting = [threading.Event(), None]
+        session.pending[commandId] = waiting
+        self.commands += 1
+        try:
+            sent = session.send({
+                "type": "command", "id": commandId, "instruction": _instruction, "requestId": _requestId
+            })
+            if not sent or not waiting[0].wait(_timeoutInSeconds):
+                self.commandTimeouts += 1
+                return None
+            return waiting[1]
+        finally:
+            session.pending.pop(commandId, None)
+
+    def state(self, _node: str) -> Optional[Dict]:
+        with self.__changed:
+            session = self.__sessions.get(_node)
+            return None if session is None else session.state
+
+    def waitFor(self, _condition: Callable[[], bool], _timeoutInSeconds: float) -> bool:
+        """
+        Wait until the condition holds, it's checked whenever a connector comes, goes or pushes its state
+        """
+        with self.__changed:
+            return self.__changed.wait_for(_condition, _timeoutInSeconds)
+
+    def waitForConnector(self, _node: str, _timeoutInSeconds: float) -> bool:
+        return self.waitFor(lambda: _node in self.__sessions, _timeoutInSeconds)
+
+    def dropConnections(self):
+        with self.__changed:
+            sessions = list(self.__sessions.values())
+        self.dropped += len(sessions)
+        for _session in sessions:
+            _session.close()
+
+    def mute(self, _seconds: float):
+        self.__mutedUntil = timer() + _seconds
+
+    # ---- clients (e.g. the web back-end) ----
+
+    def __acceptClient(self, _client: socket.socket):
+        _client.settimeout(5)
+        try:
+            message = _client.recv(2048).decode()
+            lines = message.split("\n")
+            headers = {}
+            for _line in lines[:-1]:
+                name, separator, value = _line.partition(":")
+                if separator:
+                    headers[name.strip().lower()] = value.strip()
+
+            nodes = self.nodes()
+            node = headers.get("x-node", nodes[0] if len(nodes) == 1 else "")
+            reply = self.command(node, lines[-1], headers.get("x-request-id"))
+            _client.sendall((reply if reply is not None else 'HTTP/1.1 "503 Service Unavailable"').encode())
+        except OSError as error:
+            print(f'LOCAL RELAY: client failed {error=}')
+        finally:
+            _client.close()
+
+    def counters(self) -> Dict:
+        return {
+            "nodes": self.nodes(),
+            "connections": self.connections,
+            "refused": self.refused,
+            "commands": self.commands,
+            "commandTimeouts": self.commandTimeouts,
+            "dropped": self.dropped,
+        }
+
+    def cleanup(self):
+        print(f"LOCAL RELAY CLEANUP: {self.counters()}")
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.__listener.close()
+        if self.__clientListener is not None:
+            self.__clientListener.close()
+        self.dropConnections()
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Relay stand-in for RelayConnector, offline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=defaultRelayPort)
+    parser.add_argument("--client-port", type=int, help="also take commands like the MotorListener does")
+    parser.add_argument("--token")
+    arguments = parser.parse_args(_arguments)
+
+    relay = LocalRelay(arguments.host, arguments.port, arguments.client_port, arguments.token)
+    relay.start()
+    try:
+        while relay.is_alive():
+            relay.join(timeout=1)
+    except KeyboardInterrupt:
+        relay.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+from pathlib import Path
+from time import sleep, strftime
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional
+
+import SimulatedHardware
+
+"""
+Microbenchmarks of the hot paths, off the Pi on simulated hardware
+- every path is timed over many calls, a few rounds in a row, and the fastest round counts (microseconds per call)
+- private methods are called by their mangled names, so what's timed is exactly what the services run
+- the results are compared with a JSON baseline, a path slower than its baseline by more than
+  the tolerance fails the run (exit code 1)
+- a baseline only means something on the machine it was recorded on, record one where the gate runs
+
+Paths
+- data.instruction: `Data.Instruction` creation and `getValues()`
+- motor.blindPosition, motor.loopIteration: the motor thread, while the blind is moving
+- listener.message: one "status" request through the MotorListener's handler, from parsing to reply
+- ir.frame: the edges of one NEC frame through `PiPulseCollector.collect_pulses`, and its decoding
+- light.reading: one serial line from the arduino, parsed and decided on
+- climate.reading: one DHT reading and its change detection
+
+Run e.g. `python Microbenchmarks.py --save` once, then `python Microbenchmarks.py --tolerance 0.3`
+- the light and climate listeners connect to a MotorListener at start-up, a simulated one
+  is started on port 5000 for them
+"""
+
+SimulatedHardware.install()
+
+import pigpio  # noqa: E402
+import IrDecoder  # noqa: E402
+import MotorConnection  # noqa: E402
+from Data import Instruction  # noqa: E402
+from InfraRedListener import PiPulseCollector  # noqa: E402
+from Profiling import Timings  # noqa: E402
+from PwmBackend import SimulatedPwm  # noqa: E402
+from SerialLightSensorListener import SerialLightSensorListener  # noqa: E402
+from TemperatureHumidity import TemperatureHumidity  # noqa: E402
+from ThreadMotorController import ThreadMotorController  # noqa: E402
+
+defaultBaselineFileName = "benchmark-baseline.json"
+
+
+def perCallUs(_call: Callable[[], object], _calls: int, _rounds: int) -> float:
+    """
+    Fastest round's mean time per call, in microseconds
+    - other processes and garbage collection only ever slow a round down, so the fastest is the least disturbed
+    """
+    rounds = []
+    for _ in range(_rounds):
+        startedAt = timer()
+        for _ in range(_calls):
+            _call()
+        rounds.append((timer() - startedAt) / _calls * 1_000_000)
+    return min(rounds)
+
+
+def benchmarkInstruction(_calls: int, _rounds: int) -> float:
+    return perCallUs(
+        lambda: Instruction(_shouldMoveUpward=True, _newRequestedLength=120.0).getValues(), _calls, _rounds
+    )
+
+
+def benchmarkBlindPosition(_controller: ThreadMotorController, _calls: int, _rounds: int) -> float:
+    calculate = _controller._ThreadMotorController__calculateNewBlindPosition
+    return perCallUs(lambda: calculate(loopCheckPointTime=0.0, now=0.001), _calls, _rounds)
+
+
+def benchmarkLoopIteration(_controller: ThreadMotorController, _rounds: int, _secondsPerRound: float) -> float:
+    """
+    Mean time between two loop iterations of the running motor thread, while the blind moves down
+    """
+    histogram = Timings.histogram("motor.loopIteration")
+    wasEnabled, Timings.enabled = Timings.enabled, True
+
+    _controller.start()
+    _controller.instruct("down")
+    sleep(0.1)
+
+    rounds = []
+    for _ in range(_rounds):
+        histogram.reset()
+        sleep(_secondsPerRound)
+        rounds.append(histogram.snapshot()["meanUs"])
+
+    _controller.instruct("stop")
+    Timings.enabled = wasEnabled
+    return min(rounds)
+
+
+def benchmarkListenerMessage(_listener, _calls: int, _rounds: int) -> float:
+    handle = _listener._MotorListener__networkHandler
+    message = b"POST / HTTP/1.1\nX-Request-Id: benchmark\nContent-Length: 6\n\nstatus"
+
+    def request():
+        client, server = socket.socketpair()
+        client.sendall(message)
+        handle(server, ("127.0.0.1", 0))
+        client.recv(1024)
+        client.close()
+
+    return perCallUs(request, _calls, _rounds)
+
+
+def benchmarkIrFrame(_calls: int, _rounds: int) -> float:
+    pin = 17
+    decoded = []
+    collector = PiPulseCollector(
+        pigpio.pi(), pin, decoded.append, IrDecoder.frameEndInMilliseconds, IrDecoder.IrDecoder()
+    )
+    edges = SimulatedHardware.irEdges(IrDecoder.necPulses(210, 50), _startTick=4_294_000_000)
+    frameEndedAt = edges[-1][1] + IrDecoder.frameEndInMilliseconds * 1000
+
+    def frame():
+        for _level, _tick in edges:
+            collector.collect_pulses(pin, _level, _tick)
+        collector.collect_pulses(pin, pigpio.TIMEOUT, frameEndedAt)
+
+    frame()
+    if decoded[0] != IrDecoder.DecodedFrame(IrDecoder.nec, 210, 50):
+        raise RuntimeError(f"the NEC frame was decoded as {decoded[0]}")
+    return perCallUs(frame, _calls, _rounds)
+
+
+def benchmarkLightReading(_light: SerialLightSensorListener, _calls: int, _rounds: int) -> float:
+    device = _light._SerialLightSensorListener__serialDevice
+    latestLine = _light._SerialLightSensorListener__latestLine
+    decide = _light._SerialLightSensorListener__decide
+
+    # a few readings piled up between two samples, ending halfway through the next one
+    # - steady light between the boundaries, so nothing is sent
+    chunks = [b"401\n398\n400\n40", b"2\n399\n401\n39"]
+    calls = [0]
+
+    def reading():
+        device.feed(chunks[calls[0] % 2])
+        calls[0] += 1
+        reason, _ = decide(float(latestLine()))
+        if reason is not None:
+            raise RuntimeError(f"steady light made a decision: {reason}")
+
+    return perCallUs(reading, _calls, _rounds)
+
+
+def benchmarkClimateReading(_climate: TemperatureHumidity, _calls: int, _rounds: int) -> float:
+    sensor = _climate._TemperatureHumidity__DHT11
+    sample = _climate._TemperatureHumidity__sample
+    calls = [0]
+
+    def reading():
+        # every other reading changes, below the boundaries, so the blind stays open and nothing is sent
+        sensor.temperature = 21 + calls[0] % 4 // 2
+        calls[0] += 1
+        sample()
+
+    return perCallUs(reading, _calls, _rounds)
+
+
+def runBenchmarks(_names: List[str], _scale: float, _rounds: int) -> Dict[str, float]:
+    """
+    Microseconds per call of every path in `_names`
+    """
+    def calls(_count: int) -> int:
+        return max(1, int(_count * _scale))
+
+    results: Dict[str, float] = {}
+    directory = tempfile.TemporaryDirectory()
+    workingDirectory = os.getcwd()
+
+    # the services print a lot on their hot paths, which is part of their cost, but not worth reading
+    with contextlib.redirect_stdout(io.StringIO()):
+        listener, listenerThread = SimulatedHardware.startSimulatedMotorListener(
+            directory.name,
+            _port=MotorConnection.defaultPort,
+            _unixSocketPath=None,
+            _auditFileName=None,
+            _configFileName=None,
+            _requestsPerSecondPerClient=1000,
+            _burstPerClient=1000
+        )
+        try:
+            light = SerialLightSensorListener()
+            climate = TemperatureHumidity()
+
+            # the first climate reading opens the blind, later ones find it open already
+            climate._TemperatureHumidity__sample()
+
+            if "listener.message" in _names:
+                results["listener.message"] = benchmarkListenerMessage(listener, calls(2000), _rounds)
+        finally:
+            listener.shutdown()
+            listenerThread.join()
+
+        if "data.instruction" in _names:
+            results["data.instruction"] = benchmarkInstruction(calls(100_000), _rounds)
+        if "ir.frame" in _names:
+            results["ir.frame"] = benchmarkIrFrame(calls(2000), _rounds)
+        if "light.reading" in _names:
+            results["light.reading"] = benchmarkLightReading(light, calls(20_000), _rounds)
+        if "climate.reading" in _names:
+            results["climate.reading"] = benchmarkClimateReading(climate, calls(20_000), _rounds)
+
+        if "motor.blindPosition" in _names or "motor.loopIteration" in _names:
+            with open(Path(directory.name) / "benchmark-blind-state.txt", "w+") as stateFile:
+                controller = ThreadMotorController(stateFile, _pwmBackend=SimulatedPwm(22, 50))
+                results["motor.blindPosition"] = benchmarkBlindPosition(controller, calls(100_000), _rounds)
+                results["motor.loopIteration"] = benchmarkLoopIteration(controller, _rounds, 0.1 * _scale)
+                controller.cleanup()
+                controller.join()
+
+    os.chdir(workingDirectory)
+    directory.cleanup()
+    return {_name: round(results[_name], 3) for _name in _names if _name in results}
+
+
+def compareWithBaseline(
+        _results: Dict[str, float],
+        _baseline: Dict[str, float],
+        _tolerance: float
+) -> List[str]:
+    """
+    Print every path against its baseline, and return the ones that regressed beyond the tolerance
+    """
+    regressions = []
+    for _name, _us in _results.items():
+        baselineUs = _baseline.get(_name)
+        if baselineUs is None:
+            print(f"{_name:22} {_us:10.3f} us  (no baseline)")
+            continue
+
+        change = _us / baselineUs - 1
+        verdict = "REGRESSED" if change > _tolerance else "ok"
+        print(f"{_name:22} {_us:10.3f} us  baseline {baselineUs:10.3f} us  {change:+7.1%}  {verdict}")
+        if change > _tolerance:
+            regressions.append(_name)
+    return regressions
+
+
+paths = (
+    "data.instruction",
+    "motor.blindPosition",
+    "motor.loopIteration",
+    "listener.message",
+    "ir.frame",
+    "light.reading",
+    "climate.reading",
+)
+
+
+def main(_arguments: Optional[List[str]] = None) -> List[str]:
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the hot paths, with a regression gate")
+    parser.add_argument("--baseline", default=defaultBaselineFileName)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slow-down, 0.3 is 30%% slower")
+    parser.add_argument("--paths", nargs="+", default=list(paths), choices=paths)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--scale", type=float, default=1, help="more (or fewer) calls per round")
+    arguments = parser.parse_args(_arguments)
+
+    results = runBenchmarks(arguments.paths, arguments.scale, arguments.rounds)
+
+    print("### MICROBENCHMARKS ###")
+    baselinePath = Path(arguments.baseline)
+    baseline = json.loads(baselinePath.read_text())["results"] if baselinePath.exists() else {}
+    regressions = compareWithBaseline(results, baseline, arguments.tolerance)
+
+    if arguments.save:
+        baselinePath.write_text(json.dumps({
+            "recordedAt": strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": f"{platform.node()} {platform.machine()} python {platform.python_version()}",
+            "results": {**baseline, **results},
+        }, indent=2))
+        print(f"baseline written to {baselinePath}")
+        return []
+
+    if regressions:
+        print(f"REGRESSED beyond {arguments.tolerance:.0%}: {', '.join(regressions)}")
+    return regressions
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
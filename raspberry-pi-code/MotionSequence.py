@@ -0,0 +1,97 @@
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+from Data import checkInstruction
+
+"""
+Several motor instructions in one request, run back-to-back by the motor thread
+- written as "sequence <step>; <step>; ...", e.g. "sequence down; wait 10; 60"
+- a step is an instruction (up, down, stop, or a length in cm within the blind's height), or "wait <seconds>"
+- each move starts once the one before it has finished, a wait starts once the motor has stopped
+- a move that reverses the motor waits for the same minimum dwell as a debounced instruction (see AdmissionControl)
+- any later command cancels the rest of the sequence
+"""
+
+prefix = "sequence"
+maxSteps = 32
+maxWaitInSeconds = 3600
+
+
+class SequenceStep(NamedTuple):
+    # the instruction for the motor, None for a wait
+    instruction: Optional[str]
+    waitInSeconds: float = 0.0
+
+    def encode(self) -> str:
+        return self.instruction if self.instruction is not None else f"wait {self.waitInSeconds:g}"
+
+
+def compileSequence(_text: str, _blindHeightInCm: float) -> List[SequenceStep]:
+    """
+    Steps of a "sequence ..." command, raises ValueError when any step isn't valid
+    """
+    if not _text.startswith(prefix):
+        raise ValueError(f'a sequence starts with "{prefix}"')
+
+    steps = []
+    for _part in _text[len(prefix):].split(";"):
+        words = _part.split()
+        if not words:
+            continue
+
+        if words[0] == "wait":
+            if len(words) != 2:
+                raise ValueError(f'"{_part.strip()}" should be "wait <seconds>"')
+            seconds = float(words[1])
+            if not 0 <= seconds <= maxWaitInSeconds:
+                raise ValueError(f"a wait must be between 0 and {maxWaitInSeconds} seconds, not {seconds:g}")
+            steps.append(SequenceStep(None, seconds))
+            continue
+
+        if len(words) != 1:
+            raise ValueError(f'"{_part.strip()}" is not one instruction')
+        checkInstruction(words[0], _blindHeightInCm)
+        steps.append(SequenceStep(words[0]))
+
+    if not steps:
+        raise ValueError("a sequence needs at least one step")
+    if len(steps) > maxSteps:
+        raise ValueError(f"a sequence has at most {maxSteps} steps, not {len(steps)}")
+    return steps
+
+
+def encodeSequence(_steps: List[SequenceStep]) -> str:
+    """
+    Compiles back to the same steps, e.g. to pass a sequence on to the motor process
+    """
+    return f"{prefix} " + ";".join(_step.encode() for _step in _steps)
+
+
+class SequenceRun:
+    """
+    Progress through one sequence, owned by the motor thread once it's handed over
+    """
+    __steps: Deque[SequenceStep] = None
+
+    # the first step is taken straight away, and takes over from whatever the motor was doing
+    started: bool = False
+    # a wait is running until then
+    resumeAt: float = 0.0
+    # the next move is waiting for the motor to settle before it reverses it
+    isHeldBack: bool = False
+
+    def __init__(self, _steps: List[SequenceStep]):
+        self.__steps = deque(_steps)
+
+    def peekStep(self) -> Optional[SequenceStep]:
+        return self.__steps[0] if self.__steps else None
+
+    def nextStep(self) -> Optional[SequenceStep]:
+        self.started = True
+        return self.__steps.popleft() if self.__steps else None
+
+    def remainingSteps(self) -> int:
+        return len(self.__steps)
+
+    def remaining(self) -> List[SequenceStep]:
+        return list(self.__steps)
@@ -0,0 +1,95 @@
+import os
+import socket
+import stat
+from typing import Dict, Optional, Tuple
+
+"""
+Open connections to the MotorListener
+- producers on the same Pi use the listener's Unix domain socket, skipping name resolution and TCP
+- everything else (or when the Unix socket isn't there) uses TCP, with the address resolved only once
+- producers name themselves in an `X-Producer` header line for the audit log, only believed on the Unix socket
+"""
+
+defaultPort = 5000
+defaultUnixSocketPath = "/tmp/blind-motor-listener.sock"
+
+# header lines go before a blank line, the instruction is the last line
+producerHeader = "X-Producer"
+requestIdHeader = "X-Request-Id"
+
+# resolved TCP addresses, so each command doesn't resolve the hostname again
+_resolvedAddresses: Dict[Tuple[str, int], tuple] = {}
+
+
+def isLocalHost(_host: str) -> bool:
+    return _host in ("localhost", "127.0.0.1", "::1", "", socket.gethostname())
+
+
+def isUnixSocket(_path: Optional[str]) -> bool:
+    try:
+        return _path is not None and stat.S_ISSOCK(os.stat(_path).st_mode)
+    except OSError:
+        return False
+
+
+def commandMessage(_instruction: str, _producer: Optional[str] = None, _requestId: Optional[str] = None) -> str:
+    """
+    What a producer sends, e.g. "X-Producer: ir\n\nup"
+    """
+    headers = []
+    if _producer is not None:
+        headers.append(f"{producerHeader}: {_producer}")
+    if _requestId is not None:
+        headers.append(f"{requestIdHeader}: {_requestId}")
+    return "\n".join(headers + ["", _instruction]) if headers else _instruction
+
+
+def _resolve(_host: str, _port: int) -> tuple:
+    key = (_host, _port)
+    if key not in _resolvedAddresses:
+        family, socketType, protocol, _, address = socket.getaddrinfo(_host, _port, type=socket.SOCK_STREAM)[0]
+        _resolvedAddresses[key] = (family, socketType, protocol, address)
+    return _resolvedAddresses[key]
+
+
+def openTcpConnection(_host: str, _port: int = defaultPort, _timeout: Optional[float] = None) -> socket.socket:
+    family, socketType, protocol, address = _resolve(_host, _port)
+    connection = socket.socket(family, socketType, protocol)
+    connection.settimeout(_timeout)
+    try:
+        connection.connect(address)
+    except OSError:
+        # the address may have changed, resolve again next time
+        _resolvedAddresses.pop((_host, _port), None)
+        connection.close()
+        raise
+    return connection
+
+
+def openUnixConnection(_path: str = defaultUnixSocketPath, _timeout: Optional[float] = None) -> socket.socket:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(_timeout)
+    try:
+        connection.connect(_path)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def openMotorListenerConnection(
+        _host: str,
+        _port: int = defaultPort,
+        _unixSocketPath: Optional[str] = defaultUnixSocketPath,
+        _timeout: Optional[float] = None
+) -> socket.socket:
+    """
+    Prefer the Unix domain socket when the listener is on this host, fall back to TCP
+    """
+    if isLocalHost(_host) and isUnixSocket(_unixSocketPath):
+        try:
+            return openUnixConnection(_unixSocketPath, _timeout)
+        except OSError as error:
+            print(f'Unix socket unavailable, using TCP {error=}')
+
+    return openTcpConnection(_host, _port, _timeout)
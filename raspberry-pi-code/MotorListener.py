@@ -1,8 +1,27 @@
+import argparse
+import json
+import os
+import queue
+import selectors
 import socket
+import struct
 import threading
 from pathlib import Path
-from typing import TextIO, List
+from timeit import default_timer as timer
+from typing import Dict, Optional, TextIO, List, Tuple, Union
+import HotUpgrade
+import MotorConnection
+from AdmissionControl import ClientRateLimiter, InstructionDebouncer, RequestDeduplicator
+import BlindConfig
+import MotionSequence
+from Data import Command, checkInstruction
+from AuditLog import AuditLog, defaultFileName as defaultAuditFileName
+from BlindScheduler import BlindScheduler, ScheduleEntry
+from Profiling import Profiler, Timings
+from ProcessMotorController import ProcessMotorController
+from PwmBackend import SimulatedPwm, backendNames as pwmBackendNames, pigpioBackend
 from ThreadMotorController import ThreadMotorController
+import Telemetry
 
 
 class MotorListener:
@@ -19,37 +38,178 @@ class MotorListener:
     __okay = 204
     __noChange = 304
     __badRequest = 422
+    __forbidden = 403
+    __tooManyRequests = 429
+    __unavailable = 503
     __httpStatusCodes = {
         __okay: "204 No Content",
         __noChange: "304 Not Modified",
         __badRequest: "400 Bad Request",
+        __forbidden: "403 Forbidden",
+        __tooManyRequests: "429 Too Many Requests",
+        __unavailable: "503 Service Unavailable",
     }
 
     # network data
     __host: str = None
-    __motorPort: int = 5000
+    __motorPort: int = MotorConnection.defaultPort
     __address = None
     __network: socket = None
-    __connection: socket = None
+
+    # waits on every socket the accept loop serves
+    __selector: selectors.BaseSelector = None
+
+    # unix domain socket for producers on the same Pi
+    __unixSocketPath: Optional[str] = None
+    __unixSocketMode: int = None
+    __unixNetwork: socket = None
+
+    # motor hardware can be simulated for benchmarks and load tests (see SimulatedHardware)
+    __simulatedHardware: bool = False
 
     # blind data
     __fileDataSavedBlindLength: float = None
 
-    # motor controller (runs in background with multithreading)
-    __threadedMotorController: ThreadMotorController = None
-    __clientThreads: List[threading.Thread] = []
+    # motor controller (runs in background with multithreading, or in its own process)
+    __threadedMotorController: Union[ThreadMotorController, ProcessMotorController] = None
+    __motorInSeparateProcess: bool = False
+    __motorCpu: Optional[int] = None
+    __motorRealtimePriority: Optional[int] = None
+    # overrides the config's `motor.pwmBackend` (see PwmBackend)
+    __pwmBackendName: Optional[str] = None
     __keepRunningThreads: bool = True
 
-    # list of network connections that get cleaned up at end
-    __clients: List[tuple[socket.socket, tuple[str, int]]] = []
+    # admission control: limit each client, "stop" is never limited
+    # - a TCP client is limited by its address, checked by the accept loop so it's turned away without a handler
+    # - a producer on this Pi is limited by its process on the unix socket, its read-only queries aren't limited
+    __rateLimiter: ClientRateLimiter = None
+    # TCP clients over their budget, whose request hasn't arrived yet, and when to give up on them
+    __clientsOverBudget: Dict[socket.socket, float] = None
+    __producerHeader = MotorConnection.producerHeader.lower() + ":"
+    __maxProducerNameLength = 32
+
+    # fixed pool of handler threads, fed from a bounded queue of accepted connections
+    # - when the queue is full new clients get a 503, rather than a new thread each
+    # - a client that connects but doesn't send (or read) is dropped after the timeout
+    __handlerPool: List[threading.Thread] = None
+    __handlerThreadCount: int = None
+    __acceptQueue: queue.Queue = None
+    __clientTimeoutInSeconds: float = None
+    __drainTimeoutInSeconds: float = 10
+    overloadedClients: int = 0
+    rateLimitedClients: int = 0
+
+    # clients queued or being handled, a handoff waits until there are none
+    __clientsInFlight: int = 0
+    __clientsInFlightChanged: threading.Condition = None
+
+    # protect the motor from flapping sensors and stuck buttons
+    __debouncer: InstructionDebouncer = None
+
+    # retried or double-clicked commands carry the same request id, and are only actioned once
+    __deduplicator: RequestDeduplicator = None
+    __requestIdHeader = MotorConnection.requestIdHeader.lower() + ":"
+    __statusCommand = "status"
+
+    # instruction, position and whether the blind moves, in one reply (e.g. for the RelayConnector)
+    __stateCommand = "state"
+
+    # motor commands are refused while the motor watchdog reports the motor thread dead or stuck
+    __healthCommand = "health"
+
+    # time-of-day schedules (runs in background with multithreading)
+    __scheduler: BlindScheduler = None
+    __room: str = None
+    __scheduleCommand = "schedule"
 
-    def __init__(self):
+    # admin commands for profiling at runtime
+    __profileCommand = "profile"
+    __timingsCommand = "timings"
+
+    # record of every command received and what was decided, None when disabled
+    __auditLog: Optional[AuditLog] = None
+    __auditFileName: Optional[str] = None
+
+    # settings that can change while running, None when the config file is disabled
+    # - in process mode the motor process watches the file itself
+    __configFileName: Optional[str] = None
+    __configWatcher: Optional[BlindConfig.ConfigWatcher] = None
+
+    # batched sensor readings from other rooms over UDP (see Telemetry), None when disabled
+    __telemetryPort: Optional[int] = None
+    __telemetry: Optional[Telemetry.TelemetryReceiver] = None
+    __telemetryCommand = "telemetry"
+
+    # hot upgrade (see HotUpgrade): a new process takes the sockets and the motor over, instead of a restart
+    # - the handoff socket is None when disabled, `__takeOverFrom` is the handoff socket of the listener to replace
+    __handoffSocketPath: Optional[str] = None
+    __handoffNetwork: Optional[socket.socket] = None
+    __handoffTimeoutInSeconds: float = 30
+    __takeOverFrom: Optional[str] = None
+    __predecessor: Optional[socket.socket] = None
+    __adoptedState: Optional[Dict] = None
+    __handedOver: bool = False
+
+    def __init__(
+            self,
+            _room: str = BlindScheduler.anyRoom,
+            _requestsPerSecondPerClient: float = 2,
+            _burstPerClient: float = 5,
+            _motorInSeparateProcess: bool = False,
+            _motorCpu: Optional[int] = None,
+            _motorRealtimePriority: Optional[int] = None,
+            _pwmBackendName: Optional[str] = None,
+            _host: Optional[str] = None,
+            _port: int = MotorConnection.defaultPort,
+            _unixSocketPath: Optional[str] = MotorConnection.defaultUnixSocketPath,
+            _unixSocketMode: int = 0o660,
+            _simulatedHardware: bool = False,
+            _auditFileName: Optional[str] = defaultAuditFileName,
+            _handlerThreads: int = 16,
+            _acceptQueueSize: int = 64,
+            _clientTimeoutInSeconds: float = 5,
+            _configFileName: Optional[str] = BlindConfig.defaultFileName,
+            _telemetryPort: Optional[int] = Telemetry.defaultPort,
+            _handoffSocketPath: Optional[str] = None,
+            _takeOverFrom: Optional[str] = None
+    ):
+        self.__room = _room
+        self.__host = _host if _host is not None else socket.gethostname()
+        self.__motorPort = _port
+        self.__unixSocketPath = _unixSocketPath
+        self.__unixSocketMode = _unixSocketMode
+        self.__simulatedHardware = _simulatedHardware
+        self.__auditFileName = _auditFileName
+        self.__configFileName = _configFileName
+        self.__telemetryPort = _telemetryPort
+        self.__handoffSocketPath = _handoffSocketPath
+        self.__takeOverFrom = _takeOverFrom
+        self.__motorInSeparateProcess = _motorInSeparateProcess
+        self.__motorCpu = _motorCpu
+        self.__motorRealtimePriority = _motorRealtimePriority
+        self.__pwmBackendName = _pwmBackendName
+        self.__rateLimiter = ClientRateLimiter(
+            _ratePerSecond=_requestsPerSecondPerClient,
+            _burst=_burstPerClient
+        )
+        self.__clientsOverBudget = {}
+        self.__handlerThreadCount = _handlerThreads
+        self.__acceptQueue = queue.Queue(maxsize=_acceptQueueSize)
+        self.__clientTimeoutInSeconds = _clientTimeoutInSeconds
+        self.__clientsInFlightChanged = threading.Condition()
+        self.__deduplicator = RequestDeduplicator(
+            _isMotorAction=lambda _reply: _reply == self.__generateHttpResponse(self.__okay)
+        )
         self.__prepareNetwork()
         self.__prepareFile()
 
     def __prepareNetwork(self):
+        # a hot upgrade takes the sockets over from the listener this process replaces
+        if self.__takeOverFrom is not None:
+            self.__adoptNetwork()
+            return
+
         # prepare network listener
-        self.__host: str = socket.gethostname()
         self.__network: socket.socket = socket.socket()
         self.__network.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.__network.bind((self.__host, self.__motorPort))
@@ -57,6 +217,56 @@ class MotorListener:
         # accept many simultaneous network connections
         self.__network.listen(100)
 
+        # also listen on a unix domain socket for producers on this Pi
+        if self.__unixSocketPath is not None:
+            # remove a socket left behind by a previous run
+            if MotorConnection.isUnixSocket(self.__unixSocketPath):
+                os.unlink(self.__unixSocketPath)
+
+            self.__unixNetwork: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__unixNetwork.bind(self.__unixSocketPath)
+            os.chmod(self.__unixSocketPath, self.__unixSocketMode)
+            self.__unixNetwork.listen(100)
+
+        # telemetry datagrams are read on the same thread that accepts clients
+        if self.__telemetryPort is not None:
+            self.__telemetry = Telemetry.TelemetryReceiver(_host=self.__host, _port=self.__telemetryPort)
+
+        # a new process can take over from this one, see HotUpgrade
+        if self.__handoffSocketPath is not None:
+            self.__handoffNetwork = HotUpgrade.listenForSuccessor(self.__handoffSocketPath)
+
+    def __adoptNetwork(self):
+        """
+        Sockets and the motor's move come from the running listener, which stops listening once it handed them over
+        - the sockets are used as they were, i.e. the ports and paths passed to this listener don't apply
+        """
+        if self.__motorInSeparateProcess:
+            raise HotUpgrade.HandoffError("only a motor thread can be taken over, not a motor process")
+
+        # the previous process's PWM output has to keep running until this one drives the pin, see PwmBackend
+        pwmBackendName = self.__pwmBackendName
+        if pwmBackendName is None:
+            pwmBackendName = BlindConfig.loadAtStartup(self.__configFileName)["motor"]["pwmBackend"]
+        if not self.__simulatedHardware and pwmBackendName != pigpioBackend:
+            raise HotUpgrade.HandoffError(f"only a motor on the {pigpioBackend} pwm backend can be taken over")
+
+        print(f"### TAKING OVER FROM {self.__takeOverFrom} ###")
+        self.__predecessor, sockets, self.__adoptedState = HotUpgrade.takeOver(self.__takeOverFrom)
+        print(f"Took over sockets {list(sockets)}")
+
+        self.__network = sockets["tcp"]
+        self.__motorPort = self.__network.getsockname()[1]
+        self.__unixNetwork = sockets.get("unix")
+        self.__unixSocketPath = HotUpgrade.socketPath(self.__unixNetwork)
+        self.__handoffNetwork = sockets.get("handoff")
+        self.__handoffSocketPath = HotUpgrade.socketPath(self.__handoffNetwork)
+
+        self.__telemetryPort = None
+        if "telemetry" in sockets:
+            self.__telemetryPort = sockets["telemetry"].getsockname()[1]
+            self.__telemetry = Telemetry.TelemetryReceiver(_udpSocket=sockets["telemetry"])
+
     def __prepareFile(self):
         """
             - Save blind's state to file
@@ -107,34 +317,101 @@ class MotorListener:
         _file: TextIO  # annotate type before instantiation
         with open(self.__filePath, self.__fileMode) as _file:
 
-            # run motor controller as background thread
+            # audit events are written to disk in the background
+            if self.__auditFileName is not None:
+                self.__auditLog = AuditLog(_source="listener", _fileName=self.__auditFileName)
+                self.__auditLog.start()
+
+            # run motor controller as background thread (or process)
             # allows main thread to keep listening for new network commands
-            self.__threadedMotorController = ThreadMotorController(
-                _file=_file,
-                _initialBlindExtensionLength=self.__fileDataSavedBlindLength
+            if self.__motorInSeparateProcess:
+                # the motor process opens the state file itself
+                self.__threadedMotorController = ProcessMotorController(
+                    _filePath=self.__filePath,
+                    _initialBlindExtensionLength=self.__fileDataSavedBlindLength,
+                    _cpu=self.__motorCpu,
+                    _realtimePriority=self.__motorRealtimePriority,
+                    _simulated=self.__simulatedHardware,
+                    _auditFileName=self.__auditFileName,
+                    _configFileName=self.__configFileName,
+                    _pwmBackendName=self.__pwmBackendName
+                )
+                self.__threadedMotorController.start()
+            else:
+                config = BlindConfig.loadAtStartup(self.__configFileName)
+                self.__threadedMotorController = ThreadMotorController(
+                    _file=_file,
+                    _initialBlindExtensionLength=self.__fileDataSavedBlindLength,
+                    _pwmBackend=SimulatedPwm() if self.__simulatedHardware else None,
+                    _pwmBackendName=self.__pwmBackendName,
+                    _auditLog=self.__auditLog,
+                    _config=config,
+                    _adopt=self.__adoptedState["motor"] if self.__adoptedState is not None else None
+                )
+                self.__threadedMotorController.start()
+
+                # apply changes to the config file without restarting
+                if self.__configFileName is not None:
+                    self.__configWatcher = BlindConfig.ConfigWatcher(
+                        self.__configFileName, [self.__threadedMotorController.applyConfig], config
+                    )
+                    self.__configWatcher.start()
+
+            # every instruction for the motor is debounced in its own background thread
+            self.__debouncer = InstructionDebouncer(
+                _instruct=self.__threadedMotorController.instruct,
+                _currentBlindExtensionLength=self.__threadedMotorController.currentBlindExtensionLength
+            )
+            self.__debouncer.start()
+
+            # run schedules through the same path as network instructions
+            self.__scheduler = BlindScheduler(
+                _instruct=self.__submitScheduledInstruction,
+                _checkInstruction=self.__checkInstruction,
+                _room=self.__room
             )
-            self.__threadedMotorController.start()
+            self.__scheduler.start()
+
+            # handle clients on a fixed set of threads
+            self.__handlerPool = [
+                threading.Thread(target=self.__handlerWorker, name=f"motor-listener-handler-{_index}", daemon=True)
+                for _index in range(self.__handlerThreadCount)
+            ]
+            for _handler in self.__handlerPool:
+                _handler.start()
+
+            # wait on the tcp, unix, telemetry and handoff sockets at the same time
+            # - and on clients over their budget, until their request arrives
+            self.__selector = selector = selectors.DefaultSelector()
+            selector.register(self.__network, selectors.EVENT_READ)
+            if self.__unixNetwork is not None:
+                selector.register(self.__unixNetwork, selectors.EVENT_READ)
+            if self.__telemetry is not None:
+                selector.register(self.__telemetry.udpSocket(), selectors.EVENT_READ)
+            if self.__handoffNetwork is not None:
+                selector.register(self.__handoffNetwork, selectors.EVENT_READ)
+
+            # the previous listener exits once it knows the motor is taken care of
+            if self.__predecessor is not None:
+                self.__confirmTakeOver()
 
             # listen for new connections
             try:
-                while True:
-                    # accept new client connections
-                    print("### LISTENING ###")
-                    client, address = self.__network.accept()
-                    print(f"GOT NEW Client address: {address}, try to append to __clients list")
-                    self.__clients.append((client, address))
-
-                    # push new client in background thread
-                    # - allows main thread to keep listening for new clients
-                    print("### TRY PUSHING CLIENT TO THREAD ###")
-                    newThread = threading.Thread(
-                        target=lambda: self.__networkHandler(_client=client, _address=address),
-                    )
-                    print("### TRY STARTING THREAD ###")
-                    newThread.start()
-                    print("### TRY APPENDING THREAD ###")
-                    self.__clientThreads.append(newThread)
-                    print("### __ SUCCESS __ ###")
+                print("### LISTENING ###")
+                while self.__keepRunningThreads:
+                    # wake up regularly so a shutdown is noticed
+                    for _key, _events in selector.select(timeout=0.5):
+                        if self.__telemetry is not None and _key.fileobj is self.__telemetry.udpSocket():
+                            self.__telemetry.drain()
+                        elif _key.fileobj is self.__handoffNetwork:
+                            # nothing more is accepted once a new process took over
+                            if self.__handOverToSuccessor():
+                                break
+                        elif _key.fileobj in self.__clientsOverBudget:
+                            self.__answerClientOverBudget(_key.fileobj, _key.data)
+                        else:
+                            self.__acceptClient(_key.fileobj)
+                    self.__dropClientsOverBudget(timer())
 
             except Exception as error:
                 print("----> listenForMotorCommands EXCEPTION <------")
@@ -142,12 +419,177 @@ class MotorListener:
                 print("----> listenForMotorCommands EXCEPTION <------")
                 print(f'{error=}')
 
-                print()
-                print("----> CLEANUP <------")
+            print()
+            print("----> CLEANUP <------")
 
-                # if script is closed (or errors out)
-                # run cleanup for network and thread
-                self.__cleanup()
+            # if script is closed (or errors out)
+            # run cleanup for network and thread
+            self.__dropClientsOverBudget()
+            selector.close()
+            self.__cleanup()
+
+    def __acceptClient(self, _listeningSocket: socket.socket):
+        # accept new client connections
+        client, address = _listeningSocket.accept()
+
+        # a TCP client over its address's budget is answered here, without a handler thread
+        # - its request usually arrives just after it connects, the selector waits for it
+        if client.family != socket.AF_UNIX:
+            instruction = self.__peekInstruction(client)
+            if instruction != Command.Stop.value and not self.__rateLimiter.admit(self.__clientHost(address)):
+                if instruction is None:
+                    self.__clientsOverBudget[client] = timer() + self.__clientTimeoutInSeconds
+                    self.__selector.register(client, selectors.EVENT_READ, address)
+                else:
+                    self.__rejectClientOverBudget(client, address)
+                return
+
+        self.__queueClient(client, address)
+
+    def __answerClientOverBudget(self, _client: socket.socket, _address):
+        # its request arrived, only stopping the motor gets through
+        self.__selector.unregister(_client)
+        del self.__clientsOverBudget[_client]
+
+        if self.__peekInstruction(_client) == Command.Stop.value:
+            self.__queueClient(_client, _address)
+        else:
+            self.__rejectClientOverBudget(_client, _address)
+
+    def __rejectClientOverBudget(self, _client: socket.socket, _address):
+        self.rateLimitedClients += 1
+        print(f"RATE LIMITED: {self.__clientHost(_address)}")
+        self.__rejectClient(_client, self.__tooManyRequests)
+
+    def __dropClientsOverBudget(self, _now: float = None):
+        # clients over their budget that never sent anything, or all of them when `_now` is None
+        for _client, _giveUpAt in list(self.__clientsOverBudget.items()):
+            if _now is None or _now > _giveUpAt:
+                self.__selector.unregister(_client)
+                del self.__clientsOverBudget[_client]
+                _client.close()
+
+    def __queueClient(self, _client: socket.socket, _address):
+        _client.settimeout(self.__clientTimeoutInSeconds)
+
+        # queue new client for the handler threads
+        # - allows main thread to keep listening for new clients
+        # - turn away everyone while the queue is full
+        with self.__clientsInFlightChanged:
+            self.__clientsInFlight += 1
+        try:
+            self.__acceptQueue.put_nowait((_client, _address))
+        except queue.Full:
+            self.__clientFinished()
+            self.overloadedClients += 1
+            print(f"OVERLOADED: {self.__clientHost(_address)}")
+            self.__rejectClient(_client, self.__unavailable)
+            return
+
+        print(f"GOT NEW Client address: {_address}, queued for a handler")
+
+    def __handlerWorker(self):
+        """
+        Handle queued clients one at a time, until handed `None`
+        """
+        while True:
+            _accepted = self.__acceptQueue.get()
+            if _accepted is None:
+                return
+
+            _client, _address = _accepted
+            try:
+                self.__networkHandler(_client=_client, _address=_address)
+            finally:
+                self.__clientFinished()
+
+    def __clientFinished(self):
+        with self.__clientsInFlightChanged:
+            self.__clientsInFlight -= 1
+            self.__clientsInFlightChanged.notify_all()
+
+    def __handOverToSuccessor(self) -> bool:
+        """
+        Hot upgrade: pass the sockets and the motor's move to a new process (see HotUpgrade), returns whether it did
+        - runs on the accepting thread, so nothing is accepted meanwhile, new clients wait in the sockets' backlogs
+        - clients already accepted are answered first, by the motor as it is
+        - when the new process doesn't confirm it took over, this one un-parks its motor and carries on
+        """
+        successor, _ = self.__handoffNetwork.accept()
+        pending = None
+        parked = False
+        try:
+            request = HotUpgrade.receiveTakeOver(successor)
+            print(f"### HANDING OVER TO PROCESS {request.get('pid')} ###")
+            if self.__motorInSeparateProcess:
+                HotUpgrade.refuse(successor, "only a motor thread can be handed over, not a motor process")
+                return False
+            if not self.__threadedMotorController.canHandOver():
+                HotUpgrade.refuse(successor, f"only a motor on the {pigpioBackend} pwm backend can be handed over")
+                return False
+
+            with self.__clientsInFlightChanged:
+                answered = self.__clientsInFlightChanged.wait_for(
+                    lambda: self.__clientsInFlight == 0, self.__clientTimeoutInSeconds * 2
+                )
+            if not answered:
+                HotUpgrade.refuse(successor, f"{self.__clientsInFlight} clients are still being answered")
+                return False
+
+            # an instruction the debouncer is holding back goes with the motor
+            pending = self.__debouncer.takePending()
+            motor = self.__threadedMotorController.handOver()
+            if motor is None:
+                HotUpgrade.refuse(successor, "the motor loop did not park")
+                return False
+            parked = True
+
+            sockets = {"tcp": self.__network}
+            if self.__unixNetwork is not None:
+                sockets["unix"] = self.__unixNetwork
+            if self.__telemetry is not None:
+                sockets["telemetry"] = self.__telemetry.udpSocket()
+            sockets["handoff"] = self.__handoffNetwork
+            HotUpgrade.sendHandoff(successor, sockets, {"motor": motor, "pendingInstruction": pending})
+
+            self.__handedOver = HotUpgrade.awaitAdopted(successor, self.__handoffTimeoutInSeconds)
+        except (OSError, HotUpgrade.HandoffError) as error:
+            print(f'HANDOFF FAILED {error=}')
+        finally:
+            successor.close()
+
+            # carry on as if nothing happened
+            if not self.__handedOver:
+                if parked:
+                    self.__threadedMotorController.resume()
+                if pending is not None:
+                    self.__debouncer.submit(pending)
+
+        if self.__handedOver:
+            print("### HANDED OVER ###")
+            self.__keepRunningThreads = False
+        return self.__handedOver
+
+    def __confirmTakeOver(self):
+        # the debouncer was holding this back in the previous process
+        pending = self.__adoptedState.get("pendingInstruction")
+        if pending is not None:
+            self.__debouncer.submit(pending)
+
+        HotUpgrade.confirmAdopted(self.__predecessor)
+        self.__predecessor = None
+        print("### TOOK OVER ###")
+
+    @staticmethod
+    def __clientHost(_address) -> str:
+        # unix socket clients have no address, they all count as one local client
+        return _address[0] if isinstance(_address, tuple) else "unix"
+
+    def shutdown(self):
+        """
+        Ask `listenForMotorCommands()` to stop listening and clean up, e.g. from another thread
+        """
+        self.__keepRunningThreads = False
 
     @staticmethod
     def __disconnectClient(_client: socket.socket):
@@ -159,6 +601,33 @@ class MotorListener:
         print("### DISCONNECT COMPLETE ###")
         print()
 
+    def __rejectClient(self, _client: socket.socket, _code: int):
+        # reply straight from the accept loop, without waiting for the request
+        # - whatever the client already sent is read first, closing with it unread would reset the connection
+        #   before the client gets to read the reply
+        try:
+            _client.settimeout(0)
+            try:
+                _client.recv(2048)
+            except BlockingIOError:
+                pass
+            _client.sendall(self.__generateHttpResponse(_code).encode())
+            self.__disconnectClient(_client)
+        except OSError as error:
+            print(f'Could not reject client {error=}')
+            _client.close()
+
+    @staticmethod
+    def __peekInstruction(_client: socket.socket) -> Optional[str]:
+        # the instruction of a request that has already arrived, left on the socket for the handler
+        try:
+            _client.settimeout(0)
+            message = _client.recv(2048, socket.MSG_PEEK)
+        except OSError:
+            return None
+        return message.decode(errors="replace").split("\n")[-1] if message else None
+
+    @Timings.timed("listener.networkHandler")
     def __networkHandler(self, _client: socket.socket, _address):
         """
         MAIN WORK WITH CLIENT IS DONE HERE
@@ -170,58 +639,44 @@ class MotorListener:
         print()
 
         try:
-            while self.__keepRunningThreads:
-                # receive command and print it
-                httpMessage = _client.recv(2048).decode()
-                print(">>>>> PARTS")
-                for httpPart in httpMessage.split("\n"):
-                    print(httpPart)
-                print(">>>>> END PARTS")
-
-                # get command from message body
-                _newInstruction = httpMessage.split("\n")[-1]
-
-                # invalid message received
-                if not _newInstruction:
-                    # respond with error
-                    print(f"Invalid instruction '{_newInstruction}'")
-                    _client.sendall(self.__generateHttpResponse(self.__badRequest).encode())
-                    self.__disconnectClient(_client)
-                    return
-
-                # caller just wants to know the state of the blind
-                if _newInstruction == "status":
-                    # get latest state from Motor Controller
-                    print()
-                    print(f"Status requested '{_newInstruction}'")
-                    _status = self.__threadedMotorController.currentInstruction()
-
-                    # send status back to caller
-                    print(f'Sending "{_status}')
-                    _client.sendall(_status.encode())
-                    self.__disconnectClient(_client)
-                    print(f'Sent "{_status}')
-                    print()
-                    return
-
-                # if already doing what new instruction asked for
-                if _newInstruction == self.__threadedMotorController.currentInstruction():
-                    # no change needed, respond as done
-                    print(f"No change to instruction '{_newInstruction}'")
-                    _client.sendall(self.__generateHttpResponse(self.__noChange).encode())
-                    self.__disconnectClient(_client)
-                    return
-
-                # valid instruction received:
-                # - let the motor controller know
-                # - motor controller will handle this in the background in a separate thread
-                self.__threadedMotorController.instruct(_newInstruction)
-
-                # let caller know that we will action the valid request
-                _client.sendall(self.__generateHttpResponse(self.__okay).encode())
-                print(f'HANDLED INSTRUCTION "{_newInstruction}", RETURNING FROM THREAD')
-                self.__disconnectClient(_client)
-                return
+            # receive command and print it
+            httpMessage = _client.recv(2048).decode()
+            print(">>>>> PARTS")
+            for httpPart in httpMessage.split("\n"):
+                print(httpPart)
+            print(">>>>> END PARTS")
+
+            # get command from message body
+            _newInstruction = httpMessage.split("\n")[-1]
+            _requestId = self.__findHeader(httpMessage, self.__requestIdHeader)
+            _credentials = self.__peerCredentials(_client)
+            _clientIdentity = self.__clientIdentity(_client, _address, _credentials, httpMessage)
+
+            # turn away clients that are over their limit
+            if not self.__isAdmitted(_client, _address, _credentials, _newInstruction):
+                self.rateLimitedClients += 1
+                print(f"RATE LIMITED: {_clientIdentity}")
+                _reply = self.__generateHttpResponse(self.__tooManyRequests)
+
+            # profiling and the timers are only for someone logged in to this Pi, the TCP port is open to the network
+            elif self.__isProfilingCommand(_newInstruction) and _client.family != socket.AF_UNIX:
+                print(f"Refusing '{_newInstruction}' from {_clientIdentity}, only over the unix socket")
+                _reply = self.__generateHttpResponse(self.__forbidden)
+
+            # a repeat of an earlier request gets the original reply, without acting again
+            elif _requestId is not None and _newInstruction not in self.__readOnlyCommands():
+                _reply = self.__deduplicator.handleOnce(
+                    _clientIdentity, _requestId, lambda: self.__respondTo(_newInstruction)
+                )
+                if _reply is None:
+                    _reply = self.__generateHttpResponse(self.__unavailable)
+            else:
+                _reply = self.__respondTo(_newInstruction)
+
+            self.__auditCommand(_clientIdentity, _credentials, httpMessage, _newInstruction, _reply, _requestId)
+            _client.sendall(_reply.encode())
+            print(f'HANDLED INSTRUCTION "{_newInstruction}", RETURNING FROM HANDLER')
+            self.__disconnectClient(_client)
 
         except Exception as error:
             print("----> __networkHandler EXCEPTION <------")
@@ -229,39 +684,403 @@ class MotorListener:
             print("----> __networkHandler EXCEPTION <------")
             print(f'{error=}')
 
+        finally:
+            # e.g. the client timed out, or hung up first
+            _client.close()
+
+    @staticmethod
+    def __findHeader(_httpMessage: str, _header: str) -> Optional[str]:
+        """
+        Optional header line, e.g. `X-Request-Id: <id>` sent by the web back-end and any producer that retries,
+        or `X-Producer: <name>` sent by the producers on this Pi
+        """
+        for _line in _httpMessage.split("\n")[:-1]:
+            if _line.lower().startswith(_header):
+                return _line[len(_header):].strip() or None
+        return None
+
+    def __clientIdentity(
+            self, _client: socket.socket, _address, _credentials: Optional[Tuple[int, int]], _httpMessage: str
+    ) -> str:
+        """
+        Who sent a request, as the audit log records it
+        - a TCP client is its address, whatever it says it is, even from this Pi,
+          e.g. the Cloudflare tunnel connects from loopback on behalf of anyone
+        - a producer on the unix socket (IR, light, climate, the relay) is the producer it names,
+          or its process when it names none
+        """
+        clientHost = self.__clientHost(_address)
+        if _client.family != socket.AF_UNIX:
+            return clientHost
+
+        producer = self.__findHeader(_httpMessage, self.__producerHeader)
+        if producer is not None:
+            return f"{clientHost}:{producer[:self.__maxProducerNameLength]}"
+        return clientHost if _credentials is None else f"{clientHost}:pid {_credentials[0]}"
+
+    def __isAdmitted(
+            self, _client: socket.socket, _address, _credentials: Optional[Tuple[int, int]], _instruction: str
+    ) -> bool:
+        """
+        Whether the rate limiter lets a request through, stopping the motor always gets through
+        - a TCP client was already checked against its address's budget by the accept loop, see `__acceptClient()`
+        - a producer on the unix socket has a budget for its process, keyed by the socket's credentials
+          rather than the producer it names, and its read-only queries don't use it up,
+          e.g. the RelayConnector's state polls while the blind moves
+        """
+        if _instruction == Command.Stop.value or _client.family != socket.AF_UNIX:
+            return True
+        if _instruction in self.__readOnlyCommands():
+            return True
+
+        clientHost = self.__clientHost(_address)
+        if _credentials is None:
+            return self.__rateLimiter.admit(clientHost)
+        processId, userId = _credentials
+        return self.__rateLimiter.admit(f"{clientHost}:pid {processId} uid {userId}")
+
+    @staticmethod
+    def __peerCredentials(_client: socket.socket) -> Optional[Tuple[int, int]]:
+        # process and user id of a unix socket client, from its credentials (pid, uid, gid)
+        if _client.family != socket.AF_UNIX or not hasattr(socket, "SO_PEERCRED"):
+            return None
+        try:
+            credentials = _client.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+            processId, userId, _ = struct.unpack("3i", credentials)
+            return processId, userId
+        except OSError:
+            return None
+
+    def __readOnlyCommands(self) -> tuple:
+        return self.__statusCommand, self.__stateCommand, self.__healthCommand, self.__telemetryCommand
+
+    def __auditCommand(
+            self, _clientIdentity: str, _credentials: Optional[Tuple[int, int]], _httpMessage: str,
+            _instruction: str, _reply: str, _requestId: Optional[str]
+    ):
+        """
+        Record commands that could change the blind, read-only commands aren't worth the disk space
+        - who sent it (see `__clientIdentity()`), e.g. "unix:ir" or "unix:relay", and the request as it arrived
+        - a producer on the unix socket names itself, the process and user it really is go in the detail
+        """
+        if self.__auditLog is None or _instruction in self.__readOnlyCommands():
+            return
+        if self.__isProfilingCommand(_instruction):
+            return
+
+        detail = []
+        if _credentials is not None:
+            detail.append(f"pid {_credentials[0]} uid {_credentials[1]}")
+        if _requestId is not None:
+            detail.append(f"request {_requestId}")
+
+        self.__auditLog.record(
+            "command",
+            _source=_clientIdentity,
+            _instruction=_instruction,
+            _decision=self.__replyCode(_reply),
+            _detail=", ".join(detail) or None,
+            _request=_httpMessage
+        )
+
+    def __replyCode(self, _reply: str) -> str:
+        for _code in self.__httpStatusCodes:
+            if _reply == self.__generateHttpResponse(_code):
+                return str(_code)
+
+        # e.g. a schedule's json
+        return _reply[:64]
+
+    def __submitScheduledInstruction(self, _instruction: str) -> bool:
+        if self.__auditLog is not None:
+            self.__auditLog.record("command", _source="scheduler", _instruction=_instruction, _decision="204")
+        return self.__debouncer.submit(_instruction)
+
+    def __checkInstruction(self, _instruction: str):
+        checkInstruction(_instruction, self.__threadedMotorController.blindHeightInCm())
+
+    def __respondTo(self, _newInstruction: str) -> str:
+        """
+        Act on one instruction and return the reply for the caller
+        """
+        # invalid message received
+        if not _newInstruction:
+            # respond with error
+            print(f"Invalid instruction '{_newInstruction}'")
+            return self.__generateHttpResponse(self.__badRequest)
+
+        # caller just wants to know the state of the blind
+        if _newInstruction == self.__statusCommand:
+            # get latest state from Motor Controller
+            print()
+            print(f"Status requested '{_newInstruction}'")
+            _status = self.__threadedMotorController.currentInstruction()
+            print(f'Sending "{_status}')
+            return _status
+
+        # caller wants everything about the blind a remote would show
+        if _newInstruction == self.__stateCommand:
+            _health = self.__threadedMotorController.health()
+            return json.dumps({
+                "instruction": self.__threadedMotorController.currentInstruction(),
+                "position": round(self.__threadedMotorController.currentBlindExtensionLength(), 1),
+                "moving": _health["moving"],
+                "healthy": _health["healthy"],
+            })
+
+        # caller wants to know whether the motor is under control
+        if _newInstruction == self.__healthCommand:
+            return json.dumps(self.__threadedMotorController.health())
+
+        # caller wants the latest readings from other rooms
+        if _newInstruction == self.__telemetryCommand:
+            if self.__telemetry is None:
+                return self.__generateHttpResponse(self.__badRequest)
+            return json.dumps({"counters": self.__telemetry.counters(), "nodes": self.__telemetry.nodes()})
+
+        # caller wants to list, add or cancel schedules
+        if _newInstruction.startswith(self.__scheduleCommand):
+            _reply = self.__handleScheduleCommand(_newInstruction)
+            print(f'Schedule reply "{_reply}"')
+            return _reply
+
+        # caller wants to profile or read the hot-path timers
+        if self.__isProfilingCommand(_newInstruction):
+            return self.__handleProfilingCommand(_newInstruction)
+
+        # nothing would act on the instruction, don't pretend otherwise
+        if not self.__threadedMotorController.health()["healthy"]:
+            print(f"Motor is unhealthy, refusing '{_newInstruction}'")
+            return self.__generateHttpResponse(self.__unavailable)
+
+        # caller wants several moves and waits, run by the motor controller without coming back here
+        if _newInstruction.startswith(MotionSequence.prefix):
+            return self.__handleSequenceCommand(_newInstruction)
+
+        # the motor can't act on it, e.g. a length beyond the blind's height
+        try:
+            self.__checkInstruction(_newInstruction)
+        except ValueError as error:
+            print(f"Invalid instruction '{_newInstruction}' {error=}")
+            return self.__generateHttpResponse(self.__badRequest)
+
+        # if already doing what new instruction asked for
+        if _newInstruction == self.__threadedMotorController.currentInstruction():
+            # no change needed, respond as done
+            print(f"No change to instruction '{_newInstruction}'")
+            return self.__generateHttpResponse(self.__noChange)
+
+        # valid instruction received:
+        # - let the motor controller know
+        # - motor controller will handle this in the background in a separate thread
+        self.__debouncer.submit(_newInstruction)
+
+        # let caller know that we will action the valid request
+        return self.__generateHttpResponse(self.__okay)
+
+    def __handleSequenceCommand(self, _command: str) -> str:
+        """
+        e.g. "sequence down; wait 10; 60"
+        - goes straight to the motor controller, past the debouncer,
+          an older instruction the debouncer is still holding back is dropped so it can't cancel the sequence
+        """
+        try:
+            _steps = MotionSequence.compileSequence(_command, self.__threadedMotorController.blindHeightInCm())
+        except ValueError as error:
+            print(f'Invalid sequence "{_command}" {error=}')
+            return self.__generateHttpResponse(self.__badRequest)
+
+        self.__debouncer.discardPending()
+
+        if not self.__threadedMotorController.runSequence(_steps):
+            return self.__generateHttpResponse(self.__badRequest)
+        return self.__generateHttpResponse(self.__okay)
+
+    def __handleScheduleCommand(self, _command: str) -> str:
+        """
+        Manage schedules over the network, e.g.
+        - "schedule list"
+        - "schedule add 07:00 mon-fri up"
+        - "schedule add sunset daily 120 -15" (the last value is an offset in minutes)
+        - "schedule cancel <id>"
+        """
+        _parts = _command.split()
+
+        try:
+            _action = _parts[1]
+
+            if _action == "list":
+                return json.dumps([_entry.toDict() for _entry in self.__scheduler.entries()])
+
+            if _action == "add":
+                _entry = ScheduleEntry(
+                    _entryId=self.__scheduler.newEntryId(),
+                    _room=self.__room,
+                    _at=_parts[2],
+                    _weekdays=BlindScheduler.parseWeekdays(_parts[3]),
+                    _instruction=_parts[4],
+                    _offsetInMinutes=int(_parts[5]) if len(_parts) > 5 else 0
+                )
+                return self.__scheduler.add(_entry)
+
+            if _action == "cancel":
+                _code = self.__okay if self.__scheduler.cancel(_parts[2]) else self.__noChange
+                return self.__generateHttpResponse(_code)
+
+        except (IndexError, ValueError) as error:
+            print(f'Invalid schedule command "{_command}" {error=}')
+
+        return self.__generateHttpResponse(self.__badRequest)
+
+    def __isProfilingCommand(self, _instruction: str) -> bool:
+        return _instruction.startswith((self.__profileCommand, self.__timingsCommand))
+
+    def __handleProfilingCommand(self, _command: str) -> str:
+        """
+        Profile the running listener, only over the unix socket, e.g.
+        - "profile start", "profile stop" (replies with the dump's path), the sampling profiler sees every thread
+        - "timings" (replies with the histograms as json), "timings on", "timings off", "timings reset"
+        - cProfile would only see the handler thread running the command, start it with SIGUSR1 and
+          BLIND_PROFILER=cprofile instead (see Profiling)
+        """
+        _parts = _command.split()
+
+        if _parts[0] == self.__profileCommand and len(_parts) > 1:
+            if _parts[1] == "start":
+                _mode = _parts[2] if len(_parts) > 2 else Profiler.samplingMode
+                if _mode != Profiler.samplingMode:
+                    print(f"Refusing to profile with {_mode}, use SIGUSR1 with BLIND_PROFILER={_mode}")
+                    return self.__generateHttpResponse(self.__badRequest)
+                return Profiler.start(_mode)
+            if _parts[1] == "stop":
+                return Profiler.stop()
+
+        if _parts[0] == self.__timingsCommand:
+            if len(_parts) == 1:
+                return json.dumps({
+                    "enabled": Timings.enabled,
+                    "timers": Timings.snapshot(),
+                    "gpio": self.__threadedMotorController.gpioCounters(),
+                    "deduplication": self.__deduplicator.counters(),
+                    "watchdog": self.__threadedMotorController.health(),
+                    "auditLog": self.__auditLog.counters() if self.__auditLog is not None else None,
+                    "config": self.__configWatcher.counters() if self.__configWatcher is not None else None,
+                    "telemetry": self.__telemetry.counters() if self.__telemetry is not None else None,
+                    "handlerPool": {
+                        "threads": self.__handlerThreadCount,
+                        "queued": self.__acceptQueue.qsize(),
+                        "overloadedClients": self.overloadedClients,
+                        "rateLimitedClients": self.rateLimitedClients,
+                    },
+                })
+            if _parts[1] in ("on", "off"):
+                Timings.enabled = _parts[1] == "on"
+                return self.__generateHttpResponse(self.__okay)
+            if _parts[1] == "reset":
+                Timings.reset()
+                return self.__generateHttpResponse(self.__okay)
+
+        return self.__generateHttpResponse(self.__badRequest)
+
     def __generateHttpResponse(self, _code: int) -> str:
         return f'HTTP/1.1 "{self.__httpStatusCodes[_code]}"'
 
     def __cleanup(self):
         print("Start listener cleanup")
 
-        # cleanup connection
-        if self.__connection is not None:
-            # clean up clients
-            for client, address in self.__clients:
-                client.close()
+        # stop listening
+        # - after a hot upgrade the sockets are the new process's, only this process's descriptors of them are closed
+        self.__network.close()
+        if self.__unixNetwork is not None:
+            self.__unixNetwork.close()
+            if not self.__handedOver and MotorConnection.isUnixSocket(self.__unixSocketPath):
+                os.unlink(self.__unixSocketPath)
+        if self.__handoffNetwork is not None:
+            self.__handoffNetwork.close()
+            if not self.__handedOver and MotorConnection.isUnixSocket(self.__handoffSocketPath):
+                os.unlink(self.__handoffSocketPath)
+        if self.__telemetry is not None:
+            self.__telemetry.close()
 
-            # clean up socket
-            self.__connection.close()
-            print("Connection closed")
-        else:
-            print("NOTICE: No network found to clean")
+        # drain: clients already queued still get their reply, then each handler thread finishes
+        if self.__handlerPool is not None:
+            print(f"Draining {self.__acceptQueue.qsize()} queued clients")
+            for _ in self.__handlerPool:
+                self.__acceptQueue.put(None)
 
-        # join background client threads to this one
-        # i.e. it closes those threads
-        for _clientThread in self.__clientThreads:
-            _clientThread.join()
+            drainUntil = timer() + self.__drainTimeoutInSeconds
+            for _handler in self.__handlerPool:
+                _handler.join(timeout=max(0.0, drainUntil - timer()))
+            print("Handler threads finished")
+
+        # stop running schedules before the motor goes away
+        if self.__scheduler is not None:
+            self.__scheduler.cleanup()
+        if self.__debouncer is not None:
+            self.__debouncer.cleanup()
+        if self.__configWatcher is not None:
+            self.__configWatcher.cleanup()
 
         # clean up the Motor Controller thread
         print("Listener cleaned up")
         print()
         print("=== MOTOR CONTROLLER THREAD CLEANUP ===")
-        self.__threadedMotorController.cleanup()
+        if self.__handedOver:
+            # the motor keeps running, it's the new process's now
+            self.__threadedMotorController.release()
+        else:
+            self.__threadedMotorController.cleanup()
         print(" >> try to join thread <<")
         self.__threadedMotorController.join()
         print(" >> THREAD JOIN FINISHED <<")
 
+        # write out the last events, including the motor stopping
+        if self.__auditLog is not None:
+            self.__auditLog.cleanup()
+
 
 if __name__ == "__main__":
-    motorListener = MotorListener()
+    parser = argparse.ArgumentParser(description="Listen for blind motor instructions")
+    parser.add_argument("--room", default=BlindScheduler.anyRoom)
+    parser.add_argument("--port", type=int, default=MotorConnection.defaultPort)
+    parser.add_argument("--unix-socket", default=MotorConnection.defaultUnixSocketPath,
+                        help="path of the unix domain socket, or 'none' to disable it")
+    parser.add_argument("--unix-socket-mode", type=lambda _mode: int(_mode, 8), default=0o660,
+                        help="permissions of the unix domain socket, in octal")
+    parser.add_argument("--motor-process", action="store_true", help="run the motor in its own process")
+    parser.add_argument("--motor-cpu", type=int, help="pin the motor process to this cpu")
+    parser.add_argument("--motor-realtime", type=int, help="SCHED_FIFO priority for the motor process")
+    parser.add_argument("--pwm-backend", choices=pwmBackendNames,
+                        help="how the motor's PWM is generated, instead of the config's motor.pwmBackend")
+    parser.add_argument("--audit-file", default=defaultAuditFileName,
+                        help="sqlite file of the audit log, or 'none' to disable it")
+    parser.add_argument("--config", default=BlindConfig.defaultFileName,
+                        help="json config file, watched for changes, or 'none' to use the defaults")
+    parser.add_argument("--telemetry-port", default=str(Telemetry.defaultPort),
+                        help="udp port for batched readings from sensor nodes, or 'none' to disable it")
+    parser.add_argument("--handoff-socket", default=HotUpgrade.defaultHandoffSocketPath,
+                        help="unix socket a new process takes this one over on, or 'none' to disable hot upgrades")
+    parser.add_argument("--take-over", metavar="HANDOFF_SOCKET",
+                        help="take the sockets and the moving motor over from the listener on this handoff socket"
+                             " (both on the pigpio pwm backend)")
+    arguments = parser.parse_args()
+    if arguments.take_over is not None and arguments.motor_process:
+        parser.error("--take-over needs the motor thread, not --motor-process")
+
+    Profiler.install("motor-listener")
+    motorListener = MotorListener(
+        _room=arguments.room,
+        _motorInSeparateProcess=arguments.motor_process,
+        _motorCpu=arguments.motor_cpu,
+        _motorRealtimePriority=arguments.motor_realtime,
+        _pwmBackendName=arguments.pwm_backend,
+        _port=arguments.port,
+        _unixSocketPath=None if arguments.unix_socket == "none" else arguments.unix_socket,
+        _unixSocketMode=arguments.unix_socket_mode,
+        _auditFileName=None if arguments.audit_file == "none" else arguments.audit_file,
+        _configFileName=None if arguments.config == "none" else arguments.config,
+        _telemetryPort=None if arguments.telemetry_port == "none" else int(arguments.telemetry_port),
+        _handoffSocketPath=None if arguments.handoff_socket == "none" else arguments.handoff_socket,
+        _takeOverFrom=arguments.take_over
+    )
     motorListener.listenForMotorCommands()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import socket
+import statistics
+import tempfile
+import threading
+from pathlib import Path
+from time import sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import SimulatedHardware
+
+"""
+Stop-position error of the motor, thread mode vs process mode, under synthetic network load
+- the motor runs on simulated hardware, every duty cycle change is timestamped
+- the error of a move is how long the motor was powered compared with distance / speed,
+  reported as time and as centimetres at the real blind speed
+- each move ramps up from a standstill (see DutyCycleRamp), the time spent ramping is counted at the
+  fraction of full speed it moves the blind, as the motor thread counts it
+- the load is a set of threads in the listener's process doing what handler threads do:
+  socket round trips and message parsing
+
+Run e.g. `python MotorModeBenchmark.py --moves 20 --load 8 --cpu 3`
+- on a single core machine both modes compete for the same cpu, so run it on the Pi
+"""
+
+SimulatedHardware.install()
+
+from PwmBackend import SimulatedPwm  # noqa: E402
+from ProcessMotorController import ProcessMotorController  # noqa: E402
+from ThreadMotorController import ThreadMotorController  # noqa: E402
+
+
+def networkLoad(_stop_event: threading.Event):
+    # a socket round trip plus parsing, over and over
+    sender, receiver = socket.socketpair()
+    message = json.dumps({"instruction": "up", "padding": "x" * 512}).encode()
+    while not _stop_event.is_set():
+        sender.sendall(message)
+        json.loads(receiver.recv(4096))
+        "\n".join(str(_index) for _index in range(200)).split("\n")
+    sender.close()
+    receiver.close()
+
+
+def poweredIntervals(_history: List[Tuple[float, float]]) -> List[float]:
+    """
+    How long the motor was powered for each move, in seconds at full speed
+    - while ramping up, the blind moves at duty cycle / running duty cycle of its full speed (see `rampUpProfile()`)
+    """
+    intervals = []
+    # (seconds, duty cycle) of every step of the move being powered
+    steps: List[Tuple[float, float]] = []
+    for _index, (_timestamp, _dutyCycle) in enumerate(_history):
+        if _dutyCycle > 0 and _index + 1 < len(_history):
+            steps.append((_history[_index + 1][0] - _timestamp, _dutyCycle))
+        elif _dutyCycle == 0 and steps:
+            runningDutyCycle = steps[-1][1]
+            intervals.append(sum(_seconds * _stepDutyCycle / runningDutyCycle for _seconds, _stepDutyCycle in steps))
+            steps = []
+    return intervals
+
+
+def runMoves(_controller, _targets: List[float], _timeoutInSeconds: float = 30):
+    # let the motor thread pick up its starting instruction first
+    sleep(0.1)
+
+    for _target in _targets:
+        _controller.instruct(str(_target))
+
+        # wait for the motor to take the instruction, then to finish it
+        # - the motor process publishes its state every poll interval, and later under load,
+        #   so a fixed sleep could send the next target before this one was taken, merging two moves
+        sentAt = timer()
+        while (
+                _controller.currentInstruction() == "stop"
+                and abs(_controller.currentBlindExtensionLength() - _target) > 0.5
+                and timer() - sentAt < _timeoutInSeconds
+        ):
+            sleep(0.002)
+        while _controller.currentInstruction() != "stop":
+            sleep(0.005)
+        sleep(0.05)
+
+
+def benchmarkMode(
+        _mode: str,
+        _targets: List[float],
+        _loadThreads: int,
+        _speedInCmPerSecond: float,
+        _stateFile: Path,
+        _cpu: Optional[int] = None,
+        _realtimePriority: Optional[int] = None
+) -> List[float]:
+    """
+    Returns the powered time of every move, in seconds at full speed
+    """
+    _stateFile.write_text("0")
+
+    _stop_event = threading.Event()
+    loaders = [threading.Thread(target=networkLoad, args=(_stop_event,), daemon=True) for _ in range(_loadThreads)]
+
+    if _mode == "thread":
+        pwm = SimulatedPwm()
+        with open(_stateFile, "r+") as _file:
+            controller = ThreadMotorController(
+                _file=_file,
+                _blindSpeedInCmPerSecond=_speedInCmPerSecond,
+                _pwmBackend=pwm
+            )
+            controller.start()
+            for _loader in loaders:
+                _loader.start()
+
+            runMoves(controller, _targets)
+
+            _stop_event.set()
+            controller.cleanup()
+            controller.join()
+        history = pwm.history
+    else:
+        controller = ProcessMotorController(
+            _filePath=_stateFile,
+            _blindSpeedInCmPerSecond=_speedInCmPerSecond,
+            _cpu=_cpu,
+            _realtimePriority=_realtimePriority,
+            _simulated=True
+        )
+        controller.start()
+        for _loader in loaders:
+            _loader.start()
+
+        runMoves(controller, _targets)
+
+        _stop_event.set()
+        controller.cleanup()
+        controller.join()
+        history = controller.report["pwmHistory"]
+
+    for _loader in loaders:
+        _loader.join()
+
+    return poweredIntervals(history)
+
+
+def summarise(
+        _intervals: List[float],
+        _targets: List[float],
+        _speedInCmPerSecond: float,
+        _realSpeedInCmPerSecond: float
+) -> Dict[str, float]:
+    distances = [abs(_target - _previous) for _previous, _target in zip([0] + _targets, _targets)]
+    errors = [
+        _interval - _distance / _speedInCmPerSecond
+        for _interval, _distance in zip(_intervals, distances)
+    ]
+    absoluteErrors = sorted(abs(_error) for _error in errors)
+
+    return {
+        "moves": len(errors),
+        "movesExpected": len(_targets),
+        "meanErrorMs": statistics.fmean(errors) * 1000,
+        "p95AbsErrorMs": absoluteErrors[int(len(absoluteErrors) * 0.95) - 1] * 1000,
+        "maxAbsErrorMs": absoluteErrors[-1] * 1000,
+        "maxAbsErrorCmAtRealSpeed": absoluteErrors[-1] * _realSpeedInCmPerSecond,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Stop-position error, thread vs process motor mode")
+    parser.add_argument("--moves", type=int, default=20)
+    parser.add_argument("--load", type=int, default=8, help="threads of synthetic network load")
+    parser.add_argument("--speed", type=float, default=100, help="simulated cm/s, faster keeps the run short")
+    parser.add_argument("--real-speed", type=float, default=8, help="cm/s of the real blind")
+    parser.add_argument("--cpu", type=int, help="pin the motor process to this cpu")
+    parser.add_argument("--realtime", type=int, help="SCHED_FIFO priority for the motor process")
+    parser.add_argument("--modes", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    arguments = parser.parse_args(_arguments)
+
+    # move back and forth between two positions
+    targets = [30.0 if _index % 2 == 0 else 10.0 for _index in range(arguments.moves)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as _directory:
+        for _mode in arguments.modes:
+            intervals = benchmarkMode(
+                _mode, targets, arguments.load, arguments.speed, Path(_directory) / "blind-state.txt",
+                _cpu=arguments.cpu, _realtimePriority=arguments.realtime
+            )
+            results[_mode] = summarise(intervals, targets, arguments.speed, arguments.real_speed)
+
+    print()
+    print("### STOP-POSITION ERROR ###")
+    for _mode, _result in results.items():
+        print(f"{_mode}: {_result}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
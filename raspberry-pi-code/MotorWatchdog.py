@@ -0,0 +1,152 @@
+import threading
+from timeit import default_timer as timer
+from typing import Callable, Dict, Optional
+
+"""
+Supervisor for the motor thread
+- every move gets a deadline: the time it should take at the blind's speed, plus a margin
+- the motor thread beats on every loop iteration, by bumping a counter (no clock reads, no locks)
+- the watchdog checks a few times a second, and cuts the motor's power when
+  - a move runs past its deadline, e.g. the position tracking went wrong
+  - the motor thread stops beating while the motor runs, e.g. it's stuck
+  - the motor thread has died, e.g. an exception in the motor loop
+- `health()` is what MotorListener reports, and refuses motor commands on
+"""
+
+
+class MotorWatchdog(threading.Thread):
+    """
+    Started with the motor thread, the motor thread calls `moveStarted()` and `moveFinished()`
+    and bumps `heartbeats` on every loop iteration
+    """
+    healthy = "healthy"
+    lagging = "lagging"
+    dead = "dead"
+    states = (healthy, lagging, dead)
+
+    # cut the motor's power, must be safe to call from this thread
+    __forceStop: Callable[[str], None] = None
+    __isMotorThreadAlive: Callable[[], bool] = None
+
+    __heartbeatTimeoutInSeconds: float = None
+    __deadlineMarginInSeconds: float = None
+    __deadlineMarginFraction: float = None
+    __checkIntervalInSeconds: float = None
+
+    # latest move, None while the motor is stopped
+    __deadline: Optional[float] = None
+
+    # when the heartbeat counter last changed
+    __lastHeartbeats: int = -1
+    __lastHeartbeatAt: float = None
+
+    __state: str = healthy
+
+    # allow this thread to be stopped as part of the cleanup
+    __stop_event: threading.Event = None
+
+    # written by the motor thread on every loop iteration
+    heartbeats: int = 0
+
+    # counters for tuning
+    checks: int = 0
+    forcedStops: int = 0
+    lastForcedStop: Optional[str] = None
+
+    def __init__(
+            self,
+            _forceStop: Callable[[str], None],
+            _isMotorThreadAlive: Callable[[], bool],
+            _heartbeatTimeoutInSeconds: float = 1,
+            _deadlineMarginInSeconds: float = 2,
+            _deadlineMarginFraction: float = 0.2,
+            _checkIntervalInSeconds: float = 0.1
+    ):
+        super().__init__(daemon=True, name="motor-watchdog")
+        self.__forceStop = _forceStop
+        self.__isMotorThreadAlive = _isMotorThreadAlive
+        self.__heartbeatTimeoutInSeconds = _heartbeatTimeoutInSeconds
+        self.__deadlineMarginInSeconds = _deadlineMarginInSeconds
+        self.__deadlineMarginFraction = _deadlineMarginFraction
+        self.__checkIntervalInSeconds = _checkIntervalInSeconds
+        self.__lastHeartbeatAt = timer()
+        self.__stop_event = threading.Event()
+
+    def moveStarted(self, _expectedSeconds: float):
+        """
+        Motor thread started the motor, for a move that should take `_expectedSeconds`
+        """
+        self.__deadline = (
+            timer()
+            + _expectedSeconds * (1 + self.__deadlineMarginFraction)
+            + self.__deadlineMarginInSeconds
+        )
+
+    def moveFinished(self):
+        self.__deadline = None
+
+    def isHealthy(self) -> bool:
+        return self.__state == self.healthy
+
+    def health(self) -> Dict:
+        deadline = self.__deadline
+        now = timer()
+        return {
+            "state": self.__state,
+            "healthy": self.__state == self.healthy,
+            "moving": deadline is not None,
+            "secondsToDeadline": round(deadline - now, 3) if deadline is not None else None,
+            "heartbeatAgeSeconds": round(now - self.__lastHeartbeatAt, 3),
+            "forcedStops": self.forcedStops,
+            "lastForcedStop": self.lastForcedStop,
+        }
+
+    def check(self, _now: Optional[float] = None) -> Optional[str]:
+        """
+        One round of checks, returns the reason the motor was stopped (if it was)
+        """
+        now = timer() if _now is None else _now
+        self.checks += 1
+
+        heartbeats = self.heartbeats
+        if heartbeats != self.__lastHeartbeats:
+            self.__lastHeartbeats = heartbeats
+            self.__lastHeartbeatAt = now
+
+        wasDead = self.__state == self.dead
+        if not self.__isMotorThreadAlive():
+            self.__state = self.dead
+        elif now - self.__lastHeartbeatAt > self.__heartbeatTimeoutInSeconds:
+            self.__state = self.lagging
+        else:
+            self.__state = self.healthy
+
+        # a dead thread may have died while starting the motor, before it set a deadline
+        deadline = self.__deadline
+        reason = None
+        if self.__state == self.dead and not wasDead:
+            reason = "motor thread died"
+        elif deadline is not None and self.__state == self.lagging:
+            reason = f"no heartbeat for {now - self.__lastHeartbeatAt:.2f}s"
+        elif deadline is not None and now > deadline:
+            reason = f"move overran its deadline by {now - deadline:.2f}s"
+
+        if reason is not None:
+            print(f"WATCHDOG: FORCE STOP - {reason}")
+            self.__deadline = None
+            self.forcedStops += 1
+            self.lastForcedStop = reason
+            self.__forceStop(reason)
+        return reason
+
+    def run(self):
+        while not self.__stop_event.wait(self.__checkIntervalInSeconds):
+            try:
+                self.check()
+            except Exception as error:
+                print(f"WATCHDOG ERROR: {error=}")
+
+    def cleanup(self):
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
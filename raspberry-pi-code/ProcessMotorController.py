@@ -0,0 +1,416 @@
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory
+from pathlib import Path
+from time import sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+import MotionSequence
+from MotorWatchdog import MotorWatchdog
+
+"""
+Run ThreadMotorController in its own process
+- the motor loop no longer shares a GIL with the network handler threads
+- the listener and the motor process talk through one shared memory block:
+  - motor state (position, instruction, counters) published by the motor process
+  - a single-producer/single-consumer ring buffer of instructions
+- each is guarded by a lock shared between the processes, which is also the memory barrier:
+  plain loads and stores to shared memory may be seen out of order by the other core, e.g. on the Pi's ARM
+"""
+
+
+class SharedMotorState:
+    """
+    Layout of the shared memory block
+    - the locks are created by the listener and passed to the motor process with the block's name
+    """
+    # how often the state was published, 0 until the motor process is ready
+    __sequence = struct.Struct("<Q")
+    __sequenceOffset = 0
+
+    # position, blind height, heartbeat, gpio counters, instruction, watchdog state, forced stops, seconds to deadline
+    __state = struct.Struct("<dddQQQ63pBQd")
+    __stateOffset = 8
+
+    # ring buffer: head (written by the listener), tail (written by the motor process), slots
+    __counter = struct.Struct("<Q")
+    __headOffset = 136
+    __tailOffset = 144
+    __slot = struct.Struct("<63p")
+    __slotSize = 64
+    __slotsOffset = 152
+    slotCount = 64
+
+    size = __slotsOffset + slotCount * __slotSize
+    maxInstructionLength = 62
+
+    # a motor process that died holding a lock mustn't hang the listener, its heartbeat stops instead
+    lockTimeoutInSeconds = 0.5
+
+    def __init__(self, _memory: shared_memory.SharedMemory, _stateLock, _ringLock):
+        self.__memory = _memory
+        self.__buffer = _memory.buf
+        self.__stateLock = _stateLock
+        self.__ringLock = _ringLock
+        self.__lastState = None
+
+    def __readCounter(self, _offset: int) -> int:
+        return self.__counter.unpack_from(self.__buffer, _offset)[0]
+
+    def __writeCounter(self, _offset: int, _value: int):
+        self.__counter.pack_into(self.__buffer, _offset, _value)
+
+    # ---- state: written by the motor process, read by the listener ----
+
+    def publish(
+            self, _position: float, _blindHeightInCm: float, _instruction: str, _gpioCounters: Dict[str, int],
+            _health: Dict
+    ):
+        with self.__stateLock:
+            self.__publish(_position, _blindHeightInCm, _instruction, _gpioCounters, _health)
+
+    def __publish(
+            self, _position: float, _blindHeightInCm: float, _instruction: str, _gpioCounters: Dict[str, int],
+            _health: Dict
+    ):
+        sequence = self.__sequence.unpack_from(self.__buffer, self.__sequenceOffset)[0]
+        self.__state.pack_into(
+            self.__buffer, self.__stateOffset,
+            _position,
+            _blindHeightInCm,
+            timer(),
+            _gpioCounters.get("writesRequested", 0),
+            _gpioCounters.get("writesSkipped", 0),
+            _gpioCounters.get("hardwareCalls", 0),
+            _instruction.encode()[:self.maxInstructionLength],
+            MotorWatchdog.states.index(_health["state"]),
+            _health["forcedStops"],
+            _health["secondsToDeadline"] if _health["secondsToDeadline"] is not None else float("nan"),
+        )
+        self.__sequence.pack_into(self.__buffer, self.__sequenceOffset, sequence + 1)
+
+    def read(self) -> Optional[Dict]:
+        """
+        Consistent copy of the state, or None before the motor process has published anything
+        - the last copy read, when the lock can't be had
+        """
+        if self.__stateLock.acquire(timeout=self.lockTimeoutInSeconds):
+            try:
+                if self.__sequence.unpack_from(self.__buffer, self.__sequenceOffset)[0] != 0:
+                    self.__lastState = self.__state.unpack_from(self.__buffer, self.__stateOffset)
+            finally:
+                self.__stateLock.release()
+
+        if self.__lastState is None:
+            return None
+        (
+            position, blindHeight, heartbeat, requested, skipped, calls, instruction, health, forcedStops,
+            secondsToDeadline
+        ) = self.__lastState
+
+        return {
+            "position": position,
+            "blindHeight": blindHeight,
+            "heartbeat": heartbeat,
+            "instruction": instruction.decode(),
+            "gpio": {"writesRequested": requested, "writesSkipped": skipped, "hardwareCalls": calls},
+            "health": {
+                "state": MotorWatchdog.states[health],
+                "moving": secondsToDeadline == secondsToDeadline,
+                "secondsToDeadline": secondsToDeadline if secondsToDeadline == secondsToDeadline else None,
+                "forcedStops": forcedStops,
+            },
+        }
+
+    # ---- instructions: pushed by the listener, popped by the motor process ----
+
+    def push(self, _instruction: str) -> bool:
+        if not self.__ringLock.acquire(timeout=self.lockTimeoutInSeconds):
+            return False
+        try:
+            head = self.__readCounter(self.__headOffset)
+            tail = self.__readCounter(self.__tailOffset)
+
+            # ring is full, the motor process has stopped taking instructions
+            if head - tail >= self.slotCount:
+                return False
+
+            slotOffset = self.__slotsOffset + (head % self.slotCount) * self.__slotSize
+            self.__slot.pack_into(self.__buffer, slotOffset, _instruction.encode())
+
+            # publish the slot only once it's written
+            self.__writeCounter(self.__headOffset, head + 1)
+            return True
+        finally:
+            self.__ringLock.release()
+
+    def pop(self) -> Optional[str]:
+        with self.__ringLock:
+            head = self.__readCounter(self.__headOffset)
+            tail = self.__readCounter(self.__tailOffset)
+            if tail == head:
+                return None
+
+            slotOffset = self.__slotsOffset + (tail % self.slotCount) * self.__slotSize
+            instruction = self.__slot.unpack_from(self.__buffer, slotOffset)[0].decode()
+
+            # free the slot only once it's read
+            self.__writeCounter(self.__tailOffset, tail + 1)
+            return instruction
+
+    def release(self):
+        self.__buffer = None
+        self.__memory.close()
+
+
+def runMotorProcess(
+        _memoryName: str,
+        _stateLock,
+        _ringLock,
+        _filePath: str,
+        _initialBlindExtensionLength: float,
+        _blindHeightInCm: float,
+        _blindSpeedInCmPerSecond: float,
+        _cpu: Optional[int],
+        _realtimePriority: Optional[int],
+        _simulated: bool,
+        _auditFileName: Optional[str],
+        _configFileName: Optional[str],
+        _pwmBackendName: Optional[str],
+        _reportConnection
+):
+    """
+    MAIN of the motor process
+    """
+    # keep the motor loop on its own core, away from the network
+    if _cpu is not None:
+        os.sched_setaffinity(0, {_cpu})
+        print(f"MOTOR PROCESS: pinned to cpu {_cpu}")
+
+    if _realtimePriority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(_realtimePriority))
+            print(f"MOTOR PROCESS: real-time priority {_realtimePriority}")
+        except PermissionError as error:
+            print(f"MOTOR PROCESS WARNING: could not set real-time priority {error=}")
+
+    pwmBackend = None
+    if _simulated:
+        import SimulatedHardware
+        from PwmBackend import SimulatedPwm
+        SimulatedHardware.install()
+        pwmBackend = SimulatedPwm()
+
+    # imported here so the simulated hardware is in place first
+    from ThreadMotorController import ThreadMotorController
+
+    # the motor process writes its own events to the shared audit database
+    auditLog = None
+    if _auditFileName is not None:
+        from AuditLog import AuditLog
+        auditLog = AuditLog(_source="motor", _fileName=_auditFileName)
+        auditLog.start()
+
+    # the motor process follows the config file itself, a config doesn't fit through the ring
+    config = None
+    if _configFileName is not None:
+        import BlindConfig
+        config = BlindConfig.loadAtStartup(_configFileName)
+
+    sharedState = SharedMotorState(shared_memory.SharedMemory(name=_memoryName), _stateLock, _ringLock)
+
+    with open(_filePath, "r+") as _file:
+        controller = ThreadMotorController(
+            _file=_file,
+            _initialBlindExtensionLength=_initialBlindExtensionLength,
+            _blindHeightInCm=_blindHeightInCm,
+            _blindSpeedInCmPerSecond=_blindSpeedInCmPerSecond,
+            _pwmBackend=pwmBackend,
+            _pwmBackendName=_pwmBackendName,
+            _auditLog=auditLog,
+            _config=config
+        )
+        controller.start()
+
+        configWatcher = None
+        if _configFileName is not None:
+            configWatcher = BlindConfig.ConfigWatcher(_configFileName, [controller.applyConfig], config)
+            configWatcher.start()
+
+        # pass instructions on to the motor thread, and publish its state for the listener
+        keepRunning = True
+        while keepRunning:
+            instruction = sharedState.pop()
+            while instruction is not None:
+                if instruction == ProcessMotorController.shutdownInstruction:
+                    keepRunning = False
+                    break
+
+                # a sequence travels through the ring as its text
+                # - checked again here, a config change may have shortened the blind since the listener checked it
+                if instruction.startswith(MotionSequence.prefix):
+                    try:
+                        controller.runSequence(
+                            MotionSequence.compileSequence(instruction, controller.blindHeightInCm())
+                        )
+                    except ValueError as error:
+                        print(f'MOTOR PROCESS WARNING: dropped sequence "{instruction}" {error=}')
+                else:
+                    controller.instruct(instruction)
+                instruction = sharedState.pop()
+
+            sharedState.publish(
+                controller.currentBlindExtensionLength(),
+                controller.blindHeightInCm(),
+                controller.currentInstruction(),
+                controller.gpioCounters(),
+                controller.health()
+            )
+            sleep(ProcessMotorController.pollIntervalInSeconds)
+
+        if configWatcher is not None:
+            configWatcher.cleanup()
+        controller.cleanup()
+        controller.join()
+        if auditLog is not None:
+            auditLog.cleanup()
+
+        _reportConnection.send({
+            "gpio": controller.gpioCounters(),
+            "pwmHistory": pwmBackend.history if pwmBackend is not None else [],
+        })
+
+    sharedState.release()
+
+
+class ProcessMotorController:
+    """
+    Same interface as ThreadMotorController, but the motor runs in a separate process
+    """
+    shutdownInstruction = "__shutdown__"
+    pollIntervalInSeconds = 0.001
+
+    # the motor process publishes every poll interval, much longer without means it's stuck
+    heartbeatTimeoutInSeconds = 1
+
+    __memory: shared_memory.SharedMemory = None
+    __sharedState: SharedMotorState = None
+    __process: multiprocessing.Process = None
+    __reportConnection = None
+
+    # what the motor process sent back when it finished
+    report: Dict = None
+
+    def __init__(
+            self,
+            _filePath: Path,
+            _initialBlindExtensionLength: float = 0,
+            _blindHeightInCm: float = 200,
+            _blindSpeedInCmPerSecond: float = 8,
+            _cpu: Optional[int] = None,
+            _realtimePriority: Optional[int] = None,
+            _simulated: bool = False,
+            _auditFileName: Optional[str] = None,
+            _configFileName: Optional[str] = None,
+            _pwmBackendName: Optional[str] = None
+    ):
+        # spawn a clean interpreter, rather than forking one that already has threads and GPIO state
+        context = multiprocessing.get_context("spawn")
+
+        stateLock, ringLock = context.Lock(), context.Lock()
+        self.__memory = shared_memory.SharedMemory(create=True, size=SharedMotorState.size)
+        self.__memory.buf[:SharedMotorState.size] = bytes(SharedMotorState.size)
+        self.__sharedState = SharedMotorState(self.__memory, stateLock, ringLock)
+        self.__reportConnection, _childConnection = context.Pipe(duplex=False)
+        self.__process = context.Process(
+            target=runMotorProcess,
+            args=(
+                self.__memory.name,
+                stateLock,
+                ringLock,
+                str(_filePath),
+                _initialBlindExtensionLength,
+                _blindHeightInCm,
+                _blindSpeedInCmPerSecond,
+                _cpu,
+                _realtimePriority,
+                _simulated,
+                _auditFileName,
+                _configFileName,
+                _pwmBackendName,
+                _childConnection,
+            ),
+            name="motor-process",
+        )
+
+    def start(self, _timeoutInSeconds: float = 30):
+        self.__process.start()
+
+        # wait for the motor process to be ready
+        startedAt = timer()
+        while self.__sharedState.read() is None:
+            if not self.__process.is_alive() or timer() - startedAt > _timeoutInSeconds:
+                raise RuntimeError("motor process did not start")
+            sleep(0.01)
+
+        print(f" $$$$$$$$ MOTOR PROCESS RUNNING (pid {self.__process.pid}) $$$$$$$$")
+
+    def instruct(self, instruction: str) -> bool:
+        if len(instruction.encode()) > SharedMotorState.maxInstructionLength:
+            print(f'ERROR: instruction too long for the motor process "{instruction}"')
+            return False
+
+        return self.__sharedState.push(instruction)
+
+    def runSequence(self, _steps: List[MotionSequence.SequenceStep]) -> bool:
+        """
+        Only sequences that fit in one slot of the ring can be passed on
+        """
+        return self.instruct(MotionSequence.encodeSequence(_steps))
+
+    def currentInstruction(self) -> str:
+        return self.__sharedState.read()["instruction"]
+
+    def currentBlindExtensionLength(self) -> float:
+        return self.__sharedState.read()["position"]
+
+    def blindHeightInCm(self) -> float:
+        return self.__sharedState.read()["blindHeight"]
+
+    def gpioCounters(self) -> Dict[str, int]:
+        return self.__sharedState.read()["gpio"]
+
+    def health(self) -> Dict:
+        """
+        The motor thread's watchdog, as published by the motor process, and the motor process itself
+        """
+        state = self.__sharedState.read()
+        health = state["health"]
+        heartbeatAge = timer() - state["heartbeat"]
+
+        if not self.__process.is_alive():
+            health["state"] = MotorWatchdog.dead
+        elif heartbeatAge > self.heartbeatTimeoutInSeconds:
+            health["state"] = MotorWatchdog.lagging
+
+        health["healthy"] = health["state"] == MotorWatchdog.healthy
+        health["processHeartbeatAgeSeconds"] = round(heartbeatAge, 3)
+        return health
+
+    def is_alive(self) -> bool:
+        return self.__process.is_alive()
+
+    def cleanup(self):
+        print("CLEANUP REQUESTED: Stop motor process")
+        while not self.__sharedState.push(self.shutdownInstruction) and self.__process.is_alive():
+            sleep(self.pollIntervalInSeconds)
+
+        if self.__reportConnection.poll(10):
+            self.report = self.__reportConnection.recv()
+
+    def join(self, timeout: Optional[float] = None):
+        self.__process.join(timeout)
+        self.__sharedState.release()
+        self.__memory.unlink()
@@ -0,0 +1,312 @@
+import cProfile
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from time import strftime
+from timeit import default_timer as timer
+from typing import Callable, Dict, Optional
+
+"""
+Opt-in profiling shared by every entry point
+- hot-path timers record into fixed-size histograms, read them at runtime with
+  SIGUSR2 (written to ./profiles) or the MotorListener "timings" command
+- SIGUSR1 (or the MotorListener "profile start"/"profile stop" commands, sampling only) toggles a profiler
+  and dumps it to ./profiles when it is stopped
+- set BLIND_PROFILING=1 to turn the timers on at startup, BLIND_PROFILER=cprofile|sampling picks the profiler
+"""
+
+
+class Histogram:
+    """
+    Fixed-size histogram of durations
+    - bucket `n` holds durations below 2^n microseconds, so recording is O(1) and memory never grows
+    """
+    __bucketCount = 32
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.buckets = [0] * self.__bucketCount
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+
+    def record(self, _seconds: float):
+        bucket = min(int(_seconds * 1_000_000).bit_length(), self.__bucketCount - 1)
+        with self.__lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.totalSeconds += _seconds
+            if _seconds > self.maxSeconds:
+                self.maxSeconds = _seconds
+
+    def __percentileUs(self, _buckets, _count: int, _fraction: float) -> int:
+        # upper edge of the bucket the percentile falls in
+        target = _count * _fraction
+        seen = 0
+        for _bucket, _bucketCount in enumerate(_buckets):
+            seen += _bucketCount
+            if seen >= target:
+                return 2 ** _bucket
+        return 2 ** (self.__bucketCount - 1)
+
+    def snapshot(self) -> Dict:
+        with self.__lock:
+            buckets, count = list(self.buckets), self.count
+            totalSeconds, maxSeconds = self.totalSeconds, self.maxSeconds
+
+        if count == 0:
+            return {"count": 0}
+
+        return {
+            "count": count,
+            "meanUs": totalSeconds / count * 1_000_000,
+            "maxUs": maxSeconds * 1_000_000,
+            "p50Us": self.__percentileUs(buckets, count, 0.50),
+            "p95Us": self.__percentileUs(buckets, count, 0.95),
+            "p99Us": self.__percentileUs(buckets, count, 0.99),
+            "buckets": {f"<{2 ** _bucket}us": _seen for _bucket, _seen in enumerate(buckets) if _seen},
+        }
+
+    def reset(self):
+        with self.__lock:
+            self.buckets = [0] * self.__bucketCount
+            self.count = 0
+            self.totalSeconds = 0.0
+            self.maxSeconds = 0.0
+
+
+class LoopTimer:
+    """
+    Records the time between consecutive `lap()` calls, i.e. one loop iteration
+    - call `lap()` at the top of the loop, no re-indenting of the loop body needed
+    """
+
+    def __init__(self, _histogram: Histogram):
+        self.__histogram = _histogram
+        self.__lastLapAt: Optional[float] = None
+
+    def lap(self):
+        if not Timings.enabled:
+            self.__lastLapAt = None
+            return
+
+        now = timer()
+        if self.__lastLapAt is not None:
+            self.__histogram.record(now - self.__lastLapAt)
+        self.__lastLapAt = now
+
+
+class _TimedBlock:
+    __slots__ = ("histogram", "startedAt")
+
+    def __init__(self, _histogram: Histogram):
+        self.histogram = _histogram
+        self.startedAt = 0.0
+
+    def __enter__(self):
+        self.startedAt = timer() if Timings.enabled else 0.0
+        return self
+
+    def __exit__(self, *_):
+        if self.startedAt:
+            self.histogram.record(timer() - self.startedAt)
+        return False
+
+
+class Timings:
+    """
+    Registry of named hot-path timers
+    - when disabled (the default) a timer costs one attribute check
+    """
+    enabled: bool = os.environ.get("BLIND_PROFILING") == "1"
+
+    __histograms: Dict[str, Histogram] = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def histogram(cls, _name: str) -> Histogram:
+        with cls.__lock:
+            if _name not in cls.__histograms:
+                cls.__histograms[_name] = Histogram()
+            return cls.__histograms[_name]
+
+    @classmethod
+    def block(cls, _name: str) -> _TimedBlock:
+        """
+        Time a block of code: `with Timings.block("serial.read"): ...`
+        """
+        return _TimedBlock(cls.histogram(_name))
+
+    @classmethod
+    def loop(cls, _name: str) -> LoopTimer:
+        return LoopTimer(cls.histogram(_name))
+
+    @classmethod
+    def timed(cls, _name: str) -> Callable:
+        """
+        Decorator that times every call of a function
+        """
+        def decorator(_function: Callable) -> Callable:
+            histogram = cls.histogram(_name)
+
+            @functools.wraps(_function)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return _function(*args, **kwargs)
+
+                startedAt = timer()
+                try:
+                    return _function(*args, **kwargs)
+                finally:
+                    histogram.record(timer() - startedAt)
+
+            return wrapper
+
+        return decorator
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, Dict]:
+        with cls.__lock:
+            histograms = dict(cls.__histograms)
+        return {_name: _histogram.snapshot() for _name, _histogram in sorted(histograms.items())}
+
+    @classmethod
+    def reset(cls):
+        with cls.__lock:
+            histograms = list(cls.__histograms.values())
+        for _histogram in histograms:
+            _histogram.reset()
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of every thread at a fixed interval
+    - unlike cProfile, this sees the motor thread and the network handler threads too
+    - output is in "folded" format, ready for flamegraph tools
+    """
+
+    def __init__(self, _intervalInSeconds: float = 0.005):
+        super().__init__(daemon=True)
+        self.__intervalInSeconds = _intervalInSeconds
+        self.__stop_event = threading.Event()
+        self.stacks: Counter = Counter()
+
+    def run(self):
+        ownThreadId = threading.get_ident()
+
+        while not self.__stop_event.wait(self.__intervalInSeconds):
+            for _threadId, _frame in sys._current_frames().items():
+                if _threadId == ownThreadId:
+                    continue
+
+                stack = []
+                while _frame is not None:
+                    stack.append(f"{_frame.f_code.co_name} ({Path(_frame.f_code.co_filename).name}:{_frame.f_lineno})")
+                    _frame = _frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stopAndDump(self, _path: Path):
+        self.__stop_event.set()
+        self.join()
+        with open(_path, "w") as _file:
+            for _stack, _samples in self.stacks.most_common():
+                _file.write(f"{_stack} {_samples}\n")
+
+
+class Profiler:
+    """
+    Start/stop a profiler for one entry point and dump the results to ./profiles
+    """
+    cProfileMode = "cprofile"
+    samplingMode = "sampling"
+
+    __name: str = "blind"
+    __directory = Path("./profiles")
+    # re-entrant, the signal handlers may run while the main thread holds it
+    __lock = threading.RLock()
+    __active = None
+    __activeMode: str = None
+
+    @classmethod
+    def __outputPath(cls, _kind: str, _suffix: str) -> Path:
+        cls.__directory.mkdir(exist_ok=True)
+        return cls.__directory / f"{cls.__name}-{_kind}-{os.getpid()}-{strftime('%Y%m%d-%H%M%S')}.{_suffix}"
+
+    @classmethod
+    def isRunning(cls) -> bool:
+        return cls.__active is not None
+
+    @classmethod
+    def start(cls, _mode: str = None) -> str:
+        """
+        cProfile only sees the thread that starts it, use sampling for threaded entry points
+        """
+        _mode = _mode or os.environ.get("BLIND_PROFILER", cls.samplingMode)
+
+        with cls.__lock:
+            if cls.__active is not None:
+                return f"already running {cls.__activeMode}"
+
+            if _mode == cls.cProfileMode:
+                cls.__active = cProfile.Profile()
+                cls.__active.enable()
+            else:
+                _mode = cls.samplingMode
+                cls.__active = SamplingProfiler()
+                cls.__active.start()
+
+            cls.__activeMode = _mode
+            print(f"PROFILER: started {_mode}")
+            return f"started {_mode}"
+
+    @classmethod
+    def stop(cls) -> str:
+        """
+        Stop the running profiler and return where it was dumped
+        """
+        with cls.__lock:
+            if cls.__active is None:
+                return "not running"
+
+            if cls.__activeMode == cls.cProfileMode:
+                cls.__active.disable()
+                path = cls.__outputPath(cls.cProfileMode, "prof")
+                cls.__active.dump_stats(path)
+            else:
+                path = cls.__outputPath(cls.samplingMode, "folded")
+                cls.__active.stopAndDump(path)
+
+            cls.__active = None
+            cls.__activeMode = None
+            print(f"PROFILER: dumped to {path}")
+            return str(path)
+
+    @classmethod
+    def toggle(cls, _mode: str = None) -> str:
+        return cls.stop() if cls.isRunning() else cls.start(_mode)
+
+    @classmethod
+    def dumpTimings(cls) -> str:
+        path = cls.__outputPath("timings", "json")
+        with open(path, "w") as _file:
+            json.dump(Timings.snapshot(), _file, indent=2)
+        print(f"TIMINGS: dumped to {path}")
+        return str(path)
+
+    @classmethod
+    def install(cls, _name: str):
+        """
+        Entry points call this once at startup
+        - SIGUSR1 toggles the profiler, SIGUSR2 dumps the hot-path timings
+        """
+        cls.__name = _name
+        signal.signal(signal.SIGUSR1, lambda _signal, _frame: cls.toggle())
+        signal.signal(signal.SIGUSR2, lambda _signal, _frame: cls.dumpTimings())
+
+        if Timings.enabled:
+            print(f"PROFILING: hot-path timers enabled for {_name} (pid {os.getpid()})")
@@ -0,0 +1,182 @@
+import threading
+from abc import ABC, abstractmethod
+from timeit import default_timer as timer
+from typing import List, Tuple
+
+# names of the backends, as `motor.pwmBackend` in the config (see BlindConfig) and `--pwm-backend`
+rpiGpioBackend = "rpigpio"
+pigpioBackend = "pigpio"
+backendNames = (rpiGpioBackend, pigpioBackend)
+
+
+class PwmBackend(ABC):
+    """
+    What the motor controller needs from a PWM output
+    - duty cycles are percentages, i.e. 0 to 100
+    - the backend owns its pin, nothing else writes it
+    """
+    pin: int = None
+    frequency: float = None
+
+    # whether the output keeps running as it is while a new process takes the motor over (see HotUpgrade)
+    survivesHandoff: bool = False
+
+    @abstractmethod
+    def start(self, _dutyCycle: float):
+        pass
+
+    @abstractmethod
+    def changeDutyCycle(self, _dutyCycle: float):
+        pass
+
+    @abstractmethod
+    def stop(self):
+        pass
+
+    @abstractmethod
+    def repin(self, _pin: int):
+        """
+        Move the output to another pin, with no power on either, e.g. after a config change
+        """
+        pass
+
+
+class RpiGpioPwm(PwmBackend):
+    """
+    Software PWM from RPi.GPIO
+    - timed by a background thread in this process, so it uses CPU and jitters under load
+    - that thread can't be handed over, so neither can the motor (see HotUpgrade)
+    """
+
+    def __init__(self, _pin: int, _frequency: float):
+        from RPi import GPIO  # type: ignore
+        self.pin = _pin
+        self.frequency = _frequency
+        GPIO.setup(_pin, GPIO.OUT, initial=GPIO.LOW)
+        self.__pwm = GPIO.PWM(_pin, _frequency)
+
+    def start(self, _dutyCycle: float):
+        self.__pwm.start(_dutyCycle)
+
+    def changeDutyCycle(self, _dutyCycle: float):
+        self.__pwm.ChangeDutyCycle(_dutyCycle)
+
+    def stop(self):
+        self.__pwm.stop()
+
+    def repin(self, _pin: int):
+        from RPi import GPIO  # type: ignore
+        self.__pwm.stop()
+        self.pin = _pin
+        GPIO.setup(_pin, GPIO.OUT, initial=GPIO.LOW)
+        self.__pwm = GPIO.PWM(_pin, self.frequency)
+        self.__pwm.start(0)
+
+
+class PigpioPwm(PwmBackend):
+    """
+    PWM generated by the pigpio daemon
+    - on the hardware PWM pins (12, 13, 18, 19) the PWM peripheral is used
+    - on every other pin pigpio times the output with DMA
+    - either way no thread in this process is involved, and the output keeps running
+      if this process stops (until it's told otherwise)
+    """
+
+    survivesHandoff = True
+
+    __hardwarePwmPins = (12, 13, 18, 19)
+
+    # pigpio's hardware PWM duty cycle is in millionths
+    __hardwareDutyScale = 10_000
+
+    def __init__(self, _pi, _pin: int, _frequency: float):
+        import pigpio
+        self.pin = _pin
+        self.frequency = _frequency
+        self.__pi = _pi
+        self.__isHardware = _pin in self.__hardwarePwmPins
+
+        if not self.__isHardware:
+            _pi.set_mode(_pin, pigpio.OUTPUT)
+            _pi.set_PWM_frequency(_pin, int(_frequency))
+            # use percentages directly as the duty cycle range
+            _pi.set_PWM_range(_pin, 100)
+
+    def changeDutyCycle(self, _dutyCycle: float):
+        if self.__isHardware:
+            self.__pi.hardware_PWM(self.pin, int(self.frequency), int(_dutyCycle * self.__hardwareDutyScale))
+        else:
+            self.__pi.set_PWM_dutycycle(self.pin, round(_dutyCycle))
+
+    def start(self, _dutyCycle: float):
+        self.changeDutyCycle(_dutyCycle)
+
+    def stop(self):
+        self.changeDutyCycle(0)
+
+    def repin(self, _pin: int):
+        import pigpio
+        self.stop()
+        self.pin = _pin
+        self.__isHardware = _pin in self.__hardwarePwmPins
+
+        if not self.__isHardware:
+            self.__pi.set_mode(_pin, pigpio.OUTPUT)
+            self.__pi.set_PWM_frequency(_pin, int(self.frequency))
+            self.__pi.set_PWM_range(_pin, 100)
+        self.changeDutyCycle(0)
+
+
+def createPwmBackend(_name: str, _pin: int, _frequency: float) -> PwmBackend:
+    """
+    The backend by its name, see `backendNames`
+    - without a running pigpio daemon the motor still runs, on RPi.GPIO's software PWM
+    """
+    if _name == pigpioBackend:
+        import pigpio
+        pi = pigpio.pi()
+        if pi.connected:
+            return PigpioPwm(pi, _pin, _frequency)
+        print("PWM WARNING: the pigpio daemon is not running (start it with `sudo pigpiod`), using RPi.GPIO")
+
+    return RpiGpioPwm(_pin, _frequency)
+
+
+class SimulatedPwm(PwmBackend):
+    """
+    PWM stand-in for running off the Pi
+    - records every duty cycle change with a timestamp, so tests and benchmarks can
+      check when the motor was powered
+    """
+    dutyCycle: float = 0
+    isRunning: bool = False
+    history: List[Tuple[float, float]] = None
+
+    # nothing is driven, so the benchmarks can hand the motor over
+    survivesHandoff = True
+
+    def __init__(self, _pin: int = 0, _frequency: float = 50):
+        self.pin = _pin
+        self.frequency = _frequency
+        self.history = []
+        self.__lock = threading.Lock()
+
+    def __record(self, _dutyCycle: float):
+        with self.__lock:
+            self.dutyCycle = _dutyCycle
+            self.history.append((timer(), _dutyCycle))
+
+    def start(self, _dutyCycle: float):
+        self.isRunning = True
+        self.__record(_dutyCycle)
+
+    def changeDutyCycle(self, _dutyCycle: float):
+        self.__record(_dutyCycle)
+
+    def stop(self):
+        self.isRunning = False
+        self.__record(0)
+
+    def repin(self, _pin: int):
+        self.__record(0)
+        self.pin = _pin
@@ -0,0 +1,144 @@
+import argparse
+import statistics
+import threading
+from time import process_time, sleep
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional
+
+from PwmBackend import PwmBackend, SimulatedPwm
+
+"""
+Compare the PWM backends for the motor
+- CPU: process time used while the PWM runs at 50% with nothing else happening
+- jitter: spread of the output's period while other threads keep the Pi busy,
+  measured from pigpio edge callbacks on the PWM pin (needs the pigpio daemon)
+- call cost: how long a duty cycle change takes the caller
+
+Run on the Pi, e.g. `python PwmBenchmark.py --backends rpi pigpio --seconds 10 --load 4`
+Off the Pi only the simulated backend is available
+"""
+
+
+def busyLoad(_stop_event: threading.Event):
+    # keep the GIL busy, like a burst of network handler threads would
+    while not _stop_event.is_set():
+        sum(range(1000))
+
+
+def measureEdges(_pi, _pin: int, _seconds: float) -> List[int]:
+    """
+    Collect rising edge ticks (microseconds) on the pin
+    """
+    import pigpio
+    ticks: List[int] = []
+    _callback = _pi.callback(_pin, pigpio.RISING_EDGE, lambda _gpio, _level, _tick: ticks.append(_tick))
+    sleep(_seconds)
+    _callback.cancel()
+    return ticks
+
+
+def periodStatistics(_ticks: List[int], _frequency: float) -> Dict[str, float]:
+    import pigpio
+    periods = [pigpio.tickDiff(_first, _second) for _first, _second in zip(_ticks, _ticks[1:])]
+    if len(periods) < 2:
+        return {"periods": len(periods)}
+
+    expectedPeriod = 1_000_000 / _frequency
+    return {
+        "periods": len(periods),
+        "meanPeriodUs": statistics.fmean(periods),
+        "jitterStdevUs": statistics.stdev(periods),
+        "worstErrorUs": max(abs(_period - expectedPeriod) for _period in periods),
+    }
+
+
+def benchmarkBackend(
+        _name: str,
+        _makeBackend: Callable[[], PwmBackend],
+        _seconds: float,
+        _loadThreads: int,
+        _pi=None
+) -> Dict[str, float]:
+    backend = _makeBackend()
+    result: Dict[str, float] = {}
+
+    # cost of changing the duty cycle, as seen by the motor thread
+    backend.start(0)
+    _changes = 1000
+    startedAt = timer()
+    for _index in range(_changes):
+        backend.changeDutyCycle(_index % 100)
+    result["changeDutyCycleUs"] = (timer() - startedAt) / _changes * 1_000_000
+
+    # cpu used by this process just to keep the pwm running
+    backend.changeDutyCycle(50)
+    cpuAt, wallAt = process_time(), timer()
+    sleep(_seconds)
+    result["idleCpuPercent"] = (process_time() - cpuAt) / (timer() - wallAt) * 100
+
+    # output jitter while other threads compete for the cpu
+    if _pi is not None:
+        _stop_event = threading.Event()
+        loaders = [threading.Thread(target=busyLoad, args=(_stop_event,), daemon=True) for _ in range(_loadThreads)]
+        for _loader in loaders:
+            _loader.start()
+
+        result.update(periodStatistics(measureEdges(_pi, backend.pin, _seconds), backend.frequency))
+
+        _stop_event.set()
+        for _loader in loaders:
+            _loader.join()
+
+    backend.stop()
+    print(f"{_name}: {result}")
+    return result
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare PWM backends for the blind motor")
+    parser.add_argument("--backends", nargs="+", default=["simulated"], choices=["simulated", "rpi", "pigpio"])
+    parser.add_argument("--pin", type=int, default=22)
+    parser.add_argument("--frequency", type=float, default=50)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--load", type=int, default=4, help="busy threads while measuring jitter")
+    arguments = parser.parse_args(_arguments)
+
+    pi = None
+    if "rpi" in arguments.backends or "pigpio" in arguments.backends:
+        import pigpio
+        pi = pigpio.pi()
+
+    makers: Dict[str, Callable[[], PwmBackend]] = {
+        "simulated": lambda: SimulatedPwm(arguments.pin, arguments.frequency),
+    }
+    if "rpi" in arguments.backends:
+        from RPi import GPIO  # type: ignore
+        from PwmBackend import RpiGpioPwm
+        GPIO.setmode(GPIO.BCM)
+        makers["rpi"] = lambda: RpiGpioPwm(arguments.pin, arguments.frequency)
+    if "pigpio" in arguments.backends:
+        from PwmBackend import PigpioPwm
+        makers["pigpio"] = lambda: PigpioPwm(pi, arguments.pin, arguments.frequency)
+
+    results = {}
+    for _name in arguments.backends:
+        results[_name] = benchmarkBackend(
+            _name,
+            makers[_name],
+            arguments.seconds,
+            arguments.load,
+            # the simulated backend has no real output to measure
+            _pi=pi if _name != "simulated" else None
+        )
+
+    if "rpi" in arguments.backends:
+        from RPi import GPIO  # type: ignore
+        GPIO.cleanup()
+    if pi is not None:
+        pi.stop()
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import io
+import os
+import socket
+import tempfile
+import threading
+from pathlib import Path
+from time import sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+import MotorConnection
+import SimulatedHardware
+from LocalRelay import LocalRelay
+from RelayConnector import RelayConnector
+
+"""
+Round trips through the relay connection, and how it recovers, offline
+- a MotorListener on simulated hardware, a RelayConnector next to it, and the LocalRelay stand-in
+- round trip: "status" commands from the relay, one at a time and many in flight at once (multiplexed),
+  against a new TCP connection per command straight to the MotorListener (what every click costs now,
+  before the internet and the tunnel are added)
+- state push: from a command leaving the relay to the relay holding the blind's new state
+- reconnects: connections dropped by the relay, a relay that hangs (found by the heartbeat),
+  and a relay that is down for a while, with how long until the connector is back
+
+Run e.g. `python RelayBenchmark.py --commands 500 --concurrency 8 --drops 5 --outage 3`
+"""
+
+node = "benchmark"
+
+
+def percentiles(_latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(_latencies)
+    if not latencies:
+        return {}
+    return {
+        "count": len(latencies),
+        "p50Ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p90Ms": round(latencies[int(len(latencies) * 0.9)] * 1000, 3),
+        "p99Ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        "maxMs": round(latencies[-1] * 1000, 3),
+    }
+
+
+def benchmarkDirect(_port: int, _commands: int) -> Dict:
+    latencies = []
+    for _ in range(_commands):
+        startedAt = timer()
+        connection = MotorConnection.openTcpConnection("127.0.0.1", _port, _timeout=5)
+        connection.sendall(b"status")
+        connection.recv(1024)
+        connection.close()
+        latencies.append(timer() - startedAt)
+    return percentiles(latencies)
+
+
+def benchmarkRelay(_relay: LocalRelay, _commands: int, _concurrency: int) -> Dict:
+    latencies: List[float] = []
+    failures = [0]
+
+    def send(_count: int):
+        for _ in range(_count):
+            startedAt = timer()
+            reply = _relay.command(node, "status")
+            if reply is None:
+                failures[0] += 1
+            else:
+                latencies.append(timer() - startedAt)
+
+    startedAt = timer()
+    senders = [
+        threading.Thread(target=send, args=(_commands // _concurrency,), daemon=True) for _ in range(_concurrency)
+    ]
+    for _sender in senders:
+        _sender.start()
+    for _sender in senders:
+        _sender.join()
+    seconds = timer() - startedAt
+
+    return {
+        "concurrency": _concurrency,
+        "commandsPerSecond": round(len(latencies) / seconds) if seconds else 0,
+        "failures": failures[0],
+        **percentiles(latencies),
+    }
+
+
+def benchmarkStatePush(_relay: LocalRelay, _instructions: List[str]) -> Dict:
+    """
+    From sending each instruction to the relay holding a state with it
+    """
+    latencies = []
+    for _instruction in _instructions:
+        startedAt = timer()
+        _relay.command(node, _instruction)
+        if _relay.waitFor(lambda: (_relay.state(node) or {}).get("instruction") == _instruction, 10):
+            latencies.append(timer() - startedAt)
+        # past the MotorListener's reversal dwell, so the next one isn't held back
+        sleep(2)
+    return {"instructions": len(_instructions), **percentiles(latencies)}
+
+
+def benchmarkDrops(_relay: LocalRelay, _drops: int) -> Dict:
+    latencies = []
+    for _ in range(_drops):
+        _relay.dropConnections()
+        droppedAt = timer()
+        # the old session is gone once the connector's reader sees the drop
+        _relay.waitFor(lambda: node not in _relay.nodes(), 5)
+        if _relay.waitForConnector(node, 30):
+            latencies.append(timer() - droppedAt)
+        # stay up long enough for the backoff to reset
+        sleep(0.5)
+    return {"drops": _drops, **percentiles(latencies)}
+
+
+def benchmarkHang(_relay: LocalRelay, _connector: RelayConnector, _deadAfterInSeconds: float) -> Dict:
+    disconnects = _connector.disconnects
+    hungAt = timer()
+    _relay.mute(_deadAfterInSeconds * 2)
+
+    while _connector.disconnects == disconnects and timer() - hungAt < _deadAfterInSeconds * 4:
+        sleep(0.01)
+    noticedAfter = timer() - hungAt
+    return {
+        "deadAfterSeconds": _deadAfterInSeconds,
+        "noticedAfterSeconds": round(noticedAfter, 3),
+        "reason": _connector.lastDisconnectReason,
+    }
+
+
+def benchmarkOutage(_relay: LocalRelay, _connector: RelayConnector, _outageInSeconds: float, _deadAfter: float):
+    """
+    Stop the relay for a while, then start a new one on the same port, returns the new relay and the results
+    """
+    port = _relay.port()
+    failuresBefore = _connector.connectFailures
+    _relay.cleanup()
+    sleep(_outageInSeconds)
+
+    relay = LocalRelay(_port=port, _deadAfterInSeconds=_deadAfter)
+    relay.start()
+    upAt = timer()
+    reconnected = relay.waitForConnector(node, 60)
+    return relay, {
+        "outageSeconds": _outageInSeconds,
+        "reconnectedAfterRelayUpSeconds": round(timer() - upAt, 3) if reconnected else None,
+        "failedConnectAttempts": _connector.connectFailures - failuresBefore,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Round trips and reconnects of the relay connection, offline")
+    parser.add_argument("--commands", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--drops", type=int, default=5)
+    parser.add_argument("--outage", type=float, default=3, help="seconds the relay is down")
+    parser.add_argument("--heartbeat", type=float, default=0.5, help="seconds between pings")
+    parser.add_argument("--backoff-cap", type=float, default=2)
+    arguments = parser.parse_args(_arguments)
+
+    directory = tempfile.TemporaryDirectory()
+    workingDirectory = os.getcwd()
+    unixSocketPath = str(Path(directory.name) / "listener.sock")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        listenerPort = probe.getsockname()[1]
+    deadAfter = arguments.heartbeat * 3
+
+    results = {}
+    # the services print a lot, which isn't worth reading here
+    with contextlib.redirect_stdout(io.StringIO()):
+        listener, listenerThread = SimulatedHardware.startSimulatedMotorListener(
+            directory.name,
+            _host="127.0.0.1",
+            _port=listenerPort,
+            _unixSocketPath=unixSocketPath,
+            _auditFileName=None,
+            _configFileName=None,
+            _telemetryPort=None,
+            _requestsPerSecondPerClient=10_000,
+            _burstPerClient=10_000
+        )
+        relay = LocalRelay(_port=0, _deadAfterInSeconds=deadAfter)
+        relay.start()
+        connector = RelayConnector(
+            _relayHost="127.0.0.1",
+            _relayPort=relay.port(),
+            _node=node,
+            _motorHost="127.0.0.1",
+            _motorPort=listenerPort,
+            _unixSocketPath=unixSocketPath,
+            _forwarderThreads=arguments.concurrency,
+            _heartbeatInSeconds=arguments.heartbeat,
+            _deadAfterInSeconds=deadAfter,
+            _backoffBaseInSeconds=0.1,
+            _backoffCapInSeconds=arguments.backoff_cap,
+            _stableAfterInSeconds=0.2
+        )
+        connector.start()
+
+        try:
+            if not relay.waitForConnector(node, 10):
+                raise RuntimeError("the connector never connected to the relay")
+
+            results["directTcp"] = benchmarkDirect(listenerPort, arguments.commands)
+            results["relaySerial"] = benchmarkRelay(relay, arguments.commands, 1)
+            results["relayMultiplexed"] = benchmarkRelay(relay, arguments.commands, arguments.concurrency)
+            results["statePush"] = benchmarkStatePush(relay, ["down", "stop", "up", "stop"])
+            results["heartbeatRoundTripMs"] = connector.lastRoundTripMs
+            results["drops"] = benchmarkDrops(relay, arguments.drops)
+            results["hang"] = benchmarkHang(relay, connector, deadAfter)
+            relay.waitForConnector(node, 30)
+            relay, results["outage"] = benchmarkOutage(relay, connector, arguments.outage, deadAfter)
+            results["connector"] = connector.counters()
+        finally:
+            connector.cleanup()
+            relay.cleanup()
+            listener.shutdown()
+            listenerThread.join()
+
+    os.chdir(workingDirectory)
+    directory.cleanup()
+
+    print("### RELAY BENCHMARK ###")
+    for _name, _result in results.items():
+        print(f"{_name}: {_result}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+import argparse
+import json
+import queue
+import random
+import socket
+import ssl
+import struct
+import threading
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+import MotorConnection
+from Profiling import Profiler, Timings
+
+"""
+One long-lived outbound connection from the Pi to a relay, instead of an inbound HTTP request per click
+- the connector dials out (no tunnel or open port needed), says hello with its node name, and keeps the connection:
+  the relay sends commands over it, and the connector sends back the MotorListener's replies and state updates
+- frames are a 4 byte big-endian length and a JSON object with a "type", every command carries an id,
+  so several can be in flight at once and replies can come back in any order
+- commands go to the MotorListener like any other producer's (with the web remote's request id, so a retried
+  click still only acts once), on a few forwarding threads, so a slow command never holds up the connection
+- the connector pings every `_heartbeatInSeconds`, and gives up on a connection that has been silent
+  for `_deadAfterInSeconds` (the relay answers pings, and gives up on a silent connector the same way)
+- reconnecting backs off exponentially with full jitter, so a relay coming back isn't hit by every Pi at once,
+  the backoff only resets after a connection stayed up for `_stableAfterInSeconds`
+- state ("state" command of the MotorListener) is polled every `_statePollInSeconds`, and pushed to the relay
+  whenever it changed, it's polled straight after a command, then more often while the blind moves
+  and for `_afterCommandInSeconds` (the MotorListener may hold a reversal back for a moment)
+  - the MotorListener doesn't rate-limit read-only queries from the Pi itself, so polls never use up the budget
+    of commands, the relay's commands have a budget of their own (it names itself "relay", see MotorConnection)
+
+Frames
+- connector: hello {node, token, version}, reply {id, reply}, state {state}, ping {at}, pong {at}
+- relay: welcome, refused {reason}, command {id, instruction, requestId}, ping {at}, pong {at}
+
+Run e.g. `python RelayConnector.py --relay relay.example.org:7000 --node living-room --tls`
+(`python LocalRelay.py` is a relay stand-in to run it against offline)
+"""
+
+defaultRelayPort = 7000
+protocolVersion = 1
+
+frameHeader = struct.Struct(">I")
+maxFrameSize = 1 << 16
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encodeFrame(_message: Dict) -> bytes:
+    body = json.dumps(_message, separators=(",", ":")).encode()
+    if len(body) > maxFrameSize:
+        raise FrameError(f"a frame carries up to {maxFrameSize} bytes, not {len(body)}")
+    return frameHeader.pack(len(body)) + body
+
+
+class FrameReader:
+    """
+    Cuts the bytes read from a connection into messages, a frame can arrive in any number of pieces
+    """
+    __buffer: bytearray = None
+
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, _data: bytes) -> List[Dict]:
+        self.__buffer += _data
+        messages = []
+        offset = 0
+        while len(self.__buffer) - offset >= frameHeader.size:
+            size = frameHeader.unpack_from(self.__buffer, offset)[0]
+            if size > maxFrameSize:
+                raise FrameError(f"frame of {size} bytes is too big")
+            end = offset + frameHeader.size + size
+            if len(self.__buffer) < end:
+                break
+
+            try:
+                message = json.loads(self.__buffer[offset + frameHeader.size:end])
+            except ValueError as error:
+                raise FrameError(f"frame is not valid json: {error}")
+            if not isinstance(message, dict) or "type" not in message:
+                raise FrameError("a frame must be a json object with a type")
+            messages.append(message)
+            offset = end
+
+        del self.__buffer[:offset]
+        return messages
+
+
+def receiveMessage(_connection: socket.socket, _reader: FrameReader, _timeoutInSeconds: float) -> Dict:
+    """
+    The next message on a connection that has nothing else going on yet, e.g. the reply to a hello
+    """
+    _connection.settimeout(_timeoutInSeconds)
+    while True:
+        data = _connection.recv(4096)
+        if not data:
+            raise ConnectionResetError("connection closed before a reply")
+        messages = _reader.feed(data)
+        if messages:
+            return messages[0]
+
+
+class RelayConnector(threading.Thread):
+    """
+    Runs next to the MotorListener, stop it with `cleanup()`
+    """
+    __relayHost: str = None
+    __relayPort: int = None
+    __node: str = None
+    __token: Optional[str] = None
+    __useTls: bool = False
+
+    __motorHost: str = None
+    __motorPort: int = None
+    __unixSocketPath: Optional[str] = None
+    __motorTimeoutInSeconds: float = 5
+
+    __heartbeatInSeconds: float = None
+    __deadAfterInSeconds: float = None
+    __backoffBaseInSeconds: float = None
+    __backoffCapInSeconds: float = None
+    __stableAfterInSeconds: float = None
+    __statePollInSeconds: float = None
+    __movingStatePollInSeconds: float = None
+    __afterCommandInSeconds: float = None
+    __connectTimeoutInSeconds: float = 5
+    __tickInSeconds: float = 0.05
+
+    # commands waiting for a forwarding thread, None stops one
+    __commands: queue.Queue = None
+    __forwarders: List[threading.Thread] = None
+
+    __connection: Optional[socket.socket] = None
+    __sendLock: threading.Lock = None
+    __lastState: Optional[Dict] = None
+    __nextStatePollAt: float = 0.0
+    __fastPollUntil: float = 0.0
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    connects: int = 0
+    connectFailures: int = 0
+    disconnects: int = 0
+    lastDisconnectReason: Optional[str] = None
+    commands: int = 0
+    repliesLost: int = 0
+    statePolls: int = 0
+    statePushes: int = 0
+    pingsSent: int = 0
+    lastRoundTripMs: Optional[float] = None
+
+    def __init__(
+            self,
+            _relayHost: str,
+            _relayPort: int = defaultRelayPort,
+            _node: Optional[str] = None,
+            _token: Optional[str] = None,
+            _useTls: bool = False,
+            _motorHost: str = "localhost",
+            _motorPort: int = MotorConnection.defaultPort,
+            _unixSocketPath: Optional[str] = MotorConnection.defaultUnixSocketPath,
+            _forwarderThreads: int = 4,
+            _heartbeatInSeconds: float = 10,
+            _deadAfterInSeconds: float = 30,
+            _backoffBaseInSeconds: float = 0.5,
+            _backoffCapInSeconds: float = 30,
+            _stableAfterInSeconds: float = 10,
+            _statePollInSeconds: float = 5,
+            _movingStatePollInSeconds: float = 1,
+            _afterCommandInSeconds: float = 5
+    ):
+        super().__init__(daemon=True, name="relay-connector")
+        self.__relayHost = _relayHost
+        self.__relayPort = _relayPort
+        self.__node = _node if _node is not None else socket.gethostname()
+        self.__token = _token
+        self.__useTls = _useTls
+        self.__motorHost = _motorHost
+        self.__motorPort = _motorPort
+        self.__unixSocketPath = _unixSocketPath
+        self.__heartbeatInSeconds = _heartbeatInSeconds
+        self.__deadAfterInSeconds = _deadAfterInSeconds
+        self.__backoffBaseInSeconds = _backoffBaseInSeconds
+        self.__backoffCapInSeconds = _backoffCapInSeconds
+        self.__stableAfterInSeconds = _stableAfterInSeconds
+        self.__statePollInSeconds = _statePollInSeconds
+        self.__movingStatePollInSeconds = _movingStatePollInSeconds
+        self.__afterCommandInSeconds = _afterCommandInSeconds
+
+        self.__commands = queue.Queue()
+        self.__sendLock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__forwarders = [
+            threading.Thread(target=self.__forwardCommands, name=f"relay-forwarder-{_index}", daemon=True)
+            for _index in range(_forwarderThreads)
+        ]
+
+    def isConnected(self) -> bool:
+        return self.__connection is not None
+
+    def backoffDelay(self, _attempt: int) -> float:
+        """
+        Full jitter: anywhere up to the exponentially growing ceiling
+        """
+        return random.uniform(0, min(self.__backoffCapInSeconds, self.__backoffBaseInSeconds * 2 ** _attempt))
+
+    def __connect(self) -> socket.socket:
+        connection = socket.create_connection((self.__relayHost, self.__relayPort), self.__connectTimeoutInSeconds)
+        try:
+            if self.__useTls:
+                connection = ssl.create_default_context().wrap_socket(connection, server_hostname=self.__relayHost)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            connection.sendall(encodeFrame({
+                "type": "hello", "node": self.__node, "token": self.__token, "version": protocolVersion
+            }))
+            reply = receiveMessage(connection, FrameReader(), self.__connectTimeoutInSeconds)
+            if reply["type"] != "welcome":
+                raise ConnectionRefusedError(f"relay refused the connector: {reply.get('reason')}")
+        except (OSError, FrameError):
+            connection.close()
+            raise
+
+        connection.settimeout(self.__tickInSeconds)
+        return connection
+
+    def __send(self, _message: Dict) -> bool:
+        """
+        False when there is no connection to send on, the relay times out whatever it was waiting for
+        """
+        connection = self.__connection
+        if connection is None:
+            return False
+        try:
+            with self.__sendLock:
+                connection.sendall(encodeFrame(_message))
+            return True
+        except OSError as error:
+            print(f'RELAY CONNECTOR: could not send {error=}')
+            return False
+
+    def __serve(self, _connection: socket.socket) -> str:
+        """
+        Read and answer the relay until the connection is lost, returns why it was lost
+        """
+        reader = FrameReader()
+        now = timer()
+        lastReceivedAt = now
+        nextPingAt = now + self.__heartbeatInSeconds
+
+        # the relay knows nothing about this blind yet
+        self.__lastState = None
+        self.__nextStatePollAt = now
+
+        while not self.__stop_event.is_set():
+            try:
+                data = _connection.recv(maxFrameSize)
+                if not data:
+                    return "closed by relay"
+            except socket.timeout:
+                data = None
+            except OSError as error:
+                return f"{error=}"
+
+            now = timer()
+            if data:
+                lastReceivedAt = now
+                try:
+                    messages = reader.feed(data)
+                except FrameError as error:
+                    return f"{error=}"
+                for _message in messages:
+                    self.__handle(_message)
+
+            if now - lastReceivedAt > self.__deadAfterInSeconds:
+                return "relay went silent"
+            if now >= nextPingAt:
+                self.pingsSent += 1
+                self.__send({"type": "ping", "at": now})
+                nextPingAt = now + self.__heartbeatInSeconds
+            if now >= self.__nextStatePollAt:
+                self.__pushState()
+
+        return "stopped"
+
+    def __handle(self, _message: Dict):
+        kind = _message["type"]
+        if kind == "command":
+            self.commands += 1
+            self.__commands.put((_message.get("id"), str(_message.get("instruction", "")), _message.get("requestId")))
+        elif kind == "ping":
+            self.__send({"type": "pong", "at": _message.get("at")})
+        elif kind == "pong" and isinstance(_message.get("at"), float):
+            self.lastRoundTripMs = round((timer() - _message["at"]) * 1000, 3)
+        # anything else is from a newer relay, and can be ignored
+
+    def __forwardCommands(self):
+        while True:
+            command = self.__commands.get()
+            if command is None:
+                return
+
+            commandId, instruction, requestId = command
+            with Timings.block("relay.command"):
+                reply = self.__askMotorListener(instruction, requestId)
+            if not self.__send({"type": "reply", "id": commandId, "reply": reply}):
+                self.repliesLost += 1
+
+            # the state is about to change, let the relay know soon
+            now = timer()
+            self.__fastPollUntil = now + self.__afterCommandInSeconds
+            self.__nextStatePollAt = min(self.__nextStatePollAt, now + 0.05)
+
+    def __askMotorListener(self, _instruction: str, _requestId: Optional[str] = None) -> str:
+        message = MotorConnection.commandMessage(_instruction, _producer="relay", _requestId=_requestId)
+        try:
+            connection = MotorConnection.openMotorListenerConnection(
+                self.__motorHost, self.__motorPort, self.__unixSocketPath, self.__motorTimeoutInSeconds
+            )
+        except OSError as error:
+            print(f'RELAY CONNECTOR: MotorListener unavailable {error=}')
+            return 'HTTP/1.1 "503 Service Unavailable"'
+
+        try:
+            connection.sendall(message.encode())
+            # the listener closes the connection after its reply, which can be longer than one read (e.g. schedules)
+            chunks = []
+            while True:
+                chunk = connection.recv(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return b"".join(chunks).decode()
+        except OSError as error:
+            print(f'RELAY CONNECTOR: no reply from MotorListener {error=}')
+            return 'HTTP/1.1 "503 Service Unavailable"'
+        finally:
+            connection.close()
+
+    def __pushState(self):
+        self.statePolls += 1
+        reply = self.__askMotorListener("state")
+        try:
+            state = json.loads(reply)
+        except ValueError:
+            # e.g. rate limited, try again at the idle pace
+            state = None
+
+        now = timer()
+        moving = isinstance(state, dict) and state.get("moving")
+        self.__nextStatePollAt = now + (
+            self.__movingStatePollInSeconds if moving or now < self.__fastPollUntil else self.__statePollInSeconds
+        )
+        if isinstance(state, dict) and state != self.__lastState:
+            if self.__send({"type": "state", "state": state}):
+                self.__lastState = state
+                self.statePushes += 1
+
+    def run(self):
+        print(f" $$$$$$$$ RUNNING RELAY CONNECTOR ({self.__node} -> {self.__relayHost}:{self.__relayPort}) $$$$$$$$")
+        for _forwarder in self.__forwarders:
+            _forwarder.start()
+
+        attempt = 0
+        while not self.__stop_event.is_set():
+            try:
+                connection = self.__connect()
+            except (OSError, FrameError) as error:
+                self.connectFailures += 1
+                delay = self.backoffDelay(attempt)
+                attempt += 1
+                print(f'RELAY CONNECTOR: could not connect, next try in {delay:.1f}s {error=}')
+                self.__stop_event.wait(delay)
+                continue
+
+            self.connects += 1
+            connectedAt = timer()
+            print("RELAY CONNECTOR: connected")
+            self.__connection = connection
+            reason = self.__serve(connection)
+            with self.__sendLock:
+                self.__connection = None
+                connection.close()
+
+            if self.__stop_event.is_set():
+                break
+            self.disconnects += 1
+            self.lastDisconnectReason = reason
+
+            # a connection that keeps dropping straight away still backs off
+            if timer() - connectedAt >= self.__stableAfterInSeconds:
+                attempt = 0
+            delay = self.backoffDelay(attempt)
+            attempt += 1
+            print(f'RELAY CONNECTOR: disconnected ({reason}), reconnecting in {delay:.1f}s')
+            self.__stop_event.wait(delay)
+
+    def counters(self) -> Dict:
+        return {
+            "connected": self.isConnected(),
+            "connects": self.connects,
+            "connectFailures": self.connectFailures,
+            "disconnects": self.disconnects,
+            "lastDisconnectReason": self.lastDisconnectReason,
+            "commands": self.commands,
+            "repliesLost": self.repliesLost,
+            "statePolls": self.statePolls,
+            "statePushes": self.statePushes,
+            "pingsSent": self.pingsSent,
+            "lastRoundTripMs": self.lastRoundTripMs,
+        }
+
+    def cleanup(self):
+        print(f"RELAY CONNECTOR CLEANUP: {self.counters()}")
+        self.__stop_event.set()
+        for _ in self.__forwarders:
+            self.__commands.put(None)
+        if self.is_alive():
+            self.join()
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Keep a connection to the relay for the web remote")
+    parser.add_argument("--relay", required=True, help="host:port of the relay")
+    parser.add_argument("--node", default=socket.gethostname(), help="name the relay knows this blind by")
+    parser.add_argument("--token", help="shared secret the relay expects in the hello")
+    parser.add_argument("--tls", action="store_true", help="connect to the relay over TLS")
+    parser.add_argument("--motor-host", default="localhost")
+    parser.add_argument("--motor-port", type=int, default=MotorConnection.defaultPort)
+    parser.add_argument("--heartbeat", type=float, default=10, help="seconds between pings")
+    arguments = parser.parse_args(_arguments)
+
+    relayHost, _, relayPort = arguments.relay.rpartition(":")
+    Profiler.install("relay-connector")
+    connector = RelayConnector(
+        _relayHost=relayHost,
+        _relayPort=int(relayPort),
+        _node=arguments.node,
+        _token=arguments.token,
+        _useTls=arguments.tls,
+        _motorHost=arguments.motor_host,
+        _motorPort=arguments.motor_port,
+        _heartbeatInSeconds=arguments.heartbeat,
+        _deadAfterInSeconds=arguments.heartbeat * 3
+    )
+    connector.start()
+    try:
+        while connector.is_alive():
+            connector.join(timeout=1)
+    except KeyboardInterrupt:
+        connector.cleanup()
+
+
+if __name__ == "__main__":
+    main()
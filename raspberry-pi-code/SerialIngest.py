@@ -0,0 +1,307 @@
+import argparse
+import glob
+import os
+import selectors
+import termios
+import threading
+import tty
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Profiling import Timings
+
+"""
+Readings from many serial light sensors (one arduino per window) on one thread
+- every device matching the patterns is opened non-blocking, in raw mode, and waited on with one selector (epoll)
+- a wake-up reads whatever a device has in one `os.readv()` into that device's own buffer, reused for every read,
+  and parses every complete line in it, a partial line stays at the front of the buffer for the next read
+- the first line after opening is dropped, it's most likely the end of a line the arduino started earlier
+- devices are hot-plugged: the patterns are globbed again every `_rescanInSeconds`, a device that appeared
+  is opened, one that vanished (or whose reads fail, e.g. unplugged) is closed
+- `_onReadings(path, readings, now)` gets all of one device's readings of a wake-up at once, in order
+
+Run e.g. `python SerialIngest.py --patterns "/dev/ttyACM*" "/dev/ttyUSB*"`
+(`python SerialIngestBenchmark.py` compares it with a blocking thread per device, on pseudo-terminals)
+"""
+
+defaultPatterns = ("/dev/ttyACM*",)
+
+
+def configureRaw(_fd: int, _baud: int):
+    """
+    Raw mode (no echo, no line editing) at the baud rate, like pyserial does when it opens a port
+    """
+    tty.setraw(_fd)
+    attributes = termios.tcgetattr(_fd)
+    speed = getattr(termios, f"B{_baud}")
+    attributes[4] = attributes[5] = speed
+    termios.tcsetattr(_fd, termios.TCSANOW, attributes)
+
+
+class SerialPort:
+    """
+    One open device, and the line it's in the middle of
+    """
+    path: str = None
+    fd: int = None
+    buffer: bytearray = None
+    view: memoryview = None
+    fill: int = 0
+    synced: bool = False
+
+    # counters for tuning
+    bytesRead: int = 0
+    lines: int = 0
+    malformed: int = 0
+    overflows: int = 0
+
+    def __init__(self, _path: str, _baud: int, _bufferSize: int):
+        self.path = _path
+        self.fd = os.open(_path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            configureRaw(self.fd, _baud)
+        except (termios.error, AttributeError, OSError):
+            os.close(self.fd)
+            raise
+        self.buffer = bytearray(_bufferSize)
+        self.view = memoryview(self.buffer)
+
+    def readings(self) -> Optional[List[float]]:
+        """
+        The readings of every line completed since the last call, None when the device is gone
+        """
+        try:
+            count = os.readv(self.fd, [self.view[self.fill:]])
+        except BlockingIOError:
+            return []
+        except OSError:
+            return None
+        if count == 0:
+            # hung up
+            return None
+
+        self.bytesRead += count
+        total = self.fill + count
+        end = self.buffer.rfind(b"\n", 0, total)
+        if end < 0:
+            if total == len(self.buffer):
+                # no line is this long, start again from the next one
+                self.overflows += 1
+                self.fill = 0
+                self.synced = False
+            else:
+                self.fill = total
+            return []
+
+        lines = self.buffer[:end].split(b"\n")
+        if not self.synced:
+            lines = lines[1:]
+            self.synced = True
+
+        readings = []
+        for _line in lines:
+            try:
+                readings.append(float(_line))
+            except ValueError:
+                if _line.strip():
+                    self.malformed += 1
+        self.lines += len(readings)
+
+        # keep the partial line for the next read
+        rest = total - end - 1
+        self.view[:rest] = self.view[end + 1:total]
+        self.fill = rest
+        return readings
+
+    def close(self):
+        self.view.release()
+        os.close(self.fd)
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "bytesRead": self.bytesRead,
+            "lines": self.lines,
+            "malformed": self.malformed,
+            "overflows": self.overflows,
+        }
+
+
+class SerialIngest(threading.Thread):
+    """
+    Caller passes `_onReadings`, which runs on this thread, and stops it with `cleanup()`
+    - or calls `poll()` itself, instead of starting the thread
+    """
+    __patterns: List[str] = None
+    __baud: int = None
+    __bufferSize: int = None
+    __rescanInSeconds: float = None
+    __onReadings: Callable[[str, List[float], float], None] = None
+
+    __selector: selectors.BaseSelector = None
+    __ports: Dict[str, SerialPort] = None
+    # devices that failed to open (e.g. busy, or no permission) are only tried again a few rescans later
+    __failedUntil: Dict[str, float] = None
+    __nextRescanAt: float = 0.0
+    __latest: Dict[str, Tuple[float, float]] = None
+    __stop_event: threading.Event = None
+
+    # counters for tuning
+    wakeups: int = 0
+    rescans: int = 0
+    devicesAdded: int = 0
+    devicesRemoved: int = 0
+    openFailures: int = 0
+
+    def __init__(
+            self,
+            _onReadings: Optional[Callable[[str, List[float], float], None]] = None,
+            _patterns: Tuple[str, ...] = defaultPatterns,
+            _baud: int = 9600,
+            _bufferSize: int = 4096,
+            _rescanInSeconds: float = 2
+    ):
+        super().__init__(daemon=True, name="serial-ingest")
+        self.__onReadings = _onReadings
+        self.__patterns = list(_patterns)
+        self.__baud = _baud
+        self.__bufferSize = _bufferSize
+        self.__rescanInSeconds = _rescanInSeconds
+        self.__selector = selectors.DefaultSelector()
+        self.__ports = {}
+        self.__failedUntil = {}
+        self.__latest = {}
+        self.__stop_event = threading.Event()
+
+    def devices(self) -> List[str]:
+        return sorted(self.__ports)
+
+    def latest(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Newest reading of every open device, and when it was read
+        """
+        return {_path: self.__latest[_path] for _path in self.__ports if _path in self.__latest}
+
+    def rescan(self, _now: Optional[float] = None):
+        now = timer() if _now is None else _now
+        self.rescans += 1
+        self.__nextRescanAt = now + self.__rescanInSeconds
+
+        found = set()
+        for _pattern in self.__patterns:
+            found.update(glob.glob(_pattern))
+
+        for _path in [_path for _path in self.__ports if _path not in found]:
+            self.__remove(_path, "vanished")
+        for _path in sorted(found - self.__ports.keys()):
+            if self.__failedUntil.get(_path, 0.0) > now:
+                continue
+            try:
+                port = SerialPort(_path, self.__baud, self.__bufferSize)
+            except (OSError, termios.error) as error:
+                self.openFailures += 1
+                self.__failedUntil[_path] = now + self.__rescanInSeconds * 5
+                print(f'SERIAL INGEST: could not open {_path} {error=}')
+                continue
+
+            self.__failedUntil.pop(_path, None)
+            self.__ports[_path] = port
+            self.__selector.register(port.fd, selectors.EVENT_READ, port)
+            self.devicesAdded += 1
+            print(f"SERIAL INGEST: added {_path}")
+
+    def __remove(self, _path: str, _reason: str):
+        port = self.__ports.pop(_path)
+        self.__selector.unregister(port.fd)
+        port.close()
+        self.__latest.pop(_path, None)
+        self.devicesRemoved += 1
+        print(f"SERIAL INGEST: removed {_path} ({_reason}) {port.counters()}")
+
+    def poll(self, _timeoutInSeconds: float) -> int:
+        """
+        Wait for readings (or the next rescan), and hand them on, returns how many there were
+        """
+        now = timer()
+        if now >= self.__nextRescanAt:
+            self.rescan(now)
+
+        timeout = max(0.0, min(_timeoutInSeconds, self.__nextRescanAt - now))
+        # with no devices open there's nothing to wait on but the next rescan
+        if not self.__ports:
+            self.__stop_event.wait(timeout)
+            return 0
+
+        events = self.__selector.select(timeout)
+        if not events:
+            return 0
+
+        with Timings.block("serial.wakeup"):
+            self.wakeups += 1
+            now = timer()
+            count = 0
+            for _key, _ in events:
+                port: SerialPort = _key.data
+                readings = port.readings()
+                if readings is None:
+                    self.__remove(port.path, "read failed")
+                    continue
+                if not readings:
+                    continue
+
+                count += len(readings)
+                self.__latest[port.path] = (readings[-1], now)
+                if self.__onReadings is not None:
+                    self.__onReadings(port.path, readings, now)
+            return count
+
+    def run(self):
+        print(f" $$$$$$$$ RUNNING SERIAL INGEST ({', '.join(self.__patterns)}) $$$$$$$$")
+        while not self.__stop_event.is_set():
+            self.poll(0.5)
+
+    def counters(self) -> Dict:
+        return {
+            "devices": len(self.__ports),
+            "wakeups": self.wakeups,
+            "rescans": self.rescans,
+            "devicesAdded": self.devicesAdded,
+            "devicesRemoved": self.devicesRemoved,
+            "openFailures": self.openFailures,
+            "ports": {_path: _port.counters() for _path, _port in self.__ports.items()},
+        }
+
+    def close(self):
+        for _path in list(self.__ports):
+            self.__remove(_path, "closed")
+        self.__selector.close()
+
+    def cleanup(self):
+        print(f"SERIAL INGEST CLEANUP: {self.counters()}")
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.close()
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Read every serial light sensor on one thread")
+    parser.add_argument("--patterns", nargs="+", default=list(defaultPatterns), help="globs of serial devices")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--rescan", type=float, default=2, help="seconds between looking for new devices")
+    parser.add_argument("--report", type=float, default=5, help="seconds between printing the latest readings")
+    arguments = parser.parse_args(_arguments)
+
+    ingest = SerialIngest(_patterns=tuple(arguments.patterns), _baud=arguments.baud, _rescanInSeconds=arguments.rescan)
+    try:
+        nextReportAt = timer() + arguments.report
+        while True:
+            ingest.poll(0.5)
+            if timer() >= nextReportAt:
+                nextReportAt += arguments.report
+                print(f"### LATEST ### {ingest.latest()}")
+    except KeyboardInterrupt:
+        ingest.close()
+
+
+if __name__ == "__main__":
+    main()
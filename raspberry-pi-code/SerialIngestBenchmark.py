@@ -0,0 +1,231 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+from pathlib import Path
+from time import process_time, sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+from SerialIngest import SerialIngest, configureRaw
+
+"""
+CPU cost of reading many serial light sensors, on pseudo-terminals standing in for the arduinos
+- a separate process writes to every pty at the arduino's pace: a reading per line, as fast as 9600 baud allows
+- epoll: one `SerialIngest` thread for all of them
+- threads: a blocking thread per device reading a byte at a time until the end of the line,
+  which is what `serial.Serial.readline()` does in `SerialLightSensorListener`
+- the cpu time of this process (not the writer's) per device count, and lines per second
+- hot-plug: ptys are unplugged and new ones plugged in while the epoll ingest runs,
+  with how long until it noticed
+
+Run e.g. `python SerialIngestBenchmark.py --devices 1 4 16 64 --seconds 5`
+"""
+
+# "401\r\n" at 9600 baud, 10 bits a byte
+defaultLinesPerSecond = 9600 / 10 / 5
+
+
+def writeReadings(_masters: List[int], _linesPerSecond: float, _seconds: float):
+    """
+    Every pty gets the same lines, a few at a time, at the rate
+    """
+    tick = 0.02
+    linesPerTick = max(1, round(_linesPerSecond * tick))
+    chunk = b"".join(b"%d\r\n" % (400 + _index % 7) for _index in range(linesPerTick))
+    startedAt = timer()
+    ticks = 0
+    while timer() - startedAt < _seconds:
+        for _master in _masters:
+            try:
+                os.write(_master, chunk)
+            except OSError:
+                # unplugged meanwhile
+                pass
+        ticks += 1
+        aheadBy = ticks * tick - (timer() - startedAt)
+        if aheadBy > 0:
+            sleep(aheadBy)
+
+
+def openPtys(_count: int, _directory: Path, _firstIndex: int = 0) -> List[Tuple[int, int, Path]]:
+    """
+    (master, slave, link) of new ptys, linked as `ttyBENCH<n>` in the directory, so a pattern finds them
+    """
+    ptys = []
+    for _index in range(_firstIndex, _firstIndex + _count):
+        master, slave = os.openpty()
+        # the writer never reads, so nothing must be echoed back
+        configureRaw(slave, 9600)
+        link = _directory / f"ttyBENCH{_index}"
+        link.symlink_to(os.ttyname(slave))
+        ptys.append((master, slave, link))
+    return ptys
+
+
+def closePtys(_ptys: List[Tuple[int, int, Path]]):
+    for _master, _slave, _link in _ptys:
+        _link.unlink(missing_ok=True)
+        os.close(_master)
+        os.close(_slave)
+
+
+def benchmarkEpoll(_ptys, _directory: Path, _linesPerSecond: float, _seconds: float) -> Dict:
+    lines = [0]
+
+    def counted(_path: str, _readings: List[float], _now: float):
+        lines[0] += len(_readings)
+
+    ingest = SerialIngest(counted, _patterns=(str(_directory / "ttyBENCH*"),), _rescanInSeconds=1)
+    ingest.rescan()
+    writer = multiprocessing.Process(
+        target=writeReadings, args=([_master for _master, _, _ in _ptys], _linesPerSecond, _seconds), daemon=True
+    )
+    writer.start()
+
+    cpuAt, wallAt = process_time(), timer()
+    while writer.is_alive():
+        ingest.poll(0.1)
+    # whatever is still buffered
+    while ingest.poll(0.05):
+        pass
+    cpuSeconds, wallSeconds = process_time() - cpuAt, timer() - wallAt
+
+    wakeups = ingest.wakeups
+    ingest.close()
+    return {
+        "mode": "epoll",
+        "devices": len(_ptys),
+        "linesPerSecond": round(lines[0] / wallSeconds),
+        "cpuPercent": round(cpuSeconds / wallSeconds * 100, 1),
+        "cpuUsPerLine": round(cpuSeconds / lines[0] * 1_000_000, 2) if lines[0] else 0.0,
+        "linesPerWakeup": round(lines[0] / wakeups, 1) if wakeups else 0.0,
+    }
+
+
+def benchmarkThreads(_ptys, _linesPerSecond: float, _seconds: float) -> Dict:
+    lines = [0] * len(_ptys)
+    stop_event = threading.Event()
+
+    def readLines(_index: int, _fd: int):
+        line = bytearray()
+        while not stop_event.is_set():
+            try:
+                byte = os.read(_fd, 1)
+            except OSError:
+                return
+            if byte == b"\n":
+                try:
+                    float(line)
+                    lines[_index] += 1
+                except ValueError:
+                    pass
+                line.clear()
+            else:
+                line += byte
+
+    # each thread gets its own blocking descriptor of the pty
+    fds = [os.open(os.ttyname(_slave), os.O_RDWR | os.O_NOCTTY) for _, _slave, _ in _ptys]
+    readers = [threading.Thread(target=readLines, args=(_index, _fd), daemon=True) for _index, _fd in enumerate(fds)]
+    for _reader in readers:
+        _reader.start()
+
+    writer = multiprocessing.Process(
+        target=writeReadings, args=([_master for _master, _, _ in _ptys], _linesPerSecond, _seconds), daemon=True
+    )
+    writer.start()
+    cpuAt, wallAt = process_time(), timer()
+    writer.join()
+    sleep(0.1)
+    cpuSeconds, wallSeconds = process_time() - cpuAt, timer() - wallAt
+
+    # unblock the readers with one last line each
+    stop_event.set()
+    for _master, _, _ in _ptys:
+        os.write(_master, b"\n")
+    for _reader in readers:
+        _reader.join(timeout=1)
+    for _fd in fds:
+        os.close(_fd)
+
+    total = sum(lines)
+    return {
+        "mode": "threads",
+        "devices": len(_ptys),
+        "linesPerSecond": round(total / wallSeconds),
+        "cpuPercent": round(cpuSeconds / wallSeconds * 100, 1),
+        "cpuUsPerLine": round(cpuSeconds / total * 1_000_000, 2) if total else 0.0,
+    }
+
+
+def benchmarkHotPlug(_directory: Path, _devices: int, _rounds: int, _rescanInSeconds: float) -> Dict:
+    ptys = openPtys(_devices, _directory)
+    ingest = SerialIngest(_patterns=(str(_directory / "ttyBENCH*"),), _rescanInSeconds=_rescanInSeconds)
+    ingest.rescan()
+
+    unplugged, plugged = [], []
+    nextIndex = _devices
+    for _ in range(_rounds):
+        # unplug one: the link goes and reads fail
+        gone = ptys.pop(0)
+        closePtys([gone])
+        startedAt = timer()
+        while str(gone[2]) in ingest.devices() and timer() - startedAt < 10:
+            ingest.poll(0.05)
+        unplugged.append(timer() - startedAt)
+
+        # plug in a new one
+        fresh = openPtys(1, _directory, nextIndex)
+        nextIndex += 1
+        ptys += fresh
+        startedAt = timer()
+        while str(fresh[0][2]) not in ingest.devices() and timer() - startedAt < 10:
+            ingest.poll(0.05)
+        plugged.append(timer() - startedAt)
+
+    result = {
+        "rescanSeconds": _rescanInSeconds,
+        "devicesAtEnd": len(ingest.devices()),
+        "meanUnplugNoticedSeconds": round(sum(unplugged) / len(unplugged), 3),
+        "meanPlugNoticedSeconds": round(sum(plugged) / len(plugged), 3),
+        "maxPlugNoticedSeconds": round(max(plugged), 3),
+    }
+    ingest.close()
+    closePtys(ptys)
+    return result
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="CPU of reading many serial light sensors, on pseudo-terminals")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=defaultLinesPerSecond, help="lines per second per device")
+    parser.add_argument("--modes", nargs="+", default=["epoll", "threads"], choices=["epoll", "threads"])
+    parser.add_argument("--hot-plug-rounds", type=int, default=5)
+    arguments = parser.parse_args(_arguments)
+
+    print("### SERIAL INGEST BENCHMARK ###")
+    results = []
+    with tempfile.TemporaryDirectory() as directoryName:
+        directory = Path(directoryName)
+        for _devices in arguments.devices:
+            for _mode in arguments.modes:
+                ptys = openPtys(_devices, directory)
+                if _mode == "epoll":
+                    result = benchmarkEpoll(ptys, directory, arguments.rate, arguments.seconds)
+                else:
+                    result = benchmarkThreads(ptys, arguments.rate, arguments.seconds)
+                closePtys(ptys)
+                print(result)
+                results.append(result)
+
+        if arguments.hot_plug_rounds:
+            result = benchmarkHotPlug(directory, 4, arguments.hot_plug_rounds, 1)
+            print(f"hot-plug: {result}")
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
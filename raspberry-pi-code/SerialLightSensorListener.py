@@ -1,7 +1,14 @@
 import socket
-from time import sleep
+from time import time
+from typing import Dict, Optional, Tuple
+from MotorConnection import commandMessage, openMotorListenerConnection
 import serial
-from Data import Command
+import BlindConfig
+from AdaptiveSampling import AdaptiveSampler, isUrgent
+from AuditLog import AuditLog
+from LightHysteresis import LightHysteresis
+from LightTrend import TrendPredictor
+from Profiling import Profiler, Timings
 
 
 class SerialLightSensorListener:
@@ -9,6 +16,19 @@ class SerialLightSensorListener:
     __tooBright: float = 700
     __tooDark: float = 100
 
+    # sample quickly near a boundary or while the light is changing, back off while it is steady
+    __sampler: AdaptiveSampler = None
+    __nearThresholdMargin: float = 30
+    __changeMargin: float = 15
+
+    # decides when to open and close the blind
+    __hysteresis: LightHysteresis = None
+
+    # closes the blind ahead of a crossing, when the light is clearly heading for it, None when disabled
+    # - off unless asked for with a lead time (`light.predictLeadInSeconds` in the config),
+    #   ThresholdTuner doesn't model early closes, so with it on the offline decisions no longer match the live ones
+    __trend: TrendPredictor = None
+
     # USB serial connection
     __serialDevice: serial.Serial = None
 
@@ -16,16 +36,39 @@ class SerialLightSensorListener:
     __port = 5000
     __host: str = None
 
+    # record every decision, with the reading behind it
+    __auditLog: AuditLog = None
+
+    # new config (see BlindConfig), applied between two readings
+    # - a new config also ends the wait for the next reading early
+    __pendingConfig: BlindConfig.PendingConfig = None
+
     def __init__(
             self,
             _closeBlindWhenBrighterThan=700,
             _closeBlindWhenDarkerThan=100,
             _usbDevicePort: str = '/dev/ttyACM0',
-            _baud: int = 9600, _timeout: int = 1
+            _baud: int = 9600, _timeout: int = 1,
+            _minimumSampleIntervalInSeconds: float = 0.25,
+            _maximumSampleIntervalInSeconds: float = 4,
+            _medianWindow: int = 1,
+            _predictLeadInSeconds: float = 0,
+            _predictMinimumConfidence: float = 16
     ):
         # track trigger boundaries for closing the blind
         self.__tooBright = _closeBlindWhenBrighterThan
         self.__tooDark = _closeBlindWhenDarkerThan
+        self.__hysteresis = LightHysteresis(self.__tooDark, self.__tooBright, _medianWindow)
+        if _predictLeadInSeconds > 0:
+            self.__trend = TrendPredictor(
+                self.__tooDark, self.__tooBright,
+                _leadInSeconds=_predictLeadInSeconds, _minimumConfidence=_predictMinimumConfidence
+            )
+        self.__sampler = AdaptiveSampler(
+            _name="light",
+            _minimumIntervalInSeconds=_minimumSampleIntervalInSeconds,
+            _maximumIntervalInSeconds=_maximumSampleIntervalInSeconds
+        )
 
         # receive serial light sensor data from arduino via USB
         self.__serialDevice: serial.Serial = serial.Serial(_usbDevicePort, _baud, timeout=_timeout)
@@ -33,25 +76,58 @@ class SerialLightSensorListener:
 
         # prepare network connection
         self.__host = socket.gethostname()
-        self.__connection = socket.socket()
-        self.__connection.connect((self.__host, self.__port))
+        self.__connection = openMotorListenerConnection(self.__host, self.__port)
+
+        self.__auditLog = AuditLog(_source="light")
+        self.__auditLog.start()
+
+        self.__pendingConfig = BlindConfig.PendingConfig()
+
+    def applyConfig(self, _config: Dict, _changedAt: float):
+        self.__pendingConfig.offer(_config, _changedAt)
+
+    def __applyPendingConfig(self):
+        config, changedAt = self.__pendingConfig.take()
+        light = config["light"]
+
+        self.__tooBright = light["closeBlindWhenBrighterThan"]
+        self.__tooDark = light["closeBlindWhenDarkerThan"]
+        self.__hysteresis.reconfigure(self.__tooDark, self.__tooBright, light["medianWindow"])
+
+        # a lead time of 0 turns predicting off, a predictor turned back on starts with no readings
+        if light["predictLeadInSeconds"] <= 0:
+            self.__trend = None
+        elif self.__trend is None:
+            self.__trend = TrendPredictor(
+                self.__tooDark, self.__tooBright,
+                _leadInSeconds=light["predictLeadInSeconds"], _minimumConfidence=light["predictMinimumConfidence"]
+            )
+        else:
+            self.__trend.reconfigure(
+                self.__tooDark, self.__tooBright, light["predictLeadInSeconds"], light["predictMinimumConfidence"]
+            )
+
+        self.__sampler.reconfigure(light["minimumSampleIntervalInSeconds"], light["maximumSampleIntervalInSeconds"])
+
+        BlindConfig.recordInEffect(changedAt)
+        print(f"LIGHT SENSOR: new config {light}")
 
     def run(self):
-        # track the latest state of the blind
-        tooDark_blindIsClosed = False
-        tooBright_blindIsClosed = False
+        previousLightReading = None
 
         try:
             while True:
-                # wait between readings
-                sleep(1)
+                # wait between readings, for longer while the light is steady
+                self.__pendingConfig.arrived.wait(self.__sampler.interval())
+                if self.__pendingConfig.isWaiting:
+                    self.__applyPendingConfig()
 
                 # some data is being received
                 if self.__serialDevice.in_waiting > 0:
                     try:
                         # read serial data and check that it's usable
-                        lightReading = self.__serialDevice.readline().decode('utf-8').rstrip()
-                        self.__serialDevice.reset_input_buffer()
+                        with Timings.block("light.serialRead"):
+                            lightReading = self.__latestLine()
                         print(f'> Raw {lightReading=}')
                         lightReading = float(lightReading)
                     except Exception as error:
@@ -59,61 +135,84 @@ class SerialLightSensorListener:
                         print(f'<<<< Light reading error: {error=} >>>>')
                         continue
 
-                    # figure out what state the blind should be in now
-                    blindShouldBeOpen = self.__tooDark < lightReading < self.__tooBright
-
-                    # figure out the current state of the blind
-                    blindIsClosed = tooDark_blindIsClosed or tooBright_blindIsClosed
-
-                    # standard amount of daylight - open the blinds
-                    if blindShouldBeOpen and blindIsClosed:
-                        print("> Open blind in normal light range")
+                    # sample faster when close to a boundary, or when the light is changing
+                    self.__sampler.sampled()
+                    self.__sampler.nextInterval(isUrgent(
+                        lightReading, previousLightReading, (self.__tooDark, self.__tooBright),
+                        self.__nearThresholdMargin, self.__changeMargin
+                    ))
+                    previousLightReading = lightReading
+
+                    reason, detail = self.__decide(lightReading)
+                    if reason is not None:
+                        print(f"> {LightHysteresis.instructionFor(reason)} blind - {detail}")
                         # send message to motor listener over network
-                        self.__sendInstructionsToMotorListener(Command.Up.value)
-                        tooDark_blindIsClosed = False
-                        tooBright_blindIsClosed = False
-                        continue
-
-                    # nighttime - close the blinds
-                    if lightReading < self.__tooDark and not tooDark_blindIsClosed:
-                        print("> Close blind - too dark")
-                        self.__sendInstructionsToMotorListener(Command.Down.value)
-                        tooDark_blindIsClosed = True
-                        continue
-
-                    # too bright - close the blinds
-                    if lightReading > self.__tooBright and not tooBright_blindIsClosed:
-                        print("> Close blind - too bright")
-                        self.__sendInstructionsToMotorListener(Command.Down.value)
-                        tooBright_blindIsClosed = True
-                        continue
+                        self.__sendInstructionsToMotorListener(LightHysteresis.instructionFor(reason), detail)
 
         except Exception as error:
             print()
             print(f'SERIAL ERROR: {error=}')
             print('<<< ENDING SERIAL READING >>>')
             print()
-
-    def __sendInstructionsToMotorListener(self, message: str):
-        print(f"LIGHT SENSOR SENDING MESSAGE: '{message}'")
+            self.__auditLog.cleanup()
+
+    def __decide(self, _lightReading: float) -> Tuple[Optional[str], str]:
+        """
+        Figure out if the blind should open or close now, or whether it's about to have to
+        """
+        now = time()
+        reason = self.__hysteresis.update(_lightReading, now)
+        detail = f"{reason} {_lightReading}"
+
+        if reason is None and self.__trend is not None:
+            reason = self.__trend.update(now, _lightReading, self.__hysteresis)
+            detail = f"predicted {reason} {_lightReading}"
+        return reason, detail
+
+    def __latestLine(self) -> str:
+        """
+        The newest complete line from the arduino, older readings piled up while sleeping are skipped
+        """
+        lines = self.__serialDevice.read(self.__serialDevice.in_waiting).decode('utf-8').split("\n")
+
+        # the last piece is an incomplete line (or empty), wait for the end of it when it's all there is
+        if len(lines) < 2:
+            return (lines[0] + self.__serialDevice.readline().decode('utf-8')).rstrip()
+        return lines[-2].rstrip()
+
+    def __sendInstructionsToMotorListener(self, message: str, _reason: str):
+        self.__sampler.decided()
+        print(f"LIGHT SENSOR SENDING MESSAGE: '{message}' {self.__sampler.stats()}")
 
         # create a new connection when needed because the motor listener
         # closes connections after instructions are received
         try:
-            self.__connection = socket.socket()
-            self.__connection.connect((self.__host, self.__port))
+            self.__connection = openMotorListenerConnection(self.__host, self.__port)
         except Exception as error:
             print(f'Socket was already open {error=}')
 
         # send new instruction to motor listener over local network
-        self.__connection.sendall(message.encode())
+        self.__connection.sendall(commandMessage(message, _producer="light").encode())
 
         # take note of the response received
         data = self.__connection.recv(1024).decode()
         print(f'LIGHT SENSOR: Response from MotorListener: "{data}"')
         self.__connection.close()
 
+        self.__auditLog.record("sensorDecision", _instruction=message, _decision=data, _detail=_reason)
+
 
 if __name__ == "__main__":
-    listener = SerialLightSensorListener()
+    Profiler.install("light-sensor")
+    lightConfig = BlindConfig.loadAtStartup(BlindConfig.defaultFileName)
+    listener = SerialLightSensorListener(
+        _closeBlindWhenBrighterThan=lightConfig["light"]["closeBlindWhenBrighterThan"],
+        _closeBlindWhenDarkerThan=lightConfig["light"]["closeBlindWhenDarkerThan"],
+        _minimumSampleIntervalInSeconds=lightConfig["light"]["minimumSampleIntervalInSeconds"],
+        _maximumSampleIntervalInSeconds=lightConfig["light"]["maximumSampleIntervalInSeconds"],
+        _medianWindow=lightConfig["light"]["medianWindow"],
+        _predictLeadInSeconds=lightConfig["light"]["predictLeadInSeconds"],
+        _predictMinimumConfidence=lightConfig["light"]["predictMinimumConfidence"]
+    )
+    BlindConfig.ConfigWatcher(BlindConfig.defaultFileName, [listener.applyConfig], lightConfig).start()
     listener.run()
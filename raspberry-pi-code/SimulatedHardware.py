@@ -0,0 +1,290 @@
+import sys
+import types
+from timeit import default_timer as timer
+from typing import Dict, List, Tuple
+
+"""
+Stand-ins for the Pi-only libraries, so the controllers can run on any machine
+- call `install()` before importing ThreadMotorController (or anything else that imports RPi.GPIO,
+  pigpio, serial, board or adafruit_dht)
+- the real libraries are never replaced when they are importable, unless `_force=True`
+- used by the benchmarks and load tests, never by the services on the Pi
+"""
+
+
+def _makeGpioModule() -> types.ModuleType:
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM = 11
+    gpio.BOARD = 10
+    gpio.OUT = 0
+    gpio.IN = 1
+    gpio.LOW = 0
+    gpio.HIGH = 1
+
+    # last level written to every pin, handy for assertions
+    gpio.levels: Dict[int, int] = {}
+
+    def setmode(_mode):
+        pass
+
+    def setwarnings(_flag):
+        pass
+
+    def setup(_channel, _direction, initial=0, **_):
+        for _pin in _channel if isinstance(_channel, (list, tuple)) else [_channel]:
+            gpio.levels[_pin] = initial
+
+    def output(_channel, _value):
+        if isinstance(_channel, (list, tuple)):
+            values = _value if isinstance(_value, (list, tuple)) else [_value] * len(_channel)
+            gpio.levels.update(zip(_channel, values))
+        else:
+            gpio.levels[_channel] = _value
+
+    def input(_channel):
+        return gpio.levels.get(_channel, 0)
+
+    def cleanup(*_):
+        gpio.levels.clear()
+
+    class PWM:
+        def __init__(self, _channel, _frequency):
+            self.channel = _channel
+            self.frequency = _frequency
+            self.dutyCycle = 0
+
+        def start(self, _dutyCycle):
+            self.dutyCycle = _dutyCycle
+
+        def ChangeDutyCycle(self, _dutyCycle):
+            self.dutyCycle = _dutyCycle
+
+        def ChangeFrequency(self, _frequency):
+            self.frequency = _frequency
+
+        def stop(self):
+            self.dutyCycle = 0
+
+    for _function in (setmode, setwarnings, setup, output, input, cleanup):
+        setattr(gpio, _function.__name__, _function)
+    gpio.PWM = PWM
+    return gpio
+
+
+def _makePigpioModule() -> types.ModuleType:
+    pigpio = types.ModuleType("pigpio")
+    pigpio.INPUT = 0
+    pigpio.OUTPUT = 1
+    pigpio.RISING_EDGE = 0
+    pigpio.FALLING_EDGE = 1
+    pigpio.EITHER_EDGE = 2
+    pigpio.TIMEOUT = 2
+
+    def tickDiff(_t1: int, _t2: int) -> int:
+        # ticks are microseconds since boot, wrapping at 32 bits
+        return (_t2 - _t1) & 0xFFFFFFFF
+
+    class _Callback:
+        def __init__(self, _pi, _entry):
+            self.__pi = _pi
+            self.__entry = _entry
+
+        def cancel(self):
+            if self.__entry in self.__pi.callbacks:
+                self.__pi.callbacks.remove(self.__entry)
+
+    class pi:
+        def __init__(self, *_):
+            self.connected = True
+            # last level written to every pin, and the edge callbacks, handy for assertions
+            self.levels: Dict[int, int] = {}
+            self.callbacks = []
+
+        def set_mode(self, _pin, _mode):
+            pass
+
+        def write(self, _pin, _level):
+            self.levels[_pin] = _level
+
+        def read(self, _pin):
+            return self.levels.get(_pin, 0)
+
+        def set_bank_1(self, _mask):
+            self.levels.update({_pin: 1 for _pin in range(32) if _mask >> _pin & 1})
+
+        def clear_bank_1(self, _mask):
+            self.levels.update({_pin: 0 for _pin in range(32) if _mask >> _pin & 1})
+
+        def set_PWM_frequency(self, _pin, _frequency):
+            return _frequency
+
+        def set_PWM_range(self, _pin, _range):
+            pass
+
+        def set_PWM_dutycycle(self, _pin, _dutyCycle):
+            pass
+
+        def hardware_PWM(self, _pin, _frequency, _dutyCycle):
+            pass
+
+        def set_watchdog(self, _pin, _milliseconds):
+            pass
+
+        def callback(self, _pin, _edge=0, _function=None):
+            entry = (_pin, _edge, _function)
+            self.callbacks.append(entry)
+            return _Callback(self, entry)
+
+        def get_current_tick(self) -> int:
+            return int(timer() * 1_000_000) & 0xFFFFFFFF
+
+        def stop(self):
+            self.connected = False
+
+    pigpio.tickDiff = tickDiff
+    pigpio.pi = pi
+    return pigpio
+
+
+def irEdges(_pulses: List[int], _startTick: int = 0) -> List[Tuple[int, int]]:
+    """
+    (level, tick) of every edge an IR frame produces at the receiver, for pigpio-style callbacks
+    - `_pulses` are the times between edges, starting with a mark (see IrDecoder's `necPulses()` and others)
+    - the receiver's output is active low, a mark pulls it to 0
+    """
+    edges = [(0, _startTick & 0xFFFFFFFF)]
+    tick = _startTick
+    for _index, _pulse in enumerate(_pulses):
+        tick += _pulse
+        edges.append((1 if _index % 2 == 0 else 0, tick & 0xFFFFFFFF))
+    return edges
+
+
+def _makeSerialModule() -> types.ModuleType:
+    serial = types.ModuleType("serial")
+
+    class SerialException(IOError):
+        pass
+
+    class Serial:
+        """
+        Reads return whatever was passed to `feed()`, as if the arduino had sent it
+        """
+
+        def __init__(self, _port=None, _baudrate=9600, timeout=None, **_):
+            self.port = _port
+            self.baudrate = _baudrate
+            self.timeout = timeout
+            self.buffer = bytearray()
+
+        def feed(self, _data: bytes):
+            self.buffer += _data
+
+        @property
+        def in_waiting(self) -> int:
+            return len(self.buffer)
+
+        def read(self, _size: int = 1) -> bytes:
+            data = bytes(self.buffer[:_size])
+            del self.buffer[:_size]
+            return data
+
+        def readline(self) -> bytes:
+            end = self.buffer.find(b"\n")
+            return self.read(len(self.buffer) if end < 0 else end + 1)
+
+        def reset_input_buffer(self):
+            self.buffer.clear()
+
+        def close(self):
+            pass
+
+    serial.SerialException = SerialException
+    serial.Serial = Serial
+    return serial
+
+
+def _makeBoardModule() -> types.ModuleType:
+    board = types.ModuleType("board")
+    for _pin in range(28):
+        setattr(board, f"D{_pin}", _pin)
+    return board
+
+
+def _makeAdafruitDhtModule() -> types.ModuleType:
+    adafruitDht = types.ModuleType("adafruit_dht")
+
+    class DHT11:
+        """
+        Readings are whatever was last set on `temperature` and `humidity`
+        """
+
+        def __init__(self, _pin, use_pulseio: bool = True):
+            self.pin = _pin
+            self.temperature = 21
+            self.humidity = 50
+
+        def exit(self):
+            pass
+
+    class DHT22(DHT11):
+        pass
+
+    adafruitDht.DHT11 = DHT11
+    adafruitDht.DHT22 = DHT22
+    return adafruitDht
+
+
+def _isImportable(_name: str) -> bool:
+    try:
+        __import__(_name)
+        return True
+    except ImportError:
+        return False
+
+
+def install(_force: bool = False):
+    """
+    Register the stand-in modules with python's import system
+    """
+    if _force or not _isImportable("RPi.GPIO"):
+        gpio = _makeGpioModule()
+        package = types.ModuleType("RPi")
+        package.GPIO = gpio
+        sys.modules["RPi"] = package
+        sys.modules["RPi.GPIO"] = gpio
+
+    for _name, _makeModule in (
+            ("pigpio", _makePigpioModule),
+            ("serial", _makeSerialModule),
+            ("board", _makeBoardModule),
+            ("adafruit_dht", _makeAdafruitDhtModule),
+    ):
+        if _force or not _isImportable(_name):
+            sys.modules[_name] = _makeModule()
+
+
+def startSimulatedMotorListener(_directory: str, **_listenerOptions):
+    """
+    Run a MotorListener on simulated hardware in a background thread
+    - its state and schedule files are kept in `_directory`
+    - returns the listener and its thread, call `listener.shutdown()` then `thread.join()` to stop it
+    """
+    import os
+    import threading
+    from time import sleep
+
+    install()
+    from MotorListener import MotorListener
+
+    # the listener keeps its files in the working directory
+    os.chdir(_directory)
+    _listenerOptions.setdefault("_simulatedHardware", True)
+    listener = MotorListener(**_listenerOptions)
+
+    thread = threading.Thread(target=listener.listenForMotorCommands, daemon=True)
+    thread.start()
+
+    # let the motor thread pick up its starting instruction
+    sleep(0.2)
+    return listener, thread
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+import MotorConnection
+from LoadTester import processStatus, startServer
+
+"""
+Soak test of the MotorListener's connection handling
+- opens, uses and closes a very large number of connections (a million by default)
+- samples the listener's RSS and thread count as it goes, both should stay flat:
+  the handler threads are a fixed pool and nothing is kept per connection
+- a mix of clients that send a command, and clients that connect then hang up without sending
+
+Run e.g.
+  `python SoakTest.py --connections 1000000 --concurrency 16`
+  `python SoakTest.py --connections 20000 --transport tcp --json`
+"""
+
+
+class SoakClient(threading.Thread):
+    """
+    Takes connections off a shared budget until it's used up
+    """
+
+    def __init__(self, _connect, _budget: List[int], _budgetLock: threading.Lock, _hangUpEvery: int):
+        super().__init__(daemon=True)
+        self.__connect = _connect
+        self.__budget = _budget
+        self.__budgetLock = _budgetLock
+        self.__hangUpEvery = _hangUpEvery
+
+        self.completed = 0
+        self.hungUp = 0
+        self.errors = 0
+
+    def __takeConnection(self) -> Optional[int]:
+        with self.__budgetLock:
+            if self.__budget[0] <= 0:
+                return None
+            self.__budget[0] -= 1
+            return self.__budget[0]
+
+    def run(self):
+        while True:
+            number = self.__takeConnection()
+            if number is None:
+                return
+
+            try:
+                connection = self.__connect()
+                try:
+                    # some clients give up without sending anything
+                    if self.__hangUpEvery and number % self.__hangUpEvery == 0:
+                        self.hungUp += 1
+                        continue
+
+                    connection.sendall(b"status")
+                    connection.recv(1024)
+                    self.completed += 1
+                finally:
+                    connection.close()
+            except OSError:
+                self.errors += 1
+
+
+def isFlat(_samples: List[Dict], _key: str, _tolerance: float) -> bool:
+    """
+    Compares the end of the run with the end of the warm up (the first 10% of samples)
+    """
+    if len(_samples) < 2:
+        return True
+    warmedUp = _samples[max(1, len(_samples) // 10)][_key]
+    return _samples[-1][_key] <= warmedUp * (1 + _tolerance)
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Soak test the MotorListener's connection handling")
+    parser.add_argument("--connections", type=int, default=1_000_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--transport", choices=["tcp", "unix"], default="unix")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5057)
+    parser.add_argument("--unix-socket", default=os.path.join(tempfile.gettempdir(), "blind-soak-test.sock"))
+    parser.add_argument("--hang-up-every", type=int, default=10, help="every n-th client hangs up without sending")
+    parser.add_argument("--sample-seconds", type=float, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed RSS growth after warm up")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    arguments = parser.parse_args(_arguments)
+
+    # the load tester's server, with rate limiting out of the way
+    server = startServer(argparse.Namespace(
+        port=arguments.port,
+        unix_socket=arguments.unix_socket,
+        client_rate=1_000_000,
+        motor_process=False
+    ))
+
+    if arguments.transport == "unix":
+        connect = lambda: MotorConnection.openUnixConnection(arguments.unix_socket, 10)  # noqa: E731
+    else:
+        connect = lambda: MotorConnection.openTcpConnection(arguments.host, arguments.port, 10)  # noqa: E731
+
+    budget = [arguments.connections]
+    budgetLock = threading.Lock()
+    clients = [
+        SoakClient(connect, budget, budgetLock, arguments.hang_up_every)
+        for _ in range(arguments.concurrency)
+    ]
+
+    startedAt = timer()
+    samples = [{"second": 0, "connections": 0, **processStatus(server.pid)}]
+    for _client in clients:
+        _client.start()
+
+    # sample the server until every connection has been made
+    while any(_client.is_alive() for _client in clients):
+        sampleAt = timer() + arguments.sample_seconds
+        for _client in clients:
+            _client.join(timeout=max(0.0, sampleAt - timer()))
+        with budgetLock:
+            done = arguments.connections - budget[0]
+        samples.append({"second": round(timer() - startedAt), "connections": done, **processStatus(server.pid)})
+        if not arguments.json:
+            print(f"SOAK: {samples[-1]}", flush=True)
+
+    elapsed = timer() - startedAt
+
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+    summary = {
+        "connections": arguments.connections,
+        "completed": sum(_client.completed for _client in clients),
+        "hungUp": sum(_client.hungUp for _client in clients),
+        "errors": sum(_client.errors for _client in clients),
+        "connectionsPerSecond": arguments.connections / elapsed,
+        "rssKb": {"start": samples[0]["rssKb"], "end": samples[-1]["rssKb"],
+                  "max": max(_sample["rssKb"] for _sample in samples)},
+        "threads": {"start": samples[0]["threads"], "end": samples[-1]["threads"],
+                    "max": max(_sample["threads"] for _sample in samples)},
+        "rssIsFlat": isFlat(samples, "rssKb", arguments.tolerance),
+        "threadsAreFlat": isFlat(samples, "threads", 0),
+        "samples": samples,
+    }
+
+    if arguments.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print("### SOAK TEST ###")
+        for _key, _value in summary.items():
+            if _key != "samples":
+                print(f"{_key}: {_value}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
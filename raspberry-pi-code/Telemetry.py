@@ -0,0 +1,342 @@
+import socket
+import struct
+from collections import OrderedDict
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+from Profiling import Timings
+
+"""
+Sensor readings from Pis in other rooms, in batches over UDP, instead of a TCP connection per reading
+- a datagram is a 12 byte header (magic, version, reading count, node id, sequence number),
+  then up to `maxReadingsPerDatagram` readings of 5 bytes each (channel, float32 value), all little-endian
+- the MotorListener waits on the telemetry socket with its other sockets, and drains up to
+  `_drainLimit` datagrams into preallocated buffers per wake-up, before parsing any of them
+- sequence numbers (per node) count lost datagrams, and let late ones in without rolling a reading back:
+  a datagram older than the newest one is only counted, up to `windowSize` behind, duplicates are dropped
+- a node is fresh while it has been heard from within `_staleAfterInSeconds`
+- at most `_maxTrackedNodes` nodes are tracked, the one heard from longest ago is forgotten first,
+  so datagrams with made-up node ids can't grow memory
+"""
+
+defaultPort = 5001
+
+magic = b"BT"
+version = 1
+headerStruct = struct.Struct("<2sBBII")
+readingStruct = struct.Struct("<Bf")
+maxReadingsPerDatagram = 64
+maxDatagramSize = headerStruct.size + maxReadingsPerDatagram * readingStruct.size
+
+light = 1
+temperature = 2
+humidity = 3
+channelNames = {light: "light", temperature: "temperature", humidity: "humidity"}
+
+# how far behind the newest datagram a late one is still recognised, a much older one means the node restarted
+windowSize = 64
+windowMask = (1 << windowSize) - 1
+restartGap = 1024
+sequenceMask = 0xFFFFFFFF
+
+
+def encodeBatch(_nodeId: int, _sequence: int, _readings: List[Tuple[int, float]]) -> bytes:
+    if not 0 < len(_readings) <= maxReadingsPerDatagram:
+        raise ValueError(f"a datagram carries 1 to {maxReadingsPerDatagram} readings, not {len(_readings)}")
+
+    datagram = bytearray(headerStruct.size + len(_readings) * readingStruct.size)
+    headerStruct.pack_into(datagram, 0, magic, version, len(_readings), _nodeId, _sequence & sequenceMask)
+    for _index, (_channel, _value) in enumerate(_readings):
+        readingStruct.pack_into(datagram, headerStruct.size + _index * readingStruct.size, _channel, _value)
+    return bytes(datagram)
+
+
+class NodeState:
+    """
+    What one remote node last reported, and how its datagrams have been arriving
+    """
+    __slots__ = (
+        "nodeId", "lastSeenAt", "latest", "highestSequence", "window",
+        "received", "lost", "reordered", "duplicates", "late", "restarts"
+    )
+
+    def __init__(self, _nodeId: int):
+        self.nodeId = _nodeId
+        self.lastSeenAt = 0.0
+        self.latest: Dict[int, float] = {}
+        self.highestSequence: Optional[int] = None
+        # bit n is clear when the datagram n behind the newest one was counted as lost
+        # - the ones before the first datagram heard were never counted, their bits are set,
+        #   so one of them arriving late is dropped like a duplicate
+        self.window = windowMask
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.late = 0
+        self.restarts = 0
+
+    def accept(self, _sequence: int) -> Optional[bool]:
+        """
+        True for the newest datagram so far, False for a late one still worth counting, None to drop it
+        """
+        if self.highestSequence is None:
+            self.highestSequence = _sequence
+            self.received += 1
+            return True
+
+        ahead = (_sequence - self.highestSequence) & sequenceMask
+        if 0 < ahead <= sequenceMask // 2:
+            self.lost += ahead - 1
+            self.window = (self.window << ahead | 1) & windowMask if ahead < windowSize else 1
+            self.highestSequence = _sequence
+            self.received += 1
+            return True
+
+        behind = (self.highestSequence - _sequence) & sequenceMask
+        if behind >= restartGap:
+            # the node started counting again
+            self.restarts += 1
+            self.highestSequence, self.window = _sequence, windowMask
+            self.received += 1
+            return True
+        if behind >= windowSize:
+            self.late += 1
+            return None
+
+        bit = 1 << behind
+        if self.window & bit:
+            self.duplicates += 1
+            return None
+
+        # it was counted as lost when a newer one overtook it
+        self.window |= bit
+        self.lost -= 1
+        self.reordered += 1
+        self.received += 1
+        return False
+
+    def toDict(self, _now: float, _staleAfterInSeconds: float) -> Dict:
+        age = _now - self.lastSeenAt
+        return {
+            "nodeId": self.nodeId,
+            "ageSeconds": round(age, 3),
+            "fresh": age <= _staleAfterInSeconds,
+            "latest": {channelNames.get(_channel, str(_channel)): _value for _channel, _value in self.latest.items()},
+            "received": self.received,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "late": self.late,
+            "restarts": self.restarts,
+        }
+
+
+class TelemetryReceiver:
+    """
+    Owns the UDP socket, the caller waits for it to be readable (e.g. in a selector) and calls `drain()`
+    """
+    __socket: socket.socket = None
+    __drainLimit: int = None
+    __staleAfterInSeconds: float = None
+    __forgetAfterInSeconds: float = None
+
+    # one buffer per datagram of a drain, reused by every drain
+    __buffers: List[bytearray] = None
+    __sizes: List[int] = None
+
+    # least recently heard from first, other threads only read copies of it
+    __nodes: OrderedDict = None
+    __maxTrackedNodes: int = None
+    __lastPrunedAt: float = 0.0
+
+    # counters for tuning
+    drains: int = 0
+    datagrams: int = 0
+    readings: int = 0
+    malformed: int = 0
+    largestDrain: int = 0
+    nodesEvicted: int = 0
+
+    def __init__(
+            self,
+            _host: str = "",
+            _port: int = defaultPort,
+            _drainLimit: int = 64,
+            _staleAfterInSeconds: float = 120,
+            _forgetAfterInSeconds: float = 86400,
+            _receiveBufferBytes: int = 1 << 20,
+            _udpSocket: Optional[socket.socket] = None,
+            _maxTrackedNodes: int = 8192
+    ):
+        self.__drainLimit = _drainLimit
+        self.__staleAfterInSeconds = _staleAfterInSeconds
+        self.__forgetAfterInSeconds = _forgetAfterInSeconds
+        self.__buffers = [bytearray(maxDatagramSize) for _ in range(_drainLimit)]
+        self.__sizes = [0] * _drainLimit
+        self.__nodes = OrderedDict()
+        self.__maxTrackedNodes = _maxTrackedNodes
+
+        # a socket that is already bound, e.g. handed over by the previous process (see HotUpgrade), is used as it is
+        if _udpSocket is not None:
+            self.__socket = _udpSocket
+        else:
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # room for a burst from many nodes while the listener is busy with something else
+            self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _receiveBufferBytes)
+            self.__socket.bind((_host, _port))
+        self.__socket.setblocking(False)
+
+    def udpSocket(self) -> socket.socket:
+        return self.__socket
+
+    def address(self) -> Tuple[str, int]:
+        return self.__socket.getsockname()
+
+    def drain(self) -> int:
+        """
+        Read every waiting datagram (up to the drain limit), then parse them, returns how many were read
+        """
+        with Timings.block("telemetry.drain"):
+            buffers, sizes = self.__buffers, self.__sizes
+            count = 0
+            while count < self.__drainLimit:
+                try:
+                    sizes[count] = self.__socket.recv_into(buffers[count])
+                except (BlockingIOError, InterruptedError):
+                    break
+                count += 1
+
+            now = timer()
+            for _index in range(count):
+                self.__parse(buffers[_index], sizes[_index], now)
+
+            self.drains += 1
+            self.datagrams += count
+            if count > self.largestDrain:
+                self.largestDrain = count
+
+            if now - self.__lastPrunedAt > 60:
+                self.__prune(now)
+            return count
+
+    def __parse(self, _buffer: bytearray, _size: int, _now: float):
+        if _size < headerStruct.size:
+            self.malformed += 1
+            return
+
+        datagramMagic, datagramVersion, readingCount, nodeId, sequence = headerStruct.unpack_from(_buffer, 0)
+        if (
+                datagramMagic != magic or datagramVersion != version
+                or _size != headerStruct.size + readingCount * readingStruct.size
+        ):
+            self.malformed += 1
+            return
+
+        node = self.__nodes.get(nodeId)
+        if node is None:
+            node = self.__nodes[nodeId] = NodeState(nodeId)
+
+            # forget the least recently heard from node
+            if len(self.__nodes) > self.__maxTrackedNodes:
+                self.__nodes.popitem(last=False)
+                self.nodesEvicted += 1
+        else:
+            self.__nodes.move_to_end(nodeId)
+
+        newest = node.accept(sequence)
+        if newest is None:
+            return
+
+        node.lastSeenAt = _now
+        self.readings += readingCount
+
+        # a late datagram's readings are older than the ones already kept
+        if newest:
+            latest = node.latest
+            for _channel, _value in readingStruct.iter_unpack(memoryview(_buffer)[headerStruct.size:_size]):
+                latest[_channel] = _value
+
+    def __prune(self, _now: float):
+        self.__lastPrunedAt = _now
+        forgotten = [
+            _nodeId for _nodeId, _node in self.__nodes.items()
+            if _now - _node.lastSeenAt > self.__forgetAfterInSeconds
+        ]
+        for _nodeId in forgotten:
+            del self.__nodes[_nodeId]
+
+    def latest(self, _channel: int) -> Dict[int, float]:
+        """
+        Newest value of the channel from every fresh node
+        """
+        now = timer()
+        return {
+            _nodeId: _node.latest[_channel] for _nodeId, _node in list(self.__nodes.items())
+            if _channel in _node.latest and now - _node.lastSeenAt <= self.__staleAfterInSeconds
+        }
+
+    def nodes(self) -> List[Dict]:
+        now = timer()
+        return [_node.toDict(now, self.__staleAfterInSeconds) for _node in list(self.__nodes.values())]
+
+    def counters(self) -> Dict:
+        now = timer()
+        nodes = list(self.__nodes.values())
+        return {
+            "nodes": len(nodes),
+            "freshNodes": sum(1 for _node in nodes if now - _node.lastSeenAt <= self.__staleAfterInSeconds),
+            "drains": self.drains,
+            "datagrams": self.datagrams,
+            "readings": self.readings,
+            "malformed": self.malformed,
+            "largestDrain": self.largestDrain,
+            "nodesEvicted": self.nodesEvicted,
+            "lost": sum(_node.lost for _node in nodes),
+            "reordered": sum(_node.reordered for _node in nodes),
+            "duplicates": sum(_node.duplicates for _node in nodes),
+            "late": sum(_node.late for _node in nodes),
+        }
+
+    def close(self):
+        self.__socket.close()
+
+
+class TelemetrySender:
+    """
+    Used on a remote node: `add()` readings as they are taken, they go out together on `flush()`,
+    or as soon as a datagram is full
+    """
+    __nodeId: int = None
+    __address: Tuple[str, int] = None
+    __socket: socket.socket = None
+    __sequence: int = 0
+    __pending: List[Tuple[int, float]] = None
+
+    def __init__(self, _nodeId: int, _host: str, _port: int = defaultPort, _firstSequence: int = 0):
+        self.__nodeId = _nodeId
+        self.__address = socket.getaddrinfo(_host, _port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sequence = _firstSequence
+        self.__pending = []
+
+    def add(self, _channel: int, _value: float):
+        self.__pending.append((_channel, _value))
+        if len(self.__pending) == maxReadingsPerDatagram:
+            self.flush()
+
+    def flush(self):
+        if not self.__pending:
+            return
+        datagram = encodeBatch(self.__nodeId, self.__sequence, self.__pending)
+        self.__sequence = (self.__sequence + 1) & sequenceMask
+        self.__pending = []
+        try:
+            self.__socket.sendto(datagram, self.__address)
+        except OSError as error:
+            # telemetry is best effort, the next batch will tell the listener it missed one
+            print(f'TELEMETRY: could not send {error=}')
+
+    def close(self):
+        self.flush()
+        self.__socket.close()
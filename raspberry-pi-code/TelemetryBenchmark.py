@@ -0,0 +1,165 @@
+import argparse
+import multiprocessing
+import random
+import selectors
+from time import process_time, sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import Telemetry
+
+"""
+Throughput of the telemetry receiver, with thousands of simulated sensor nodes
+- a separate process sends every node's batches, round after round, paced to a datagram rate
+- some datagrams are never sent (loss), some are swapped with the node's next one (reordering)
+- the receiver is drained like the MotorListener drains it, and its cpu time per datagram is reported,
+  with the lost and reordered datagrams it counted against what was injected
+- anything the kernel dropped (the receive buffer overflowed) shows up as extra loss
+
+Run e.g. `python TelemetryBenchmark.py --nodes 5000 --rounds 20 --drain-limits 1 16 64`
+"""
+
+
+def makeTraffic(
+        _nodes: int,
+        _rounds: int,
+        _readingsPerDatagram: int,
+        _loss: float,
+        _reorder: float,
+        _seed: int
+) -> Tuple[List[bytes], Dict[str, int]]:
+    """
+    Every datagram to send, in order, and how many were dropped or swapped on purpose
+    """
+    generator = random.Random(_seed)
+    channels = (Telemetry.light, Telemetry.temperature, Telemetry.humidity)
+    batches: List[List[Optional[bytes]]] = []
+    injected = {"generated": 0, "dropped": 0, "swapped": 0}
+
+    for _round in range(_rounds):
+        batch = []
+        for _node in range(_nodes):
+            readings = [
+                (channels[_index % len(channels)], generator.uniform(0, 1000)) for _index in range(_readingsPerDatagram)
+            ]
+            batch.append(Telemetry.encodeBatch(_node, _round, readings))
+        batches.append(batch)
+        injected["generated"] += _nodes
+
+    # swap a node's datagram with its next one, or leave it out
+    for _round in range(_rounds):
+        for _node in range(_nodes):
+            if _round + 1 < _rounds and generator.random() < _reorder:
+                current, following = batches[_round][_node], batches[_round + 1][_node]
+                if current is not None and following is not None:
+                    batches[_round][_node], batches[_round + 1][_node] = following, current
+                    injected["swapped"] += 1
+            if generator.random() < _loss and batches[_round][_node] is not None:
+                batches[_round][_node] = None
+                injected["dropped"] += 1
+
+    datagrams = [_datagram for _batch in batches for _datagram in _batch if _datagram is not None]
+    return datagrams, injected
+
+
+def sendTraffic(_address: Tuple[str, int], _datagrams: List[bytes], _datagramsPerSecond: float):
+    import socket
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    burst = 64
+    startedAt = timer()
+    for _index in range(0, len(_datagrams), burst):
+        for _datagram in _datagrams[_index:_index + burst]:
+            sender.sendto(_datagram, _address)
+
+        # keep to the rate, a burst at a time
+        if _datagramsPerSecond > 0:
+            aheadBy = (_index + burst) / _datagramsPerSecond - (timer() - startedAt)
+            if aheadBy > 0:
+                sleep(aheadBy)
+    sender.close()
+
+
+def benchmarkDrainLimit(
+        _drainLimit: int,
+        _datagrams: List[bytes],
+        _injected: Dict[str, int],
+        _nodes: int,
+        _datagramsPerSecond: float
+) -> Dict:
+    receiver = Telemetry.TelemetryReceiver(
+        _host="127.0.0.1", _port=0, _drainLimit=_drainLimit, _maxTrackedNodes=max(8192, _nodes)
+    )
+    selector = selectors.DefaultSelector()
+    selector.register(receiver.udpSocket(), selectors.EVENT_READ)
+
+    sender = multiprocessing.Process(
+        target=sendTraffic, args=(receiver.address(), _datagrams, _datagramsPerSecond), daemon=True
+    )
+    cpuAt, wallAt = process_time(), timer()
+    sender.start()
+
+    # until the sender is done and nothing more arrives
+    lastDatagramAt = timer()
+    while sender.is_alive() or timer() - lastDatagramAt < 0.2:
+        if selector.select(timeout=0.05):
+            if receiver.drain():
+                lastDatagramAt = timer()
+
+    cpuSeconds = process_time() - cpuAt
+    wallSeconds = lastDatagramAt - wallAt
+    sender.join()
+    selector.close()
+    receiver.close()
+
+    counters = receiver.counters()
+    received = counters["datagrams"]
+    result = {
+        "drainLimit": _drainLimit,
+        "sent": len(_datagrams),
+        "received": received,
+        "kernelDropped": len(_datagrams) - received,
+        "datagramsPerSecond": round(received / wallSeconds) if wallSeconds else 0,
+        "readingsPerSecond": round(counters["readings"] / wallSeconds) if wallSeconds else 0,
+        "cpuUsPerDatagram": round(cpuSeconds / received * 1_000_000, 2) if received else 0.0,
+        "datagramsPerDrain": round(received / counters["drains"], 1) if counters["drains"] else 0.0,
+        "nodesSeen": counters["nodes"],
+        "injectedLoss": _injected["dropped"],
+        "countedLost": counters["lost"],
+        "injectedReorders": _injected["swapped"],
+        "countedReordered": counters["reordered"],
+        "duplicates": counters["duplicates"],
+        "late": counters["late"],
+    }
+
+    # missing datagrams a node hasn't sent a newer one after yet (or the first ones) can't be counted as lost
+    result["missingNotCounted"] = _injected["generated"] - received - counters["lost"]
+    print(result)
+    return result
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Throughput of batched UDP telemetry from many sensor nodes")
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--readings", type=int, default=6, help="readings per datagram")
+    parser.add_argument("--loss", type=float, default=0.01)
+    parser.add_argument("--reorder", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=20000, help="datagrams per second, 0 for as fast as possible")
+    parser.add_argument("--drain-limits", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--seed", type=int, default=1)
+    arguments = parser.parse_args(_arguments)
+
+    datagrams, injected = makeTraffic(
+        arguments.nodes, arguments.rounds, arguments.readings, arguments.loss, arguments.reorder, arguments.seed
+    )
+
+    print("### TELEMETRY BENCHMARK ###")
+    print(f"{arguments.nodes} nodes, {len(datagrams)} datagrams of {arguments.readings} readings, {injected}")
+    return [
+        benchmarkDrainLimit(_drainLimit, datagrams, injected, arguments.nodes, arguments.rate)
+        for _drainLimit in arguments.drain_limits
+    ]
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,14 @@
 # Based on Adafruit_CircuitPython_DHT Library Example
 
 import socket
-from time import sleep
+from typing import Dict
+from MotorConnection import commandMessage, openMotorListenerConnection
 import board
 import adafruit_dht
+import BlindConfig
+from AdaptiveSampling import AdaptiveSampler, isUrgent
+from AuditLog import AuditLog
+from Profiling import Profiler, Timings
 
 
 class TemperatureHumidity:
@@ -17,6 +22,12 @@ class TemperatureHumidity:
     __down: str = "180"
     __lastInstruction: str = ""
 
+    # sample quickly near a boundary or while the readings change, back off while they are steady
+    # - the DHT11 can't be read more than once a second
+    __sampler: AdaptiveSampler = None
+    __nearTemperatureMargin: float = 1
+    __nearHumidityMargin: float = 3
+
     # get readings from temp/humidity module
     __DHT11 = None
     __degreesCelsius: float = 0
@@ -26,9 +37,27 @@ class TemperatureHumidity:
     __host: str = None
     __port = 5000
 
-    def __init__(self, _closeBlindAtTemperature: float = 25, _closeBlindAtHumidity: float = 80):
+    # record every decision, with the readings behind it
+    __auditLog: AuditLog = None
+
+    # new config (see BlindConfig), applied between two readings
+    # - a new config also ends the wait for the next reading early
+    __pendingConfig: BlindConfig.PendingConfig = None
+
+    def __init__(
+            self,
+            _closeBlindAtTemperature: float = 25,
+            _closeBlindAtHumidity: float = 80,
+            _minimumSampleIntervalInSeconds: float = 1,
+            _maximumSampleIntervalInSeconds: float = 30
+    ):
         # setup board sensor
         self.__DHT11 = adafruit_dht.DHT11(board.D16)
+        self.__sampler = AdaptiveSampler(
+            _name="climate",
+            _minimumIntervalInSeconds=_minimumSampleIntervalInSeconds,
+            _maximumIntervalInSeconds=_maximumSampleIntervalInSeconds
+        )
 
         # save trigger boundaries
         self.__closeBlindAtTemperature = _closeBlindAtTemperature
@@ -36,37 +65,78 @@ class TemperatureHumidity:
 
         # prepare network connection
         self.__host = socket.gethostname()
-        self.__connection = socket.socket()
-        self.__connection.connect((self.__host, self.__port))
+        self.__connection = openMotorListenerConnection(self.__host, self.__port)
+
+        self.__auditLog = AuditLog(_source="climate")
+        self.__auditLog.start()
+
+        self.__pendingConfig = BlindConfig.PendingConfig()
+
+    def applyConfig(self, _config: Dict, _changedAt: float):
+        self.__pendingConfig.offer(_config, _changedAt)
+
+    def __applyPendingConfig(self):
+        config, changedAt = self.__pendingConfig.take()
+        climate = config["climate"]
+
+        self.__closeBlindAtTemperature = climate["closeBlindAtTemperature"]
+        self.__closeBlindAtHumidity = climate["closeBlindAtHumidity"]
+        self.__sampler.reconfigure(
+            climate["minimumSampleIntervalInSeconds"], climate["maximumSampleIntervalInSeconds"]
+        )
+
+        BlindConfig.recordInEffect(changedAt)
+        print(f"CLIMATE SENSOR: new config {climate}")
 
     def run(self):
         """
         Main loop that triggers readings and processing of instructions for MotorListener
         """
         while True:
-            # wait between readings
-            sleep(1)
-
-            # track previous readings before getting new readings
-            previousDegreesCelsius = self.__degreesCelsius
-            previousHumidityPercentage = self.__humidityPercentage
+            # wait between readings, for longer while the readings are steady
+            self.__pendingConfig.arrived.wait(self.__sampler.interval())
+            if self.__pendingConfig.isWaiting:
+                self.__applyPendingConfig()
 
-            # check for new readings
-            self.__readSensorValues()
+            self.__sample()
 
-            # figure out if something has changed
-            noChange = (
-                    previousDegreesCelsius == self.__degreesCelsius and
-                    previousHumidityPercentage == self.__humidityPercentage
+    def __sample(self):
+        """
+        One reading, and instructions for MotorListener when it changed
+        """
+        # track previous readings before getting new readings
+        previousDegreesCelsius = self.__degreesCelsius
+        previousHumidityPercentage = self.__humidityPercentage
+
+        # check for new readings
+        self.__readSensorValues()
+
+        # sample faster when close to a boundary, or when either reading is changing
+        self.__sampler.sampled()
+        self.__sampler.nextInterval(
+            isUrgent(
+                self.__degreesCelsius, previousDegreesCelsius, (self.__closeBlindAtTemperature,),
+                self.__nearTemperatureMargin, 1
+            ) or isUrgent(
+                self.__humidityPercentage, previousHumidityPercentage, (self.__closeBlindAtHumidity,),
+                self.__nearHumidityMargin, 1
             )
+        )
 
-            # nothing changed, do nothing
-            if noChange:
-                continue
+        # figure out if something has changed
+        noChange = (
+                previousDegreesCelsius == self.__degreesCelsius and
+                previousHumidityPercentage == self.__humidityPercentage
+        )
+
+        # nothing changed, do nothing
+        if noChange:
+            return
 
-            # something changed, handle this change
-            self.__handleNewInstructions()
+        # something changed, handle this change
+        self.__handleNewInstructions()
 
+    @Timings.timed("climate.dhtRead")
     def __readSensorValues(self):
         """
         Get temperature and humidity reading from the DHT11 sensor
@@ -124,27 +194,39 @@ class TemperatureHumidity:
             return
 
     def __sendInstructionsToMotorListener(self, message: str):
-        print("Send message")
+        self.__sampler.decided()
+        print(f"Send message {self.__sampler.stats()}")
 
         # create a new connection when needed because the motor listener
         # closes connections after instructions are received
         try:
-            self.__connection = socket.socket()
-            self.__connection.connect((self.__host, self.__port))
+            self.__connection = openMotorListenerConnection(self.__host, self.__port)
         except Exception as error:
             print(f'Socket was already open {error=}')
 
         # send new instruction to motor listener over local network
-        self.__connection.send(message.encode())
+        self.__connection.send(commandMessage(message, _producer="climate").encode())
         data = self.__connection.recv(1024).decode()
         print(f'Response from MotorListenerL: "{data}"')
         self.__connection.close()
 
+        self.__auditLog.record(
+            "sensorDecision", _instruction=message, _decision=data, _detail=self.__readingsMessage()
+        )
+
     def __readingsMessage(self) -> str:
         # use a common message for printing
         return f"temperature {self.__degreesCelsius}ºc, humidity {self.__humidityPercentage}%"
 
 
 if __name__ == "__main__":
-    listener = TemperatureHumidity()
+    Profiler.install("temperature-humidity")
+    climateConfig = BlindConfig.loadAtStartup(BlindConfig.defaultFileName)
+    listener = TemperatureHumidity(
+        _closeBlindAtTemperature=climateConfig["climate"]["closeBlindAtTemperature"],
+        _closeBlindAtHumidity=climateConfig["climate"]["closeBlindAtHumidity"],
+        _minimumSampleIntervalInSeconds=climateConfig["climate"]["minimumSampleIntervalInSeconds"],
+        _maximumSampleIntervalInSeconds=climateConfig["climate"]["maximumSampleIntervalInSeconds"]
+    )
+    BlindConfig.ConfigWatcher(BlindConfig.defaultFileName, [listener.applyConfig], climateConfig).start()
     listener.run()
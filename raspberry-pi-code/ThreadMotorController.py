@@ -1,18 +1,33 @@
 import threading
 from copy import deepcopy
 from time import sleep, time
-from typing import Dict, TextIO
+from typing import Callable, Dict, List, Optional, TextIO
 from timeit import default_timer as timer
 from RPi import GPIO  # type: ignore
 
+from AuditLog import AuditLog
+from BlindConfig import PendingConfig, recordInEffect
 from Data import Command, Instruction
+from DutyCycleRamp import (
+    DutyCycleRamp, RampStep, followedBy, kickProfile, rampDownProfile, rampUpProfile, steadyProfile
+)
+from GpioOutput import CachedGpioOutput
+from MotionSequence import SequenceRun, SequenceStep, compileSequence, encodeSequence
+from MotorWatchdog import MotorWatchdog
+from Profiling import Timings
+from PwmBackend import PwmBackend, createPwmBackend, rpiGpioBackend
 
 # use broadcom pin numbering
 GPIO.setmode(GPIO.BCM)
 
 
 class MotorLeds:
-    def __init__(self):
+    # pin writes go through the shared output cache
+    __gpio: CachedGpioOutput = None
+
+    def __init__(self, _gpio: CachedGpioOutput, _command: Command = Command.Stop):
+        self.__gpio = _gpio
+
         # setup io pins
         self.__greenPin = 5
         self.__redPin = 6
@@ -23,31 +38,24 @@ class MotorLeds:
             Command.Down.name: self.__yellowPin
         }
 
-        # begin by having LEDs in the red "stopped" state
+        # begin by having LEDs in the red "stopped" state, or lit for a move taken over from another process
         for _commandName, _pin in self.__pins.items():
-            brightness = GPIO.HIGH if _commandName == Command.Stop.name else GPIO.LOW
-            GPIO.setup(_pin, GPIO.OUT)
-            GPIO.output(_pin, brightness)
+            self.__gpio.setup(_pin, _commandName == _command.name)
 
     # update pin status
     def command(self, _command: Command):
-        # identify LED to light
-        pinForUpdate = self.__pins[_command.name]
-
-        # turn off other LEDS
-        for _commandName, _pin in self.__pins.items():
-            if _commandName != _command.name:
-                GPIO.output(_pin, GPIO.LOW)
-
-        # light identified LED
-        GPIO.output(pinForUpdate, GPIO.HIGH)
+        # light identified LED and turn off other LEDs, in one batch
+        # - LEDs that are already in the right state are not written again
+        self.__gpio.writeMany({
+            _pin: _commandName == _command.name for _commandName, _pin in self.__pins.items()
+        })
 
     def cleanup(self):
         # tidy up LEDs
-        for _keyCommand, pin in self.__pins.items():
-            GPIO.output(pin, GPIO.LOW)
+        self.__gpio.writeMany({_pin: False for _pin in self.__pins.values()})
 
         GPIO.cleanup()
+        self.__gpio.forget(self.__pins.values())
 
 
 class ThreadMotorController(threading.Thread):
@@ -76,13 +84,19 @@ class ThreadMotorController(threading.Thread):
     __stoppedNoPower: int = 0
 
     # pulse width modulation for motor speed control
-    __pwm: GPIO.PWM = None
+    __pwm: PwmBackend = None
     __pwmFrequency = 50
     __presentDutyCycle: float = 0
 
     # h-bridge rotation direction setting
     __hBridgeRotateUpward = True
 
+    # soft start and soft reversal, played a step at a time by the loop in `run()`
+    # - the direction the blind is actually moving, and how fast compared to full speed
+    __ramp: DutyCycleRamp = None
+    __movingUpward: Optional[bool] = None
+    __speedFraction: float = 0.0
+
     # the current command that is running e.g. up/down/stop etc
     __instruction: Dict = None
 
@@ -95,12 +109,59 @@ class ThreadMotorController(threading.Thread):
     # light up LEDs with current motor status
     __leds: MotorLeds = None
 
+    # all pin writes go through this cache, so unchanged pins aren't written again
+    __gpio: CachedGpioOutput = None
+
+    # record every motor start and stop
+    __auditLog: AuditLog = None
+
+    # cuts the motor's power when a move overruns, or this thread dies or stalls
+    __watchdog: MotorWatchdog = None
+
+    # new config (see BlindConfig), waiting for the loop to apply it
+    __pendingConfig: PendingConfig = None
+
+    # steps of a motion sequence still to run, None when there is no sequence
+    # - the lock keeps a later instruction from being overwritten by the sequence it cancels
+    __sequence: Optional[SequenceRun] = None
+    __sequenceLock: threading.Lock = None
+
+    # direction the motor was last sent in, and when that direction started
+    # - a sequence goes past the debouncer (see AdmissionControl), so its moves are held back here
+    #   until the motor has run the other way for the same minimum dwell
+    __minimumReversalDwellInSeconds: float = None
+    __lastDirectionIsUpward: Optional[bool] = None
+    __lastDirectionChangedAt: float = None
+
+    # a hot upgrade (see HotUpgrade) parks the loop while a new process takes over the move
+    # - parked, the loop leaves the motor, the pins and the position alone, and only keeps the watchdog fed
+    __park: threading.Event = None
+    __parked: threading.Event = None
+    __unpark: threading.Event = None
+    __snapshot: Optional[Dict] = None
+
+    # the move a previous process handed over, carried on by `run()`
+    __adopted: Optional[Dict] = None
+
+    # counters for tuning
+    sequencesStarted: int = 0
+    sequencesCancelled: int = 0
+    sequenceStepsRun: int = 0
+    sequenceReversalsDelayed: int = 0
+
     def __init__(
             self,
             _file: TextIO,
             _initialBlindExtensionLength: float = 0,
             _blindHeightInCm: float = 200,
-            _blindSpeedInCmPerSecond: float = 8
+            _blindSpeedInCmPerSecond: float = 8,
+            _gpio: CachedGpioOutput = None,
+            _pwmBackend: PwmBackend = None,
+            _pwmBackendName: Optional[str] = None,
+            _auditLog: AuditLog = None,
+            _config: Dict = None,
+            _adopt: Dict = None,
+            _minimumReversalDwellInSeconds: float = 1.5
     ):
         super().__init__()
         # setup file to write new states to
@@ -108,12 +169,19 @@ class ThreadMotorController(threading.Thread):
 
         # handle stopping of threads
         self.__stop_event = threading.Event()
+        self.__park = threading.Event()
+        self.__parked = threading.Event()
+        self.__unpark = threading.Event()
 
         # setup blind data
         self.__instruction = deepcopy(self.__getStopInstruction())
         self.__blindHeightInCm = _blindHeightInCm
         self.__blindSpeedInCmPerSecond = _blindSpeedInCmPerSecond
 
+        self.__sequenceLock = threading.Lock()
+        self.__minimumReversalDwellInSeconds = _minimumReversalDwellInSeconds
+        self.__lastDirectionChangedAt = -_minimumReversalDwellInSeconds
+
         # make it possible to pause this thread
         self.paused = True
         self.state = threading.Condition()
@@ -121,17 +189,168 @@ class ThreadMotorController(threading.Thread):
         # register what length the blind is extended to currently
         self.__blindExtensionLength = _initialBlindExtensionLength
 
+        # the config file has the final say, over the arguments and defaults
+        self.__pendingConfig = PendingConfig()
+        if _config is not None:
+            self.__useConfig(_config)
+
+        # carry on the move of the previous process (see `handOver()`), instead of starting from a standstill
+        self.__ramp = DutyCycleRamp()
+        self.__adopted = _adopt
+        if _adopt is not None:
+            self.__adoptMove(_adopt)
+
         # enable pins for h-bridge
-        GPIO.setup(self.__bridgeInput1Pin, GPIO.OUT)
-        GPIO.setup(self.__bridgeInput2Pin, GPIO.OUT)
-        GPIO.setup(self.__bridgePwmPin, GPIO.OUT)
+        # - an adopted move keeps the levels the previous process left the pins at
+        self.__gpio = _gpio if _gpio is not None else CachedGpioOutput()
+        self.__gpio.setup(self.__bridgeInput1Pin, self.__movingUpward is True)
+        self.__gpio.setup(self.__bridgeInput2Pin, self.__movingUpward is False)
 
         # prepare pwm for controlling of motor's speed
-        self.__pwm: GPIO.PWM = GPIO.PWM(self.__bridgePwmPin, self.__pwmFrequency)
+        # - the pwm pin belongs to the PWM backend, nothing else writes it
+        # - the backend is `_pwmBackendName`, or else the one named in the config (`motor.pwmBackend`)
+        if _pwmBackendName is None:
+            _pwmBackendName = _config["motor"]["pwmBackend"] if _config is not None else rpiGpioBackend
+        self.__pwm: PwmBackend = (
+            _pwmBackend if _pwmBackend is not None
+            else createPwmBackend(_pwmBackendName, self.__bridgePwmPin, self.__pwmFrequency)
+        )
         self.__pwm.start(self.__presentDutyCycle)
 
         # initialise LED lights
-        self.__leds: MotorLeds = MotorLeds()
+        self.__leds: MotorLeds = MotorLeds(self.__gpio, self.__commandShownByLeds())
+
+        self.__auditLog = _auditLog
+
+        self.__watchdog = MotorWatchdog(_forceStop=self.emergencyStop, _isMotorThreadAlive=self.is_alive)
+
+    def start(self):
+        super().start()
+        self.__watchdog.start()
+
+    def __adoptMove(self, _state: Dict):
+        """
+        Take the motor over from a snapshot of `handOver()`, the time since the snapshot is counted by `run()`
+        """
+        print(f"ADOPTING MOVE: {_state}")
+        sinceSnapshot = max(0.0, time() - _state["capturedAt"])
+        self.__blindExtensionLength = _state["position"]
+        self.__instruction = _state["instruction"]
+        self.__movingUpward = _state["movingUpward"]
+        self.__speedFraction = _state["speedFraction"]
+        self.__presentDutyCycle = _state["dutyCycle"]
+
+        # the rest of a kick or ramp, on the same clock as before
+        if _state["ramp"]:
+            self.__ramp.begin([RampStep(*_step) for _step in _state["ramp"]], timer() - sinceSnapshot)
+
+        if _state["sequence"] is not None:
+            steps = _state["sequence"]["steps"]
+            self.__sequence = SequenceRun(compileSequence(steps, self.__blindHeightInCm) if steps else [])
+            self.__sequence.started = _state["sequence"]["started"]
+            self.__sequence.resumeAt = timer() + _state["sequence"]["resumeInSeconds"] - sinceSnapshot
+
+    def __commandShownByLeds(self) -> Command:
+        # the LEDs of an adopted move are lit as `__actOnNewInstruction()` lit them
+        if self.__adopted is None or self.__adopted["runningInstruction"]["value"] == Command.Stop.value:
+            return Command.Stop
+        return Command.Up if self.__adopted["shouldMoveUpward"] else Command.Down
+
+    def handOver(self, _timeoutInSeconds: float = 1) -> Optional[Dict]:
+        """
+        Park the loop and return its move, for a new process to carry on (see HotUpgrade), None when it didn't park
+        - the motor keeps running as it is, the parked loop writes nothing and doesn't track the position
+        - follow with `release()` once the new process took over, or `resume()` when it didn't
+        """
+        self.__unpark.clear()
+        self.__park.set()
+        if self.__parked.wait(_timeoutInSeconds):
+            return self.__snapshot
+
+        self.resume()
+        return None
+
+    def canHandOver(self) -> bool:
+        """
+        Whether the motor's PWM output keeps running while a new process takes it over, see `handOver()`
+        """
+        return self.__pwm.survivesHandoff
+
+    def resume(self):
+        self.__park.clear()
+        self.__unpark.set()
+
+    def release(self):
+        """
+        End this thread after a hot upgrade, the motor is the new process's now
+        - unlike `cleanup()` nothing is stopped, written to disk or tidied up
+        """
+        print("RELEASED: motor was handed over to a new process")
+        self.__watchdog.cleanup()
+        self.__stop_event.set()
+        self.__unpark.set()
+
+    def __snapshotOf(self, _currentCommand: Dict, _loopCheckPointTime: float, _shouldMoveUpward: bool,
+                     _newRequestedLength: float) -> Dict:
+        """
+        Everything `__adoptMove()` and `run()` need to carry on the move, as json
+        """
+        now = timer()
+        position = self.__blindExtensionLength
+        if _currentCommand["value"] != Command.Stop.value:
+            position = self.__calculateNewBlindPosition(loopCheckPointTime=_loopCheckPointTime, now=now)
+
+        with self.__sequenceLock:
+            sequence = self.__sequence
+            remainingSteps = sequence.remaining() if sequence is not None else []
+
+        return {
+            "capturedAt": time(),
+            "position": position,
+            "instruction": deepcopy(self.__instruction),
+            "runningInstruction": deepcopy(_currentCommand),
+            "shouldMoveUpward": _shouldMoveUpward,
+            "newRequestedLength": _newRequestedLength,
+            "movingUpward": self.__movingUpward,
+            "speedFraction": self.__speedFraction,
+            "dutyCycle": self.__presentDutyCycle,
+            "ramp": [list(_step) for _step in self.__ramp.remaining(now)],
+            "sequence": None if sequence is None else {
+                "steps": encodeSequence(remainingSteps) if remainingSteps else None,
+                "started": sequence.started,
+                "resumeInSeconds": max(0.0, sequence.resumeAt - now),
+            },
+        }
+
+    def __parkLoop(self, _currentCommand: Dict, _loopCheckPointTime: float, _shouldMoveUpward: bool,
+                   _newRequestedLength: float):
+        """
+        Leave the motor as it is until `resume()` or `release()`
+        """
+        self.__snapshot = self.__snapshotOf(
+            _currentCommand, _loopCheckPointTime, _shouldMoveUpward, _newRequestedLength
+        )
+        print(f"PARKED: {self.__snapshot}")
+        self.__watchdog.moveFinished()
+        self.__parked.set()
+
+        # keep the watchdog from taking the pause for a stalled thread
+        while not self.__unpark.wait(0.05):
+            self.__watchdog.heartbeats += 1
+        self.__parked.clear()
+        self.__park.clear()
+
+        # the blind kept moving meanwhile, the next iteration counts that in, and the rest gets a new deadline
+        if not self.__stop_event.is_set() and _currentCommand["value"] != Command.Stop.value:
+            print("RESUMED: motor was not handed over")
+            self.__startWatchdogDeadline(_newRequestedLength)
+
+    def __startWatchdogDeadline(self, _newRequestedLength: float):
+        # give the watchdog a deadline for this move
+        self.__watchdog.moveStarted(
+            abs(_newRequestedLength - self.__blindExtensionLength) / self.__blindSpeedInCmPerSecond
+            + self.__ramp.remainingSeconds(timer())
+        )
 
     @staticmethod
     def __getStopInstruction():
@@ -145,6 +364,96 @@ class ThreadMotorController(threading.Thread):
         # simple helper that caller can use for getting latest blind state
         return self.__instruction['value']
 
+    def currentBlindExtensionLength(self) -> float:
+        # simple helper that caller can use for getting latest blind position
+        return self.__blindExtensionLength
+
+    def blindHeightInCm(self) -> float:
+        # simple helper that caller can use to check a length before sending it
+        return self.__blindHeightInCm
+
+    def gpioCounters(self) -> Dict[str, int]:
+        # simple helper that caller can use to see how many pin writes were avoided
+        return self.__gpio.counters()
+
+    def health(self) -> Dict:
+        # simple helper that caller can use to see whether the motor is under control
+        return self.__watchdog.health()
+
+    def applyConfig(self, _config: Dict, _changedAt: float):
+        """
+        Caller (e.g. `BlindConfig.ConfigWatcher`) uses this to change settings while the motor runs
+        - the loop applies all of it between two iterations
+        """
+        self.__pendingConfig.offer(_config, _changedAt)
+
+    def __useConfig(self, _config: Dict):
+        self.__blindHeightInCm = _config["blind"]["heightInCm"]
+        self.__blindSpeedInCmPerSecond = _config["blind"]["speedInCmPerSecond"]
+        self.__lowPowerForLoweringBlind = _config["motor"]["lowPowerForLoweringBlind"]
+        self.__highPowerForRaisingBlind = _config["motor"]["highPowerForRaisingBlind"]
+        self.__bridgeInput1Pin = _config["motor"]["bridgeInput1Pin"]
+        self.__bridgeInput2Pin = _config["motor"]["bridgeInput2Pin"]
+        self.__bridgePwmPin = _config["motor"]["bridgePwmPin"]
+
+    def __applyPendingConfig(self) -> bool:
+        """
+        Apply the new config, unless it moves the motor's pins while the motor is running
+        - then all of it waits until the motor has stopped, so it's never applied in parts
+        """
+        pending = self.__pendingConfig.take()
+        if pending is None:
+            return False
+
+        config, changedAt = pending
+        oldPins = (self.__bridgeInput1Pin, self.__bridgeInput2Pin, self.__bridgePwmPin)
+        newPins = (
+            config["motor"]["bridgeInput1Pin"], config["motor"]["bridgeInput2Pin"], config["motor"]["bridgePwmPin"]
+        )
+        isRunning = self.__instruction["value"] != Command.Stop.value or self.__ramp.isRunning()
+        if newPins != oldPins and isRunning:
+            self.__pendingConfig.putBack(pending)
+            return False
+
+        self.__useConfig(config)
+
+        if newPins != oldPins:
+            print(f"CONFIG: moving motor pins from {oldPins} to {newPins}")
+            self.__gpio.writeMany({oldPins[0]: False, oldPins[1]: False})
+            self.__gpio.forget(oldPins[:2])
+            self.__gpio.setup(self.__bridgeInput1Pin)
+            self.__gpio.setup(self.__bridgeInput2Pin)
+            if newPins[2] != oldPins[2]:
+                self.__pwm.repin(self.__bridgePwmPin)
+
+        # a shorter blind may already be past its new end
+        self.__ensureValuesAreWithinConstraints(write=True)
+
+        # a running move continues at the new duty cycle
+        if self.__presentDutyCycle != self.__stoppedNoPower and not self.__ramp.isRunning():
+            self.__presentDutyCycle = self.__getDutyCycle(_upward=self.__movingUpward)
+            self.__pwm.changeDutyCycle(self.__presentDutyCycle)
+
+        recordInEffect(changedAt)
+        return True
+
+    def emergencyStop(self, _reason: str):
+        """
+        Cut the motor's power from another thread, e.g. the watchdog's, even when this thread has died
+        - the bridge inputs are pulled low too, in case the pwm is what's stuck
+        - a live loop takes the stop as a new instruction, and updates the position as usual
+        """
+        self.__ramp.cancel()
+        with self.__sequenceLock:
+            self.__sequence = None
+        self.__presentDutyCycle = self.__stoppedNoPower
+        self.__pwm.changeDutyCycle(self.__stoppedNoPower)
+        self.__gpio.writeMany({self.__bridgeInput1Pin: False, self.__bridgeInput2Pin: False})
+        self.__leds.command(Command.Stop)
+        self.__audit("motorStop", _detail=f"watchdog: {_reason}")
+
+        self.__instruction = deepcopy(self.__getStopInstruction())
+
     def instruct(self, instruction) -> bool:
         """
         Caller uses this public method to send new instruction for the motor
@@ -155,24 +464,153 @@ class ThreadMotorController(threading.Thread):
         print(".................... INSTRUCTION ......................")
         print()
 
-        self.__instruction = {
-            "value": instruction,
-            "timestamp": time()
-        }
+        # any new instruction cancels the rest of a running sequence
+        with self.__sequenceLock:
+            if self.__sequence is not None:
+                self.__sequence = None
+                self.sequencesCancelled += 1
+
+            self.__instruction = {
+                "value": instruction,
+                "timestamp": time()
+            }
+            self.__noteDirection(instruction, timer())
 
         return True
 
+    def runSequence(self, _steps: List[SequenceStep]) -> bool:
+        """
+        Caller uses this to run several steps back-to-back (see MotionSequence)
+        - takes over from whatever the motor is doing, like any new instruction
+        """
+        print(f"SEQUENCE OF {len(_steps)} STEPS: {[_step.encode() for _step in _steps]}")
+        with self.__sequenceLock:
+            if self.__sequence is not None:
+                self.sequencesCancelled += 1
+            self.__sequence = SequenceRun(_steps)
+            self.sequencesStarted += 1
+        return True
+
+    def __advanceSequence(self, sequence: Optional[SequenceRun]):
+        """
+        Start the next step of the sequence, once the previous move or wait has finished
+        - takes the sequence as the loop read it, `instruct()` or an emergency stop may clear it at any time
+        """
+        if sequence is None:
+            return
+
+        now = timer()
+        isMoving = self.__instruction["value"] != Command.Stop.value or self.__ramp.isRunning()
+        if sequence.started and (isMoving or now < sequence.resumeAt):
+            return
+
+        with self.__sequenceLock:
+            # cancelled meanwhile
+            if self.__sequence is not sequence:
+                return
+
+            # give the motor time to settle before reversing it, the step stays next in line
+            step = sequence.peekStep()
+            if step is not None and step.instruction is not None and self.__isEarlyReversal(step.instruction, now):
+                if not sequence.isHeldBack:
+                    sequence.isHeldBack = True
+                    self.sequenceReversalsDelayed += 1
+                return
+            sequence.isHeldBack = False
+
+            step = sequence.nextStep()
+            if step is None:
+                print("SEQUENCE FINISHED")
+                self.__sequence = None
+                return
+
+            print(f"SEQUENCE STEP: {step.encode()}, {sequence.remainingSteps()} to go")
+            self.sequenceStepsRun += 1
+            if step.instruction is None:
+                sequence.resumeAt = timer() + step.waitInSeconds
+            else:
+                self.__instruction = {
+                    "value": step.instruction,
+                    "timestamp": time()
+                }
+                self.__noteDirection(step.instruction, now)
+
+    def __direction(self, _instruction: str) -> Optional[bool]:
+        """
+        True for upward, False for downward, None when the motor won't move, as the debouncer sees it
+        """
+        if _instruction == Command.Up.value:
+            return True
+        if _instruction == Command.Down.value:
+            return False
+
+        try:
+            _newExtensionLength = float(_instruction)
+        except ValueError:
+            return None
+
+        # numeric instructions are positions, i.e. a shorter blind means moving upward
+        return _newExtensionLength < self.__blindExtensionLength
+
+    def __noteDirection(self, _instruction: str, _now: float):
+        direction = self.__direction(_instruction)
+        if direction is not None and direction != self.__lastDirectionIsUpward:
+            self.__lastDirectionIsUpward = direction
+            self.__lastDirectionChangedAt = _now
+
+    def __isEarlyReversal(self, _instruction: str, _now: float) -> bool:
+        direction = self.__direction(_instruction)
+        return (
+                direction is not None and
+                self.__lastDirectionIsUpward is not None and
+                direction != self.__lastDirectionIsUpward and
+                _now < self.__lastDirectionChangedAt + self.__minimumReversalDwellInSeconds
+        )
+
     def __setDirectionOfRotation(self, _upward: bool):
         """
         reverse the direction of the motor by inverting states of input pins
         """
-        input1, input2 = (GPIO.HIGH, GPIO.LOW) if _upward else (GPIO.LOW, GPIO.HIGH)
+        input1, input2 = (True, False) if _upward else (False, True)
         print(f'{input1=}')
         print(f'{input2=}')
-        GPIO.output(self.__bridgePwmPin, False)
-        GPIO.output(self.__bridgeInput1Pin, input1)
-        GPIO.output(self.__bridgeInput2Pin, input2)
-        GPIO.output(self.__bridgePwmPin, True)
+
+        # cut power before touching the inputs, then switch both inputs in one batch
+        # - when the direction hasn't changed, the inputs are not written at all
+        # - power comes back with the ramp step's duty cycle, see `__applyRampSteps()`
+        self.__pwm.changeDutyCycle(self.__stoppedNoPower)
+        self.__gpio.writeMany({
+            self.__bridgeInput1Pin: input1,
+            self.__bridgeInput2Pin: input2,
+        })
+
+    def __startMotor(self, _upward: bool, _startProfile: Callable[[bool, float], List[RampStep]]):
+        """
+        Begin a move, softly
+        - from a standstill the start profile is played, e.g. a kick
+        - when running the other way, the motor is ramped down before it is reversed
+        - when already running this way, only the duty cycle changes
+        """
+        dutyCycle = self.__getDutyCycle(_upward=_upward)
+        print(f"{dutyCycle=}")
+
+        if self.__presentDutyCycle == self.__stoppedNoPower:
+            profile = _startProfile(_upward, dutyCycle)
+        elif self.__movingUpward != _upward:
+            profile = followedBy(rampDownProfile(self.__presentDutyCycle), _startProfile(_upward, dutyCycle))
+        else:
+            profile = steadyProfile(dutyCycle)
+
+        self.__ramp.begin(profile, timer())
+
+    def __applyRampSteps(self, _now: float):
+        for _step in self.__ramp.due(_now):
+            if _step.upward is not None:
+                self.__setDirectionOfRotation(_upward=_step.upward)
+                self.__movingUpward = _step.upward
+            self.__presentDutyCycle = _step.dutyCycle
+            self.__pwm.changeDutyCycle(_step.dutyCycle)
+            self.__speedFraction = _step.speedFraction
 
     def __getDutyCycle(self, _upward: bool) -> float:
         """
@@ -181,6 +619,14 @@ class ThreadMotorController(threading.Thread):
         """
         return self.__highPowerForRaisingBlind if _upward else self.__lowPowerForLoweringBlind
 
+    def __audit(self, _kind: str, _detail: str = None):
+        if self.__auditLog is not None:
+            self.__auditLog.record(
+                _kind, _source="motor", _instruction=self.__instruction["value"],
+                _position=self.__blindExtensionLength, _detail=_detail
+            )
+
+    @Timings.timed("motor.actOnNewInstruction")
     def __actOnNewInstruction(self) -> Instruction:
         """
         Motor is controlled here
@@ -213,18 +659,13 @@ class ThreadMotorController(threading.Thread):
                 )
 
             # DO retracting of blind to zero length from current length
-            # prepare motor
-            self.__setDirectionOfRotation(_upward=True)
-            self.__presentDutyCycle = self.__getDutyCycle(_upward=True)
-            print(f"{self.__presentDutyCycle=}")
-
-            # get motor running, then change to correct duty cycle
-            self.__pwm.start(100)
-            sleep(0.25)
-            self.__pwm.ChangeDutyCycle(self.__presentDutyCycle)
+            # get motor running with a kick, then change to correct duty cycle
+            # - the kick is played by the loop, so a new instruction can cut it short
+            self.__startMotor(_upward=True, _startProfile=kickProfile)
 
             # update status-light
             self.__leds.command(Command.Up)
+            self.__audit("motorStart")
 
             # return latest state
             print(")) running motor upward now")
@@ -246,19 +687,14 @@ class ThreadMotorController(threading.Thread):
                 )
 
             # DO extending of blind to maximum length
-            # prepare motor
-            self.__setDirectionOfRotation(_upward=False)
-            self.__presentDutyCycle = self.__getDutyCycle(_upward=False)
-            print(f"{self.__presentDutyCycle=}")
-
-            # get motor running, then change to correct duty cycle
+            # get motor running with a kick, then change to correct duty cycle
+            # - the kick is played by the loop, so a new instruction can cut it short
             print(")) running motor downward now")
-            self.__pwm.start(100)
-            sleep(0.25)
-            self.__pwm.ChangeDutyCycle(self.__presentDutyCycle)
+            self.__startMotor(_upward=False, _startProfile=kickProfile)
 
             # update status-light
             self.__leds.command(Command.Down)
+            self.__audit("motorStart")
 
             # return latest state
             return Instruction(
@@ -282,20 +718,16 @@ class ThreadMotorController(threading.Thread):
         print(f'{shouldMoveBlindUpward=}')
         print(f'{difference=}')
 
-        # prepare motor
-        self.__setDirectionOfRotation(_upward=shouldMoveBlindUpward)
-        self.__presentDutyCycle = self.__getDutyCycle(_upward=shouldMoveBlindUpward)
-
-        # start rolling the blind in the required direction
-        self.__pwm.ChangeDutyCycle(self.__presentDutyCycle)
+        # start rolling the blind in the required direction, ramping up to the correct duty cycle
+        self.__startMotor(_upward=shouldMoveBlindUpward, _startProfile=rampUpProfile)
         print(f"))NOTICE: running motor {shouldMoveBlindUpward=}")
-        print(f"{self.__presentDutyCycle=}")
 
         # update status-light
         if shouldMoveBlindUpward:
             self.__leds.command(Command.Up)
         else:
             self.__leds.command(Command.Down)
+        self.__audit("motorStart")
 
         # return latest state
         return Instruction(
@@ -303,15 +735,19 @@ class ThreadMotorController(threading.Thread):
             _newRequestedLength=_newExtensionLength
         )
 
-    def __calculateNewBlindPosition(self, loopCheckPointTime, shouldMoveUpward) -> float:
+    def __calculateNewBlindPosition(self, loopCheckPointTime, now: float = None) -> float:
         """
         Calculate new length of blind after it has moved
+        - pass `now` when it becomes the next checkpoint, so no time falls between two readings of the clock
+        - the blind moves the way the motor is actually turning, which during a reversal
+          is still the old way, and slower while ramping
         """
-        amountBlindMoved = (timer() - loopCheckPointTime) * self.__blindSpeedInCmPerSecond
+        now = timer() if now is None else now
+        amountBlindMoved = (now - loopCheckPointTime) * self.__blindSpeedInCmPerSecond * self.__speedFraction
 
         updatedLength = (
             # when OPENING the blind, the extension length is getting shorter
-            self.__blindExtensionLength - amountBlindMoved if shouldMoveUpward
+            self.__blindExtensionLength - amountBlindMoved if self.__movingUpward
             # when CLOSING blind, the extension length is getting longer
             else self.__blindExtensionLength + amountBlindMoved
         )
@@ -367,9 +803,16 @@ class ThreadMotorController(threading.Thread):
         """
         Helper for stopping the motor and doing all related tasks
         """
+        wasRunning = self.__presentDutyCycle != self.__stoppedNoPower or self.__ramp.isRunning()
+        self.__ramp.cancel()
+        self.__speedFraction = 0.0
         self.__presentDutyCycle = self.__stoppedNoPower
-        self.__pwm.ChangeDutyCycle(self.__presentDutyCycle)
+        self.__pwm.changeDutyCycle(self.__presentDutyCycle)
         self.__leds.command(Command.Stop)
+        self.__watchdog.moveFinished()
+
+        if wasRunning:
+            self.__audit("motorStop")
 
     def run(self):
         """
@@ -388,9 +831,36 @@ class ThreadMotorController(threading.Thread):
         shouldMoveUpward = False
         newRequestedLength = 0
         counterCheckpointTime = timer()
+        loopTimer = Timings.loop("motor.loopIteration")
+
+        # carry on the move the previous process handed over, the blind kept moving since its snapshot
+        if self.__adopted is not None:
+            currentCommand = deepcopy(self.__adopted["runningInstruction"])
+            shouldMoveUpward = self.__adopted["shouldMoveUpward"]
+            newRequestedLength = self.__adopted["newRequestedLength"]
+            loopCheckPointTime = timer() - max(0.0, time() - self.__adopted["capturedAt"])
+            if currentCommand["value"] != Command.Stop.value:
+                self.__startWatchdogDeadline(newRequestedLength)
 
         # run in a loop until the thread is killed
         while not self.__stop_event.is_set():
+            loopTimer.lap()
+            self.__watchdog.heartbeats += 1
+
+            # a new process is taking over, see `handOver()`
+            if self.__park.is_set():
+                self.__parkLoop(currentCommand, loopCheckPointTime, shouldMoveUpward, newRequestedLength)
+                continue
+
+            # settings changed while running, see BlindConfig
+            if self.__pendingConfig.isWaiting:
+                self.__applyPendingConfig()
+
+            # next step of a motion sequence, with no round trip to the caller in between
+            with self.__sequenceLock:
+                sequence = self.__sequence
+            self.__advanceSequence(sequence)
+
             # avoid trying to re-run current command
             # - e.g. user pressed the same button on the remote twice
             newInstructionReceived = currentCommand != self.__instruction
@@ -407,7 +877,7 @@ class ThreadMotorController(threading.Thread):
                 if currentCommand["value"] != Command.Stop.value:
                     # update tracking data
                     self.__blindExtensionLength = self.__calculateNewBlindPosition(
-                        loopCheckPointTime=loopCheckPointTime, shouldMoveUpward=shouldMoveUpward
+                        loopCheckPointTime=loopCheckPointTime
                     )
                     self.__ensureValuesAreWithinConstraints()
                     self.__writeNewLengthToDisk()
@@ -422,6 +892,10 @@ class ThreadMotorController(threading.Thread):
                 )
                 print(f'{shouldMoveUpward=}')
 
+                # give the watchdog a deadline for this move
+                if currentCommand["value"] != Command.Stop.value:
+                    self.__startWatchdogDeadline(newRequestedLength)
+
                 # start tracking time elapsed since last loop ran
                 loopCheckPointTime = timer()
 
@@ -432,11 +906,11 @@ class ThreadMotorController(threading.Thread):
 
             # new instructions running
             # use loop time tracker to calculate the latest blind length
+            now = timer()
             self.__blindExtensionLength = self.__calculateNewBlindPosition(
-                loopCheckPointTime=loopCheckPointTime, shouldMoveUpward=shouldMoveUpward
+                loopCheckPointTime=loopCheckPointTime, now=now
             )
             self.__ensureValuesAreWithinConstraints()
-            now = timer()
 
             # only print latest state every second to lessen strain on Pi
             if now - counterCheckpointTime > 1:
@@ -448,6 +922,9 @@ class ThreadMotorController(threading.Thread):
             # reset the loop time tracker
             loopCheckPointTime = now
 
+            # play the next steps of a kick or ramp, once the time before them was tracked at the old speed
+            self.__applyRampSteps(now)
+
             # check of goal state was achieved
             blindHasFinishedRolling = self.__hasBlindHasFinishedRolling(
                 _shouldMoveUpward=shouldMoveUpward,
@@ -480,6 +957,9 @@ class ThreadMotorController(threading.Thread):
         """
         print("CLEANUP REQUESTED: Start motor controller cleanup")
 
+        # the motor is being stopped on purpose, the watchdog has nothing left to do
+        self.__watchdog.cleanup()
+
         # make sure latest state was flush to disk
         self.__writeNewLengthToDisk()
 
@@ -487,6 +967,7 @@ class ThreadMotorController(threading.Thread):
         self.__pwm.stop()
         self.__leds.cleanup()
         GPIO.cleanup()
+        print(f"GPIO WRITES: {self.__gpio.counters()}")
 
         # stop this thread
         print("Stop thread")
@@ -0,0 +1,298 @@
+import argparse
+import itertools
+import sys
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from LightHysteresis import LightHysteresis
+
+"""
+Offline tuning of the light sensor's boundaries (`_closeBlindWhenDarkerThan`, `_closeBlindWhenBrighterThan`)
+and median filter, over long recordings of light readings
+- `LightHysteresis` is re-implemented with whole-array NumPy operations, so thousands of combinations
+  can be swept over millions of readings in seconds
+- for every combination: how many instructions would have been sent, and how long the blind would have
+  been open and closed
+- early closes ahead of a crossing (see LightTrend) aren't modelled, the light sensor only makes them when
+  it's given a lead time
+
+Readings can be a CSV (`reading` or `timestamp,reading` per line), a `.npy` array, or raw binary (`--dtype`).
+Readings without timestamps are `--interval` seconds apart.
+
+Run e.g.
+  `python ThresholdTuner.py light.csv --dark 50:200:10 --bright 500:900:20 --windows 1,3,5`
+  `python ThresholdTuner.py --verify` (the online and offline decisions must be identical)
+"""
+
+# decision codes, in the order of `LightHysteresis`'s checks
+_noDecision, _opensForNormalLight, _closesForDark, _closesForBright = 0, 1, 2, 3
+_reasons = {
+    _opensForNormalLight: LightHysteresis.normalLight,
+    _closesForDark: LightHysteresis.tooDark,
+    _closesForBright: LightHysteresis.tooBright,
+}
+
+
+def _previous(_values: np.ndarray) -> np.ndarray:
+    # value of the element before each element, -1 before the first
+    shifted = np.empty_like(_values)
+    shifted[0] = -1
+    shifted[1:] = _values[:-1]
+    return shifted
+
+
+def _lastIndexWhere(_mask: np.ndarray, _indices: np.ndarray) -> np.ndarray:
+    # index of the most recent element (so far) where the mask is set, -1 when there is none
+    return np.maximum.accumulate(np.where(_mask, _indices, -1))
+
+
+def medianFiltered(_readings: np.ndarray, _medianWindow: int) -> np.ndarray:
+    """
+    Median of each reading and the ones before it, NaN until the window is full (nothing is decided then)
+    """
+    if _medianWindow == 1:
+        return _readings
+    filtered = np.full(_readings.shape, np.nan)
+    filtered[_medianWindow - 1:] = np.median(sliding_window_view(_readings, _medianWindow), axis=1)
+    return filtered
+
+
+def decide(_filtered: np.ndarray, _tooDark: float, _tooBright: float) -> np.ndarray:
+    """
+    The decision code for every reading, identical to feeding them one by one to `LightHysteresis.update()`
+    - the blind's flags are only cleared by a reading between the boundaries, so:
+      - a low reading closes the blind if it is the first low reading since the last normal one
+      - a high reading closes the blind if it is the first high reading since the last normal one
+      - a normal reading opens the blind if there was any low or high reading since the last normal one
+    """
+    if not _tooDark < _tooBright:
+        raise ValueError(f"dark boundary {_tooDark} must be below the bright boundary {_tooBright}")
+
+    indices = np.arange(len(_filtered))
+
+    # comparisons with NaN are False, so readings before the median window is full do nothing
+    isLow = _filtered < _tooDark
+    isHigh = _filtered > _tooBright
+    isNormal = (_filtered > _tooDark) & (_filtered < _tooBright)
+
+    previousNormal = _previous(_lastIndexWhere(isNormal, indices))
+    previousLow = _previous(_lastIndexWhere(isLow, indices))
+    previousHigh = _previous(_lastIndexWhere(isHigh, indices))
+
+    opens = isNormal & (np.maximum(previousLow, previousHigh) > previousNormal)
+    closesForDark = isLow & (previousLow <= previousNormal)
+    closesForBright = isHigh & (previousHigh <= previousNormal)
+
+    decisions = np.zeros(len(_filtered), dtype=np.int8)
+    decisions[opens] = _opensForNormalLight
+    decisions[closesForDark] = _closesForDark
+    decisions[closesForBright] = _closesForBright
+    return decisions
+
+
+def _side(_filtered: np.ndarray, _boundary: float) -> np.ndarray:
+    # -1 below, 0 exactly on, 1 above the boundary, 2 before the median window is full
+    side = np.sign(_filtered - _boundary)
+    return np.where(np.isnan(side), 2, side).astype(np.int8)
+
+
+def _runStarts(_sides: np.ndarray) -> np.ndarray:
+    # index of the first reading of every run of readings on the same side
+    return np.flatnonzero(np.concatenate(([True], _sides[1:] != _sides[:-1])))
+
+
+def decideAtRunStarts(
+        _filtered: np.ndarray,
+        _darkRunStarts: np.ndarray,
+        _brightRunStarts: np.ndarray,
+        _tooDark: float,
+        _tooBright: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same decisions as `decide()`, from only the first reading of every run of readings in the same range
+    - a reading in the same range as the one before can't change the flags, so it never decides anything
+    - a sweep then only looks at the (few) readings where the light crossed one of the two boundaries
+    """
+    runStarts = np.union1d(_darkRunStarts, _brightRunStarts)
+    return runStarts, decide(_filtered[runStarts], _tooDark, _tooBright)
+
+
+def summarise(
+        _decisionIndices: np.ndarray,
+        _decisions: np.ndarray,
+        _cumulativeDurations: np.ndarray
+) -> Dict[str, float]:
+    """
+    Instructions sent, and time spent open and closed (the blind starts open)
+    - `_cumulativeDurations[i]` is when reading `i` started, with the end of the recording last
+    """
+    hasDecision = _decisions != _noDecision
+    decided = _decisions[hasDecision]
+    decidedAt = _decisionIndices[hasDecision]
+
+    # the blind is closed from each closing decision until the next decision, or the end
+    decisionStarts = _cumulativeDurations[decidedAt]
+    decisionEnds = np.append(decisionStarts[1:], _cumulativeDurations[-1])
+    isClosing = decided != _opensForNormalLight
+    closedSeconds = float((decisionEnds - decisionStarts)[isClosing].sum())
+    totalSeconds = float(_cumulativeDurations[-1])
+
+    return {
+        "instructions": int(hasDecision.sum()),
+        "opens": int((decided == _opensForNormalLight).sum()),
+        "closesForDark": int((decided == _closesForDark).sum()),
+        "closesForBright": int((decided == _closesForBright).sum()),
+        "openHours": round((totalSeconds - closedSeconds) / 3600, 3),
+        "closedHours": round(closedSeconds / 3600, 3),
+    }
+
+
+def sweep(
+        _readings: np.ndarray,
+        _durations: np.ndarray,
+        _darkBoundaries: List[float],
+        _brightBoundaries: List[float],
+        _medianWindows: List[int]
+) -> List[Dict[str, float]]:
+    cumulativeDurations = np.concatenate(([0.0], np.cumsum(_durations)))
+
+    results = []
+    for _medianWindow in _medianWindows:
+        filtered = medianFiltered(_readings, _medianWindow)
+
+        # where the light crosses each boundary, once per boundary rather than once per combination
+        darkRunStarts = {_tooDark: _runStarts(_side(filtered, _tooDark)) for _tooDark in _darkBoundaries}
+        brightRunStarts = {_tooBright: _runStarts(_side(filtered, _tooBright)) for _tooBright in _brightBoundaries}
+
+        for _tooDark, _tooBright in itertools.product(_darkBoundaries, _brightBoundaries):
+            if not _tooDark < _tooBright:
+                continue
+            runStarts, decisions = decideAtRunStarts(
+                filtered, darkRunStarts[_tooDark], brightRunStarts[_tooBright], _tooDark, _tooBright
+            )
+            results.append({
+                "tooDark": _tooDark,
+                "tooBright": _tooBright,
+                "medianWindow": _medianWindow,
+                **summarise(runStarts, decisions, cumulativeDurations),
+            })
+    return results
+
+
+def loadReadings(_path: Path, _interval: float, _dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the readings, and how long each reading lasted in seconds
+    """
+    if _path.suffix == ".csv":
+        table = np.loadtxt(_path, delimiter=",", ndmin=2, dtype=np.float64)
+        timestamps = table[:, 0] if table.shape[1] > 1 else None
+        readings = table[:, -1]
+    elif _path.suffix == ".npy":
+        readings = np.load(_path).astype(np.float64)
+        timestamps = None
+    else:
+        readings = np.fromfile(_path, dtype=_dtype).astype(np.float64)
+        timestamps = None
+
+    if timestamps is None:
+        return readings, np.full(len(readings), _interval)
+
+    # each reading lasts until the next one, the last one for the typical gap
+    durations = np.empty(len(readings))
+    durations[:-1] = np.diff(timestamps)
+    durations[-1] = np.median(durations[:-1]) if len(readings) > 1 else _interval
+    return readings, durations
+
+
+def _parseRange(_value: str) -> List[float]:
+    # "start:stop:step" (stop included) or "a,b,c"
+    if ":" in _value:
+        start, stop, step = (float(_part) for _part in _value.split(":"))
+        return [round(float(_value), 6) for _value in np.arange(start, stop + step / 2, step)]
+    return [float(_part) for _part in _value.split(",")]
+
+
+def verify(_series: int = 200, _length: int = 2000, _seed: int = 1) -> bool:
+    """
+    Online (`LightHysteresis`) and offline (`decide`) decisions must be identical
+    - integer readings, so plenty of them land exactly on a boundary
+    """
+    generator = np.random.default_rng(_seed)
+    for _series_index in range(_series):
+        # a random walk across the whole sensor range, with noise
+        readings = np.clip(
+            np.cumsum(generator.normal(0, 25, _length)) % 2048 - 512 + generator.normal(0, 5, _length), 0, 1023
+        ).round()
+        tooDark = float(generator.integers(0, 500))
+        tooBright = float(generator.integers(int(tooDark) + 1, 1024))
+        medianWindow = int(generator.choice([1, 3, 5, 9]))
+
+        hysteresis = LightHysteresis(tooDark, tooBright, medianWindow)
+        online = [hysteresis.update(float(_reading)) for _reading in readings]
+        # the whole-array decisions, and the run-start decisions the sweep uses
+        filtered = medianFiltered(readings, medianWindow)
+        offline = decide(filtered, tooDark, tooBright)
+        runStarts, runDecisions = decideAtRunStarts(
+            filtered, _runStarts(_side(filtered, tooDark)), _runStarts(_side(filtered, tooBright)), tooDark, tooBright
+        )
+        fromRunStarts = np.zeros(len(readings), dtype=np.int8)
+        fromRunStarts[runStarts] = runDecisions
+        if not np.array_equal(offline, fromRunStarts):
+            print(f"MISMATCH: series {_series_index}, run-start decisions differ from the whole-array decisions")
+            return False
+
+        for _index, (_online, _offline) in enumerate(zip(online, offline)):
+            if _online != _reasons.get(int(_offline)):
+                print(
+                    f"MISMATCH: series {_series_index} reading {_index} ({readings[_index]}), "
+                    f"{tooDark=} {tooBright=} {medianWindow=}: online {_online!r}, offline {_reasons.get(int(_offline))!r}"
+                )
+                return False
+
+    print(f"VERIFIED: online and offline decisions identical over {_series} series of {_length} readings")
+    return True
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Sweep light sensor boundaries over recorded readings")
+    parser.add_argument("readings", nargs="?", type=Path)
+    parser.add_argument("--dark", type=_parseRange, default=_parseRange("50:200:10"), help="e.g. 50:200:10")
+    parser.add_argument("--bright", type=_parseRange, default=_parseRange("500:900:20"), help="e.g. 500,700,900")
+    parser.add_argument("--windows", type=lambda _value: [int(_part) for _part in _value.split(",")], default=[1, 3, 5])
+    parser.add_argument("--interval", type=float, default=1, help="seconds between readings without timestamps")
+    parser.add_argument("--dtype", default="float32", help="of raw binary readings")
+    parser.add_argument("--top", type=int, default=20, help="print the combinations with the fewest instructions")
+    parser.add_argument("--output", type=Path, help="write every combination to this csv")
+    parser.add_argument("--verify", action="store_true", help="check the online and offline decisions match")
+    arguments = parser.parse_args(_arguments)
+
+    if arguments.verify:
+        sys.exit(0 if verify() else 1)
+    if arguments.readings is None:
+        parser.error("readings are needed, unless verifying")
+
+    readings, durations = loadReadings(arguments.readings, arguments.interval, arguments.dtype)
+
+    startedAt = timer()
+    results = sweep(readings, durations, arguments.dark, arguments.bright, arguments.windows)
+    elapsed = timer() - startedAt
+    print(f"### {len(results)} COMBINATIONS OVER {len(readings)} READINGS IN {elapsed:.2f} s ###")
+
+    columns = list(results[0]) if results else []
+    if arguments.output is not None:
+        with open(arguments.output, "w") as _file:
+            _file.write(",".join(columns) + "\n")
+            for _result in results:
+                _file.write(",".join(str(_result[_column]) for _column in columns) + "\n")
+
+    for _result in sorted(results, key=lambda _result: _result["instructions"])[:arguments.top]:
+        print(_result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import contextlib
+import io
+import os
+import socket
+import statistics
+import tempfile
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional
+
+import MotorConnection
+import SimulatedHardware
+
+"""
+Round-trip latency of one "status" command per connection, for each way of reaching the MotorListener
+- tcp-resolve: how producers used to connect, resolving the hostname for every command
+- tcp: TCP with the address resolved once
+- unix: the Unix domain socket
+
+Run e.g. `python TransportBenchmark.py --requests 2000`
+"""
+
+
+def roundTrip(_connect: Callable[[], socket.socket]) -> float:
+    startedAt = timer()
+    connection = _connect()
+    connection.sendall(b"status")
+    connection.recv(1024)
+    connection.close()
+    return timer() - startedAt
+
+
+def summarise(_latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(_latencies)
+    return {
+        "requests": len(latencies),
+        "meanUs": statistics.fmean(latencies) * 1_000_000,
+        "p50Us": latencies[len(latencies) // 2] * 1_000_000,
+        "p99Us": latencies[int(len(latencies) * 0.99) - 1] * 1_000_000,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare MotorListener transports")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=5055)
+    arguments = parser.parse_args(_arguments)
+
+    host = socket.gethostname()
+    transports: Dict[str, Callable[[], socket.socket]] = {
+        "tcp-resolve": lambda: socket.create_connection((socket.gethostname(), arguments.port)),
+        "tcp": lambda: MotorConnection.openTcpConnection(host, arguments.port),
+    }
+
+    results = {}
+    workingDirectory = os.getcwd()
+    with tempfile.TemporaryDirectory() as _directory:
+        unixSocketPath = os.path.join(_directory, "motor-listener.sock")
+        transports["unix"] = lambda: MotorConnection.openUnixConnection(unixSocketPath)
+
+        # the listener prints every request, keep that out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            listener, thread = SimulatedHardware.startSimulatedMotorListener(
+                _directory,
+                _port=arguments.port,
+                _unixSocketPath=unixSocketPath,
+                _requestsPerSecondPerClient=1_000_000,
+                _burstPerClient=1_000_000
+            )
+
+            try:
+                for _name, _connect in transports.items():
+                    # warm up
+                    for _ in range(50):
+                        roundTrip(_connect)
+                    results[_name] = summarise([roundTrip(_connect) for _ in range(arguments.requests)])
+            finally:
+                listener.shutdown()
+                thread.join()
+                os.chdir(workingDirectory)
+
+    print("### TRANSPORT LATENCY ###")
+    for _name, _result in results.items():
+        print(f"{_name}: {_result}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
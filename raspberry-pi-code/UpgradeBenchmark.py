@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from time import sleep
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import MotorConnection
+
+"""
+How long the MotorListener can't be reached while a new process replaces it, hot upgrade against kill and restart
+- listeners run on simulated hardware in processes of their own, like LoadTester's, the blind is moving when
+  the switch starts
+- a prober sends "status" over TCP every `--interval`, each probe waits up to `--timeout`
+- unavailable: the longest time without an answered probe around the switch, failed: probes that got an error
+  (e.g. connection refused) instead of an answer
+- hot upgrade: the new process takes over with `--take-over` (see HotUpgrade), the old one exits once it handed over
+- restart: the old process is interrupted (its cleanup stops the motor), then the new one is started
+- the blind's state before and after the switch: a hot upgrade keeps it moving, at its speed, a restart stops it
+
+Run e.g. `python UpgradeBenchmark.py --rounds 5 --modes hot restart`
+"""
+
+# simulated blind, no config file
+blindSpeedInCmPerSecond = 8
+
+# printed by a listener process once it listens, other threads' output may end up on the same line
+readyLine = "### LISTENER READY ###"
+
+
+def percentiles(_values: List[float]) -> Dict[str, float]:
+    values = sorted(_values)
+    if not values:
+        return {}
+    return {
+        "p50Ms": round(values[len(values) // 2] * 1000, 1),
+        "maxMs": round(values[-1] * 1000, 1),
+    }
+
+
+def serve(_arguments):
+    """
+    Run a MotorListener on simulated hardware, until it's interrupted or has handed over
+    """
+    import SimulatedHardware
+
+    listener, thread = SimulatedHardware.startSimulatedMotorListener(
+        _arguments.directory,
+        _host="127.0.0.1",
+        _port=_arguments.port,
+        _unixSocketPath=_arguments.unix_socket,
+        _handoffSocketPath=_arguments.handoff_socket,
+        _takeOverFrom=_arguments.take_over,
+        _auditFileName=None,
+        _configFileName=None,
+        _telemetryPort=None,
+        _requestsPerSecondPerClient=1_000_000,
+        _burstPerClient=1_000_000
+    )
+    # an interrupt stops the listener the way it stops when run on its own, motor cleanup included
+    signal.signal(signal.SIGINT, lambda *_: listener.shutdown())
+    print(readyLine, flush=True)
+    thread.join()
+
+
+def startListener(_arguments, _takeOver: bool = False) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve",
+        "--directory", _arguments.directory,
+        "--port", str(_arguments.port),
+        "--unix-socket", _arguments.unix_socket,
+        "--handoff-socket", _arguments.handoff_socket,
+    ]
+    if _takeOver:
+        command += ["--take-over", _arguments.handoff_socket]
+
+    # the listener prints every request, which isn't worth reading here
+    listener = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    lastLines: List[str] = []
+    for _line in listener.stdout:
+        if readyLine in _line:
+            break
+        lastLines = (lastLines + [_line.rstrip()])[-5:]
+    else:
+        raise RuntimeError(f"listener did not start: {lastLines}")
+
+    # keep draining the output so the listener never blocks on a full pipe
+    threading.Thread(target=lambda: [None for _ in listener.stdout], daemon=True).start()
+    return listener
+
+
+def ask(_port: int, _instruction: str, _timeout: float) -> Optional[str]:
+    try:
+        connection = MotorConnection.openTcpConnection("127.0.0.1", _port, _timeout)
+        try:
+            connection.sendall(_instruction.encode())
+            return connection.recv(4096).decode()
+        finally:
+            connection.close()
+    except OSError:
+        return None
+
+
+class Prober(threading.Thread):
+    """
+    Asks for the status over and over, and keeps (sent at, answered at, answered) of every probe
+    """
+
+    def __init__(self, _port: int, _intervalInSeconds: float, _timeoutInSeconds: float):
+        super().__init__(daemon=True, name="upgrade-prober")
+        self.__port = _port
+        self.__intervalInSeconds = _intervalInSeconds
+        self.__timeoutInSeconds = _timeoutInSeconds
+        self.__stop_event = threading.Event()
+        self.probes: List[Tuple[float, float, bool]] = []
+
+    def run(self):
+        while not self.__stop_event.is_set():
+            sentAt = timer()
+            answered = ask(self.__port, "status", self.__timeoutInSeconds) is not None
+            self.probes.append((sentAt, timer(), answered))
+            self.__stop_event.wait(self.__intervalInSeconds)
+
+    def during(self, _from: float, _until: float) -> Dict:
+        """
+        Probes that were sent, or answered, in the window
+        """
+        probes = [_probe for _probe in self.probes if _probe[1] >= _from and _probe[0] <= _until]
+        answeredAt = [_from] + sorted(_answeredAt for _, _answeredAt, _answered in probes if _answered)
+        return {
+            "unavailable": max(_later - _earlier for _earlier, _later in zip(answeredAt, answeredAt[1:]))
+            if len(answeredAt) > 1 else _until - _from,
+            "failed": sum(1 for _, _, _answered in probes if not _answered),
+            "slowest": max((_answeredAt - _sentAt for _sentAt, _answeredAt, _ in probes), default=0.0),
+        }
+
+    def cleanup(self):
+        self.__stop_event.set()
+        self.join()
+
+
+def state(_port: int) -> Tuple[float, Optional[Dict]]:
+    reply = ask(_port, "state", 5)
+    return timer(), json.loads(reply) if reply else None
+
+
+def benchmarkMode(_arguments, _mode: str, _prober: Prober) -> Tuple[subprocess.Popen, Dict]:
+    listener = startListener(_arguments)
+    gaps, slowest, speeds = [], [], []
+    failed = keptMoving = 0
+
+    for _round in range(_arguments.rounds):
+        # get the blind moving, past the kick and a reversal's dwell
+        instruction = "down" if _round % 2 == 0 else "up"
+        ask(_arguments.port, instruction, 5)
+        sleep(2.5)
+
+        before = state(_arguments.port)
+        switchAt = timer()
+        if _mode == "hot":
+            successor = startListener(_arguments, _takeOver=True)
+            listener.wait(timeout=60)
+        else:
+            listener.send_signal(signal.SIGINT)
+            listener.wait(timeout=60)
+            successor = startListener(_arguments)
+        listener = successor
+
+        # one answer from the new process ends the switch
+        while ask(_arguments.port, "status", _arguments.timeout) is None and timer() - switchAt < 60:
+            sleep(_arguments.interval)
+        doneAt = timer()
+        sleep(0.5)
+        after = state(_arguments.port)
+
+        window = _prober.during(switchAt, doneAt)
+        gaps.append(window["unavailable"])
+        slowest.append(window["slowest"])
+        failed += window["failed"]
+        if before[1] is not None and after[1] is not None:
+            keptMoving += after[1]["moving"] and after[1]["instruction"] == instruction
+            speeds.append(abs(after[1]["position"] - before[1]["position"]) / (after[0] - before[0]))
+
+    return listener, {
+        "mode": _mode,
+        "rounds": _arguments.rounds,
+        "unavailable": percentiles(gaps),
+        "slowestProbe": percentiles(slowest),
+        "failedProbes": failed,
+        "motorKeptMoving": keptMoving,
+        "speedAcrossSwitchCmPerSecond": round(sum(speeds) / len(speeds), 2) if speeds else None,
+        "blindSpeedCmPerSecond": blindSpeedInCmPerSecond,
+    }
+
+
+def main(_arguments: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Unavailability of the MotorListener while a new process replaces it")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", default=["hot", "restart"], choices=["hot", "restart"])
+    parser.add_argument("--interval", type=float, default=0.002, help="seconds between probes")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds a probe waits for its answer")
+    parser.add_argument("--port", type=int, default=0, help="tcp port of the listeners, a free one when 0")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--unix-socket", help=argparse.SUPPRESS)
+    parser.add_argument("--handoff-socket", help=argparse.SUPPRESS)
+    parser.add_argument("--take-over", help=argparse.SUPPRESS)
+    arguments = parser.parse_args(_arguments)
+
+    if arguments.serve:
+        serve(arguments)
+        return None
+
+    if arguments.port == 0:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            arguments.port = probe.getsockname()[1]
+
+    print("### UPGRADE BENCHMARK ###")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        arguments.directory = directory
+        arguments.unix_socket = os.path.join(directory, "listener.sock")
+        arguments.handoff_socket = os.path.join(directory, "handoff.sock")
+
+        prober = Prober(arguments.port, arguments.interval, arguments.timeout)
+        prober.start()
+        for _mode in arguments.modes:
+            listener, result = benchmarkMode(arguments, _mode, prober)
+            # interrupt the last listener so it shuts down its motor cleanly
+            listener.send_signal(signal.SIGINT)
+            listener.wait(timeout=60)
+            print(result)
+            results.append(result)
+        prober.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    main()
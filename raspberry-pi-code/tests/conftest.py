@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# the modules sit side by side in raspberry-pi-code, and off the Pi they need the stand-in hardware modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import SimulatedHardware  # noqa: E402
+
+SimulatedHardware.install()
@@ -0,0 +1,195 @@
+import threading
+import time
+
+import pytest
+
+import AdmissionControl
+from AdmissionControl import ClientRateLimiter, InstructionDebouncer, RequestDeduplicator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # the limiter and the deduplicator read the time through `timer()`
+    now = [1000.0]
+    monkeypatch.setattr(AdmissionControl, "timer", lambda: now[0])
+    return now
+
+
+def test_rate_limiter_allows_a_burst_then_refills(clock):
+    limiter = ClientRateLimiter(_ratePerSecond=2, _burst=3)
+
+    assert [limiter.admit("a") for _ in range(4)] == [True, True, True, False]
+    clock[0] += 0.5
+    assert limiter.admit("a")
+    assert not limiter.admit("a")
+    assert (limiter.admitted, limiter.rejected) == (4, 2)
+
+
+def test_rate_limiter_keeps_a_budget_per_client(clock):
+    limiter = ClientRateLimiter(_ratePerSecond=1, _burst=1)
+
+    assert limiter.admit("192.168.1.20")
+    assert not limiter.admit("192.168.1.20")
+    assert limiter.admit("unix:pid 42 uid 1000")
+
+
+def test_rate_limiter_forgets_the_least_recently_seen_client(clock):
+    limiter = ClientRateLimiter(_ratePerSecond=1, _burst=1, _maxTrackedClients=2)
+
+    limiter.admit("a")
+    limiter.admit("b")
+    limiter.admit("c")
+
+    # "a" was forgotten, so it starts with a full bucket again
+    assert limiter.admit("a")
+    assert not limiter.admit("c")
+
+
+def test_deduplicator_replies_to_a_repeat_without_handling_it_again(clock):
+    calls = []
+    deduplicator = RequestDeduplicator(_isMotorAction=lambda _reply: _reply == "204")
+
+    def handle():
+        calls.append(1)
+        return "204"
+
+    assert deduplicator.handleOnce("ir", "1", handle) == "204"
+    assert deduplicator.handleOnce("ir", "1", handle) == "204"
+    assert len(calls) == 1
+    assert deduplicator.counters() == {"originals": 1, "duplicates": 1, "motorActionsSuppressed": 1}
+
+
+def test_deduplicator_keeps_clients_apart(clock):
+    deduplicator = RequestDeduplicator(_isMotorAction=lambda _reply: False)
+
+    assert deduplicator.handleOnce("192.168.1.20", "1", lambda: "first") == "first"
+    assert deduplicator.handleOnce("192.168.1.21", "1", lambda: "second") == "second"
+
+
+def test_deduplicator_handles_a_request_again_after_its_ttl(clock):
+    deduplicator = RequestDeduplicator(_isMotorAction=lambda _reply: False, _ttlInSeconds=60)
+
+    deduplicator.handleOnce("ir", "1", lambda: "first")
+    clock[0] += 61
+    assert deduplicator.handleOnce("ir", "1", lambda: "second") == "second"
+
+
+def test_deduplicator_forgets_a_request_that_failed(clock):
+    deduplicator = RequestDeduplicator(_isMotorAction=lambda _reply: False)
+
+    def fail():
+        raise RuntimeError("motor controller gone")
+
+    with pytest.raises(RuntimeError):
+        deduplicator.handleOnce("ir", "1", fail)
+    assert deduplicator.handleOnce("ir", "1", lambda: "retried") == "retried"
+
+
+def test_deduplicator_repeat_waits_for_the_original():
+    deduplicator = RequestDeduplicator(_isMotorAction=lambda _reply: False)
+    started = threading.Event()
+    release = threading.Event()
+    replies = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "original"
+
+    original = threading.Thread(target=lambda: replies.append(deduplicator.handleOnce("ir", "1", slow)))
+    original.start()
+    started.wait(5)
+    repeat = threading.Thread(target=lambda: replies.append(deduplicator.handleOnce("ir", "1", lambda: "repeat")))
+    repeat.start()
+    release.set()
+    original.join(5)
+    repeat.join(5)
+
+    assert replies == ["original", "original"]
+
+
+class Motor:
+    """
+    Records what the debouncer passes on, and when
+    """
+
+    def __init__(self):
+        self.position = 100.0
+        self.instructions = []
+
+    def instruct(self, _instruction: str) -> bool:
+        self.instructions.append((time.monotonic(), _instruction))
+        return True
+
+
+@pytest.fixture
+def debounced():
+    motor = Motor()
+    debouncer = InstructionDebouncer(
+        _instruct=motor.instruct,
+        _currentBlindExtensionLength=lambda: motor.position,
+        _coalesceWindowInSeconds=0.05,
+        _minimumReversalDwellInSeconds=0.3
+    )
+    debouncer.start()
+    yield debouncer, motor
+    debouncer.cleanup()
+    debouncer.join(1)
+
+
+def waitFor(_condition, _timeoutInSeconds: float = 2):
+    giveUpAt = time.monotonic() + _timeoutInSeconds
+    while not _condition() and time.monotonic() < giveUpAt:
+        time.sleep(0.005)
+
+
+def test_debouncer_coalesces_a_burst_to_the_latest_instruction(debounced):
+    debouncer, motor = debounced
+
+    debouncer.submit("down")
+    waitFor(lambda: len(motor.instructions) == 1)
+    for _length in ("120", "130", "140"):
+        debouncer.submit(_length)
+    waitFor(lambda: len(motor.instructions) == 2)
+    time.sleep(0.1)
+
+    assert [_instruction for _, _instruction in motor.instructions] == ["down", "140"]
+    assert debouncer.coalesced == 2
+
+
+def test_debouncer_holds_back_a_reversal(debounced):
+    debouncer, motor = debounced
+
+    debouncer.submit("down")
+    waitFor(lambda: len(motor.instructions) == 1)
+    debouncer.submit("up")
+    waitFor(lambda: len(motor.instructions) == 2)
+
+    (downAt, _), (upAt, _) = motor.instructions
+    assert upAt - downAt >= 0.3 - 0.01
+    assert debouncer.reversalsDelayed == 1
+
+
+def test_debouncer_never_delays_stop(debounced):
+    debouncer, motor = debounced
+
+    debouncer.submit("down")
+    waitFor(lambda: len(motor.instructions) == 1)
+    submittedAt = time.monotonic()
+    debouncer.submit("stop")
+    waitFor(lambda: len(motor.instructions) == 2)
+
+    assert motor.instructions[1][1] == "stop"
+    assert motor.instructions[1][0] - submittedAt < 0.04
+
+
+def test_debouncer_takes_a_shorter_length_as_moving_up(debounced):
+    debouncer, motor = debounced
+
+    debouncer.submit("150")
+    waitFor(lambda: len(motor.instructions) == 1)
+    motor.position = 150.0
+    debouncer.submit("20")
+    waitFor(lambda: len(motor.instructions) == 2)
+
+    assert motor.instructions[1][0] - motor.instructions[0][0] >= 0.3 - 0.01
@@ -0,0 +1,30 @@
+import pytest
+
+import BlindConfig
+
+
+def test_predicting_is_off_by_default():
+    assert BlindConfig.defaults()["light"]["predictLeadInSeconds"] == 0
+
+
+def test_predicting_can_be_turned_on():
+    config = BlindConfig.validate({"light": {"predictLeadInSeconds": 10, "predictMinimumConfidence": 20}})
+
+    assert config["light"]["predictLeadInSeconds"] == 10
+    assert config["light"]["predictMinimumConfidence"] == 20
+
+
+@pytest.mark.parametrize("_light", [
+    {"predictLeadInSeconds": -1},
+    {"predictMinimumConfidence": -1},
+    {"predictLeadInSeconds": "soon"},
+])
+def test_predicting_rejects_values_out_of_range(_light):
+    with pytest.raises(BlindConfig.ConfigError):
+        BlindConfig.validate({"light": _light})
+
+
+def test_pwm_backend_must_be_known():
+    assert BlindConfig.validate({"motor": {"pwmBackend": "pigpio"}})["motor"]["pwmBackend"] == "pigpio"
+    with pytest.raises(BlindConfig.ConfigError):
+        BlindConfig.validate({"motor": {"pwmBackend": "wiringpi"}})
@@ -0,0 +1,49 @@
+import os
+import socket
+
+import pytest
+
+import HotUpgrade
+from PwmBackend import PigpioPwm, RpiGpioPwm, SimulatedPwm
+
+
+def openDescriptors() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_refusal_closes_the_descriptors_it_carried():
+    running, successor = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    extra = socket.socket()
+    try:
+        before = openDescriptors()
+        HotUpgrade._send(running, {"type": "refused", "reason": "busy"}, [extra.fileno()])
+
+        with pytest.raises(HotUpgrade.HandoffError, match="busy"):
+            HotUpgrade._expect(successor, "handoff", 1)
+        assert openDescriptors() == before
+    finally:
+        for _socket in (running, successor, extra):
+            _socket.close()
+
+
+def test_unexpected_message_closes_the_descriptors_it_carried():
+    running, successor = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    extra = socket.socket()
+    try:
+        before = openDescriptors()
+        HotUpgrade._send(running, {"type": "adopted"}, [extra.fileno()])
+
+        with pytest.raises(HotUpgrade.HandoffError):
+            HotUpgrade._expect(successor, "handoff", 1)
+        assert openDescriptors() == before
+    finally:
+        for _socket in (running, successor, extra):
+            _socket.close()
+
+
+def test_only_an_output_that_outlives_its_process_is_handed_over():
+    import pigpio
+
+    assert PigpioPwm(pigpio.pi(), 22, 50).survivesHandoff
+    assert SimulatedPwm().survivesHandoff
+    assert not RpiGpioPwm(22, 50).survivesHandoff
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from MotionSequence import SequenceStep, compileSequence, encodeSequence
+from PwmBackend import SimulatedPwm
+from ThreadMotorController import ThreadMotorController
+
+
+def test_sequence_compiles_to_steps():
+    steps = compileSequence("sequence down; wait 10; 60", 200)
+
+    assert steps == [SequenceStep("down"), SequenceStep(None, 10), SequenceStep("60")]
+    assert compileSequence(encodeSequence(steps), 200) == steps
+
+
+@pytest.mark.parametrize("_length", ["nan", "inf", "-inf", "-1", "200.5"])
+def test_sequence_rejects_a_length_the_blind_cant_reach(_length):
+    with pytest.raises(ValueError):
+        compileSequence(f"sequence down; {_length}", 200)
+
+
+@pytest.mark.parametrize("_wait", ["nan", "inf", "-1", "3601"])
+def test_sequence_rejects_a_wait_out_of_range(_wait):
+    with pytest.raises(ValueError):
+        compileSequence(f"sequence down; wait {_wait}", 200)
+
+
+@pytest.fixture
+def controller(tmp_path):
+    stateFile = tmp_path / "blind-state.txt"
+    stateFile.write_text("0")
+
+    with open(stateFile, "r+") as _file:
+        controller = ThreadMotorController(
+            _file,
+            _blindSpeedInCmPerSecond=100,
+            _pwmBackend=SimulatedPwm(22, 50),
+            _minimumReversalDwellInSeconds=0.5
+        )
+        controller.start()
+        yield controller
+        controller.cleanup()
+        controller.join()
+
+
+def waitForInstruction(_controller: ThreadMotorController, _instruction: str, _timeoutInSeconds: float = 5) -> float:
+    giveUpAt = time.monotonic() + _timeoutInSeconds
+    while _controller.currentInstruction() != _instruction:
+        assert time.monotonic() < giveUpAt, f"the motor was never sent {_instruction}"
+        time.sleep(0.005)
+    return time.monotonic()
+
+
+def test_sequence_holds_back_a_first_step_that_reverses_the_motor(controller):
+    controller.instruct("150")
+    downAt = time.monotonic()
+    controller.runSequence(compileSequence("sequence up", 200))
+
+    upAt = waitForInstruction(controller, "up")
+
+    assert upAt - downAt >= 0.5 - 0.02
+    assert controller.sequenceReversalsDelayed == 1
+
+
+def test_sequence_holds_back_a_step_that_reverses_the_one_before(controller):
+    startedAt = time.monotonic()
+    controller.runSequence(compileSequence("sequence 20; 0", 200))
+
+    waitForInstruction(controller, "20")
+    upAt = waitForInstruction(controller, "0")
+
+    assert upAt - startedAt >= 0.5 - 0.02
+    assert controller.sequenceReversalsDelayed == 1
+
+
+def test_sequence_steps_in_one_direction_are_not_held_back(controller):
+    startedAt = time.monotonic()
+    controller.runSequence(compileSequence("sequence 5; 10", 200))
+
+    waitForInstruction(controller, "10")
+
+    assert time.monotonic() - startedAt < 0.5
+    assert controller.sequenceReversalsDelayed == 0
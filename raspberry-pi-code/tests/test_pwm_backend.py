@@ -0,0 +1,128 @@
+import time
+
+import pytest
+from RPi import GPIO
+
+import pigpio
+from GpioOutput import CachedGpioOutput, PigpioBankBackend
+from PwmBackend import PigpioPwm, PwmBackend, RpiGpioPwm, SimulatedPwm, createPwmBackend, pigpioBackend, rpiGpioBackend
+from ThreadMotorController import ThreadMotorController
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        PwmBackend()
+
+
+def test_simulated_pwm_records_every_duty_cycle():
+    pwm = SimulatedPwm(22, 50)
+
+    pwm.start(0)
+    pwm.changeDutyCycle(70)
+    pwm.repin(23)
+    pwm.stop()
+
+    assert [_dutyCycle for _, _dutyCycle in pwm.history] == [0, 70, 0, 0]
+    assert pwm.pin == 23
+    assert not pwm.isRunning
+
+
+def test_backend_is_picked_by_name():
+    assert isinstance(createPwmBackend(rpiGpioBackend, 22, 50), RpiGpioPwm)
+    assert isinstance(createPwmBackend(pigpioBackend, 22, 50), PigpioPwm)
+
+
+def test_pigpio_falls_back_to_rpi_gpio_without_the_daemon(monkeypatch):
+    class DisconnectedPi(pigpio.pi):
+        def __init__(self, *_):
+            super().__init__()
+            self.connected = False
+
+    monkeypatch.setattr(pigpio, "pi", DisconnectedPi)
+
+    assert isinstance(createPwmBackend(pigpioBackend, 22, 50), RpiGpioPwm)
+
+
+def test_batch_clears_pins_before_setting_them(monkeypatch):
+    calls = []
+    monkeypatch.setattr(GPIO, "output", lambda _pins, _levels: calls.append((list(_pins), list(_levels))))
+    gpio = CachedGpioOutput()
+    gpio.setup(26, True)
+    gpio.setup(4, False)
+
+    gpio.writeMany({26: False, 4: True})
+
+    assert calls == [([26, 4], [GPIO.LOW, GPIO.HIGH])]
+
+
+def test_pigpio_batch_clears_pins_before_setting_them():
+    class RecordingPi(pigpio.pi):
+        def __init__(self):
+            super().__init__()
+            self.banks = []
+
+        def set_bank_1(self, _mask):
+            self.banks.append(("set", _mask))
+
+        def clear_bank_1(self, _mask):
+            self.banks.append(("clear", _mask))
+
+    pi = RecordingPi()
+    gpio = CachedGpioOutput(PigpioBankBackend(pi))
+    gpio.setup(26, True)
+    gpio.setup(4, False)
+
+    gpio.writeMany({26: False, 4: True})
+
+    assert pi.banks == [("clear", 1 << 26), ("set", 1 << 4)]
+
+
+def test_reversal_powers_the_motor_down_and_never_writes_the_pwm_pin(monkeypatch, tmp_path):
+    events = []
+
+    class RecordingPwm(SimulatedPwm):
+        def changeDutyCycle(self, _dutyCycle: float):
+            events.append(("pwm", _dutyCycle))
+            super().changeDutyCycle(_dutyCycle)
+
+    def output(_pins, _levels):
+        pins = _pins if isinstance(_pins, list) else [_pins]
+        levels = _levels if isinstance(_levels, list) else [_levels]
+        events.append(("gpio", dict(zip(pins, levels))))
+
+    monkeypatch.setattr(GPIO, "output", output)
+    stateFile = tmp_path / "blind-state.txt"
+    stateFile.write_text("0")
+
+    with open(stateFile, "r+") as _file:
+        controller = ThreadMotorController(_file, _blindSpeedInCmPerSecond=100, _pwmBackend=RecordingPwm(22, 50))
+        controller.start()
+        try:
+            controller.instruct("150")
+            waitFor(lambda: controller.currentBlindExtensionLength() > 20)
+            controller.instruct("0")
+            waitFor(lambda: any(_kind == "gpio" and _levels.get(26) == GPIO.HIGH for _kind, _levels in events))
+        finally:
+            controller.cleanup()
+            controller.join()
+
+    dutyCycle = 0
+    bridgeWrites = 0
+    for _kind, _value in events:
+        if _kind == "pwm":
+            dutyCycle = _value
+            continue
+        assert 22 not in _value
+        if 26 in _value or 4 in _value:
+            bridgeWrites += 1
+            assert dutyCycle == 0, "the h-bridge inputs were switched with the motor powered"
+
+    # down, then up
+    assert bridgeWrites >= 2
+
+
+def waitFor(_condition, _timeoutInSeconds: float = 5):
+    giveUpAt = time.monotonic() + _timeoutInSeconds
+    while not _condition() and time.monotonic() < giveUpAt:
+        time.sleep(0.01)
+    assert _condition()
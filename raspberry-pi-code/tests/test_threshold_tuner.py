@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import ThresholdTuner
+from LightHysteresis import LightHysteresis
+
+
+def onlineReasons(_readings, _tooDark, _tooBright, _medianWindow):
+    hysteresis = LightHysteresis(_tooDark, _tooBright, _medianWindow)
+    return [hysteresis.update(float(_reading), _now=0) for _reading in _readings]
+
+
+def offlineReasons(_readings, _tooDark, _tooBright, _medianWindow):
+    filtered = ThresholdTuner.medianFiltered(np.asarray(_readings, dtype=float), _medianWindow)
+    return [ThresholdTuner._reasons.get(int(_code)) for _code in ThresholdTuner.decide(filtered, _tooDark, _tooBright)]
+
+
+@pytest.mark.parametrize("_seed", range(5))
+def test_offline_decisions_match_online_ones(_seed):
+    # a random walk across the whole sensor range, integer readings so many land exactly on a boundary
+    generator = np.random.default_rng(_seed)
+    readings = np.clip(np.cumsum(generator.normal(0, 25, 3000)) % 2048 - 512, 0, 1023).round()
+    tooDark = float(generator.integers(0, 500))
+    tooBright = float(generator.integers(int(tooDark) + 1, 1024))
+
+    for _medianWindow in (1, 3, 5, 9):
+        assert (
+            offlineReasons(readings, tooDark, tooBright, _medianWindow)
+            == onlineReasons(readings, tooDark, tooBright, _medianWindow)
+        )
+
+
+def test_run_start_decisions_match_whole_array_ones():
+    generator = np.random.default_rng(7)
+    readings = np.clip(np.cumsum(generator.normal(0, 25, 5000)) % 2048 - 512, 0, 1023).round()
+    filtered = ThresholdTuner.medianFiltered(readings, 3)
+
+    runStarts, runDecisions = ThresholdTuner.decideAtRunStarts(
+        filtered,
+        ThresholdTuner._runStarts(ThresholdTuner._side(filtered, 100)),
+        ThresholdTuner._runStarts(ThresholdTuner._side(filtered, 700)),
+        100, 700
+    )
+    fromRunStarts = np.zeros(len(readings), dtype=np.int8)
+    fromRunStarts[runStarts] = runDecisions
+
+    np.testing.assert_array_equal(fromRunStarts, ThresholdTuner.decide(filtered, 100, 700))
+
+
+def test_readings_on_a_boundary_change_nothing():
+    readings = [500, 100, 99, 100, 700, 701, 700, 400]
+    expected = [None, None, LightHysteresis.tooDark, None, None, LightHysteresis.tooBright, None,
+                LightHysteresis.normalLight]
+
+    assert onlineReasons(readings, 100, 700, 1) == expected
+    assert offlineReasons(readings, 100, 700, 1) == expected
+
+
+def test_nothing_is_decided_until_the_median_window_is_full():
+    assert offlineReasons([10, 10, 10, 900], 100, 700, 3)[:2] == [None, None]
+
+
+def test_boundaries_must_be_in_order():
+    with pytest.raises(ValueError):
+        ThresholdTuner.decide(np.array([1.0]), 700, 100)
+
+
+def test_verify_passes():
+    assert ThresholdTuner.verify(_series=20, _length=500)
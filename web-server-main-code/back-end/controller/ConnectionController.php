@@ -3,16 +3,24 @@
 namespace App\Http\Controllers;
 
 use Illuminate\Http\Client\ConnectionException;
+use Illuminate\Http\Request;
 use Illuminate\Support\Facades\Http;
+use Illuminate\Support\Str;
 
 class ConnectionController extends Controller
 {
     // handle button clicks from the remote control
-    public function webRemote($_command)
+    public function webRemote(Request $request, $_command)
     {
-        // try to send command to motor via a cloudflare tunnel
+        // the same request id on a retry or double click means the motor only acts once
+        $requestId = $request->query('requestId', (string) Str::uuid());
+
+        // try to send command to motor via a cloudflare tunnel, retrying with the same request id
         try {
-            $response = Http::withBody($_command)->post("devices.zayndev.org");
+            $response = Http::withHeaders(['X-Request-Id' => $requestId])
+                ->withBody($_command)
+                ->retry(2, 200, throw: false)
+                ->post("devices.zayndev.org");
         } catch (ConnectionException $e) {
             return $e->getMessage();
         }
@@ -27,9 +27,19 @@ export const Remote = () => {
         setOpen("");
     };
 
+    // repeated clicks of the same button in quick succession share a request id, so the blind only acts once
+    const lastRequest = React.useRef<{ action: Commands, requestId: string, sentAt: number } | null>(null);
+    const requestIdFor = (action: Commands) => {
+        const now = Date.now();
+        if (lastRequest.current?.action !== action || now - lastRequest.current.sentAt > 1000) {
+            lastRequest.current = {action, requestId: crypto.randomUUID(), sentAt: now};
+        }
+        return lastRequest.current.requestId;
+    }
+
     // send remote message to backend server when buttons are clicked
     const handleClick = (action: Commands) => {
-        axios.get(`api/remote/${action}`)
+        axios.get(`api/remote/${action}`, {params: {requestId: requestIdFor(action)}})
             // successful request
             .then(function (response) {
                 console.log(response);